@@ -0,0 +1,136 @@
+-- Migration 005: Quality score as a database function
+-- Date: 2026-10-18
+-- Purpose: Compute media_files.quality_score inside PostgreSQL so ranking,
+--          sorting and duplicate recommendations never go stale or need a
+--          Python-side rescore.
+--
+-- The formula mirrors the "default" profile in BUILTIN_PROFILES
+-- (backend/app/services/quality_service.py), from which quality_score_sql()
+-- is generated. tests/test_quality_service.py checks this function's
+-- constants against that profile.
+
+BEGIN;
+
+-- ============================================================================
+-- 1. Scoring function (0-200 scale)
+-- ============================================================================
+CREATE OR REPLACE FUNCTION media_quality_score(
+    p_height INTEGER,
+    p_video_codec TEXT,
+    p_bitrate INTEGER,
+    p_audio_channels NUMERIC,
+    p_audio_track_count INTEGER,
+    p_subtitle_track_count INTEGER,
+    p_hdr_type TEXT
+)
+RETURNS INTEGER AS $$
+DECLARE
+    score INTEGER := 0;
+    codec TEXT := LOWER(COALESCE(p_video_codec, ''));
+    ideal_bitrate INTEGER;
+    audio_tracks INTEGER := COALESCE(p_audio_track_count, 1);
+    subtitle_tracks INTEGER := COALESCE(p_subtitle_track_count, 0);
+BEGIN
+    -- Resolution score (0-100) and resolution-specific ideal bitrate (kbps)
+    IF COALESCE(p_height, 0) > 0 THEN
+        IF p_height >= 2160 THEN
+            score := score + 100; ideal_bitrate := 50000;
+        ELSIF p_height >= 1080 THEN
+            score := score + 75; ideal_bitrate := 10000;
+        ELSIF p_height >= 720 THEN
+            score := score + 50; ideal_bitrate := 5000;
+        ELSIF p_height >= 480 THEN
+            score := score + 25; ideal_bitrate := 2500;
+        ELSE
+            score := score + 10; ideal_bitrate := 1000;
+        END IF;
+    END IF;
+
+    -- Codec score (0-22), first match wins
+    IF codec LIKE '%hevc%' OR codec LIKE '%h265%' OR codec LIKE '%x265%' THEN
+        score := score + 20;
+    ELSIF codec LIKE '%avc%' OR codec LIKE '%h264%' OR codec LIKE '%x264%' THEN
+        score := score + 15;
+    ELSIF codec LIKE '%vp9%' THEN
+        score := score + 18;
+    ELSIF codec LIKE '%av1%' THEN
+        score := score + 22;
+    END IF;
+
+    -- Bitrate score (0-30), integer arithmetic capped at the ideal bitrate
+    IF COALESCE(p_bitrate, 0) > 0 AND ideal_bitrate IS NOT NULL THEN
+        score := score + (LEAST(p_bitrate, ideal_bitrate) * 30) / ideal_bitrate;
+    END IF;
+
+    -- Audio channels score (0-15)
+    IF COALESCE(p_audio_channels, 2) >= 5 THEN
+        score := score + 15;
+    ELSE
+        score := score + 10;
+    END IF;
+
+    -- Multi-audio tracks (+3 per extra track, max 10)
+    IF audio_tracks > 1 THEN
+        score := score + LEAST((audio_tracks - 1) * 3, 10);
+    END IF;
+
+    -- Subtitle tracks (+2 per track, max 10)
+    IF subtitle_tracks > 0 THEN
+        score := score + LEAST(subtitle_tracks * 2, 10);
+    END IF;
+
+    -- HDR (+15)
+    IF p_hdr_type IN ('HDR10', 'Dolby Vision', 'HDR10+', 'HLG') THEN
+        score := score + 15;
+    END IF;
+
+    RETURN LEAST(score, 200);
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- ============================================================================
+-- 2. Keep quality_score current whenever the scored metadata changes
+-- ============================================================================
+CREATE OR REPLACE FUNCTION update_media_quality_score()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.quality_score = media_quality_score(
+        NEW.height,
+        NEW.video_codec,
+        NEW.bitrate,
+        NEW.audio_channels,
+        NEW.audio_track_count,
+        NEW.subtitle_track_count,
+        NEW.hdr_type
+    );
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_media_files_quality_score ON media_files;
+CREATE TRIGGER trigger_media_files_quality_score
+    BEFORE INSERT OR UPDATE OF height, video_codec, bitrate, audio_channels,
+        audio_track_count, subtitle_track_count, hdr_type
+    ON media_files
+    FOR EACH ROW
+    EXECUTE FUNCTION update_media_quality_score();
+
+-- ============================================================================
+-- 3. Rescore existing rows in place (no round-trip through Python)
+-- ============================================================================
+UPDATE media_files SET quality_score = media_quality_score(
+    height,
+    video_codec,
+    bitrate,
+    audio_channels,
+    audio_track_count,
+    subtitle_track_count,
+    hdr_type
+);
+
+-- Ranking queries order by media_type, quality_score DESC, id: match it
+-- column for column (001 created this index on quality_score ASC)
+DROP INDEX IF EXISTS idx_media_type_quality;
+CREATE INDEX idx_media_type_quality ON media_files(media_type, quality_score DESC, id);
+
+COMMIT;
@@ -0,0 +1,29 @@
+-- Migration 006: TMDb response cache
+-- Date: 2026-10-18
+-- Purpose: Persist TMDb lookups keyed by normalized (endpoint, query, year)
+--          so repeated titles (e.g. every episode of a show) and known misses
+--          don't hit the API on every scan.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS tmdb_cache (
+    id SERIAL PRIMARY KEY,
+    cache_key VARCHAR(600) NOT NULL UNIQUE,
+    endpoint VARCHAR(100) NOT NULL,
+    query VARCHAR(500),
+    year INTEGER,
+
+    -- NULL response with is_negative = true records "no match on TMDb"
+    response JSON,
+    is_negative BOOLEAN NOT NULL DEFAULT false,
+
+    fetched_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    expires_at TIMESTAMP NOT NULL
+);
+
+-- cache_key lookups use the UNIQUE constraint's index; drop the redundant
+-- copy an earlier revision of this migration created
+DROP INDEX IF EXISTS idx_tmdb_cache_cache_key;
+CREATE INDEX IF NOT EXISTS idx_tmdb_cache_expires_at ON tmdb_cache(expires_at);
+
+COMMIT;
@@ -0,0 +1,18 @@
+-- Migration 007: Filename parse cache
+-- Date: 2026-10-18
+-- Purpose: Persist guessit results keyed by (filename, guessit version) so
+--          rescans and archive scans don't re-run the rule engine for names
+--          that have already been parsed.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS filename_parse_cache (
+    id SERIAL PRIMARY KEY,
+    filename VARCHAR(500) NOT NULL,
+    guessit_version VARCHAR(20) NOT NULL,
+    parsed JSON NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    CONSTRAINT uq_filename_parse_cache UNIQUE (guessit_version, filename)
+);
+
+COMMIT;
@@ -1,7 +1,10 @@
 """Application configuration using pydantic-settings."""
+from pydantic import field_validator
 from pydantic_settings import BaseSettings
 from functools import lru_cache
-from typing import List
+from typing import Any, Dict, List
+import ipaddress
+import json
 
 
 class Settings(BaseSettings):
@@ -63,6 +66,13 @@ class Settings(BaseSettings):
     tmdb_read_access_token: str
     tmdb_base_url: str = "https://api.themoviedb.org/3/"
     tmdb_rate_limit: int = 40  # requests per 10 seconds
+    tmdb_max_connections: int = 10  # pooled keep-alive connections
+    tmdb_max_retries: int = 3  # on 429/5xx/transport errors
+    tmdb_retry_backoff_seconds: float = 1.0  # doubled per retry
+    tmdb_cache_enabled: bool = True
+    tmdb_cache_ttl_hours: int = 720  # 30 days for found titles
+    tmdb_cache_negative_ttl_hours: int = 24  # retry misses daily
+    tmdb_cache_memory_size: int = 4096  # in-process LRU entries
 
     # Azure OpenAI
     azure_openai_key: str
@@ -77,12 +87,36 @@ class Settings(BaseSettings):
     ffprobe_path: str = "/usr/bin/ffprobe"
     mediainfo_path: str = "/usr/bin/mediainfo"
     md5_chunk_size: int = 8192
+    ffmpeg_wall_budget_seconds: float = 14400.0  # stop any FFmpeg running longer (not counting pauses); 0 = no limit
+    ffmpeg_cpu_budget_seconds: float = 0.0  # stop any FFmpeg using more CPU time; 0 = no limit
 
     # Duplicate Detection
     fuzzy_match_threshold: int = 85
     quality_auto_approve_threshold: int = 50
     quality_manual_review_threshold: int = 20
     max_duplicates_per_batch: int = 100
+    dedup_quality_profile: str = "default"  # default, archive, mobile, space-saver
+    quality_profiles: str = ""  # JSON: {"name": {"extends": "default", ...}}
+
+    @property
+    def quality_profiles_dict(self) -> Dict[str, Dict[str, Any]]:
+        """Parse custom quality scoring profiles from JSON."""
+        if not self.quality_profiles.strip():
+            return {}
+        return json.loads(self.quality_profiles)
+
+    @field_validator("quality_profiles")
+    @classmethod
+    def _check_quality_profiles(cls, value: str) -> str:
+        """Reject malformed custom profiles at startup instead of on every scorer."""
+        if value.strip():
+            from app.services.quality_service import validate_custom_profiles
+            try:
+                custom = json.loads(value)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"QUALITY_PROFILES is not valid JSON: {e}") from e
+            validate_custom_profiles(custom)
+        return value
 
     # Deletion Policy
     auto_delete_enabled: bool = False
@@ -109,6 +143,66 @@ class Settings(BaseSettings):
         """Parse video extensions from comma-separated string."""
         return [ext.strip() for ext in self.video_extensions.split(",")]
 
+    parse_cache_memory_size: int = 20000  # in-process guessit result LRU
+    parse_pool_min_batch: int = 200  # cold names before using a process pool
+    parse_pool_workers: int = 4
+
+    # Streaming
+    stream_chunk_min: int = 262144  # adaptive read size bounds when sendfile isn't available
+    stream_chunk_max: int = 4194304
+    stream_read_ahead_chunks: int = 2  # reads kept in flight per stream
+    stream_io_workers: int = 32  # dedicated thread pool for streaming reads
+    stream_accel_redirect_root: str = ""  # e.g. /mnt/nas-media; empty disables nginx handoff
+    stream_accel_redirect_prefix: str = "/_mediavault_media/"  # nginx internal location
+    stream_bandwidth_headroom: float = 0.75  # share of a client's bandwidth a transcode may use
+    stream_save_data_kbps: int = 1500  # total bitrate cap for clients sending Save-Data
+    stream_trusted_proxies: str = "127.0.0.1,::1"  # addresses/CIDRs whose X-Real-IP / X-Forwarded-For are believed
+
+    @field_validator("stream_trusted_proxies")
+    @classmethod
+    def _check_trusted_proxies(cls, value: str) -> str:
+        """Every entry must be an IP address or network."""
+        for entry in value.split(","):
+            if entry.strip():
+                ipaddress.ip_network(entry.strip(), strict=False)
+        return value
+
+    # Transcode cache (finished transcodes keyed by content, profile, resolution)
+    transcode_cache_enabled: bool = True
+    transcode_cache_dir: str = "/tmp/mediavault_cache/transcodes"
+    transcode_cache_max_gb: float = 50.0
+    transcode_cache_policy: str = "lru"  # lru or lfu
+    transcode_session_linger_seconds: float = 10.0  # keep FFmpeg alive this long after the last viewer leaves
+
+    # Transcode scheduler (concurrent FFmpeg encodes per encoder type)
+    transcode_gpu_slots: int = 3  # NVENC sessions; consumer cards allow few (unused without NVENC)
+    transcode_cpu_slots: int = 0  # libx264 encodes; 0 = half the CPU cores
+    transcode_queue_timeout_seconds: float = 30.0  # max wait for a slot before answering 503
+
+    # Preview artifacts (posters, sprite sheets, WebVTT thumbnail tracks) keyed by content
+    preview_dir: str = "/tmp/mediavault_cache/previews"
+    preview_pregenerate: bool = True  # generate them (and the default preview clip) after scans
+
+    # Prewarm (background transcodes of likely-next titles at the lowest scheduler priority)
+    prewarm_enabled: bool = True
+    prewarm_interval_seconds: float = 600.0  # how often recent files and open duplicate groups are queued
+    prewarm_recent_hours: float = 48.0  # files discovered within this window count as recently added
+    prewarm_max_items: int = 10  # recent files and open groups queued per round (each)
+    prewarm_full_max_minutes: float = 60.0  # titles up to this long get their whole /smart output
+    prewarm_head_minutes: float = 5.0  # longer titles get this much HLS
+    prewarm_max_gb: float = 20.0  # prewarmed output kept on disk at most
+    prewarm_cpu_seconds_per_hour: float = 1800.0  # CPU time prewarm encodes may use per hour; 0 = unlimited
+
+    # HLS (segments are transcoded on demand)
+    hls_segment_format: str = "mpegts"  # mpegts (segments on demand) or fmp4 (CMAF, one file per rendition)
+    hls_segment_seconds: int = 4
+    hls_prefetch_segments: int = 5  # encode this far ahead of the player, then pause
+    hls_encoder_idle_seconds: float = 60.0  # stop encoders with no segment requests
+    hls_segment_timeout_seconds: float = 30.0  # max wait for a segment to be encoded
+    hls_store_max_gb: float = 10.0  # whole titles are evicted (least recently watched) beyond this
+    hls_store_max_age_hours: float = 1.0  # drop titles not watched for this long
+    hls_store_sweep_seconds: float = 60.0
+
     # Logging
     log_level: str = "INFO"
     log_file: str = "/var/log/mediavault/mediavault.log"
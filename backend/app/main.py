@@ -7,6 +7,7 @@ import sys
 from app.config import get_settings
 from app.database import init_db
 from app.routes import scan, media, duplicates, archives, deletions, stream, rename, nas
+from app.services.prewarm_service import get_prewarm_service
 
 # Configure logger
 logger.remove()
@@ -67,6 +68,9 @@ async def startup_event():
     # Initialize database
     init_db()
 
+    if settings.prewarm_enabled:
+        get_prewarm_service().start()
+
     logger.success("✓ Application startup complete")
 
 
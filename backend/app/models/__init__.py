@@ -6,6 +6,8 @@ from app.models.duplicate import DuplicateGroup, DuplicateMember, UserDecision
 from app.models.deletion import PendingDeletion, ArchiveOperation
 from app.models.chat import ChatSession, ChatMessage
 from app.models.archive import ArchiveFile, ArchiveContent
+from app.models.tmdb import TMDbCacheEntry
+from app.models.parse_cache import FilenameParseCacheEntry
 
 __all__ = [
     "User",
@@ -22,4 +24,6 @@ __all__ = [
     "ChatMessage",
     "ArchiveFile",
     "ArchiveContent",
+    "TMDbCacheEntry",
+    "FilenameParseCacheEntry",
 ]
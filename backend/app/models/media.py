@@ -87,7 +87,7 @@ class MediaFile(Base):
     __table_args__ = (
         Index("idx_media_parsed_movie", "parsed_title", "parsed_year"),
         Index("idx_media_parsed_tv", "parsed_title", "parsed_season", "parsed_episode"),
-        Index("idx_media_type_quality", "media_type", "quality_score"),
+        Index("idx_media_type_quality", "media_type", quality_score.desc(), "id"),
     )
 
 
@@ -0,0 +1,20 @@
+"""Filename parse cache model."""
+from sqlalchemy import Column, Integer, String, DateTime, JSON, UniqueConstraint
+from sqlalchemy.sql import func
+
+from app.database import Base
+
+
+class FilenameParseCacheEntry(Base):
+    """Cached guessit result for a filename under a given guessit version."""
+
+    __tablename__ = "filename_parse_cache"
+    __table_args__ = (
+        UniqueConstraint("guessit_version", "filename", name="uq_filename_parse_cache"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    filename = Column(String(500), nullable=False)
+    guessit_version = Column(String(20), nullable=False)
+    parsed = Column(JSON, nullable=False)
+    created_at = Column(DateTime(timezone=False), nullable=False, server_default=func.now())
@@ -0,0 +1,24 @@
+"""TMDb response cache model."""
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, JSON
+from sqlalchemy.sql import func
+
+from app.database import Base
+
+
+class TMDbCacheEntry(Base):
+    """Cached TMDb API result keyed by normalized (endpoint, query, year)."""
+
+    __tablename__ = "tmdb_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String(600), nullable=False, unique=True)
+    endpoint = Column(String(100), nullable=False)
+    query = Column(String(500), nullable=True)
+    year = Column(Integer, nullable=True)
+
+    # NULL response with is_negative=True records "TMDb had no match"
+    response = Column(JSON, nullable=True)
+    is_negative = Column(Boolean, default=False, nullable=False)
+
+    fetched_at = Column(DateTime(timezone=False), nullable=False, server_default=func.now())
+    expires_at = Column(DateTime(timezone=False), nullable=False, index=True)
@@ -6,6 +6,8 @@ from sqlalchemy.orm import Session
 
 from app.database import get_db
 from app.models import DuplicateGroup, DuplicateMember, MediaFile, UserDecision
+from app.services.dedup_service import DeduplicationService
+from app.services.quality_service import get_profile_specs
 
 router = APIRouter(prefix="/duplicates", tags=["duplicates"])
 
@@ -72,6 +74,33 @@ def list_duplicate_groups(
     }
 
 
+@router.get("/profiles")
+def list_quality_profiles():
+    """List quality scoring profiles available for duplicate ranking."""
+    return {"profiles": sorted(get_profile_specs().keys())}
+
+
+@router.get("/profiles/compare")
+def compare_quality_profiles(
+    profiles: str = "default,archive,mobile,space-saver",
+    include_reviewed: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Compare keep/delete outcomes of open duplicate groups across profiles.
+
+    The first profile in the comma-separated list is the baseline.
+    """
+    profile_names = [name.strip() for name in profiles.split(",") if name.strip()]
+    if not profile_names:
+        raise HTTPException(status_code=400, detail="At least one profile is required")
+
+    try:
+        return DeduplicationService(db).compare_profiles(profile_names, include_reviewed=include_reviewed)
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.get("/groups/{group_id}")
 def get_duplicate_group(group_id: int, db: Session = Depends(get_db)):
     """Get detailed information about a duplicate group."""
@@ -25,9 +25,18 @@ def list_media(
     limit: int = 50,
     media_type: Optional[str] = None,
     is_duplicate: Optional[bool] = None,
+    sort_by: str = "discovered_at",
     db: Session = Depends(get_db)
 ):
-    """List media files with optional filters."""
+    """
+    List media files with optional filters.
+
+    ``sort_by`` accepts ``discovered_at`` (newest first) or ``quality_score``
+    (by media type, best first). Quality ordering follows
+    idx_media_type_quality column for column, so pages are read off the
+    index instead of sorting the table; the trigger from migration 005
+    keeps quality_score non-null.
+    """
     query = db.query(MediaFile).filter(MediaFile.is_deleted == False)
 
     if media_type:
@@ -36,8 +45,15 @@ def list_media(
     if is_duplicate is not None:
         query = query.filter(MediaFile.is_duplicate == is_duplicate)
 
+    if sort_by == "quality_score":
+        order_by = [MediaFile.media_type, MediaFile.quality_score.desc(), MediaFile.id]
+    elif sort_by == "discovered_at":
+        order_by = [MediaFile.discovered_at.desc()]
+    else:
+        raise HTTPException(status_code=400, detail="sort_by must be 'discovered_at' or 'quality_score'")
+
     total = query.count()
-    files = query.order_by(MediaFile.discovered_at.desc()).offset(skip).limit(limit).all()
+    files = query.order_by(*order_by).offset(skip).limit(limit).all()
 
     return {
         "total": total,
@@ -157,7 +157,7 @@ async def browse_nas(
 
 
 @router.post("/scan", response_model=ScanStatusResponse)
-async def start_scan(
+def start_scan(
     request: ScanRequest,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
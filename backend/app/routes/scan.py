@@ -7,6 +7,8 @@ from typing import List, Optional
 from app.database import get_db
 from app.services.scanner_service import ScannerService
 from app.services.dedup_service import DeduplicationService
+from app.services.quality_service import QualityService
+from app.services.tmdb_cache import get_tmdb_cache
 from app.models import ScanHistory
 
 router = APIRouter(prefix="/scan", tags=["scan"])
@@ -60,11 +62,14 @@ def start_scan(
 
 
 @router.post("/deduplicate")
-def run_deduplication(db: Session = Depends(get_db)):
-    """Run duplicate detection on scanned files."""
+def run_deduplication(profile: Optional[str] = None, db: Session = Depends(get_db)):
+    """Run duplicate detection on scanned files, ranking with a quality profile."""
     try:
-        dedup = DeduplicationService(db)
+        dedup = DeduplicationService(db, profile=profile)
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
+    try:
         # Find exact duplicates
         exact_groups = dedup.find_exact_duplicates()
 
@@ -79,6 +84,7 @@ def run_deduplication(db: Session = Depends(get_db)):
             "fuzzy_duplicates": len(fuzzy_groups),
             "groups_created": total_groups,
             "total_members": total_members,
+            "profile": dedup.profile,
             "message": f"Found {len(exact_groups)} exact and {len(fuzzy_groups)} fuzzy duplicate groups"
         }
 
@@ -86,6 +92,38 @@ def run_deduplication(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/rescore")
+def rescore_quality(db: Session = Depends(get_db)):
+    """Recompute quality scores for all media files inside the database."""
+    try:
+        updated = QualityService().rescore_all(db)
+
+        return {
+            "files_rescored": updated,
+            "message": f"Rescored {updated} media files"
+        }
+
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/tmdb-cache")
+def get_tmdb_cache_stats():
+    """TMDb response cache hit/miss counters for this process."""
+    return get_tmdb_cache().stats()
+
+
+@router.delete("/tmdb-cache/expired")
+def purge_tmdb_cache():
+    """Delete expired TMDb cache rows."""
+    try:
+        deleted = get_tmdb_cache().purge_expired()
+        return {"deleted": deleted}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/history")
 def get_scan_history(
     limit: int = 10,
@@ -1,28 +1,60 @@
 """Video streaming routes with range request support."""
+import asyncio
 import os
+import re
 import tempfile
-import subprocess
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 from fastapi import APIRouter, Depends, HTTPException, Request, BackgroundTasks
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from typing import Optional
+from starlette.concurrency import iterate_in_threadpool
+from typing import AsyncIterator, Callable, Iterator, List, Optional, Tuple
 from loguru import logger
 
 from app.database import get_db
-from app.models import MediaFile
+from app.models import DuplicateGroup, MediaFile
 from app.utils.path_utils import resolve_media_path
+from app.utils.file_response import ThroughputMeter, file_range_response, video_content_type
+from app.utils.fmp4 import FragmentIndex
+from app.services.comparison_service import (
+    COMPARE_MAX_SECONDS, COMPARE_SECONDS, COMPARE_START, COMPOSITE, LAYOUTS,
+    ComparisonService, comparison_fps, group_members,
+)
 from app.services.ffmpeg_service import FFmpegService
-from app.services.hls_service_simple import HLSServiceSimple
+from app.services.hls_service import DEFAULT_RENDITION, build_ladder, get_hls_service
+from app.services.hls_cmaf import CMAFPackager, build_cmaf_playlist, build_dash_manifest
+from app.services.prewarm_service import get_prewarm_service
+from app.services.preview_service import POSTER, SPRITE, THUMBNAILS, get_preview_service, preview_profile
+from app.services.stream_profiles import (
+    ACCEPT_CH, StreamProfile, client_hints, client_key, get_throughput_history,
+    select_profile, smart_output_key,
+)
+from app.services.stream_registry import (
+    StreamTracker, get_stream_registry, render_metrics, service_metrics,
+)
+from app.services.transcode_cache import get_transcode_cache, media_fingerprint, transcode_cache_key
+from app.services.transcode_sessions import TranscodeSession, get_session_manager
+from app.services.transcode_scheduler import TranscodeQueueTimeout, get_transcode_scheduler
 from app.config import get_settings
 
 settings = get_settings()
 
 router = APIRouter(prefix="/stream", tags=["stream"])
 
+# How often a live transcode response checks that its client is still there
+DISCONNECT_POLL_SECONDS = 1.0
+
+# Stream registry method of each /smart recommendation served through FFmpeg
+SMART_METHODS = {"remux_only": "remux", "audio_transcode": "audio_transcode", "hls_transcode": "transcode"}
+
 # Initialize services
 ffmpeg_service = FFmpegService()
-hls_service = HLSServiceSimple()  # Using simple version for testing
+hls_service = get_hls_service()
+cmaf_packager = CMAFPackager()
+comparison_service = ComparisonService()
 
 
 @router.get("/gpu-status")
@@ -43,87 +75,198 @@ def get_gpu_status():
     }
 
 
-def range_requests_response(
-    request: Request,
-    file_path: str,
-    content_type: str = "video/mp4"
-):
+@router.get("/transcode-cache")
+def get_transcode_cache_stats():
     """
-    Returns a StreamingResponse with support for HTTP Range requests.
+    Transcode cache usage and hit metrics.
 
-    Args:
-        request: FastAPI request object
-        file_path: Absolute path to the media file
-        content_type: MIME type of the media file
+    Returns:
+        Cache statistics (hits, misses, evictions, bytes used)
+    """
+    if not settings.transcode_cache_enabled:
+        return {"enabled": False}
+    return {"enabled": True, **get_transcode_cache().stats()}
+
+
+@router.get("/scheduler")
+def get_transcode_scheduler_stats():
+    """
+    Transcode scheduler slots, running encodes and queue.
 
     Returns:
-        StreamingResponse with proper range headers
-    """
-    file_size = os.path.getsize(file_path)
-    range_header = request.headers.get("range")
-
-    if range_header:
-        # Parse range header (e.g., "bytes=0-1023")
-        byte_range = range_header.strip().lower().replace("bytes=", "")
-
-        if "-" not in byte_range:
-            raise HTTPException(status_code=416, detail="Invalid range header")
-
-        start_str, end_str = byte_range.split("-")
-
-        start = int(start_str) if start_str else 0
-        end = int(end_str) if end_str else file_size - 1
-
-        # Ensure valid range
-        if start >= file_size or end >= file_size or start > end:
-            raise HTTPException(status_code=416, detail="Range not satisfiable")
-
-        chunk_size = end - start + 1
-
-        def iter_file():
-            """Generator to stream file chunks."""
-            with open(file_path, "rb") as f:
-                f.seek(start)
-                remaining = chunk_size
-                while remaining > 0:
-                    read_size = min(8192, remaining)
-                    data = f.read(read_size)
-                    if not data:
-                        break
-                    remaining -= len(data)
-                    yield data
-
-        headers = {
-            "Content-Range": f"bytes {start}-{end}/{file_size}",
-            "Accept-Ranges": "bytes",
-            "Content-Length": str(chunk_size),
-            "Content-Type": content_type,
-        }
+        Slot usage per encoder type and queued requests with positions
+    """
+    return get_transcode_scheduler().stats()
 
-        return StreamingResponse(
-            iter_file(),
-            status_code=206,  # Partial Content
-            headers=headers,
-        )
 
-    else:
-        # No range header - stream entire file
-        def iter_full_file():
-            with open(file_path, "rb") as f:
-                while chunk := f.read(8192):
-                    yield chunk
-
-        headers = {
-            "Accept-Ranges": "bytes",
-            "Content-Length": str(file_size),
-            "Content-Type": content_type,
-        }
+@router.get("/previews")
+def get_preview_stats():
+    """
+    Preview artifact generation counters.
+
+    Returns:
+        Generated/failed/cache-hit counts and the background backlog
+    """
+    return get_preview_service().stats()
+
+
+@router.get("/prewarm")
+def get_prewarm_stats():
+    """
+    Background prewarm counters and budget usage.
+
+    Returns:
+        Prewarmed/yielded/skipped counts, backlog, disk and CPU usage
+    """
+    return get_prewarm_service().stats()
+
+
+@router.get("/sessions")
+def get_stream_sessions():
+    """
+    Stream sessions being served and recently finished.
+
+    Returns:
+        Per-session method, bytes, throughput, time to first byte, stalls
+        and FFmpeg speed; per-method totals; shared FFmpeg sessions and
+        transcode scheduler state
+    """
+    return {
+        **get_stream_registry().sessions(),
+        "ffmpeg_sessions": get_session_manager().stats(),
+        "scheduler": get_transcode_scheduler().stats(),
+    }
+
 
-        return StreamingResponse(
-            iter_full_file(),
-            status_code=200,
-            headers=headers,
+@router.get("/metrics")
+def get_stream_metrics():
+    """
+    Stream, transcode and cache metrics in the Prometheus text format.
+
+    Returns:
+        text/plain exposition of stream sessions, TTFB histogram, stalls,
+        scheduler slots and queue, FFmpeg sessions and speed, cache and
+        background worker counters
+    """
+    families = get_stream_registry().metrics() + service_metrics()
+    return PlainTextResponse(render_metrics(families), media_type="text/plain; version=0.0.4")
+
+
+def _meter(request: Request) -> ThroughputMeter:
+    """Throughput meter feeding the client's history (for profile selection)."""
+    return get_throughput_history().meter(client_key(request))
+
+
+@contextmanager
+def _track(request: Request, file_id: int, method: str):
+    """
+    Register a response with the stream registry for the block.
+
+    Yields the :class:`StreamTracker` to pass to the response as its
+    meter; it also feeds the client's throughput history. If the block
+    raises, the response never happens and the tracker is closed.
+    """
+    client = client_key(request)
+    tracker = get_stream_registry().open(
+        file_id, method, client, on_close=lambda kbps: get_throughput_history().record(client, kbps)
+    )
+    try:
+        yield tracker
+    except BaseException:
+        tracker.close()
+        raise
+
+
+def _with_profile(response, profile: Optional[StreamProfile]):
+    """Ask for bandwidth client hints, and say which rung (if any) was picked."""
+    response.headers["Accept-CH"] = ACCEPT_CH
+    if profile is not None:
+        response.headers["X-Stream-Profile"] = profile.name
+        exposed = response.headers.get("Access-Control-Expose-Headers")
+        response.headers["Access-Control-Expose-Headers"] = (
+            f"{exposed}, X-Stream-Profile" if exposed else "X-Stream-Profile"
         )
+    return response
+
+
+def bitrate_bps(media_file: MediaFile) -> Optional[int]:
+    """A file's bitrate in bits/s, as the chunk sizer wants it (``MediaFile.bitrate`` is in kbps)."""
+    return int(media_file.bitrate * 1000) if media_file.bitrate else None
+
+
+def _played(file_id: int) -> None:
+    """Let the prewarm worker get the next episode ready."""
+    if settings.prewarm_enabled:
+        get_prewarm_service().played(file_id)
+
+
+def _queue_full(e: TranscodeQueueTimeout) -> HTTPException:
+    """503 telling the client where it stood in the transcode queue."""
+    return HTTPException(
+        status_code=503,
+        detail=f"All transcoders are busy (queue position {e.position}), retry shortly",
+        headers={"Retry-After": "5", "X-Queue-Position": str(e.position)}
+    )
+
+
+def _output_key(media_file: MediaFile, resolved_path: Path, profile: str,
+                width: Optional[int] = None, height: Optional[int] = None) -> str:
+    """Key identifying a transcode output (source content, profile, resolution)."""
+    fingerprint = media_fingerprint(media_file.md5_hash, str(resolved_path))
+    return transcode_cache_key(fingerprint, profile, width, height)
+
+
+def _cache_key(media_file: MediaFile, resolved_path: Path, profile: str,
+               width: Optional[int] = None, height: Optional[int] = None) -> Optional[str]:
+    """Transcode cache key for a media file, or None when caching is disabled."""
+    if not settings.transcode_cache_enabled:
+        return None
+    return _output_key(media_file, resolved_path, profile, width, height)
+
+
+def _cached_or_transcode(cache_key: Optional[str], transcode, fallback_path: Path,
+                         failure_detail: str = "Transcoding failed") -> Path:
+    """
+    Return the cached output for ``cache_key``, running ``transcode`` on a miss.
+
+    ``transcode(output_path) -> bool`` writes a complete file. With caching
+    enabled it writes to a unique temp file that is published atomically;
+    otherwise it writes to ``fallback_path`` (the caller cleans that up).
+    A transcode that can't get a scheduler slot in time answers 503.
+    """
+    try:
+        return _run_cached_transcode(cache_key, transcode, fallback_path, failure_detail)
+    except TranscodeQueueTimeout as e:
+        raise _queue_full(e)
+
+
+def _run_cached_transcode(cache_key: Optional[str], transcode, fallback_path: Path,
+                          failure_detail: str) -> Path:
+    if cache_key is None:
+        if not transcode(fallback_path):
+            raise HTTPException(status_code=500, detail=failure_detail)
+        return fallback_path
+
+    cache = get_transcode_cache()
+    cached = cache.lookup(cache_key)
+    if cached is not None:
+        logger.info(f"Transcode cache hit: {cache_key[:12]}")
+        return cached
+
+    def run() -> Path:
+        # A concurrent request may have published while we waited
+        if cache.contains(cache_key):
+            return cache.path_for(cache_key)
+        temp_path = cache.temp_path(cache_key)
+        try:
+            if not transcode(temp_path):
+                raise HTTPException(status_code=500, detail=failure_detail)
+            return cache.publish(cache_key, temp_path)
+        finally:
+            cache.discard(temp_path)
+
+    # Concurrent requests for the same output share one FFmpeg run
+    return get_session_manager().single_flight(cache_key, run)
 
 
 @router.get("/{file_id}")
@@ -141,7 +284,7 @@ def stream_video(
         db: Database session
 
     Returns:
-        StreamingResponse with video data
+        Ranged file response (or an nginx X-Accel-Redirect handoff)
     """
     media_file = db.query(MediaFile).filter(MediaFile.id == file_id).first()
 
@@ -153,34 +296,21 @@ def stream_video(
     if not resolved_path or not resolved_path.exists():
         raise HTTPException(status_code=404, detail="File not found on disk")
 
-    # Determine content type based on file extension
-    ext = os.path.splitext(media_file.filename)[1].lower()
-    content_type_map = {
-        ".mp4": "video/mp4",
-        ".mkv": "video/x-matroska",
-        ".avi": "video/x-msvideo",
-        ".mov": "video/quicktime",
-        ".webm": "video/webm",
-        ".m4v": "video/x-m4v",
-        ".wmv": "video/x-ms-wmv",
-        ".flv": "video/x-flv",
-        ".mpg": "video/mpeg",
-        ".mpeg": "video/mpeg",
-        ".ts": "video/mp2t",
-    }
-
-    content_type = content_type_map.get(ext, "video/mp4")
-
-    return range_requests_response(
-        request=request,
-        file_path=str(resolved_path),
-        content_type=content_type
-    )
+    method = "range" if request.headers.get("range") else "direct"
+    with _track(request, file_id, method) as tracker:
+        return file_range_response(
+            request=request,
+            file_path=str(resolved_path),
+            content_type=video_content_type(media_file.filename),
+            bitrate=bitrate_bps(media_file),
+            meter=tracker
+        )
 
 
 @router.head("/{file_id}")
 def stream_video_head(
     file_id: int,
+    request: Request,
     db: Session = Depends(get_db)
 ):
     """
@@ -188,6 +318,7 @@ def stream_video_head(
 
     Args:
         file_id: Media file ID
+        request: FastAPI request (for range headers)
         db: Database session
 
     Returns:
@@ -203,34 +334,11 @@ def stream_video_head(
     if not resolved_path or not resolved_path.exists():
         raise HTTPException(status_code=404, detail="File not found on disk")
 
-    from fastapi.responses import Response
-
-    file_size = resolved_path.stat().st_size
-    ext = os.path.splitext(media_file.filename)[1].lower()
-
-    content_type_map = {
-        ".mp4": "video/mp4",
-        ".mkv": "video/x-matroska",
-        ".avi": "video/x-msvideo",
-        ".mov": "video/quicktime",
-        ".webm": "video/webm",
-        ".m4v": "video/x-m4v",
-        ".wmv": "video/x-ms-wmv",
-        ".flv": "video/x-flv",
-        ".mpg": "video/mpeg",
-        ".mpeg": "video/mpeg",
-        ".ts": "video/mp2t",
-    }
-
-    content_type = content_type_map.get(ext, "video/mp4")
-
-    return Response(
-        status_code=200,
-        headers={
-            "Accept-Ranges": "bytes",
-            "Content-Length": str(file_size),
-            "Content-Type": content_type,
-        }
+    return file_range_response(
+        request=request,
+        file_path=str(resolved_path),
+        content_type=video_content_type(media_file.filename),
+        bitrate=bitrate_bps(media_file)
     )
 
 
@@ -272,39 +380,45 @@ def stream_transcoded_video(
     if not resolved_path or not resolved_path.exists():
         raise HTTPException(status_code=404, detail="File not found on disk")
 
-    # Create temporary output file
-    temp_dir = Path(tempfile.gettempdir()) / "mediavault_transcodes"
-    temp_dir.mkdir(exist_ok=True)
-
-    output_file = temp_dir / f"transcode_{file_id}_{width}x{height}.mp4"
+    # Transcode with GPU acceleration (or reuse a cached transcode)
+    def transcode(output_path: Path) -> bool:
+        with get_transcode_scheduler().slot(
+            "interactive", prefer_gpu=use_gpu, label=f"transcode {file_id}",
+            timeout=settings.transcode_queue_timeout_seconds
+        ) as slot:
+            logger.info(f"Transcoding {media_file.filename} with {'GPU' if slot.gpu else 'CPU'}...")
+            return ffmpeg_service.transcode_for_streaming_gpu(
+                input_path=str(resolved_path),
+                output_path=str(output_path),
+                width=width,
+                height=height,
+                use_gpu=slot.gpu
+            )
 
-    # Transcode with GPU acceleration
-    logger.info(f"Transcoding {media_file.filename} with {'GPU' if use_gpu else 'CPU'}...")
+    # Encoder choice doesn't change what's served, so it isn't part of the key
+    cache_key = _cache_key(media_file, resolved_path, "h264-crf23", width, height)
 
-    success = ffmpeg_service.transcode_for_streaming_gpu(
-        input_path=str(resolved_path),
-        output_path=str(output_file),
-        width=width,
-        height=height,
-        use_gpu=use_gpu
+    temp_dir = Path(tempfile.gettempdir()) / "mediavault_transcodes"
+    temp_dir.mkdir(exist_ok=True)
+    output_file = _cached_or_transcode(
+        cache_key, transcode,
+        temp_dir / f"transcode_{file_id}_{width}x{height}_{os.getpid()}_{id(request)}.mp4"
     )
 
-    if not success:
-        raise HTTPException(status_code=500, detail="Transcoding failed")
-
-    # Schedule cleanup of temp file after streaming completes
-    def cleanup():
-        try:
-            if output_file.exists():
-                output_file.unlink()
-                logger.info(f"Cleaned up temp file: {output_file}")
-        except Exception as e:
-            logger.warning(f"Failed to cleanup temp file: {e}")
+    if cache_key is None:
+        # Schedule cleanup of temp file after streaming completes
+        def cleanup():
+            try:
+                if output_file.exists():
+                    output_file.unlink()
+                    logger.info(f"Cleaned up temp file: {output_file}")
+            except Exception as e:
+                logger.warning(f"Failed to cleanup temp file: {e}")
 
-    background_tasks.add_task(cleanup)
+        background_tasks.add_task(cleanup)
 
     # Stream the transcoded file with range support
-    return range_requests_response(
+    return file_range_response(
         request=request,
         file_path=str(output_file),
         content_type="video/mp4"
@@ -349,64 +463,242 @@ def stream_preview_clip(
     if not resolved_path or not resolved_path.exists():
         raise HTTPException(status_code=404, detail="File not found on disk")
 
-    # Create temporary preview file
+    # Generate preview with GPU (or reuse a cached preview)
+    def transcode(output_path: Path) -> bool:
+        with get_transcode_scheduler().slot(
+            "preview", prefer_gpu=use_gpu, label=f"preview {file_id}",
+            timeout=settings.transcode_queue_timeout_seconds
+        ) as slot:
+            logger.info(f"Generating preview for {media_file.filename} with {'GPU' if slot.gpu else 'CPU'}...")
+            return ffmpeg_service.create_preview_clip_gpu(
+                input_path=str(resolved_path),
+                output_path=str(output_path),
+                start_time=start_time,
+                duration=duration,
+                use_gpu=slot.gpu
+            )
+
+    # The default clip is pre-generated into the cache after scans
+    cache_key = _cache_key(media_file, resolved_path, preview_profile(start_time, duration))
+
     temp_dir = Path(tempfile.gettempdir()) / "mediavault_previews"
     temp_dir.mkdir(exist_ok=True)
+    preview_file = _cached_or_transcode(
+        cache_key, transcode,
+        temp_dir / f"preview_{file_id}_{start_time.replace(':', '-')}_{duration}s_{os.getpid()}_{id(request)}.mp4",
+        failure_detail="Preview generation failed"
+    )
 
-    preview_file = temp_dir / f"preview_{file_id}_{start_time.replace(':', '-')}_{duration}s.mp4"
+    if cache_key is None:
+        # Schedule cleanup
+        def cleanup():
+            try:
+                if preview_file.exists():
+                    preview_file.unlink()
+                    logger.info(f"Cleaned up preview file: {preview_file}")
+            except Exception as e:
+                logger.warning(f"Failed to cleanup preview: {e}")
 
-    # Generate preview with GPU
-    logger.info(f"Generating preview for {media_file.filename} with {'GPU' if use_gpu else 'CPU'}...")
+        background_tasks.add_task(cleanup)
 
-    success = ffmpeg_service.create_preview_clip_gpu(
-        input_path=str(resolved_path),
-        output_path=str(preview_file),
-        start_time=start_time,
-        duration=duration,
-        use_gpu=use_gpu
+    return file_range_response(
+        request=request,
+        file_path=str(preview_file),
+        content_type="video/mp4"
     )
 
-    if not success:
-        raise HTTPException(status_code=500, detail="Preview generation failed")
 
-    # Schedule cleanup
-    def cleanup():
-        try:
-            if preview_file.exists():
-                preview_file.unlink()
-                logger.info(f"Cleaned up preview file: {preview_file}")
-        except Exception as e:
-            logger.warning(f"Failed to cleanup preview: {e}")
+def _artifact_response(file_id: int, name: str, request: Request, db: Session, content_type: str):
+    """Serve a cached preview artifact, generating it on first use."""
+    media_file = db.query(MediaFile).filter(MediaFile.id == file_id).first()
+
+    if not media_file:
+        raise HTTPException(status_code=404, detail="Media file not found")
+
+    resolved_path = resolve_media_path(media_file.filepath)
+
+    if not resolved_path or not resolved_path.exists():
+        raise HTTPException(status_code=404, detail="File not found on disk")
 
-    background_tasks.add_task(cleanup)
+    try:
+        path = get_preview_service().artifact(media_file, resolved_path, name)
+    except TranscodeQueueTimeout as e:
+        raise _queue_full(e)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"No {name} available for this file")
 
-    return range_requests_response(
+    return file_range_response(
         request=request,
-        file_path=str(preview_file),
-        content_type="video/mp4"
+        file_path=str(path),
+        content_type=content_type,
+        headers={"Cache-Control": "public, max-age=86400", "Access-Control-Allow-Origin": "*"}
     )
 
 
-@router.get("/{file_id}/hls/master.m3u8")
-def serve_hls_master_playlist(
-    file_id: int,
-    background_tasks: BackgroundTasks,
+@router.get("/{file_id}/poster.jpg")
+def get_poster(file_id: int, request: Request, db: Session = Depends(get_db)):
+    """
+    Poster frame (a tenth of the way in), cached by content.
+
+    Returns:
+        JPEG image
+    """
+    return _artifact_response(file_id, POSTER, request, db, "image/jpeg")
+
+
+@router.get("/{file_id}/sprite.jpg")
+def get_sprite_sheet(file_id: int, request: Request, db: Session = Depends(get_db)):
+    """
+    Seek thumbnail sprite sheet, cached by content.
+
+    Returns:
+        JPEG grid of thumbnails, addressed by ``thumbnails.vtt``
+    """
+    return _artifact_response(file_id, SPRITE, request, db, "image/jpeg")
+
+
+@router.get("/{file_id}/thumbnails.vtt")
+def get_thumbnail_track(file_id: int, request: Request, db: Session = Depends(get_db)):
+    """
+    WebVTT thumbnail track for the seek bar.
+
+    Each cue points at a tile of ``sprite.jpg`` with a ``#xywh`` fragment.
+
+    Returns:
+        text/vtt track
+    """
+    return _artifact_response(file_id, THUMBNAILS, request, db, "text/vtt")
+
+
+def _parse_offsets(offsets: Optional[str]) -> dict:
+    """``"12:1.5,15:-0.25"`` -> {12: 1.5, 15: -0.25} (seconds each version is shifted by)."""
+    parsed = {}
+    for item in (offsets or "").split(","):
+        if not item.strip():
+            continue
+        try:
+            file_id, seconds = item.split(":")
+            parsed[int(file_id)] = float(seconds)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid offset {item!r}; use file_id:seconds")
+    return parsed
+
+
+def _comparison(group_id: int, db: Session, start: float, seconds: int, layout: Optional[str],
+                offsets: Optional[str], use_gpu: bool):
+    """Members of a duplicate group and their comparison outputs, encoded if not cached."""
+    if not settings.transcode_cache_enabled:
+        raise HTTPException(status_code=409, detail="Comparisons need the transcode cache enabled")
+    if layout is not None and layout not in LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"layout must be one of {', '.join(LAYOUTS)}")
+
+    group = db.query(DuplicateGroup).filter(DuplicateGroup.id == group_id).first()
+    if not group:
+        raise HTTPException(status_code=404, detail="Duplicate group not found")
+
+    members, files = group_members(db, group_id, _parse_offsets(offsets))
+    if not members:
+        raise HTTPException(status_code=404, detail="No member of this group is on disk")
+
+    fps = comparison_fps(files)
+    seconds = max(1, min(seconds, COMPARE_MAX_SECONDS))
+    try:
+        outputs = comparison_service.prepare(
+            members, start=max(start, 0.0), seconds=seconds, fps=fps, layout=layout,
+            prefer_gpu=use_gpu, label=f"comparison of group {group_id}"
+        )
+    except TranscodeQueueTimeout as e:
+        raise _queue_full(e)
+    if outputs is None:
+        raise HTTPException(status_code=500, detail="Comparison encode failed")
+    return members, files, fps, seconds, outputs
+
+
+@router.get("/compare/{group_id}")
+def get_comparison(
+    group_id: int,
+    request: Request,
+    start: float = COMPARE_START,
+    seconds: int = COMPARE_SECONDS,
+    layout: Optional[str] = None,
+    offsets: Optional[str] = None,
+    use_gpu: bool = True,
     db: Session = Depends(get_db)
 ):
     """
-    Serve HLS master playlist for adaptive streaming.
+    Time-aligned low-resolution previews of a duplicate group's versions.
 
-    Automatically generates HLS segments if not already available.
-    Supports multiple quality levels (480p, 720p, 1080p).
+    All versions are encoded together in one scheduled job (and cached),
+    starting ``start`` seconds in; ``offsets`` (``file_id:seconds,...``)
+    shifts individual versions so their content lines up. Every preview
+    has the same frame rate and starts at time zero, so players can be
+    scrubbed together; with ``layout`` (hstack or vstack) a single
+    composite video is produced as well.
 
     Args:
-        file_id: Media file ID
-        background_tasks: Background task handler
+        group_id: Duplicate group ID
+        request: FastAPI request (its query is carried into the URLs)
+        start: Source position of the previews, in seconds
+        seconds: Preview length (max 120)
+        layout: Optional composite layout, hstack or vstack
+        offsets: Per-version shifts, e.g. ``12:1.5,15:-0.25``
+        use_gpu: Prefer NVENC
         db: Database session
 
     Returns:
-        Master playlist (.m3u8) for adaptive streaming
+        Per-version preview URLs and offsets, plus the composite URL
+    """
+    members, files, fps, seconds, outputs = _comparison(group_id, db, start, seconds, layout, offsets, use_gpu)
+
+    # Relative to /compare/{group_id}, carrying the parameters the outputs are keyed by
+    query = f"?{request.url.query}" if request.url.query else ""
+    return {
+        "group_id": group_id,
+        "start": max(start, 0.0),
+        "seconds": seconds,
+        "fps": fps,
+        "members": [
+            {"file_id": m.file_id, "filename": f.filename, "offset": m.offset,
+             "source_start": max(start + m.offset, 0.0), "url": f"{group_id}/{m.file_id}.mp4{query}"}
+            for m, f in zip(members, files)
+        ],
+        "composite": f"{group_id}/{COMPOSITE}.mp4{query}" if COMPOSITE in outputs else None,
+    }
+
+
+@router.get("/compare/{group_id}/{name}.mp4")
+def get_comparison_output(
+    group_id: int,
+    name: str,
+    request: Request,
+    start: float = COMPARE_START,
+    seconds: int = COMPARE_SECONDS,
+    layout: Optional[str] = None,
+    offsets: Optional[str] = None,
+    use_gpu: bool = True,
+    db: Session = Depends(get_db)
+):
+    """
+    One comparison preview (a member's file ID, or ``composite``), from the transcode cache.
+
+    Takes the same parameters as ``/compare/{group_id}``; missing outputs
+    are encoded first.
     """
+    *_, outputs = _comparison(group_id, db, start, seconds, layout, offsets, use_gpu)
+    path = outputs.get(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"No comparison output {name}")
+
+    return file_range_response(
+        request=request,
+        file_path=str(path),
+        content_type="video/mp4",
+        headers={"Cache-Control": "public, max-age=3600", "Access-Control-Allow-Origin": "*"}
+    )
+
+
+def _hls_media_file(file_id: int, db: Session):
+    """Look up a media file for HLS, with its resolved path and duration."""
     media_file = db.query(MediaFile).filter(MediaFile.id == file_id).first()
 
     if not media_file:
@@ -417,38 +709,53 @@ def serve_hls_master_playlist(
     if not resolved_path or not resolved_path.exists():
         raise HTTPException(status_code=404, detail="File not found on disk")
 
-    # Check if HLS is already generated
-    if not hls_service.is_hls_ready(file_id):
-        # Check if generation is in progress
-        if hls_service.is_generating(file_id):
-            raise HTTPException(status_code=202, detail="HLS generation in progress, retry in a few seconds")
+    if not media_file.duration:
+        raise HTTPException(status_code=409, detail="Duration unknown; rescan the file before using HLS")
 
-        # Start HLS generation in background
-        logger.info(f"Starting HLS generation for file {file_id}: {media_file.filename}")
+    return media_file, resolved_path, float(media_file.duration)
+
+
+def _hls_ladder(media_file: MediaFile) -> List[dict]:
+    """Renditions offered for a file, sized from its source resolution."""
+    return build_ladder(media_file.width, media_file.height, media_file.bitrate)
+
+
+def _hls_rendition(media_file: MediaFile, quality: str) -> dict:
+    for rendition in _hls_ladder(media_file):
+        if rendition["name"] == quality:
+            return rendition
+    raise HTTPException(status_code=404, detail=f"Unknown quality {quality}")
 
-        success = hls_service.generate_hls_simple(
-            input_path=str(resolved_path),
-            file_id=file_id,
-            width=1280,
-            height=720,
-            bitrate="4000k",
-            use_gpu=True
-        )
 
-        if not success:
-            raise HTTPException(status_code=500, detail="HLS generation failed")
+def _cmaf_enabled() -> bool:
+    """CMAF output needs the transcode cache to hold its rendition files."""
+    return settings.hls_segment_format == "fmp4" and settings.transcode_cache_enabled
 
-        # Schedule cleanup task
-        background_tasks.add_task(hls_service.cleanup_old_segments)
 
-    # Serve playlist
-    playlist_path = hls_service.get_playlist_file(file_id)
+def _cmaf_job(media_file: MediaFile, resolved_path: Path,
+              rendition: dict) -> Tuple[str, Callable[[bool], List[str]], str]:
+    """A rendition's CMAF encode: cache key, command builder and label."""
+    cache_key = _output_key(media_file, resolved_path, f"hls-cmaf-{rendition['bitrate']}",
+                            rendition["width"], rendition["height"])
 
-    if not playlist_path:
-        raise HTTPException(status_code=500, detail="Playlist not found after generation")
+    def build_cmd(use_gpu: bool) -> List[str]:
+        return cmaf_packager.command(str(resolved_path), rendition, use_gpu, has_audio=bool(media_file.audio_codec))
 
-    return FileResponse(
-        path=str(playlist_path),
+    return cache_key, build_cmd, f"hls-cmaf {rendition['name']}"
+
+
+def _cmaf_media(media_file: MediaFile, resolved_path: Path, rendition: dict):
+    """The CMAF file for a rendition, starting its encode if needed."""
+    try:
+        return cmaf_packager.media(*_cmaf_job(media_file, resolved_path, rendition))
+    except TranscodeQueueTimeout as e:
+        raise _queue_full(e)
+
+
+def _playlist_response(content: str):
+    from fastapi.responses import Response
+    return Response(
+        content=content,
         media_type="application/vnd.apple.mpegurl",
         headers={
             "Cache-Control": "no-cache",
@@ -457,6 +764,31 @@ def serve_hls_master_playlist(
     )
 
 
+@router.get("/{file_id}/hls/master.m3u8")
+def serve_hls_master_playlist(
+    file_id: int,
+    db: Session = Depends(get_db)
+):
+    """
+    Serve HLS master playlist.
+
+    Lists one rendition per ladder rung the source can fill (no
+    upscaling). Playlists are written from the file's duration, so this
+    returns immediately; segments are transcoded on demand when requested.
+
+    Args:
+        file_id: Media file ID
+        db: Database session
+
+    Returns:
+        Master playlist (.m3u8)
+    """
+    media_file, _, _ = _hls_media_file(file_id, db)
+    _played(file_id)
+
+    return _playlist_response(hls_service.master_playlist(_hls_ladder(media_file)))
+
+
 @router.get("/{file_id}/hls/{quality}/playlist.m3u8")
 def serve_hls_quality_playlist(
     file_id: int,
@@ -466,32 +798,73 @@ def serve_hls_quality_playlist(
     """
     Serve quality-specific HLS playlist.
 
+    In fmp4 mode the playlist addresses byte ranges of the rendition's
+    single CMAF file, and lists only the fragments encoded so far until
+    the file is complete.
+
     Args:
         file_id: Media file ID
-        quality: Quality level (480p, 720p, 1080p)
+        quality: Quality level (e.g. 720p)
         db: Database session
 
     Returns:
-        Quality-specific playlist (.m3u8)
+        Complete VOD playlist (.m3u8) for the quality
     """
-    media_file = db.query(MediaFile).filter(MediaFile.id == file_id).first()
+    media_file, resolved_path, duration = _hls_media_file(file_id, db)
+    rendition = _hls_rendition(media_file, quality)
+
+    if _cmaf_enabled():
+        media = _cmaf_media(media_file, resolved_path, rendition)
+        if media is None:
+            raise HTTPException(status_code=503, detail="Rendition not available, retry shortly")
+        _, index, end, complete = media
+        return _playlist_response(
+            build_cmaf_playlist(index, end, duration, complete, cmaf_packager.segment_seconds)
+        )
 
-    if not media_file:
-        raise HTTPException(status_code=404, detail="Media file not found")
+    return _playlist_response(hls_service.media_playlist(duration))
 
-    # Validate quality
-    if quality not in ["480p", "720p", "1080p"]:
-        raise HTTPException(status_code=400, detail="Invalid quality level")
 
-    # Get playlist
-    playlist_path = hls_service.get_playlist_file(file_id, quality=quality)
+@router.get("/{file_id}/hls/manifest.mpd")
+def serve_dash_manifest(
+    file_id: int,
+    db: Session = Depends(get_db)
+):
+    """
+    Serve a DASH manifest over the CMAF rendition files (fmp4 mode only).
 
-    if not playlist_path:
-        raise HTTPException(status_code=404, detail=f"Playlist not found for quality {quality}")
+    Lists the renditions whose files are complete and starts encoding the
+    rest in the background (at preview priority, so viewers' encodes go
+    first); returns 503 at once until at least one is ready.
 
-    return FileResponse(
-        path=str(playlist_path),
-        media_type="application/vnd.apple.mpegurl",
+    Args:
+        file_id: Media file ID
+        db: Database session
+
+    Returns:
+        DASH manifest (.mpd)
+    """
+    if not _cmaf_enabled():
+        raise HTTPException(status_code=404, detail="DASH requires HLS_SEGMENT_FORMAT=fmp4")
+
+    media_file, resolved_path, duration = _hls_media_file(file_id, db)
+
+    representations = []
+    for rendition in _hls_ladder(media_file):
+        cache_key, build_cmd, label = _cmaf_job(media_file, resolved_path, rendition)
+        media = cmaf_packager.cached(cache_key)
+        if media is not None:
+            representations.append((rendition, media[1], media[2]))
+        else:
+            cmaf_packager.start(cache_key, build_cmd, label, priority="preview")
+    if not representations:
+        raise HTTPException(status_code=503, detail="Renditions still encoding, retry shortly",
+                            headers={"Retry-After": "10"})
+
+    from fastapi.responses import Response
+    return Response(
+        content=build_dash_manifest(representations, duration, cmaf_packager.segment_seconds),
+        media_type="application/dash+xml",
         headers={
             "Cache-Control": "no-cache",
             "Access-Control-Allow-Origin": "*"
@@ -499,48 +872,358 @@ def serve_hls_quality_playlist(
     )
 
 
-@router.get("/{file_id}/hls/{segment}")
+@router.get("/{file_id}/hls/{quality}/media.mp4")
+def serve_cmaf_media(
+    file_id: int,
+    quality: str,
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """
+    Serve byte ranges of a rendition's CMAF file (fmp4 mode only).
+
+    While the rendition is still encoding the ranges come from its spool,
+    which only ever grows; playlists list only fragments already written.
+
+    Args:
+        file_id: Media file ID
+        quality: Quality level (e.g. 720p)
+        request: FastAPI request (for range headers)
+        db: Database session
+
+    Returns:
+        Fragmented MP4 (range response)
+    """
+    if not _cmaf_enabled():
+        raise HTTPException(status_code=404, detail="Not found")
+
+    media_file, resolved_path, _ = _hls_media_file(file_id, db)
+    rendition = _hls_rendition(media_file, quality)
+
+    cache_key = _cmaf_job(media_file, resolved_path, rendition)[0]
+    with _track(request, file_id, "hls") as tracker:
+        tracker.session.detail = rendition["name"]
+        tracker.session.progress = lambda: cmaf_packager.progress(cache_key)
+        # The spool is renamed into the cache when the encode finishes
+        for _ in range(2):
+            media = _cmaf_media(media_file, resolved_path, rendition)
+            if media is None:
+                raise HTTPException(status_code=503, detail="Rendition not available, retry shortly")
+            path, _, _, complete = media
+            try:
+                return file_range_response(
+                    request=request,
+                    file_path=str(path),
+                    content_type="video/mp4",
+                    headers={
+                        "Cache-Control": "max-age=3600" if complete else "no-cache",
+                        "Access-Control-Allow-Origin": "*"
+                    },
+                    meter=tracker
+                )
+            except FileNotFoundError:
+                continue
+        raise HTTPException(status_code=503, detail="Rendition not available, retry shortly")
+
+
+@router.get("/{file_id}/hls/{quality}/{segment}")
 def serve_hls_segment(
     file_id: int,
+    quality: str,
     segment: str,
+    request: Request,
     db: Session = Depends(get_db)
 ):
     """
-    Serve HLS video segment.
+    Serve HLS video segment, transcoding it on demand.
+
+    Waits until the segment has been written. Requesting a segment far
+    from the current encoder position, or a rendition the encoder isn't
+    producing yet, restarts FFmpeg at that segment.
 
     Args:
         file_id: Media file ID
-        segment: Segment filename (e.g., segment_000.ts)
+        quality: Quality level (e.g. 720p)
+        segment: Segment filename (e.g., segment_00012.ts)
+        request: FastAPI request (for range headers)
         db: Database session
 
     Returns:
         Video segment (.ts file)
     """
-    media_file = db.query(MediaFile).filter(MediaFile.id == file_id).first()
-
-    if not media_file:
-        raise HTTPException(status_code=404, detail="Media file not found")
+    media_file, resolved_path, duration = _hls_media_file(file_id, db)
+    rendition = _hls_rendition(media_file, quality)
 
     # Validate segment filename (security check)
-    if not segment.endswith(".ts") or "/" in segment or "\\" in segment:
+    match = re.fullmatch(r"segment_(\d{5})\.ts", segment)
+    if not match:
         raise HTTPException(status_code=400, detail="Invalid segment name")
+    index = int(match.group(1))
+    if index >= hls_service.segment_count(duration):
+        raise HTTPException(status_code=404, detail="Segment not found")
 
-    # Get segment file
-    segment_path = hls_service.get_segment_file(file_id, segment)
+    # Tracked from here so waiting for the encoder counts towards time to first byte
+    with _track(request, file_id, "hls") as tracker:
+        tracker.session.detail = rendition["name"]
+        tracker.session.progress = lambda: hls_service.progress(file_id)
+        try:
+            segment_path = hls_service.get_segment(
+                file_id=file_id,
+                index=index,
+                input_path=str(resolved_path),
+                duration=duration,
+                rendition=rendition,
+                use_gpu=ffmpeg_service.check_gpu_encoding_available(),
+                has_audio=bool(media_file.audio_codec)
+            )
+        except TranscodeQueueTimeout as e:
+            raise _queue_full(e)
 
-    if not segment_path:
-        raise HTTPException(status_code=404, detail="Segment not found")
+        if not segment_path:
+            raise HTTPException(status_code=503, detail="Segment not available, retry shortly")
 
-    return FileResponse(
-        path=str(segment_path),
-        media_type="video/mp2t",
-        headers={
-            "Cache-Control": "max-age=3600",  # Cache segments for 1 hour
-            "Access-Control-Allow-Origin": "*"
-        }
+        try:
+            return file_range_response(
+                request=request,
+                file_path=str(segment_path),
+                content_type="video/mp2t",
+                headers={
+                    "Cache-Control": "max-age=3600",  # Cache segments for 1 hour
+                    "Access-Control-Allow-Origin": "*"
+                },
+                meter=tracker
+            )
+        except FileNotFoundError:
+            # Deleted since it was generated; the next request regenerates it
+            hls_service.store.forget(file_id, rendition["name"])
+            raise HTTPException(status_code=503, detail="Segment not available, retry shortly")
+
+
+def seek_seconds(request: Request, start: Optional[float], media_file: MediaFile) -> float:
+    """
+    Source position to start a progressive transcode from.
+
+    An explicit ``start`` (seconds) wins; otherwise an open-ended ``Range``
+    request is mapped from source bytes to time using the stored bitrate
+    (or file size over duration). Clamped to the file's duration.
+    """
+    duration = float(media_file.duration or 0)
+    seconds = 0.0
+    if start is not None:
+        seconds = start
+    else:
+        range_header = request.headers.get("range", "")
+        if range_header.startswith("bytes=") and duration:
+            first = range_header[6:].split(",")[0].split("-")[0].strip()
+            if first.isdigit() and int(first) > 0:
+                byte_rate = (media_file.bitrate or 0) * 1000 / 8 or media_file.file_size / duration
+                seconds = int(first) / byte_rate
+    if duration:
+        seconds = min(seconds, max(duration - 1, 0.0))
+    return max(seconds, 0.0)
+
+
+def _progressive_headers(start_time: float) -> dict:
+    return {
+        "Accept-Ranges": "none",  # Seek with ?start= instead
+        "Cache-Control": "no-cache",
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Expose-Headers": "X-Stream-Start",
+        "X-Stream-Start": f"{start_time:.3f}"
+    }
+
+
+async def until_disconnected(request: Request, chunks: Iterator[bytes], cancel: threading.Event,
+                             meter: Optional[ThroughputMeter] = None) -> AsyncIterator[bytes]:
+    """
+    Relay a session stream until the client disconnects.
+
+    ``request.is_disconnected()`` is polled alongside the stream, so a
+    client that leaves while FFmpeg is still catching up is noticed too;
+    setting ``cancel`` ends ``chunks`` (a :meth:`TranscodeSessionManager.stream`
+    given the same event), which releases the subscription at once. The
+    client's throughput is measured with ``meter`` (by default one feeding
+    its history, for later profile selection).
+    """
+    async def watch():
+        while not await request.is_disconnected():
+            await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+        cancel.set()
+
+    watcher = asyncio.ensure_future(watch())
+    meter = meter or _meter(request)
+    try:
+        async for chunk in iterate_in_threadpool(chunks):
+            # Time suspended here is time the server spent sending the chunk
+            started = time.monotonic()
+            yield chunk
+            meter.record(len(chunk), time.monotonic() - started)
+    finally:
+        meter.close()
+        cancel.set()
+        watcher.cancel()
+        try:
+            chunks.close()
+        except ValueError:
+            pass  # still running in the threadpool; ``cancel`` ends it
+
+
+def _metered(chunks: Iterator[bytes], meter: Optional[ThroughputMeter]) -> Iterator[bytes]:
+    """Measure how long each chunk takes to send, closing ``meter`` at the end."""
+    if meter is None:
+        yield from chunks
+        return
+    try:
+        for chunk in chunks:
+            started = time.monotonic()
+            yield chunk
+            meter.record(len(chunk), time.monotonic() - started)
+    finally:
+        meter.close()
+        chunks.close()
+
+
+class SessionStreamingResponse(StreamingResponse):
+    """
+    Streaming response that runs ``closers`` however it ends.
+
+    Starlette cancels a streaming response when the client disconnects,
+    possibly before the body iterator has started, in which case the
+    iterator's own cleanup never runs; the closers (releasing the FFmpeg
+    session subscription, closing the stream tracker) run regardless.
+    """
+
+    def __init__(self, content, closers: List[Callable[[], None]], **kwargs):
+        super().__init__(content, **kwargs)
+        self.closers = closers
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            for close in self.closers:
+                close()
+
+
+def _session_response(request: Optional[Request], session: TranscodeSession, start_time: float,
+                      offset: int = 0, prefix: bytes = b"",
+                      tracker: Optional[StreamTracker] = None) -> StreamingResponse:
+    manager = get_session_manager()
+    cancel = threading.Event()
+    release = manager.releaser(session)
+    chunks = manager.stream(session, offset=offset, prefix=prefix, cancel=cancel, release=release)
+    closers = [release]
+    if tracker is not None:
+        tracker.session.progress = lambda: session.progress
+        closers.append(tracker.close)
+    return SessionStreamingResponse(
+        _metered(chunks, tracker) if request is None else until_disconnected(request, chunks, cancel, tracker),
+        closers,
+        media_type="video/mp4",
+        headers=_progressive_headers(start_time)
     )
 
 
+def ffmpeg_stream_response(session_key: str, build_cmd: Callable[[Optional[float], bool], List[str]], label: str,
+                           cache_key: Optional[str] = None, start_time: float = 0.0,
+                           priority: Optional[str] = "interactive", prefer_gpu: bool = True,
+                           request: Optional[Request] = None,
+                           tracker: Optional[StreamTracker] = None) -> StreamingResponse:
+    """
+    Stream fragmented MP4 from a shared FFmpeg session writing to stdout.
+
+    Requests with the same ``session_key`` join the running session instead
+    of starting another FFmpeg; it is stopped once the last viewer leaves.
+    With ``cache_key``, the complete output is published to the transcode
+    cache when FFmpeg finishes.
+
+    A non-zero ``start_time`` is first served from any running session of
+    the same output that has already produced that position (init segment
+    plus the spool from the covering keyframe fragment); otherwise FFmpeg
+    is started with ``build_cmd(start_time, use_gpu)``, which seeks on the
+    input, once the transcode scheduler grants a ``priority`` slot (None
+    for stream copies that need none). The actual start position is
+    returned in ``X-Stream-Start``.
+
+    With ``request``, the viewer's subscription is dropped as soon as the
+    client disconnects rather than when the next chunk fails to send.
+    ``tracker`` records the response (and FFmpeg's progress) in the stream
+    registry.
+    """
+    manager = get_session_manager()
+
+    if start_time > 0:
+        found = manager.find_seekable(session_key, start_time)
+        if found is not None:
+            session, offset, fragment_time = found
+            try:
+                init = session.init_segment()
+            except OSError:
+                manager.release(session)
+                raise
+            logger.info(f"Seek to {start_time:.1f}s served from running session at {fragment_time:.1f}s")
+            return _session_response(request, session, fragment_time, offset=offset, prefix=init,
+                                     tracker=tracker)
+        start_time = round(start_time, 1)
+
+    try:
+        session = manager.open(
+            f"{session_key}@{start_time:.1f}" if start_time else session_key,
+            lambda use_gpu: build_cmd(start_time or None, use_gpu),
+            label,
+            # Only complete outputs are cached
+            cache_key=None if start_time else cache_key,
+            base_key=session_key,
+            start_time=start_time,
+            priority=priority,
+            prefer_gpu=prefer_gpu
+        )
+    except TranscodeQueueTimeout as e:
+        raise _queue_full(e)
+    except OSError as e:
+        logger.error(f"Failed to start FFmpeg ({label}): {e}")
+        raise HTTPException(status_code=500, detail="Failed to start transcoder")
+
+    return _session_response(request, session, start_time, tracker=tracker)
+
+
+def fragment_file_response(file_path: Path, start_time: float,
+                           meter: Optional[ThroughputMeter] = None) -> StreamingResponse:
+    """
+    Stream a complete fragmented MP4 file from the keyframe fragment at ``start_time``.
+
+    Used to seek within cached transcodes for clients that pass ``start``
+    rather than using byte ranges.
+    """
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        index = FragmentIndex()
+        index.update(lambda offset, length: os.pread(fd, length, offset), size)
+        fragment = index.fragment_at(start_time)
+        init_end = index.init_end or 0
+        fragment_time, offset = fragment if fragment else (0.0, init_end)
+    except Exception:
+        os.close(fd)
+        raise
+
+    def generate():
+        try:
+            yield os.pread(fd, init_end, 0)
+            position = offset
+            while position < size:
+                chunk = os.pread(fd, min(1024 * 1024, size - position), position)
+                if not chunk:
+                    break
+                position += len(chunk)
+                yield chunk
+        finally:
+            os.close(fd)
+
+    return StreamingResponse(_metered(generate(), meter), media_type="video/mp4",
+                             headers=_progressive_headers(fragment_time))
+
+
 @router.options("/{file_id}/progressive")
 def progressive_stream_options():
     """Handle OPTIONS preflight for CORS."""
@@ -578,10 +1261,14 @@ def progressive_stream_head(file_id: int, db: Session = Depends(get_db)):
 @router.get("/{file_id}/progressive")
 def progressive_stream(
     file_id: int,
-    width: int = 1280,
-    height: int = 720,
+    request: Request,
+    width: Optional[int] = None,
+    height: Optional[int] = None,
     quality: int = 23,
     use_gpu: bool = True,
+    start: Optional[float] = None,
+    downlink: Optional[float] = None,
+    device: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """
@@ -589,13 +1276,23 @@ def progressive_stream(
 
     Starts FFmpeg and streams output while transcoding is in progress.
     Uses fragmented MP4 for instant playback (2-3 seconds to start).
+    Seeking restarts FFmpeg at ``start`` (or reuses output already
+    produced past that point); see ``X-Stream-Start`` in the response.
+
+    Without ``width``/``height`` the output is at most 720p, smaller (with
+    a bitrate cap) if the client's bandwidth hints call for it; see
+    ``X-Stream-Profile``.
 
     Args:
         file_id: Media file ID
-        width: Target width (default 1280)
-        height: Target height (default 720)
+        request: FastAPI request (Range is mapped to a start time)
+        width: Target width (negotiated if omitted)
+        height: Target height (negotiated if omitted)
         quality: CRF quality 18-28 (default 23)
         use_gpu: Use GPU NVENC encoding (default True)
+        start: Start position in seconds (default 0)
+        downlink: Client downlink in Mbit/s (overrides the Downlink header)
+        device: Device class (mobile, tablet, desktop, tv)
         db: Database session
 
     Returns:
@@ -611,89 +1308,43 @@ def progressive_stream(
     if not resolved_path or not resolved_path.exists():
         raise HTTPException(status_code=404, detail="File not found on disk")
 
-    # Build FFmpeg command for progressive streaming
-    cmd = [settings.ffmpeg_path]
-
-    if use_gpu:
-        cmd.extend([
-            "-hwaccel", "cuda",
-            "-hwaccel_output_format", "cuda"
-        ])
-
-    cmd.extend(["-i", str(resolved_path)])
-
-    if use_gpu:
-        cmd.extend([
-            "-vf", f"scale_cuda={width}:{height}",
-            "-c:v", "h264_nvenc",
-            "-preset", "p4",  # NVENC preset
-            "-cq", str(quality)
-        ])
-    else:
-        cmd.extend([
-            "-vf", f"scale={width}:{height}",
-            "-c:v", "libx264",
-            "-preset", "medium",
-            "-crf", str(quality)
-        ])
-
-    # Audio transcoding (DTS → AAC)
-    cmd.extend([
-        "-c:a", "aac",
-        "-b:a", "128k",
-        "-ac", "2",  # Stereo
-        "-ar", "48000"
-    ])
-
-    # KEY: Fragmented MP4 for progressive streaming
-    cmd.extend([
-        "-movflags", "frag_keyframe+empty_moov+default_base_moof",
-        "-f", "mp4",
-        "-"  # Output to stdout (pipe)
-    ])
-
-    logger.info(f"Starting progressive stream for {media_file.filename} ({width}x{height}, GPU={use_gpu})")
-
-    def generate():
-        """Generator that yields FFmpeg output chunks."""
-        process = None
-        try:
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                bufsize=8192
-            )
-
-            # Stream chunks as they're produced
-            while True:
-                chunk = process.stdout.read(8192)
-                if not chunk:
-                    break
-                yield chunk
-
-        except Exception as e:
-            logger.error(f"Progressive stream error: {e}")
-            if process:
-                process.kill()
-            raise
+    profile = None
+    if not width or not height:
+        profile = select_profile(media_file, client_hints(request, downlink, device),
+                                 max_height=DEFAULT_RENDITION["height"], transcoding=True)
+        if profile is not None:
+            width, height = profile.width, profile.height
+        else:
+            width = media_file.width or DEFAULT_RENDITION["width"]
+            height = media_file.height or DEFAULT_RENDITION["height"]
+
+    def build_cmd(start_time: Optional[float], gpu: bool) -> List[str]:
+        return ffmpeg_service.build_stream_command(
+            input_path=str(resolved_path),
+            recommendation="hls_transcode",
+            width=width,
+            height=height,
+            quality=quality,
+            use_gpu=gpu,
+            start_time=start_time,
+            max_kbps=profile.video_kbps if profile else None
+        )
 
-        finally:
-            if process:
-                process.wait(timeout=5)
-                if process.returncode != 0 and process.returncode is not None:
-                    stderr = process.stderr.read().decode('utf-8', errors='ignore')
-                    logger.error(f"FFmpeg error: {stderr[-500:]}")
-
-    return StreamingResponse(
-        generate(),
-        media_type="video/mp4",
-        headers={
-            "Accept-Ranges": "none",  # No seeking during active transcode
-            "Cache-Control": "no-cache",
-            "Access-Control-Allow-Origin": "*"
-        }
-    )
+    start_time = seek_seconds(request, start, media_file)
+    logger.info(f"Starting progressive stream for {media_file.filename} "
+                f"({width}x{height}, GPU={use_gpu}, start={start_time:.1f}s)")
+
+    output_profile = f"progressive-q{quality}-{'gpu' if use_gpu else 'cpu'}"
+    if profile is not None:
+        output_profile += f"-{profile.video_kbps}k"
+    session_key = _output_key(media_file, resolved_path, output_profile, width, height)
+    with _track(request, file_id, "progressive") as tracker:
+        tracker.session.detail = profile.name if profile else f"{width}x{height}"
+        return _with_profile(
+            ffmpeg_stream_response(session_key, build_cmd, "progressive", start_time=start_time,
+                                   prefer_gpu=use_gpu, request=request, tracker=tracker),
+            profile
+        )
 
 
 @router.options("/{file_id}/smart")
@@ -711,33 +1362,59 @@ def smart_stream_options():
     )
 
 
+def _smart_cache_key(media_file: MediaFile, resolved_path: Path, recommendation: str,
+                     profile: Optional[StreamProfile] = None) -> Optional[str]:
+    """Cache key for the /smart output of a file (None for direct streams)."""
+    if (recommendation == "direct_stream" and profile is None) or not settings.transcode_cache_enabled:
+        return None
+    return smart_output_key(media_file, resolved_path, recommendation, profile)
+
+
+def _smart_plan(media_file: MediaFile, request: Request, downlink: Optional[float],
+                device: Optional[str]) -> Tuple[str, Optional[StreamProfile]]:
+    """
+    How /smart serves a file to this client: the recommendation, and a ladder rung if it needs one.
+
+    A source too heavy for the client's bandwidth hints is transcoded to a
+    rung, even if it could otherwise be direct streamed or remuxed; one
+    that is transcoded anyway is also fitted to the device class.
+    """
+    compat = ffmpeg_service.is_browser_compatible(
+        video_codec=media_file.video_codec,
+        audio_codec=media_file.audio_codec,
+        container_format=media_file.format
+    )
+    transcoding = compat['recommendation'] not in ("direct_stream", "remux_only", "audio_transcode")
+    profile = select_profile(media_file, client_hints(request, downlink, device), transcoding=transcoding)
+    if profile is not None:
+        return "hls_transcode", profile
+    return compat['recommendation'], None
+
+
 @router.head("/{file_id}/smart")
-def smart_stream_head(file_id: int, db: Session = Depends(get_db)):
+def smart_stream_head(file_id: int, request: Request, downlink: Optional[float] = None,
+                      device: Optional[str] = None, db: Session = Depends(get_db)):
     """Handle HEAD requests for smart streaming."""
     media_file = db.query(MediaFile).filter(MediaFile.id == file_id).first()
     if not media_file:
         raise HTTPException(status_code=404, detail="Media file not found")
 
-    # PROOF OF CONCEPT: Handle HEAD for pre-transcoded file
-    if file_id == 275:
-        from pathlib import Path
-        cached_file = Path("/tmp/mediavault_cache/episode_275_cached.mp4")
-        if cached_file.exists():
-            file_size = cached_file.stat().st_size
-            from fastapi.responses import Response
-            return Response(
-                status_code=200,
-                media_type="video/mp4",
-                headers={
-                    "Content-Length": str(file_size),
-                    "Accept-Ranges": "bytes",
-                    "Cache-Control": "no-cache",
-                    "Access-Control-Allow-Origin": "*"
-                }
-            )
+    # A cached transcode is a regular file with range support
+    resolved_path = resolve_media_path(media_file.filepath)
+    profile = None
+    if resolved_path and resolved_path.exists():
+        recommendation, profile = _smart_plan(media_file, request, downlink, device)
+        cache_key = _smart_cache_key(media_file, resolved_path, recommendation, profile)
+        if cache_key and get_transcode_cache().contains(cache_key):
+            return _with_profile(file_range_response(
+                request=request,
+                file_path=str(get_transcode_cache().path_for(cache_key)),
+                content_type="video/mp4",
+                headers={"Cache-Control": "no-cache", "Access-Control-Allow-Origin": "*"}
+            ), profile)
 
     from fastapi.responses import Response
-    return Response(
+    return _with_profile(Response(
         status_code=200,
         media_type="video/mp4",
         headers={
@@ -745,24 +1422,41 @@ def smart_stream_head(file_id: int, db: Session = Depends(get_db)):
             "Cache-Control": "no-cache",
             "Access-Control-Allow-Origin": "*"
         }
-    )
+    ), profile)
 
 
 @router.get("/{file_id}/smart")
 def smart_stream(
     file_id: int,
     request: Request,
+    start: Optional[float] = None,
+    downlink: Optional[float] = None,
+    device: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """
     Smart streaming endpoint that auto-selects best method.
 
     - Direct stream if browser-compatible (H.264 + AAC + MP4)
-    - Progressive transcode if incompatible (DTS audio, etc.)
+    - Remux to fragmented MP4 if only the container is incompatible (MKV)
+    - Audio-only transcode if just the audio is incompatible (DTS/AC3)
+    - Full progressive transcode otherwise (HEVC, etc.)
+
+    If the source is too heavy for the client's bandwidth (declared with
+    ``downlink`` or the ``Downlink`` header, ``Save-Data``, or measured on
+    earlier streams), it is transcoded to the best ladder rung that fits
+    instead; full transcodes are also fitted to the device class
+    (``X-Stream-Profile`` names the rung).
+
+    Transcoded output can be seeked with ``start`` (seconds), or by byte
+    range once it is cached.
 
     Args:
         file_id: Media file ID
         request: FastAPI request
+        start: Start position in seconds for transcoded output
+        downlink: Client downlink in Mbit/s (overrides the Downlink header)
+        device: Device class (mobile, tablet, desktop, tv)
         db: Database session
 
     Returns:
@@ -778,116 +1472,56 @@ def smart_stream(
     if not resolved_path or not resolved_path.exists():
         raise HTTPException(status_code=404, detail="File not found on disk")
 
-    # PROOF OF CONCEPT: Serve pre-transcoded file for episode 275
-    if file_id == 275:
-        from pathlib import Path
-        cached_file = Path("/tmp/mediavault_cache/episode_275_cached.mp4")
-        if cached_file.exists():
-            logger.info(f"[POC] Serving pre-transcoded cache for file {file_id}")
-            from fastapi.responses import FileResponse
-            return FileResponse(
-                path=str(cached_file),
-                media_type="video/mp4",
-                headers={
-                    "Accept-Ranges": "bytes",
-                    "Cache-Control": "no-cache",
-                    "Access-Control-Allow-Origin": "*"
-                }
-            )
-
-    # Check codec compatibility
-    compat = ffmpeg_service.is_browser_compatible(
-        video_codec=media_file.video_codec,
-        audio_codec=media_file.audio_codec,
-        container_format=media_file.format
-    )
+    # Codec compatibility, and the client's bandwidth and device
+    recommendation, profile = _smart_plan(media_file, request, downlink, device)
 
-    logger.info(f"Smart stream for {media_file.filename}: {compat['recommendation']}")
+    logger.info(f"Smart stream for {media_file.filename}: {recommendation}"
+                + (f" at {profile.name} ({profile.video_kbps}k)" if profile else ""))
+    _played(file_id)
 
-    if compat['recommendation'] == "direct_stream":
+    if recommendation == "direct_stream":
         # Direct stream the original file with range support
-        return stream_video(file_id=file_id, request=request, db=db)
-
-    else:
-        # Progressive transcode with GPU
-        logger.info(f"Starting GPU transcode for {media_file.filename} (incompatible audio: {media_file.audio_codec})")
-
-        # Use original resolution
-        width = media_file.width or 1280
-        height = media_file.height or 720
-
-        # Build FFmpeg command for progressive streaming
-        cmd = [settings.ffmpeg_path]
-        cmd.extend(["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"])
-        cmd.extend(["-i", str(resolved_path)])
-        cmd.extend([
-            "-vf", f"scale_cuda={width}:{height}",
-            "-c:v", "h264_nvenc",
-            "-preset", "p4",
-            "-cq", "23"
-        ])
-        cmd.extend([
-            "-c:a", "aac",
-            "-b:a", "128k",
-            "-ac", "2",
-            "-ar", "48000"
-        ])
-        cmd.extend([
-            "-movflags", "frag_keyframe+empty_moov+default_base_moof",
-            "-f", "mp4",
-            "pipe:1"  # Explicitly use pipe instead of "-"
-        ])
-
-        def generate():
-            """Generator that yields FFmpeg output chunks."""
-            process = None
-            try:
-                logger.info(f"Starting FFmpeg: {' '.join(cmd)}")
-                process = subprocess.Popen(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    bufsize=0
-                )
-                logger.info(f"FFmpeg process started: PID {process.pid}")
-
-                # Just read and yield chunks - simple and non-blocking
-                while True:
-                    chunk = process.stdout.read(8192)
-                    if not chunk:
-                        logger.info("FFmpeg stream ended")
-                        break
-                    yield chunk
-
-            except Exception as e:
-                logger.error(f"Smart stream error: {e}", exc_info=True)
-                if process and process.poll() is None:
-                    process.kill()
-                raise
-
-            finally:
-                if process and process.poll() is None:
-                    logger.info("Terminating FFmpeg process")
-                    process.terminate()
-                    try:
-                        process.wait(timeout=5)
-                    except:
-                        logger.warning("FFmpeg did not terminate, killing")
-                        process.kill()
-
-                if process and process.returncode not in [0, None, -15]:  # -15 is SIGTERM
-                    try:
-                        stderr = process.stderr.read().decode('utf-8', errors='ignore')
-                        logger.error(f"FFmpeg final error (code {process.returncode}): {stderr[-500:]}")
-                    except:
-                        pass
-
-        return StreamingResponse(
-            generate(),
-            media_type="video/mp4",
-            headers={
-                "Accept-Ranges": "none",
-                "Cache-Control": "no-cache",
-                "Access-Control-Allow-Origin": "*"
-            }
+        return _with_profile(stream_video(file_id=file_id, request=request, db=db), None)
+
+    # Serve a previous complete transcode of this content from the cache
+    cache_key = _smart_cache_key(media_file, resolved_path, recommendation, profile)
+    if cache_key:
+        cached = get_transcode_cache().lookup(cache_key)
+        if cached is not None:
+            logger.info(f"Smart stream cache hit for {media_file.filename}")
+            with _track(request, file_id, "cached") as tracker:
+                tracker.session.detail = profile.name if profile else recommendation
+                if start:
+                    return _with_profile(fragment_file_response(cached, start, meter=tracker), profile)
+                return _with_profile(file_range_response(
+                    request=request,
+                    file_path=str(cached),
+                    content_type="video/mp4",
+                    headers={"Cache-Control": "no-cache", "Access-Control-Allow-Origin": "*"},
+                    meter=tracker
+                ), profile)
+
+    # Remux / audio-only transcode copy the video stream (no GPU or
+    # scheduler slot needed); anything else is a full transcode at the
+    # source resolution, or at the negotiated rung with its bitrate cap
+    def build_cmd(start_time: Optional[float], gpu: bool) -> List[str]:
+        return ffmpeg_service.build_stream_command(
+            input_path=str(resolved_path),
+            recommendation=recommendation,
+            width=profile.width if profile else media_file.width,
+            height=profile.height if profile else media_file.height,
+            use_gpu=gpu,
+            start_time=start_time,
+            max_kbps=profile.video_kbps if profile else None
         )
+    copy_video = recommendation in ("remux_only", "audio_transcode")
+
+    session_key = cache_key or smart_output_key(media_file, resolved_path, recommendation, profile)
+    with _track(request, file_id, SMART_METHODS.get(recommendation, "transcode")) as tracker:
+        tracker.session.detail = profile.name if profile else None
+        return _with_profile(ffmpeg_stream_response(
+            session_key, build_cmd, recommendation,
+            cache_key=cache_key, start_time=seek_seconds(request, start, media_file),
+            priority=None if copy_video else "interactive",
+            request=request, tracker=tracker
+        ), profile)
@@ -4,11 +4,11 @@ import subprocess
 from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime, timedelta
 from loguru import logger
-import guessit
 
 from sqlalchemy.orm import Session
 from app.models import ArchiveFile, ArchiveContent, MediaFile
 from app.services.nas_service import NASService
+from app.services.filename_parser import get_filename_parser
 from app.config import get_settings
 
 settings = get_settings()
@@ -20,6 +20,7 @@ class ArchiveService:
     def __init__(self, db: Session):
         self.db = db
         self.nas_service = NASService()
+        self.filename_parser = get_filename_parser()
         self.archive_extensions = ['.rar', '.zip', '.7z', '.tar', '.gz', '.bz2']
 
         # Destination paths from settings
@@ -130,7 +131,7 @@ class ArchiveService:
     def _parse_filename(self, filename: str) -> Dict[str, Any]:
         """Parse filename using guessit to extract metadata."""
         try:
-            parsed = guessit(filename)
+            parsed = self.filename_parser.parse(filename)
             return {
                 'title': parsed.get('title'),
                 'year': parsed.get('year'),
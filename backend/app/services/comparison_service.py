@@ -0,0 +1,240 @@
+"""Time-aligned comparison previews of duplicate versions, encoded in one FFmpeg job."""
+import subprocess
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.models import DuplicateMember, MediaFile
+from app.services.ffmpeg_process import FFmpegProcess
+from app.services.transcode_cache import get_transcode_cache, media_fingerprint, transcode_cache_key
+from app.services.transcode_scheduler import TranscodeScheduler, TranscodeSlot, get_transcode_scheduler
+from app.services.transcode_sessions import get_session_manager
+from app.utils.path_utils import resolve_media_path
+
+COMPOSITE = "composite"
+LAYOUTS = ("hstack", "vstack")
+
+# Preview geometry: rows of equal height side by side, or columns of equal width stacked
+COMPARE_HEIGHT = 360
+COMPARE_WIDTH = 640
+
+COMPARE_START = 10.0
+COMPARE_SECONDS = 30
+COMPARE_MAX_SECONDS = 120
+COMPARE_MAX_MEMBERS = 4
+DEFAULT_FPS = 24.0
+
+# Wall-clock limit for one comparison job (seconds)
+COMPARE_BUDGET = 600
+
+
+class ComparisonMember(NamedTuple):
+    """One version in a comparison; ``offset`` shifts its start to line up with the others."""
+    file_id: int
+    input_path: str
+    fingerprint: str
+    offset: float = 0.0
+
+
+def group_members(db: Session, group_id: int,
+                  offsets: Optional[Dict[int, float]] = None) -> Tuple[List[ComparisonMember], List[MediaFile]]:
+    """
+    The best-ranked members of a duplicate group that are on disk (up to :data:`COMPARE_MAX_MEMBERS`).
+
+    Returns:
+        Comparison members (with ``offsets`` by file ID applied) and their media files
+    """
+    rows = (
+        db.query(DuplicateMember, MediaFile)
+        .join(MediaFile, DuplicateMember.file_id == MediaFile.id)
+        .filter(DuplicateMember.group_id == group_id)
+        .order_by(DuplicateMember.rank)
+        .all()
+    )
+    offsets = offsets or {}
+    members, files = [], []
+    for _, media_file in rows:
+        resolved_path = resolve_media_path(media_file.filepath)
+        if not resolved_path or not resolved_path.exists():
+            continue
+        members.append(ComparisonMember(
+            media_file.id, str(resolved_path),
+            media_fingerprint(media_file.md5_hash, str(resolved_path)),
+            offsets.get(media_file.id, 0.0)
+        ))
+        files.append(media_file)
+        if len(members) == COMPARE_MAX_MEMBERS:
+            break
+    return members, files
+
+
+def comparison_fps(files: List[MediaFile]) -> float:
+    """Common frame rate of a comparison: the best-ranked version's."""
+    return float(files[0].framerate) if files and files[0].framerate else DEFAULT_FPS
+
+
+def output_keys(members: List[ComparisonMember], start: float, seconds: int, fps: float,
+                layout: Optional[str] = None) -> Dict[str, str]:
+    """
+    Transcode cache keys of a comparison's outputs: one per member, plus the composite.
+
+    A member's preview is keyed by its own content and source start, so it
+    is shared by every comparison (and group) that shows the same span.
+    """
+    profile = f"{seconds}s-{fps:g}fps"
+    keys = {
+        str(m.file_id): transcode_cache_key(m.fingerprint, f"compare-{start + m.offset:.3f}-{profile}",
+                                            None, COMPARE_HEIGHT)
+        for m in members
+    }
+    if layout and len(members) > 1:
+        spans = "|".join(f"{m.fingerprint}@{start + m.offset:.3f}" for m in members)
+        keys[COMPOSITE] = transcode_cache_key(spans, f"compare-{layout}-{profile}")
+    return keys
+
+
+class ComparisonService:
+    """
+    Low-resolution, time-aligned previews of every version of a title.
+
+    All members are decoded by one FFmpeg job under one scheduler slot.
+    Each input is seeked (frame-accurately) to ``start`` plus its offset,
+    rebased to zero and resampled to a common frame rate, so frame *n* of
+    every preview shows the same moment and players can scrub them
+    together; an ``hstack``/``vstack`` composite can come out of the same
+    decode. Outputs go to the transcode cache, so reopening a comparison
+    (or another group sharing a member) is served from there; only the
+    missing outputs are encoded.
+    """
+
+    def __init__(self, scheduler: Optional[TranscodeScheduler] = None):
+        self.ffmpeg_path = get_settings().ffmpeg_path
+        self.scheduler = scheduler
+
+    def command(self, members: List[ComparisonMember], start: float, seconds: int, fps: float,
+                outputs: Dict[str, Path], layout: Optional[str], use_gpu: bool) -> List[str]:
+        """FFmpeg command writing ``outputs`` (member ID or ``composite`` -> path) in one pass."""
+        cmd = [self.ffmpeg_path, "-hide_banner", "-nostdin", "-loglevel", "error"]
+        for member in members:
+            cmd.extend(["-ss", f"{max(start + member.offset, 0.0):.3f}", "-t", str(seconds),
+                        "-i", member.input_path])
+
+        composite = COMPOSITE in outputs
+        filters = []
+        for i, member in enumerate(members):
+            single = str(member.file_id) in outputs
+            if not (single or composite):
+                continue
+            aligned = f"[{i}:v:0]setpts=PTS-STARTPTS,fps={fps:g}"
+            if single and composite:
+                filters.append(f"{aligned},split=2[a{i}][b{i}]")
+                single_in, composite_in = f"[a{i}]", f"[b{i}]"
+            else:
+                filters.append(f"{aligned}[a{i}]" if single else f"{aligned}[b{i}]")
+                single_in = composite_in = f"[a{i}]" if single else f"[b{i}]"
+            if single:
+                filters.append(f"{single_in}scale=-2:{COMPARE_HEIGHT},setsar=1[m{i}]")
+            if composite:
+                size = f"{COMPARE_WIDTH}:-2" if layout == "vstack" else f"-2:{COMPARE_HEIGHT}"
+                filters.append(f"{composite_in}scale={size},setsar=1[s{i}]")
+        if composite:
+            stacked = "".join(f"[s{i}]" for i in range(len(members)))
+            filters.append(f"{stacked}{layout}=inputs={len(members)}[cv]")
+        cmd.extend(["-filter_complex", ";".join(filters)])
+
+        if use_gpu:
+            video = ["-c:v", "h264_nvenc", "-preset", "p4", "-cq", "28"]
+        else:
+            video = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "26", "-pix_fmt", "yuv420p"]
+        # A keyframe every second keeps scrubbing snappy
+        video.extend(["-g", str(max(1, round(fps)))])
+        audio = ["-c:a", "aac", "-b:a", "96k", "-ac", "2"]
+
+        for i, member in enumerate(members):
+            path = outputs.get(str(member.file_id))
+            if path is not None:
+                cmd.extend(["-map", f"[m{i}]", "-map", f"{i}:a:0?", *video, *audio,
+                            "-movflags", "+faststart", "-y", str(path)])
+        if composite:
+            # Sound from the first (best-ranked) version
+            cmd.extend(["-map", "[cv]", "-map", "0:a:0?", *video, *audio,
+                        "-movflags", "+faststart", "-y", str(outputs[COMPOSITE])])
+        return cmd
+
+    def prepare(self, members: List[ComparisonMember], start: float = COMPARE_START,
+                seconds: int = COMPARE_SECONDS, fps: float = DEFAULT_FPS, layout: Optional[str] = None,
+                prefer_gpu: bool = True, priority: str = "preview", label: str = "comparison",
+                slot: Optional[TranscodeSlot] = None,
+                on_start: Optional[Callable[[FFmpegProcess], None]] = None) -> Optional[Dict[str, Path]]:
+        """
+        Cached paths of every output, encoding the missing ones first.
+
+        The encode queues for a scheduler slot unless the caller passes one
+        it already holds in ``slot`` (which stays the caller's to release).
+        ``on_start`` gets the FFmpeg process of the encode, if one runs.
+
+        Returns:
+            Output name (member ID or ``composite``) -> file, or None if the
+            encode failed
+
+        Raises:
+            TranscodeQueueTimeout: if no encoder slot freed up in time
+        """
+        keys = output_keys(members, start, seconds, fps, layout)
+        cache = get_transcode_cache()
+        if any(not cache.contains(key) for key in keys.values()):
+            job_key = transcode_cache_key("|".join(sorted(keys.values())), "compare-job")
+            ok = get_session_manager().single_flight(
+                job_key, lambda: self._encode(members, start, seconds, fps, layout, keys,
+                                              prefer_gpu, priority, label, slot, on_start)
+            )
+            if not ok:
+                return None
+
+        paths = {}
+        for name, key in keys.items():
+            path = cache.lookup(key)
+            if path is None:
+                return None  # evicted in the meantime; the caller can retry
+            paths[name] = path
+        return paths
+
+    def _encode(self, members: List[ComparisonMember], start: float, seconds: int, fps: float,
+                layout: Optional[str], keys: Dict[str, str], prefer_gpu: bool, priority: str,
+                label: str, slot: Optional[TranscodeSlot],
+                on_start: Optional[Callable[[FFmpegProcess], None]]) -> bool:
+        cache = get_transcode_cache()
+        missing = {name: key for name, key in keys.items() if not cache.contains(key)}
+        if not missing:
+            return True
+
+        temps = {name: cache.temp_path(key) for name, key in missing.items()}
+        try:
+            if slot is not None:
+                acquired = nullcontext(slot)
+            else:
+                scheduler = self.scheduler or get_transcode_scheduler()
+                acquired = scheduler.slot(priority, prefer_gpu, label,
+                                          timeout=get_settings().transcode_queue_timeout_seconds)
+            with acquired as slot:
+                logger.info(f"Encoding {label}: {len(missing)} outputs from {len(members)} versions "
+                            f"with {'GPU' if slot.gpu else 'CPU'}")
+                cmd = self.command(members, start, seconds, fps, temps, layout, slot.gpu)
+                process = FFmpegProcess(cmd, label, stdout=subprocess.DEVNULL, wall_budget=COMPARE_BUDGET)
+                if on_start:
+                    on_start(process)
+                returncode = process.run()
+            if returncode != 0:
+                logger.error(f"{label} failed (code {returncode}): "
+                             f"{process.budget_exceeded or process.error_summary()}")
+                return False
+            for name, key in missing.items():
+                cache.publish(key, temps[name])
+            return True
+        finally:
+            for temp in temps.values():
+                cache.discard(temp)
@@ -8,7 +8,7 @@ from rapidfuzz import fuzz
 
 from sqlalchemy.orm import Session
 from app.models import MediaFile, DuplicateGroup, DuplicateMember
-from app.services.quality_service import QualityService
+from app.services.quality_service import QualityService, DEFAULT_PROFILE
 from app.config import get_settings
 
 settings = get_settings()
@@ -17,9 +17,10 @@ settings = get_settings()
 class DeduplicationService:
     """Service for detecting exact and fuzzy duplicates."""
 
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, profile: Optional[str] = None):
         self.db = db
-        self.quality_service = QualityService()
+        self.profile = profile or settings.dedup_quality_profile
+        self.quality_service = QualityService(profile=self.profile)
         self.fuzzy_threshold = settings.fuzzy_match_threshold
         self.auto_approve_threshold = settings.quality_auto_approve_threshold
         self.manual_review_threshold = settings.quality_manual_review_threshold
@@ -52,6 +53,7 @@ class DeduplicationService:
                 self.db.query(MediaFile)
                 .filter(MediaFile.md5_hash == md5_hash)
                 .filter(MediaFile.is_deleted == False)
+                .order_by(MediaFile.quality_score.desc().nullslast())
                 .all()
             )
 
@@ -209,6 +211,7 @@ class DeduplicationService:
                 "id": file.id,
                 "quality_score": file.quality_score if file.quality_score is not None else 0,
                 "quality_tier": file.quality_tier,
+                "height": file.height,
                 "video_codec": file.video_codec,
                 "bitrate": file.bitrate,
                 "audio_channels": file.audio_channels,
@@ -223,31 +226,7 @@ class DeduplicationService:
         ranked_files = self.quality_service.rank_files(files_metadata)
 
         # Determine recommended action
-        best_file = ranked_files[0]
-        worst_file = ranked_files[-1]
-        quality_diff = best_file["quality_score"] - worst_file["quality_score"]
-
-        if quality_diff < self.manual_review_threshold:
-            recommended_action = "manual_review"
-            action_reason = f"Quality difference too small ({quality_diff} points) - requires manual review"
-        elif quality_diff >= self.auto_approve_threshold:
-            # Check language concerns
-            has_language_concern = False
-            for file_meta in ranked_files[1:]:  # Check files to be deleted
-                concern, reason = self.quality_service.check_language_concern(file_meta)
-                if concern:
-                    has_language_concern = True
-                    action_reason = reason
-                    break
-
-            if has_language_concern:
-                recommended_action = "manual_review"
-            else:
-                recommended_action = "auto_delete"
-                action_reason = f"Clear quality winner (Δ{quality_diff} points)"
-        else:
-            recommended_action = "manual_review"
-            action_reason = f"Moderate quality difference ({quality_diff} points)"
+        recommended_action, action_reason = self._recommend_action(ranked_files)
 
         # Create group hash
         file_ids_sorted = sorted([f.id for f in files])
@@ -303,18 +282,124 @@ class DeduplicationService:
                     member_reason = f"Quality score: {ranked_meta['quality_score']}, rank: {ranked_meta['rank']}"
 
             member = DuplicateMember(
-                duplicate_group_id=group.id,
-                media_file_id=file.id,
+                group_id=group.id,
+                file_id=file.id,
                 rank=ranked_meta["rank"],
                 recommended_action=member_action,
                 action_reason=member_reason,
+                quality_score=ranked_meta["quality_score"],
             )
 
             self.db.add(member)
 
-            # Update media file
+            # Update media file (stored score is always the default profile)
             file.is_duplicate = True
-            file.quality_score = ranked_meta["quality_score"]
+            if self.profile == DEFAULT_PROFILE:
+                file.quality_score = ranked_meta["quality_score"]
 
         self.db.commit()
         return group
+
+    def _recommend_action(self, ranked_files: List[Dict[str, Any]]) -> Tuple[str, str]:
+        """Recommend a group action from files ranked best-first."""
+        best_file = ranked_files[0]
+        worst_file = ranked_files[-1]
+        quality_diff = best_file["quality_score"] - worst_file["quality_score"]
+
+        if quality_diff < self.manual_review_threshold:
+            return "manual_review", f"Quality difference too small ({quality_diff} points) - requires manual review"
+
+        if quality_diff >= self.auto_approve_threshold:
+            # Check language concerns on files to be deleted
+            for file_meta in ranked_files[1:]:
+                concern, reason = self.quality_service.check_language_concern(file_meta)
+                if concern:
+                    return "manual_review", reason
+            return "auto_delete", f"Clear quality winner (Δ{quality_diff} points)"
+
+        return "manual_review", f"Moderate quality difference ({quality_diff} points)"
+
+    def compare_profiles(
+        self,
+        profiles: List[str],
+        include_reviewed: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Compare keep/delete outcomes for existing duplicate groups across profiles.
+
+        Member metadata is loaded in one query and each profile scores the
+        whole batch in a single pass, so nothing is written to the database.
+
+        Returns:
+            Dict with per-profile summaries and groups whose keeper differs
+        """
+        query = (
+            self.db.query(
+                DuplicateMember.group_id,
+                MediaFile.id,
+                MediaFile.height,
+                MediaFile.video_codec,
+                MediaFile.bitrate,
+                MediaFile.audio_channels,
+                MediaFile.audio_track_count,
+                MediaFile.subtitle_track_count,
+                MediaFile.hdr_type,
+                MediaFile.audio_languages,
+                MediaFile.subtitle_languages,
+                MediaFile.dominant_audio_language,
+            )
+            .join(MediaFile, DuplicateMember.file_id == MediaFile.id)
+            .join(DuplicateGroup, DuplicateMember.group_id == DuplicateGroup.id)
+            .filter(MediaFile.is_deleted == False)
+        )
+        if not include_reviewed:
+            query = query.filter(DuplicateGroup.reviewed == False)
+
+        rows = [row._asdict() for row in query.all()]
+        group_ids = sorted({row["group_id"] for row in rows})
+
+        summaries: Dict[str, Dict[str, Any]] = {}
+        keepers: Dict[str, Dict[int, int]] = {}
+
+        for profile in profiles:
+            comparer = DeduplicationService(self.db, profile=profile)
+            scores = comparer.quality_service.score_many(rows)
+
+            members: Dict[int, List[Dict[str, Any]]] = {}
+            for row, score in zip(rows, scores):
+                members.setdefault(row["group_id"], []).append({**row, "quality_score": score})
+
+            actions = {"auto_delete": 0, "manual_review": 0}
+            keepers[profile] = {}
+            for group_id, group_members in members.items():
+                if len(group_members) < 2:
+                    continue
+                ranked = sorted(group_members, key=lambda m: m["quality_score"], reverse=True)
+                action, _ = comparer._recommend_action(ranked)
+                actions[action] = actions.get(action, 0) + 1
+                keepers[profile][group_id] = ranked[0]["id"]
+
+            summaries[profile] = {"groups": len(keepers[profile]), "actions": actions}
+
+        baseline = profiles[0]
+        disagreements = [
+            {
+                "group_id": group_id,
+                "keepers": {profile: keepers[profile].get(group_id) for profile in profiles},
+            }
+            for group_id in group_ids
+            if len({keepers[profile].get(group_id) for profile in profiles}) > 1
+        ]
+
+        for profile in profiles:
+            summaries[profile]["keeper_differs_from_baseline"] = sum(
+                1 for group_id, keeper in keepers[profile].items()
+                if keeper != keepers[baseline].get(group_id)
+            )
+
+        return {
+            "baseline": baseline,
+            "groups_compared": len(group_ids),
+            "profiles": summaries,
+            "disagreements": disagreements,
+        }
@@ -0,0 +1,239 @@
+"""Supervised FFmpeg processes: stderr capture, progress, budgets and clean shutdown."""
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+from loguru import logger
+
+from app.config import get_settings
+
+# Lines of FFmpeg stderr kept for error reporting (each cut to STDERR_LINE_CHARS)
+STDERR_TAIL_LINES = 50
+STDERR_LINE_CHARS = 500
+
+# How often the watchdog checks the wall-clock and CPU budgets
+WATCHDOG_INTERVAL = 1.0
+
+# Seconds to wait after SIGTERM before SIGKILL
+TERMINATE_GRACE = 5.0
+
+# Machine-readable progress on stderr instead of the status line
+PROGRESS_ARGS = ["-progress", "pipe:2", "-nostats"]
+
+_PROGRESS_LINE = re.compile(r"^(\w+)=\s*(\S*)$")
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def with_progress(cmd: List[str]) -> List[str]:
+    """``cmd`` with :data:`PROGRESS_ARGS` after the binary, if it runs FFmpeg."""
+    if cmd and Path(cmd[0]).name.startswith("ffmpeg") and "-progress" not in cmd:
+        return [cmd[0], *PROGRESS_ARGS, *cmd[1:]]
+    return cmd
+
+
+class FFmpegProcess:
+    """
+    One FFmpeg child process, supervised.
+
+    stderr is drained on a thread so FFmpeg never blocks on a full pipe:
+    ``-progress`` key/value lines update :attr:`progress` (speed, fps,
+    output position) and everything else goes to a bounded ring buffer
+    for error reports. The drain thread reaps the process when it exits
+    and calls ``on_exit``. A watchdog samples CPU time into
+    :attr:`cpu_used` and terminates FFmpeg once it exceeds
+    ``wall_budget`` seconds of (unpaused) wall-clock time or
+    ``cpu_budget`` seconds of CPU time; ``0`` disables a budget.
+    """
+
+    def __init__(
+        self,
+        cmd: List[str],
+        label: str = "",
+        stdout: Union[int, None] = subprocess.PIPE,
+        wall_budget: Optional[float] = None,
+        cpu_budget: Optional[float] = None,
+        on_exit: Optional[Callable[["FFmpegProcess"], None]] = None,
+    ):
+        settings = get_settings()
+        self.cmd = with_progress(cmd)
+        self.label = label
+        self.wall_budget = wall_budget if wall_budget is not None else settings.ffmpeg_wall_budget_seconds
+        self.cpu_budget = cpu_budget if cpu_budget is not None else settings.ffmpeg_cpu_budget_seconds
+        self.on_exit = on_exit
+
+        self.stderr_tail: deque = deque(maxlen=STDERR_TAIL_LINES)
+        self.progress: Dict[str, float] = {}
+        self.paused = False
+        self.stopped = False
+        self.budget_exceeded: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.cpu_used = 0.0  # CPU seconds as of the last sample
+
+        self._stdout = stdout
+        self._process: Optional[subprocess.Popen] = None
+        self._lock = threading.Lock()
+        self._exited = threading.Event()
+        self._paused_at: Optional[float] = None
+        self._paused_total = 0.0
+
+    def start(self) -> "FFmpegProcess":
+        """Launch FFmpeg and its drain and watchdog threads."""
+        logger.info(f"Starting FFmpeg ({self.label}): {' '.join(self.cmd)}")
+        self._process = subprocess.Popen(
+            self.cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=self._stdout,
+            stderr=subprocess.PIPE,
+            bufsize=0
+        )
+        self.started_at = time.monotonic()
+        threading.Thread(target=self._drain_stderr, name="ffmpeg-stderr", daemon=True).start()
+        threading.Thread(target=self._watchdog, name="ffmpeg-watchdog", daemon=True).start()
+        return self
+
+    def run(self) -> int:
+        """Start FFmpeg and wait for it to exit (within its budgets); returns the exit code."""
+        self.start()
+        return self.wait()
+
+    @property
+    def stdout(self):
+        return self._process.stdout if self._process else None
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self._process.pid if self._process else None
+
+    @property
+    def running(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self._process.poll() if self._process else None
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[int]:
+        """Wait for FFmpeg to exit and stderr to be drained; the exit code, or None on timeout."""
+        if not self._exited.wait(timeout):
+            return None
+        return self._process.returncode
+
+    def wall_seconds(self) -> float:
+        """Wall-clock seconds since start, not counting time spent paused."""
+        if self.started_at is None:
+            return 0.0
+        with self._lock:
+            paused = self._paused_total
+            if self._paused_at is not None:
+                paused += time.monotonic() - self._paused_at
+        return time.monotonic() - self.started_at - paused
+
+    def cpu_seconds(self) -> Optional[float]:
+        """User + system CPU seconds used so far (None once reaped or where /proc isn't available)."""
+        if self._process is None or self._process.returncode is not None:
+            return None
+        try:
+            with open(f"/proc/{self._process.pid}/stat") as f:
+                # Fields after the parenthesised command name; utime and stime are 14 and 15
+                fields = f.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def error_summary(self, chars: int = 500) -> str:
+        """The end of FFmpeg's stderr as one line."""
+        return " | ".join(self.stderr_tail)[-chars:]
+
+    def pause(self) -> None:
+        """Suspend FFmpeg (SIGSTOP)."""
+        with self._lock:
+            if self.running and not self.paused:
+                self._process.send_signal(signal.SIGSTOP)
+                self.paused = True
+                self._paused_at = time.monotonic()
+
+    def resume(self) -> None:
+        """Continue a paused FFmpeg (SIGCONT)."""
+        with self._lock:
+            if self.running and self.paused:
+                self._process.send_signal(signal.SIGCONT)
+            if self._paused_at is not None:
+                self._paused_total += time.monotonic() - self._paused_at
+                self._paused_at = None
+            self.paused = False
+
+    def terminate(self, grace: float = TERMINATE_GRACE) -> None:
+        """Stop FFmpeg: SIGTERM, then SIGKILL after ``grace`` seconds. Never raises."""
+        self.stopped = True
+        process = self._process
+        if process is None or process.poll() is not None:
+            return
+        self.resume()  # a stopped process can't handle SIGTERM
+        try:
+            process.terminate()
+            try:
+                process.wait(timeout=grace)
+            except subprocess.TimeoutExpired:
+                logger.warning(f"FFmpeg ({self.label}) did not terminate, killing")
+                process.kill()
+                process.wait(timeout=grace)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logger.error(f"Failed to stop FFmpeg ({self.label}): {e}")
+
+    def _drain_stderr(self) -> None:
+        process = self._process
+        try:
+            for raw in process.stderr:
+                line = raw.decode("utf-8", errors="ignore").rstrip()
+                match = _PROGRESS_LINE.match(line)
+                if match:
+                    self._record_progress(match.group(1), match.group(2))
+                elif line:
+                    self.stderr_tail.append(line[:STDERR_LINE_CHARS])
+        except (OSError, ValueError):
+            pass
+        finally:
+            # Last CPU sample (readable until reaped), then reap the child
+            # so it can't linger as a zombie
+            self.cpu_used = self.cpu_seconds() or self.cpu_used
+            process.wait()
+            self._exited.set()
+            if self.on_exit:
+                self.on_exit(self)
+
+    def _record_progress(self, key: str, value: str) -> None:
+        try:
+            if key == "speed":
+                self.progress["speed"] = float(value.rstrip("x"))
+            elif key == "fps":
+                self.progress["fps"] = float(value)
+            elif key == "frame":
+                self.progress["frame"] = int(value)
+            elif key == "out_time_us":
+                self.progress["out_time"] = int(value) / 1_000_000
+            elif key == "total_size":
+                self.progress["total_size"] = int(value)
+        except ValueError:
+            pass  # N/A before the first frame
+
+    def _watchdog(self) -> None:
+        while not self._exited.wait(WATCHDOG_INTERVAL):
+            used = self.cpu_seconds()
+            if used is not None:
+                self.cpu_used = used
+            reason = None
+            if self.wall_budget and self.wall_seconds() > self.wall_budget:
+                reason = f"wall-clock budget ({self.wall_budget:.0f}s)"
+            elif self.cpu_budget and self.cpu_used > self.cpu_budget:
+                reason = f"CPU budget ({self.cpu_budget:.0f}s)"
+            if reason:
+                self.budget_exceeded = reason
+                logger.warning(f"FFmpeg ({self.label}) exceeded its {reason}, stopping")
+                self.terminate()
+                return
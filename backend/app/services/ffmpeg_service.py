@@ -1,14 +1,21 @@
 """FFmpeg/FFprobe service for media metadata extraction."""
 import subprocess
 import json
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from loguru import logger
 
 from app.config import get_settings
 from app.services import cuda_hash
+from app.services.ffmpeg_process import FFmpegProcess
 
 settings = get_settings()
 
+# Fragmented MP4 flags: playable from the first fragment, writable to a pipe
+FRAGMENTED_MP4_FLAGS = "frag_keyframe+empty_moov+default_base_moof"
+
+# Audio codecs that can be stream-copied into MP4 (vorbis in MP4 is not)
+MP4_COPY_AUDIO = ['aac', 'mp3', 'opus']
+
 
 class FFmpegService:
     """Service for extracting media file metadata using FFprobe."""
@@ -16,6 +23,7 @@ class FFmpegService:
     def __init__(self):
         self.ffprobe_path = settings.ffprobe_path
         self.md5_chunk_size = settings.md5_chunk_size
+        self._gpu_available: Optional[bool] = None
 
     def check_ffprobe_installed(self) -> bool:
         """Check if FFprobe is installed."""
@@ -303,22 +311,19 @@ class FFmpegService:
                     output_path
                 ]
 
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                timeout=300  # 5 minute timeout
-            )
+            process = FFmpegProcess(cmd, "transcode", stdout=subprocess.DEVNULL, wall_budget=300)  # 5 minute timeout
+            returncode = process.run()
 
-            if result.returncode == 0:
+            if returncode == 0:
                 logger.success(f"{'GPU' if use_gpu else 'CPU'} transcoding complete: {output_path}")
                 return True
+            elif process.budget_exceeded:
+                logger.error(f"Transcode timeout for {input_path}")
+                return False
             else:
-                logger.error(f"Transcode failed: {result.stderr.decode()}")
+                logger.error(f"Transcode failed: {process.error_summary()}")
                 return False
 
-        except subprocess.TimeoutExpired:
-            logger.error(f"Transcode timeout for {input_path}")
-            return False
         except Exception as e:
             logger.error(f"Error transcoding video: {e}")
             return False
@@ -378,13 +383,8 @@ class FFmpegService:
                     output_path
                 ]
 
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                timeout=60
-            )
-
-            return result.returncode == 0
+            process = FFmpegProcess(cmd, "preview clip", stdout=subprocess.DEVNULL, wall_budget=60)
+            return process.run() == 0
 
         except Exception as e:
             logger.error(f"Error creating preview clip: {e}")
@@ -394,9 +394,14 @@ class FFmpegService:
         """
         Check if GPU encoding (NVENC) is available in FFmpeg.
 
+        The result is cached per service instance.
+
         Returns:
             True if NVENC encoders are available
         """
+        if self._gpu_available is not None:
+            return self._gpu_available
+
         try:
             result = subprocess.run(
                 [settings.ffmpeg_path, "-encoders"],
@@ -404,10 +409,12 @@ class FFmpegService:
                 text=True,
                 timeout=5
             )
-            return "h264_nvenc" in result.stdout
+            self._gpu_available = "h264_nvenc" in result.stdout
 
         except Exception:
-            return False
+            self._gpu_available = False
+
+        return self._gpu_available
 
     def is_browser_compatible(self, video_codec: Optional[str], audio_codec: Optional[str],
                              container_format: Optional[str]) -> dict:
@@ -453,6 +460,9 @@ class FFmpegService:
         # Overall compatibility
         fully_compatible = video_compatible and audio_compatible and container_compatible
 
+        # Copying into fragmented MP4 needs an MP4-compatible audio codec
+        audio_copyable = audio_compatible and (container_compatible or audio_codec in MP4_COPY_AUDIO)
+
         return {
             'compatible': fully_compatible,
             'video_compatible': video_compatible,
@@ -462,7 +472,7 @@ class FFmpegService:
             'needs_audio_transcode': audio_needs_transcode or not audio_compatible,
             'needs_remux': video_compatible and audio_compatible and not container_compatible,
             'recommendation': self._get_streaming_recommendation(
-                fully_compatible, video_compatible, audio_compatible, container_compatible
+                fully_compatible, video_compatible, audio_copyable, container_compatible
             )
         }
 
@@ -473,5 +483,85 @@ class FFmpegService:
             return "direct_stream"  # Use existing range request streaming
         elif video_ok and audio_ok and not container_ok:
             return "remux_only"  # Fast container change, no transcode
+        elif video_ok:
+            return "audio_transcode"  # Copy video, re-encode audio only
         else:
             return "hls_transcode"  # Full transcode with adaptive streaming
+
+    def build_stream_command(
+        self,
+        input_path: str,
+        recommendation: str,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        quality: int = 23,
+        use_gpu: bool = True,
+        output: str = "pipe:1",
+        start_time: Optional[float] = None,
+        max_kbps: Optional[int] = None
+    ) -> List[str]:
+        """
+        Build an FFmpeg command producing fragmented MP4 for progressive playback.
+
+        - ``remux_only``: copy video and audio into MP4 (no decode/encode)
+        - ``audio_transcode``: copy video, re-encode audio to stereo AAC
+        - anything else: full video transcode, NVENC if requested and
+          available, libx264 otherwise
+
+        Only the first video and audio streams are mapped; subtitles and data
+        streams are dropped since MP4 can't carry most MKV subtitle codecs.
+
+        ``start_time`` seeks on the input side, so FFmpeg jumps straight to
+        the keyframe before it instead of decoding from the start; copied
+        video starts on that keyframe, transcodes start exactly there.
+
+        Args:
+            input_path: Source video file
+            recommendation: Value from :meth:`is_browser_compatible`
+            width: Target width for full transcodes (source width if None)
+            height: Target height for full transcodes (source height if None)
+            quality: CQ/CRF for full transcodes
+            use_gpu: Prefer NVENC for full transcodes
+            output: Output target (default stdout)
+            start_time: Source position in seconds to start from
+            max_kbps: Video bitrate cap for full transcodes (quality still
+                decides below it)
+
+        Returns:
+            FFmpeg argument list
+        """
+        full_transcode = recommendation not in ("remux_only", "audio_transcode")
+        gpu = full_transcode and use_gpu and self.check_gpu_encoding_available()
+
+        cmd = [settings.ffmpeg_path, "-hide_banner", "-nostdin"]
+        if gpu:
+            cmd.extend(["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"])
+        if start_time:
+            cmd.extend(["-ss", f"{start_time:.3f}"])
+        cmd.extend(["-i", input_path, "-map", "0:v:0", "-map", "0:a:0?", "-sn", "-dn"])
+
+        if not full_transcode:
+            cmd.extend(["-c:v", "copy"])
+        elif gpu:
+            if width and height:
+                cmd.extend(["-vf", f"scale_cuda={width}:{height}"])
+            cmd.extend(["-c:v", "h264_nvenc", "-preset", "p4", "-cq", str(quality)])
+        else:
+            if width and height:
+                cmd.extend(["-vf", f"scale={width}:{height}"])
+            cmd.extend([
+                "-c:v", "libx264",
+                "-preset", "veryfast",
+                "-crf", str(quality),
+                "-pix_fmt", "yuv420p"
+            ])
+        if full_transcode and max_kbps:
+            cmd.extend(["-maxrate", f"{max_kbps}k", "-bufsize", f"{max_kbps * 2}k"])
+
+        if recommendation == "remux_only":
+            cmd.extend(["-c:a", "copy"])
+        else:
+            cmd.extend(["-c:a", "aac", "-b:a", "192k", "-ac", "2", "-ar", "48000"])
+
+        cmd.extend(["-movflags", FRAGMENTED_MP4_FLAGS, "-f", "mp4", output])
+        return cmd
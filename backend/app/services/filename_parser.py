@@ -0,0 +1,234 @@
+"""Cached filename parsing (guessit) for scans and archive discovery."""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import guessit
+from loguru import logger
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.models import FilenameParseCacheEntry
+
+# Cached results are only valid for the guessit release that produced them
+GUESSIT_VERSION = guessit.__version__
+
+# Names per IN (...) lookup against the persisted cache
+_DB_CHUNK = 500
+
+# Longer names don't fit the cache table's column; they are only memoized in process
+_MAX_STORED_NAME = FilenameParseCacheEntry.__table__.c.filename.type.length
+
+# INSERT ... ON CONFLICT DO NOTHING per dialect (others insert row by row)
+_CONFLICT_IGNORING_INSERTS = {"postgresql": postgresql_insert, "sqlite": sqlite_insert}
+
+
+def _json_safe(value: Any) -> Any:
+    """Convert guessit values (Language, Country, lists of them) to JSON types."""
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(v) for v in value]
+    return str(value)
+
+
+def guessit_parse(filename: str) -> Dict[str, Any]:
+    """
+    Run guessit on ``filename`` and return a JSON-serializable dict.
+
+    Module-level so it can be shipped to worker processes. Parse errors
+    yield an empty dict (cached like any other result).
+    """
+    try:
+        return {key: _json_safe(value) for key, value in guessit.guessit(filename).items()}
+    except Exception as e:
+        logger.error(f"Error parsing filename {filename}: {e}")
+        return {}
+
+
+class FilenameParser:
+    """
+    Memoized guessit parser backed by the ``filename_parse_cache`` table.
+
+    :meth:`parse` checks an in-process LRU, then the persisted cache, then
+    runs guessit. :meth:`parse_many` resolves a whole scan batch with one
+    query per chunk of names and, for large cold batches, parses the misses
+    in a process pool. Results are keyed by filename and guessit version,
+    so upgrading guessit transparently invalidates old parses.
+    """
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Session]] = None,
+        memory_size: Optional[int] = None,
+        pool_min_batch: Optional[int] = None,
+        pool_workers: Optional[int] = None,
+        persist: bool = True,
+    ):
+        settings = get_settings()
+        if session_factory is None and persist:
+            from app.database import SessionLocal
+            session_factory = SessionLocal
+
+        self.session_factory = session_factory if persist else None
+        self.memory_size = memory_size if memory_size is not None else settings.parse_cache_memory_size
+        self.pool_min_batch = pool_min_batch if pool_min_batch is not None else settings.parse_pool_min_batch
+        self.pool_workers = pool_workers if pool_workers is not None else settings.parse_pool_workers
+
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "db_hits": 0, "parsed": 0, "errors": 0}
+
+    def parse(self, filename: str) -> Dict[str, Any]:
+        """Parse a single filename (returns a copy safe to mutate)."""
+        return dict(self.parse_many([filename])[filename])
+
+    def parse_many(self, filenames: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Parse a batch of filenames.
+
+        Returns:
+            Mapping of each distinct filename to its parse result
+        """
+        results: Dict[str, Dict[str, Any]] = {}
+        pending: List[str] = []
+
+        with self._lock:
+            for name in dict.fromkeys(filenames):
+                cached = self._memory.get(name)
+                if cached is not None:
+                    self._memory.move_to_end(name)
+                    self._counters["memory_hits"] += 1
+                    results[name] = cached
+                else:
+                    pending.append(name)
+
+        if pending:
+            stored = self._load(pending)
+            with self._lock:
+                self._counters["db_hits"] += len(stored)
+            results.update(stored)
+
+            misses = [name for name in pending if name not in stored]
+            if misses:
+                parsed = self._parse_uncached(misses)
+                self._store(parsed)
+                results.update(parsed)
+
+            self._remember({name: results[name] for name in pending})
+
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for monitoring cache effectiveness."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["db_hits"] + stats["parsed"]
+        stats["hit_rate"] = round((lookups - stats["parsed"]) / lookups, 4) if lookups else 0.0
+        stats["guessit_version"] = GUESSIT_VERSION
+        return stats
+
+    def clear_memory(self) -> None:
+        """Drop the in-process LRU (persisted entries are kept)."""
+        with self._lock:
+            self._memory.clear()
+
+    def _parse_uncached(self, filenames: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Run guessit on cold names, in a process pool for large batches."""
+        if len(filenames) >= self.pool_min_batch and self.pool_workers > 1:
+            logger.info(f"Parsing {len(filenames)} new filenames with {self.pool_workers} processes...")
+            chunksize = max(1, len(filenames) // (self.pool_workers * 4))
+            try:
+                with ProcessPoolExecutor(max_workers=self.pool_workers) as pool:
+                    parsed = list(pool.map(guessit_parse, filenames, chunksize=chunksize))
+            except Exception as e:
+                logger.warning(f"Process pool parsing failed, falling back to serial: {e}")
+                parsed = [guessit_parse(name) for name in filenames]
+        else:
+            parsed = [guessit_parse(name) for name in filenames]
+
+        with self._lock:
+            self._counters["parsed"] += len(filenames)
+        return dict(zip(filenames, parsed))
+
+    def _load(self, filenames: List[str]) -> Dict[str, Dict[str, Any]]:
+        if self.session_factory is None:
+            return {}
+
+        found: Dict[str, Dict[str, Any]] = {}
+        db = self.session_factory()
+        try:
+            for i in range(0, len(filenames), _DB_CHUNK):
+                rows = (
+                    db.query(FilenameParseCacheEntry.filename, FilenameParseCacheEntry.parsed)
+                    .filter(FilenameParseCacheEntry.guessit_version == GUESSIT_VERSION)
+                    .filter(FilenameParseCacheEntry.filename.in_(filenames[i:i + _DB_CHUNK]))
+                    .all()
+                )
+                found.update({name: parsed for name, parsed in rows})
+        except Exception as e:
+            logger.warning(f"Filename parse cache read failed: {e}")
+            with self._lock:
+                self._counters["errors"] += 1
+        finally:
+            db.close()
+        return found
+
+    def _store(self, parsed: Dict[str, Dict[str, Any]]) -> None:
+        if self.session_factory is None or not parsed:
+            return
+
+        rows = [
+            {"filename": name, "guessit_version": GUESSIT_VERSION, "parsed": result}
+            for name, result in parsed.items() if len(name) <= _MAX_STORED_NAME
+        ]
+        if not rows:
+            return
+
+        db = self.session_factory()
+        try:
+            # Names a concurrent scan stored first are skipped, not fatal to the batch
+            insert = _CONFLICT_IGNORING_INSERTS.get(db.get_bind().dialect.name)
+            for i in range(0, len(rows), _DB_CHUNK):
+                chunk = rows[i:i + _DB_CHUNK]
+                if insert is not None:
+                    db.execute(insert(FilenameParseCacheEntry).values(chunk).on_conflict_do_nothing())
+                else:
+                    self._store_rows(db, chunk)
+            db.commit()
+        except Exception as e:
+            logger.warning(f"Filename parse cache write failed: {e}")
+            db.rollback()
+            with self._lock:
+                self._counters["errors"] += 1
+        finally:
+            db.close()
+
+    @staticmethod
+    def _store_rows(db: Session, rows: List[Dict[str, Any]]) -> None:
+        for row in rows:
+            try:
+                with db.begin_nested():
+                    db.add(FilenameParseCacheEntry(**row))
+            except IntegrityError:
+                pass  # already stored; anything else fails the batch in _store
+
+    def _remember(self, parsed: Dict[str, Dict[str, Any]]) -> None:
+        with self._lock:
+            for name, result in parsed.items():
+                self._memory[name] = result
+                self._memory.move_to_end(name)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+
+@lru_cache()
+def get_filename_parser() -> FilenameParser:
+    """Process-wide filename parser shared by scanner and archive services."""
+    return FilenameParser()
@@ -0,0 +1,312 @@
+"""CMAF HLS: one fragmented MP4 per rendition, addressed by byte range."""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from app.config import get_settings
+from app.services.ffmpeg_service import FRAGMENTED_MP4_FLAGS
+from app.services.hls_service import rendition_bandwidth
+from app.services.transcode_cache import get_transcode_cache
+from app.services.transcode_scheduler import TranscodeQueueTimeout
+from app.services.transcode_sessions import TranscodeSession, TranscodeSessionManager, get_session_manager
+from app.utils.fmp4 import FragmentIndex
+
+settings = get_settings()
+
+MEDIA_NAME = "media.mp4"
+
+# Fragment indexes of finished rendition files kept in memory
+INDEX_CACHE_SIZE = 64
+
+# (path, index, end offset, complete)
+CMAFMedia = Tuple[Path, FragmentIndex, int, bool]
+
+
+def fragment_ranges(index: FragmentIndex, end: int, duration: float,
+                    complete: bool) -> List[Tuple[float, float, int, int]]:
+    """
+    ``(start, seconds, offset, size)`` of each fragment written in full.
+
+    A fragment is whole once the next one has started, or when the file
+    is complete (the last one then runs to ``end`` and ``duration``).
+    """
+    count = len(index.offsets)
+    times, offsets = index.times[:count], index.offsets[:count]
+    fragments = []
+    for i in range(count):
+        if i + 1 < count:
+            stop, next_time = offsets[i + 1], times[i + 1]
+        elif complete:
+            stop, next_time = end, max(duration, times[i])
+        else:
+            break
+        fragments.append((times[i], next_time - times[i], offsets[i], stop - offsets[i]))
+    return fragments
+
+
+def build_cmaf_playlist(index: FragmentIndex, end: int, duration: float, complete: bool,
+                        segment_seconds: float) -> str:
+    """
+    Media playlist addressing a rendition's fragments by ``EXT-X-BYTERANGE``.
+
+    While the file is still being encoded the playlist is an EVENT
+    playlist listing the fragments written so far; players reload it.
+    """
+    fragments = fragment_ranges(index, end, duration, complete)
+    target = math.ceil(max([segment_seconds] + [seconds for _, seconds, _, _ in fragments]))
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:7",
+        f"#EXT-X-TARGETDURATION:{target}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        f"#EXT-X-PLAYLIST-TYPE:{'VOD' if complete else 'EVENT'}",
+        "#EXT-X-INDEPENDENT-SEGMENTS",
+        f"#EXT-X-MAP:URI=\"{MEDIA_NAME}\",BYTERANGE=\"{index.init_end}@0\"",
+    ]
+    for _, seconds, offset, size in fragments:
+        lines.append(f"#EXTINF:{max(seconds, 0.001):.3f},")
+        lines.append(f"#EXT-X-BYTERANGE:{size}@{offset}")
+        lines.append(MEDIA_NAME)
+    if complete:
+        lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def build_dash_manifest(representations: List[Tuple[Dict, FragmentIndex, int]], duration: float,
+                        segment_seconds: float) -> str:
+    """
+    Static DASH manifest over finished rendition files, reusing their fragments.
+
+    Args:
+        representations: ``(rendition, index, file size)`` per finished rendition
+        duration: Title duration in seconds
+        segment_seconds: Nominal fragment length
+    """
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" '
+        'profiles="urn:mpeg:dash:profile:isoff-main:2011" '
+        f'mediaPresentationDuration="PT{duration:.3f}S" minBufferTime="PT{segment_seconds}S">',
+        '  <Period start="PT0S">',
+        '    <AdaptationSet contentType="video" mimeType="video/mp4" segmentAlignment="true">',
+    ]
+    for rendition, index, end in representations:
+        fragments = fragment_ranges(index, end, duration, complete=True)
+        lines.append(
+            f'      <Representation id="{rendition["name"]}" bandwidth="{rendition_bandwidth(rendition)}" '
+            f'width="{rendition["width"]}" height="{rendition["height"]}" codecs="avc1.640028,mp4a.40.2">'
+        )
+        lines.append(f'        <BaseURL>{rendition["name"]}/{MEDIA_NAME}</BaseURL>')
+        lines.append('        <SegmentList timescale="1000">')
+        lines.append(f'          <Initialization range="0-{index.init_end - 1}"/>')
+        lines.append('          <SegmentTimeline>')
+        for start, seconds, _, _ in fragments:
+            lines.append(f'            <S t="{round(start * 1000)}" d="{max(round(seconds * 1000), 1)}"/>')
+        lines.append('          </SegmentTimeline>')
+        for _, _, offset, size in fragments:
+            lines.append(f'          <SegmentURL mediaRange="{offset}-{offset + size - 1}"/>')
+        lines.append('        </SegmentList>')
+        lines.append('      </Representation>')
+    lines.extend(['    </AdaptationSet>', '  </Period>', '</MPD>'])
+    return "\n".join(lines) + "\n"
+
+
+class CMAFPackager:
+    """
+    Produces and indexes one fragmented MP4 file per HLS rendition.
+
+    Each rendition is encoded once, start to finish, through a transcode
+    session that spools into the transcode cache and is published there
+    when FFmpeg exits; concurrent viewers join the same session. Keyframes
+    are forced every ``segment_seconds`` (with scene-cut keyframes off), so
+    fragments line up across renditions and each one is an HLS segment.
+    Playlists can be served from the first fragment on, growing until the
+    file is complete.
+    """
+
+    def __init__(
+        self,
+        manager: Optional[TranscodeSessionManager] = None,
+        segment_seconds: Optional[float] = None,
+        segment_timeout: Optional[float] = None,
+    ):
+        self.ffmpeg_path = settings.ffmpeg_path
+        self.manager = manager
+        self.segment_seconds = segment_seconds or settings.hls_segment_seconds
+        self.segment_timeout = segment_timeout if segment_timeout is not None else settings.hls_segment_timeout_seconds
+
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, TranscodeSession] = {}
+        self._starting: Set[str] = set()
+        self._indexes: "OrderedDict[str, Tuple[FragmentIndex, int]]" = OrderedDict()
+
+    def command(self, input_path: str, rendition: Dict, use_gpu: bool, has_audio: bool = True) -> List[str]:
+        """FFmpeg command writing a rendition as fragmented MP4 to stdout."""
+        bitrate = rendition["bitrate"]
+        size = f"{rendition['width']}:{rendition['height']}"
+
+        cmd = [self.ffmpeg_path, "-hide_banner", "-nostdin", "-loglevel", "error"]
+        if use_gpu:
+            cmd.extend(["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"])
+        cmd.extend(["-i", input_path, "-map", "0:v:0"])
+        if has_audio:
+            cmd.extend(["-map", "0:a:0"])
+        cmd.extend(["-sn", "-dn"])
+
+        if use_gpu:
+            cmd.extend([
+                "-vf", f"scale_cuda={size}",
+                "-c:v", "h264_nvenc",
+                "-preset", "p4",
+                "-forced-idr", "1",
+                "-no-scenecut", "1",
+            ])
+        else:
+            cmd.extend([
+                "-vf", f"scale={size}",
+                "-c:v", "libx264",
+                "-preset", "veryfast",
+                "-pix_fmt", "yuv420p",
+                "-sc_threshold", "0",
+            ])
+
+        cmd.extend([
+            "-b:v", bitrate,
+            "-maxrate", bitrate,
+            "-bufsize", f"{int(bitrate.rstrip('k')) * 2}k",
+            "-force_key_frames", f"expr:gte(t,n_forced*{self.segment_seconds})",
+        ])
+        if has_audio:
+            cmd.extend(["-c:a", "aac", "-b:a", "128k", "-ar", "48000", "-ac", "2"])
+        cmd.extend(["-movflags", FRAGMENTED_MP4_FLAGS, "-f", "mp4", "pipe:1"])
+        return cmd
+
+    def media(self, cache_key: str, build_cmd: Callable[[bool], List[str]], label: str,
+              start: bool = True) -> Optional[CMAFMedia]:
+        """
+        The rendition file for ``cache_key`` as ``(path, index, end, complete)``.
+
+        Finished files come from the transcode cache. Otherwise the encode is
+        started (or joined, unless ``start`` is False) with an interactive
+        scheduler slot, ``build_cmd(use_gpu)`` giving its command, and this
+        waits for its first complete fragment.
+
+        Returns:
+            The file's current state, or None if the encode failed or
+            produced nothing within ``segment_timeout``
+
+        Raises:
+            TranscodeQueueTimeout: if no encoder slot freed up in time
+        """
+        cached = self.cached(cache_key)
+        if cached is not None:
+            return cached
+
+        session = self._session(cache_key, build_cmd, label) if start else self._sessions.get(cache_key)
+        if session is None:
+            return None
+
+        deadline = time.monotonic() + self.segment_timeout
+        while len(session.index.offsets) < 2:
+            if session.done:
+                if session.published:
+                    return self.media(cache_key, build_cmd, label, start=False)
+                return None
+            if time.monotonic() >= deadline:
+                logger.warning(f"Timed out waiting for CMAF rendition {cache_key[:12]} ({label})")
+                return None
+            time.sleep(0.05)
+        return session.spool_path, session.index, session.size, False
+
+    def cached(self, cache_key: str) -> Optional[CMAFMedia]:
+        """The complete rendition file, if it is in the transcode cache (never counts a miss)."""
+        cache = get_transcode_cache()
+        # Playlists of an encoding rendition are reloaded every few seconds: not cache misses
+        cached = cache.lookup(cache_key) if cache.contains(cache_key) else None
+        if cached is None:
+            return None
+        index, end = self._file_index(cache_key, cached)
+        return cached, index, end, True
+
+    def start(self, cache_key: str, build_cmd: Callable[[bool], List[str]], label: str,
+              priority: str = "interactive") -> None:
+        """
+        Start encoding a rendition in the background, unless it is cached, running or queued.
+
+        Returns at once; the encode waits for a ``priority`` scheduler slot
+        on its own thread.
+        """
+        if get_transcode_cache().contains(cache_key):
+            return
+        with self._lock:
+            if cache_key in self._sessions or cache_key in self._starting:
+                return
+            self._starting.add(cache_key)
+        threading.Thread(target=self._start, args=(cache_key, build_cmd, label, priority),
+                         name="hls-cmaf-start", daemon=True).start()
+
+    def progress(self, cache_key: str) -> Dict[str, float]:
+        """FFmpeg progress (speed, fps, position) of a rendition's running encode; empty if none."""
+        session = self._sessions.get(cache_key)
+        return session.progress if session else {}
+
+    def _start(self, cache_key: str, build_cmd: Callable[[bool], List[str]], label: str, priority: str) -> None:
+        try:
+            self._session(cache_key, build_cmd, label, priority)
+        except (TranscodeQueueTimeout, OSError) as e:
+            logger.warning(f"Could not start CMAF rendition {cache_key[:12]} ({label}): {e}")
+        finally:
+            with self._lock:
+                self._starting.discard(cache_key)
+
+    def _session(self, cache_key: str, build_cmd: Callable[[bool], List[str]], label: str,
+                 priority: str = "interactive") -> TranscodeSession:
+        with self._lock:
+            session = self._sessions.get(cache_key)
+        if session is not None:
+            return session
+
+        # Not under the lock: this may queue for a scheduler slot
+        manager = self.manager or get_session_manager()
+        session = manager.open(cache_key, build_cmd, label, cache_key=cache_key, priority=priority)
+        with self._lock:
+            held = self._sessions.get(cache_key)
+            if held is None:
+                self._sessions[cache_key] = session
+                # Hold a subscription so the encode runs to completion
+                threading.Thread(target=self._hold, args=(manager, session), name="hls-cmaf", daemon=True).start()
+                return session
+        # Started (and held) concurrently: ours joined it
+        manager.release(session)
+        return held
+
+    def _hold(self, manager: TranscodeSessionManager, session: TranscodeSession) -> None:
+        session.wait()
+        manager.release(session)
+        with self._lock:
+            if self._sessions.get(session.key) is session:
+                del self._sessions[session.key]
+
+    def _file_index(self, cache_key: str, path: Path) -> Tuple[FragmentIndex, int]:
+        with self._lock:
+            entry = self._indexes.get(cache_key)
+            if entry is not None:
+                self._indexes.move_to_end(cache_key)
+                return entry
+
+        index = FragmentIndex()
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            index.update(lambda offset, length: os.pread(f.fileno(), length, offset), size)
+
+        with self._lock:
+            self._indexes[cache_key] = (index, size)
+            while len(self._indexes) > INDEX_CACHE_SIZE:
+                self._indexes.popitem(last=False)
+        return index, size
@@ -1,340 +1,629 @@
-"""HLS (HTTP Live Streaming) service with GPU-accelerated transcoding."""
+"""HLS (HTTP Live Streaming) service with just-in-time GPU-accelerated transcoding."""
+import math
 import subprocess
-import os
+import threading
+import time
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, Dict, List
+from typing import Callable, Dict, List, Optional, Tuple
+
 from loguru import logger
-import time
-import threading
 
 from app.config import get_settings
+from app.services.ffmpeg_process import FFmpegProcess
+from app.services.hls_store import HLSSegmentStore
+from app.services.transcode_scheduler import TranscodeScheduler, TranscodeSlot, get_transcode_scheduler
 
 settings = get_settings()
 
+SEGMENT_NAME = "segment_{:05d}.ts"
+
+# A request this many segments past the encoder's position waits for it
+# rather than restarting FFmpeg (a restart costs more than encoding these)
+RESTART_GAP_SEGMENTS = 2
+
+# Rendition ladder (bounding box and video bitrate), best first
+LADDER = [
+    {"name": "1080p", "width": 1920, "height": 1080, "bitrate": "8000k"},
+    {"name": "720p", "width": 1280, "height": 720, "bitrate": "4000k"},
+    {"name": "480p", "width": 854, "height": 480, "bitrate": "2000k"},
+    {"name": "360p", "width": 640, "height": 360, "bitrate": "1000k"},
+]
+
+DEFAULT_RENDITION = LADDER[1]
+
+# Lowest video bitrate worth encoding a rung at
+MIN_RENDITION_KBPS = 400
+
+
+def _even(value: float) -> int:
+    return max(2, int(round(value / 2)) * 2)
+
+
+def build_ladder(width: Optional[int], height: Optional[int], bitrate_kbps: Optional[int] = None) -> List[Dict]:
+    """
+    Renditions worth offering for a source, best first.
+
+    Each rung is fitted inside its bounding box keeping the source aspect
+    ratio and never upscaled, so a 720p file gets no 1080p rung, a
+    1920x800 film still gets a full-width top rung, and a 480p file is
+    offered at 480p and below. Rung bitrates are capped at the source
+    bitrate. Without known dimensions the default 720p rendition is used.
+    """
+    if not width or not height:
+        return [dict(DEFAULT_RENDITION)]
+
+    ladder: List[Dict] = []
+    seen = set()
+    for rung in LADDER:
+        scale = min(rung["width"] / width, rung["height"] / height, 1.0)
+        size = (_even(width * scale), _even(height * scale))
+        if size in seen:
+            continue  # small source: this rung would repeat the one above
+        seen.add(size)
+
+        kbps = int(rung["bitrate"].rstrip("k"))
+        if bitrate_kbps:
+            kbps = max(min(kbps, bitrate_kbps), MIN_RENDITION_KBPS)
+        # A rung the source doesn't fill is named after its actual height
+        name = rung["name"] if scale < 1.0 else f"{size[1]}p"
+        ladder.append({"name": name, "width": size[0], "height": size[1], "bitrate": f"{kbps}k"})
+
+    return ladder
+
+
+def rendition_bandwidth(rendition: Dict) -> int:
+    """Peak bits/s of a rendition (video plus 128k audio), for playlists and manifests."""
+    return (int(rendition["bitrate"].rstrip("k")) + 128) * 1000
+
+
+def segment_count(duration: float, segment_seconds: float) -> int:
+    """Number of segments in a title of ``duration`` seconds."""
+    return max(1, math.ceil(duration / segment_seconds))
+
+
+def build_media_playlist(duration: float, segment_seconds: float) -> str:
+    """
+    Complete VOD media playlist for a title, written from its duration alone.
+
+    Segments are cut on forced keyframes every ``segment_seconds``, so the
+    playlist is known before any of them has been encoded.
+    """
+    count = segment_count(duration, segment_seconds)
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{math.ceil(segment_seconds)}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+        "#EXT-X-INDEPENDENT-SEGMENTS",
+    ]
+    for index in range(count):
+        length = min(segment_seconds, duration - index * segment_seconds) if duration else segment_seconds
+        lines.append(f"#EXTINF:{max(length, 0.001):.3f},")
+        lines.append(SEGMENT_NAME.format(index))
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+class HLSEncoder:
+    """
+    One FFmpeg process writing renditions' segments from ``start_segment`` on.
+
+    All renditions share one decode, so they advance together. Segments
+    are written to a temp name and renamed when complete, so a segment
+    file that exists is always whole. The encoder can be paused (SIGSTOP)
+    when it gets too far ahead of the viewer and resumed later.
+    """
+
+    def __init__(self, cmd: List[str], output_dir: Path, renditions: List[str],
+                 start_segment: int, total_segments: int,
+                 on_segment: Optional[Callable[[str, int], None]] = None,
+                 slot: Optional[TranscodeSlot] = None):
+        self.cmd = cmd
+        self.output_dir = output_dir
+        self.renditions = renditions
+        self.on_segment = on_segment
+        self.slot = slot
+        self.start_segment = start_segment
+        self.total_segments = total_segments
+        self.next_segment = start_segment  # first segment not yet written
+        self.process = FFmpegProcess(cmd, f"HLS from segment {start_segment}", stdout=subprocess.DEVNULL)
+
+    def start(self) -> None:
+        self.process.start()
+
+    @property
+    def running(self) -> bool:
+        return self.process.running
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self.process.returncode
+
+    @property
+    def paused(self) -> bool:
+        return self.process.paused
+
+    def refresh(self) -> int:
+        """
+        Advance :attr:`next_segment` past segments that exist for every rendition.
+
+        Reports each newly finished segment (``<rendition>/<name>``, size) to
+        ``on_segment``.
+        """
+        while self.next_segment < self.total_segments:
+            name = SEGMENT_NAME.format(self.next_segment)
+            try:
+                sizes = {f"{r}/{name}": (self.output_dir / r / name).stat().st_size for r in self.renditions}
+            except FileNotFoundError:
+                break
+            if self.on_segment:
+                for segment, size in sizes.items():
+                    self.on_segment(segment, size)
+            self.next_segment += 1
+        return self.next_segment
+
+    def pause(self) -> None:
+        self.process.pause()
+
+    def resume(self) -> None:
+        self.process.resume()
+
+    def stop(self) -> None:
+        """Terminate FFmpeg (if still running) and give back its scheduler slot."""
+        self.process.terminate()
+        if self.slot:
+            self.slot.release()
+
+
+class _HLSJob:
+    """Encoder state for one title."""
+
+    def __init__(self, file_id: int, output_dir: Path, total_segments: int):
+        self.file_id = file_id
+        self.output_dir = output_dir
+        self.total_segments = total_segments
+        self.encoder: Optional[HLSEncoder] = None
+        self.playhead = 0
+        self.last_access = time.monotonic()
+        # Renditions requested recently: name -> (rendition, last request)
+        self.active: Dict[str, Tuple[Dict, float]] = {}
+        # Requests waiting (without the lock) for a slot to start an encoder
+        self.starting = 0
+        self.lock = threading.Lock()
 
-class HLSService:
-    """Service for generating HLS adaptive streaming segments with GPU acceleration."""
 
-    def __init__(self):
+class HLSService:
+    """
+    Just-in-time adaptive HLS: playlists up front, segments transcoded on demand.
+
+    The media playlist is generated from the title's duration, so players
+    can start (and seek) immediately. A segment request is served as soon
+    as that segment has been written; if no encoder is producing it soon,
+    FFmpeg is (re)started at that segment's timestamp. Encoders run up to
+    ``prefetch_segments`` ahead of the furthest requested segment, are
+    paused beyond that, and are stopped after ``idle_timeout`` seconds
+    without requests. Finished segments are accounted in a
+    :class:`HLSSegmentStore`, which evicts whole titles to stay within its
+    budget and is swept from the monitor thread.
+
+    Renditions are encoded lazily: one FFmpeg per title decodes once and
+    splits/scales to every rendition the player has asked for recently.
+    A request for a rendition the encoder isn't producing restarts it at
+    that segment with the rendition added.
+    """
+
+    def __init__(
+        self,
+        output_dir: Optional[str] = None,
+        segment_seconds: Optional[float] = None,
+        prefetch_segments: Optional[int] = None,
+        idle_timeout: Optional[float] = None,
+        segment_timeout: Optional[float] = None,
+        scheduler: Optional[TranscodeScheduler] = None,
+    ):
         self.ffmpeg_path = settings.ffmpeg_path
-        self.hls_output_dir = Path("/tmp/mediavault_hls")
-        self.hls_output_dir.mkdir(exist_ok=True)
+        self.scheduler = scheduler
+        self.hls_output_dir = Path(output_dir or "/tmp/mediavault_hls")
+        self.hls_output_dir.mkdir(parents=True, exist_ok=True)
+        self.segment_seconds = segment_seconds or settings.hls_segment_seconds
+        self.prefetch_segments = prefetch_segments if prefetch_segments is not None else settings.hls_prefetch_segments
+        self.idle_timeout = idle_timeout if idle_timeout is not None else settings.hls_encoder_idle_seconds
+        self.segment_timeout = segment_timeout if segment_timeout is not None else settings.hls_segment_timeout_seconds
 
-        # Cache to track active generation sessions
-        self._generating = {}  # file_id -> thread
-        self._generation_lock = threading.Lock()
+        self.store = HLSSegmentStore(str(self.hls_output_dir))
+        self.sweep_interval = settings.hls_store_sweep_seconds
+
+        self._jobs: Dict[int, _HLSJob] = {}
+        self._jobs_lock = threading.Lock()
+        self._monitor: Optional[threading.Thread] = None
 
     def get_hls_directory(self, file_id: int) -> Path:
-        """Get HLS output directory for a specific file."""
-        output_dir = self.hls_output_dir / str(file_id)
-        output_dir.mkdir(exist_ok=True)
-        return output_dir
+        """HLS output directory for a file (created by the encoder, not here)."""
+        return self.hls_output_dir / str(file_id)
+
+    def master_playlist(self, renditions: List[Dict]) -> str:
+        """Master playlist listing each rendition's media playlist."""
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-INDEPENDENT-SEGMENTS"]
+        for rendition in renditions:
+            lines.append(
+                f"#EXT-X-STREAM-INF:BANDWIDTH={rendition_bandwidth(rendition)},"
+                f"RESOLUTION={rendition['width']}x{rendition['height']},"
+                f"CODECS=\"avc1.640028,mp4a.40.2\""
+            )
+            lines.append(f"{rendition['name']}/playlist.m3u8")
+        return "\n".join(lines) + "\n"
+
+    def media_playlist(self, duration: float) -> str:
+        """VOD media playlist for a rendition (same for every rendition)."""
+        return build_media_playlist(duration, self.segment_seconds)
 
-    def is_hls_ready(self, file_id: int) -> bool:
+    def segment_count(self, duration: float) -> int:
+        return segment_count(duration, self.segment_seconds)
+
+    def get_segment(
+        self,
+        file_id: int,
+        index: int,
+        input_path: str,
+        duration: float,
+        rendition: Optional[Dict] = None,
+        use_gpu: bool = True,
+        has_audio: bool = True,
+    ) -> Optional[Path]:
         """
-        Check if HLS segments have been generated for this file.
+        Return segment ``index`` of a rendition, transcoding it if needed.
+
+        Blocks until the segment exists, the encoder fails, or
+        ``segment_timeout`` passes. Segments already generated are found in
+        the store's manifest without touching the filesystem. Starting an
+        encoder takes an interactive scheduler slot; ``use_gpu`` is a
+        preference, the slot decides.
 
         Returns:
-            True if master playlist exists
+            Path to the complete segment, or None on failure/timeout
+
+        Raises:
+            TranscodeQueueTimeout: if no encoder slot freed up in time
         """
-        master_playlist = self.get_hls_directory(file_id) / "master.m3u8"
-        return master_playlist.exists()
+        rendition = rendition or DEFAULT_RENDITION
+        job = self._job(file_id, duration)
+        segment = f"{rendition['name']}/{SEGMENT_NAME.format(index)}"
+
+        with job.lock:
+            now = time.monotonic()
+            job.last_access = now
+            job.active[rendition["name"]] = (rendition, now)
+            job.playhead = max(index, job.playhead) if self._near_playhead(job, index) else index
+            segment_path = self.store.lookup(file_id, segment)
+            if segment_path is None:
+                # Refreshes the running encoder, recording what it has finished
+                self._ensure_encoder(job, index, input_path, rendition, use_gpu, has_audio)
+                segment_path = self.store.lookup(file_id, segment)
+        self._ensure_monitor()
+        if segment_path is not None:
+            return segment_path
 
-    def is_generating(self, file_id: int) -> bool:
-        """Check if HLS generation is currently in progress."""
-        with self._generation_lock:
-            return file_id in self._generating
+        deadline = time.monotonic() + self.segment_timeout
+        while time.monotonic() < deadline:
+            with job.lock:
+                encoder = job.encoder
+                if encoder is not None:
+                    encoder.refresh()
+            segment_path = self.store.lookup(file_id, segment)
+            if segment_path is not None:
+                return segment_path
+            if encoder is None or not encoder.running:
+                # Encoder exited: the segment is there now or never will be
+                if encoder is not None:
+                    with job.lock:
+                        encoder.refresh()
+                    segment_path = self.store.lookup(file_id, segment)
+                    if segment_path is not None:
+                        return segment_path
+                if encoder is not None and encoder.returncode not in (0, None):
+                    logger.error(f"HLS encoder for file {file_id} failed (code {encoder.returncode}): "
+                                 f"{encoder.process.budget_exceeded or encoder.process.error_summary()}")
+                return None
+            time.sleep(0.05)
+
+        logger.warning(f"Timed out waiting for HLS segment {index} of file {file_id}")
+        return None
 
-    def generate_hls_adaptive(
+    def prewarm(
         self,
-        input_path: str,
         file_id: int,
-        qualities: Optional[List[Dict]] = None,
-        use_gpu: bool = True
-    ) -> bool:
+        input_path: str,
+        duration: float,
+        renditions: List[Dict],
+        segments: int,
+        use_gpu: bool = True,
+        has_audio: bool = True,
+        should_stop: Optional[Callable[[], bool]] = None,
+        on_start: Optional[Callable[[HLSEncoder], None]] = None,
+    ) -> Optional[int]:
         """
-        Generate HLS adaptive streaming with multiple quality levels using GPU.
+        Encode the first ``segments`` segments of ``renditions`` before anyone asks.
 
-        Creates master playlist and quality-specific playlists with segments.
-
-        Args:
-            input_path: Source video file path
-            file_id: Media file ID (used for output directory)
-            qualities: List of quality settings (default: 480p, 720p, 1080p)
-            use_gpu: Use GPU acceleration (NVENC)
+        Runs only if a prewarm scheduler slot is free right now, and stops
+        early once ``should_stop()`` is true or a viewer starts playing the
+        title (its own encoder takes over from there). ``on_start`` gets
+        the encoder once it is running.
 
         Returns:
-            True if generation successful
+            How many segments from the start are now stored, or None if no
+            slot was free
         """
-        # Default quality levels for adaptive streaming
-        if qualities is None:
-            qualities = [
-                {"name": "480p", "width": 854, "height": 480, "bitrate": "2000k"},
-                {"name": "720p", "width": 1280, "height": 720, "bitrate": "4000k"},
-                {"name": "1080p", "width": 1920, "height": 1080, "bitrate": "8000k"},
-            ]
+        segments = min(segments, self.segment_count(duration))
+        names = [r["name"] for r in renditions]
+        ready = 0
+        while ready < segments and all(
+            self.store.lookup(file_id, f"{name}/{SEGMENT_NAME.format(ready)}") for name in names
+        ):
+            ready += 1
+        if ready >= segments:
+            return ready
+
+        scheduler = self.scheduler or get_transcode_scheduler()
+        slot = scheduler.try_acquire("prewarm", prefer_gpu=use_gpu, label=f"prewarm hls {file_id}")
+        if slot is None:
+            return None
 
         output_dir = self.get_hls_directory(file_id)
-
-        # Mark as generating
-        with self._generation_lock:
-            if file_id in self._generating:
-                logger.warning(f"HLS generation already in progress for file {file_id}")
-                return False
-            self._generating[file_id] = threading.current_thread()
-
+        for name in names:
+            if not (output_dir / name).is_dir():
+                self.store.forget(file_id, name)
+                (output_dir / name).mkdir(parents=True)
+        cmd = self._encoder_command(input_path, output_dir, renditions, ready, slot.gpu, has_audio)
+        encoder = HLSEncoder(cmd, output_dir, names, ready, segments,
+                             on_segment=self._segment_recorder(file_id), slot=slot)
         try:
-            # Build complex FFmpeg command for multi-quality HLS
-            cmd = self._build_hls_command(
-                input_path=input_path,
-                output_dir=output_dir,
-                qualities=qualities,
-                use_gpu=use_gpu
-            )
-
-            logger.info(f"Starting HLS generation for file {file_id} ({len(qualities)} qualities)")
-            logger.debug(f"FFmpeg command: {' '.join(cmd)}")
-
-            # Run FFmpeg
-            start_time = time.time()
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                timeout=600  # 10 minute timeout
-            )
-
-            elapsed = time.time() - start_time
-
-            if result.returncode == 0:
-                logger.success(f"HLS generation complete for file {file_id} in {elapsed:.1f}s")
-                return True
-            else:
-                error_msg = result.stderr.decode('utf-8', errors='ignore')
-                logger.error(f"HLS generation failed for file {file_id}: {error_msg}")
-                return False
-
-        except subprocess.TimeoutExpired:
-            logger.error(f"HLS generation timeout for file {file_id}")
-            return False
-        except Exception as e:
-            logger.error(f"HLS generation error for file {file_id}: {e}")
-            return False
+            encoder.start()
+        except OSError:
+            slot.release()
+            raise
+        try:
+            if on_start:
+                on_start(encoder)
+            while encoder.refresh() < segments and encoder.running:
+                with self._jobs_lock:
+                    watched = file_id in self._jobs
+                if watched or (should_stop is not None and should_stop()):
+                    break
+                time.sleep(0.25)
+            return encoder.refresh()
         finally:
-            # Remove from generating set
-            with self._generation_lock:
-                self._generating.pop(file_id, None)
-
-    def _build_hls_command(
-        self,
-        input_path: str,
-        output_dir: Path,
-        qualities: List[Dict],
-        use_gpu: bool
-    ) -> List[str]:
+            encoder.stop()
+
+    def progress(self, file_id: int) -> Dict[str, float]:
+        """FFmpeg progress (speed, fps, position) of a title's running encoder; empty if none."""
+        with self._jobs_lock:
+            job = self._jobs.get(file_id)
+        encoder = job.encoder if job else None
+        return dict(encoder.process.progress) if encoder else {}
+
+    def stop_all(self) -> None:
+        """Stop every running encoder."""
+        with self._jobs_lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            with job.lock:
+                if job.encoder:
+                    job.encoder.stop()
+                    job.encoder = None
+
+    def _job(self, file_id: int, duration: float) -> _HLSJob:
+        with self._jobs_lock:
+            job = self._jobs.get(file_id)
+            if job is None:
+                job = _HLSJob(file_id, self.get_hls_directory(file_id), self.segment_count(duration))
+                self._jobs[file_id] = job
+            return job
+
+    def _near_playhead(self, job: _HLSJob, index: int) -> bool:
+        return job.playhead <= index <= job.playhead + self.prefetch_segments + 1
+
+    def _ensure_encoder(self, job: _HLSJob, index: int, input_path: str, rendition: Dict,
+                        use_gpu: bool, has_audio: bool) -> None:
         """
-        Build FFmpeg command for multi-quality HLS generation.
+        Make sure an encoder will reach ``index`` shortly; restart it there otherwise.
 
-        Uses GPU acceleration for multiple quality encodes simultaneously.
+        Called with ``job.lock`` held. If no slot is free, the lock is let go
+        while queueing for one, so the monitor keeps throttling and stopping
+        encoders (freeing slots) meanwhile; an encoder another request
+        started in that time is used if it covers ``index``.
+        """
+        if self._encoder_reaches(job, index, rendition):
+            return
+        encoder = job.encoder
+        if encoder is not None:
+            if encoder.running:
+                producing = rendition["name"] in encoder.renditions
+                reason = "seek" if producing else f"adding {rendition['name']}"
+                logger.info(f"HLS {reason} at segment {index}, restarting encoder")
+            encoder.stop()  # also frees the slot of one that already exited
+            job.encoder = None
+
+        scheduler = self.scheduler or get_transcode_scheduler()
+        label = f"hls {job.file_id}"
+        slot = scheduler.try_acquire("interactive", prefer_gpu=use_gpu, label=label)
+        if slot is None:
+            job.starting += 1
+            job.lock.release()
+            try:
+                slot = scheduler.acquire("interactive", prefer_gpu=use_gpu, label=label,
+                                         timeout=settings.transcode_queue_timeout_seconds)
+            finally:
+                job.lock.acquire()
+                job.starting -= 1
+            if self._encoder_reaches(job, index, rendition):
+                slot.release()
+                return
+            if job.encoder is not None:
+                job.encoder.stop()
+                job.encoder = None
+
+        # Encode every rendition requested recently, sharing one decode
+        cutoff = time.monotonic() - self.idle_timeout
+        renditions = [r for r, last in job.active.values() if last >= cutoff or r is rendition]
+        renditions.sort(key=lambda r: -r["height"])
+        try:
+            for r in renditions:
+                rendition_dir = job.output_dir / r["name"]
+                if not rendition_dir.is_dir():
+                    # Removed behind our back: whatever the manifest lists is gone
+                    self.store.forget(job.file_id, r["name"])
+                    rendition_dir.mkdir(parents=True)
+
+            cmd = self._encoder_command(input_path, job.output_dir, renditions, index, slot.gpu, has_audio)
+            job.encoder = HLSEncoder(cmd, job.output_dir, [r["name"] for r in renditions], index,
+                                     job.total_segments, on_segment=self._segment_recorder(job.file_id), slot=slot)
+            job.encoder.start()
+        except Exception:
+            job.encoder = None
+            slot.release()
+            raise
+
+    @staticmethod
+    def _encoder_reaches(job: _HLSJob, index: int, rendition: Dict) -> bool:
+        """True (resuming it) if the running encoder produces ``rendition`` and will reach ``index`` shortly."""
+        encoder = job.encoder
+        if encoder is None:
+            return False
+        encoder.refresh()
+        # Already producing it, or only a short way ahead: keep going
+        if (encoder.running and rendition["name"] in encoder.renditions
+                and encoder.start_segment <= index <= encoder.next_segment + RESTART_GAP_SEGMENTS):
+            encoder.resume()
+            return True
+        return False
+
+    def _segment_recorder(self, file_id: int) -> Callable[[str, int], None]:
+        def record(segment: str, size: int) -> None:
+            self.store.record(file_id, segment, size, keep=self._active_titles())
+        return record
+
+    def _active_titles(self) -> List[int]:
+        with self._jobs_lock:
+            return list(self._jobs)
+
+    def _encoder_command(self, input_path: str, output_dir: Path, renditions: List[Dict],
+                         start_segment: int, use_gpu: bool, has_audio: bool = True) -> List[str]:
+        """
+        FFmpeg command producing renditions' segments from ``start_segment``.
+
+        The source is decoded once and split into one scaler + encoder per
+        rendition (``scale_cuda``/NVENC on the GPU, ``scale``/libx264 on the
+        CPU). Seeks on the input to the segment's timestamp, forces a
+        keyframe at every segment boundary so cuts match the pre-written
+        playlist, and offsets output timestamps so restarted segments line
+        up with earlier ones.
         """
-        cmd = [self.ffmpeg_path, "-y"]
+        start_time = start_segment * self.segment_seconds
+        count = len(renditions)
 
-        # Input with hardware acceleration
+        cmd = [self.ffmpeg_path, "-hide_banner", "-nostdin", "-y", "-loglevel", "error"]
         if use_gpu:
-            cmd.extend([
-                "-hwaccel", "cuda",
-                "-hwaccel_output_format", "cuda"
-            ])
-
+            cmd.extend(["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"])
+        if start_time:
+            cmd.extend(["-ss", f"{start_time:.3f}"])
         cmd.extend(["-i", input_path])
 
-        # Map streams for each quality
-        for idx, quality in enumerate(qualities):
-            # Video mapping
-            cmd.extend(["-map", "0:v:0"])
-            # Audio mapping
-            cmd.extend(["-map", "0:a:0"])
+        scaler = "scale_cuda" if use_gpu else "scale"
+        split = f"[0:v:0]split={count}" + "".join(f"[s{i}]" for i in range(count))
+        scales = [f"[s{i}]{scaler}={r['width']}:{r['height']}[v{i}]" for i, r in enumerate(renditions)]
+        cmd.extend(["-filter_complex", ";".join([split] + scales)])
 
-        # Encode each quality
-        for idx, quality in enumerate(qualities):
-            # Video encoding
+        for i in range(count):
+            cmd.extend(["-map", f"[v{i}]"])
+            if has_audio:
+                cmd.extend(["-map", "0:a:0"])
+
+        for i, rendition in enumerate(renditions):
+            bitrate = rendition["bitrate"]
             if use_gpu:
-                cmd.extend([
-                    f"-c:v:{idx}", "h264_nvenc",
-                    f"-preset:v:{idx}", "p4",  # NVENC preset (p1=fastest, p7=best)
-                    f"-b:v:{idx}", quality["bitrate"],
-                    f"-maxrate:v:{idx}", quality["bitrate"],
-                    f"-bufsize:v:{idx}", str(int(quality["bitrate"].replace("k", "")) * 2) + "k",
-                    f"-vf:v:{idx}", f"scale_cuda={quality['width']}:{quality['height']}",
-                    f"-g:v:{idx}", "48",  # Keyframe interval (2 seconds @ 24fps)
-                ])
+                cmd.extend([f"-c:v:{i}", "h264_nvenc", f"-preset:v:{i}", "p4"])
             else:
-                # CPU fallback
-                cmd.extend([
-                    f"-c:v:{idx}", "libx264",
-                    f"-preset:v:{idx}", "medium",
-                    f"-b:v:{idx}", quality["bitrate"],
-                    f"-maxrate:v:{idx}", quality["bitrate"],
-                    f"-bufsize:v:{idx}", str(int(quality["bitrate"].replace("k", "")) * 2) + "k",
-                    f"-vf:v:{idx}", f"scale={quality['width']}:{quality['height']}",
-                    f"-g:v:{idx}", "48",
-                ])
-
-            # Audio encoding (AAC for all qualities)
+                cmd.extend([f"-c:v:{i}", "libx264", f"-preset:v:{i}", "veryfast", f"-pix_fmt:v:{i}", "yuv420p"])
             cmd.extend([
-                f"-c:a:{idx}", "aac",
-                f"-b:a:{idx}", "128k",
-                f"-ar:a:{idx}", "48000",
-                f"-ac:a:{idx}", "2",  # Stereo
+                f"-b:v:{i}", bitrate,
+                f"-maxrate:v:{i}", bitrate,
+                f"-bufsize:v:{i}", f"{int(bitrate.rstrip('k')) * 2}k",
             ])
+        if use_gpu:
+            cmd.extend(["-forced-idr", "1"])
+
+        cmd.extend(["-force_key_frames", f"expr:gte(t,n_forced*{self.segment_seconds})"])
+        if has_audio:
+            cmd.extend(["-c:a", "aac", "-b:a", "128k", "-ar", "48000", "-ac", "2"])
 
-        # HLS settings
+        var_stream_map = " ".join(
+            f"v:{i},a:{i},name:{r['name']}" if has_audio else f"v:{i},name:{r['name']}"
+            for i, r in enumerate(renditions)
+        )
         cmd.extend([
+            "-output_ts_offset", f"{start_time:.3f}",
             "-f", "hls",
-            "-hls_time", "4",  # 4-second segments
-            "-hls_list_size", "0",  # Keep all segments
+            "-hls_time", str(self.segment_seconds),
+            "-hls_list_size", "0",
+            "-start_number", str(start_segment),
             "-hls_segment_type", "mpegts",
-            "-hls_flags", "independent_segments+program_date_time",
+            "-hls_flags", "temp_file+independent_segments",
+            "-var_stream_map", var_stream_map,
+            "-hls_segment_filename", str(output_dir / "%v" / "segment_%05d.ts"),
+            str(output_dir / "%v" / "encoder.m3u8"),
         ])
-
-        # Variant streams for adaptive streaming
-        var_stream_map = []
-        for idx, quality in enumerate(qualities):
-            quality_dir = output_dir / quality["name"]
-            quality_dir.mkdir(exist_ok=True)
-
-            var_stream_map.append(f"v:{idx},a:{idx},name:{quality['name']}")
-
-            cmd.extend([
-                f"-hls_segment_filename", str(quality_dir / "segment_%03d.ts"),
-            ])
-
-        # Master playlist
-        cmd.extend([
-            "-var_stream_map", " ".join(var_stream_map),
-            "-master_pl_name", "master.m3u8",
-            str(output_dir / "%v/playlist.m3u8")
-        ])
-
         return cmd
 
-    def cleanup_old_segments(self, max_age_hours: int = 1, max_total_gb: float = 10.0):
-        """
-        Clean up old HLS segments to save disk space.
-
-        Args:
-            max_age_hours: Remove segments older than this (default: 1 hour)
-            max_total_gb: Maximum total HLS storage (default: 10GB)
-        """
-        try:
-            current_time = time.time()
-            max_age_seconds = max_age_hours * 3600
-            max_bytes = max_total_gb * 1024 * 1024 * 1024
-
-            # Collect all file info
-            files_info = []
-            total_size = 0
-
-            for file_dir in self.hls_output_dir.iterdir():
-                if not file_dir.is_dir():
+    def _ensure_monitor(self) -> None:
+        with self._jobs_lock:
+            if self._monitor is None or not self._monitor.is_alive():
+                self._monitor = threading.Thread(target=self._monitor_loop, name="hls-monitor", daemon=True)
+                self._monitor.start()
+
+    def _monitor_loop(self) -> None:
+        last_sweep = time.monotonic()
+        while True:
+            time.sleep(0.5)
+            try:
+                self._check_encoders()
+                if time.monotonic() - last_sweep >= self.sweep_interval:
+                    last_sweep = time.monotonic()
+                    self.store.sweep(keep=self._active_titles())
+            except Exception as e:
+                logger.error(f"HLS monitor error: {e}")
+
+    def _check_encoders(self) -> None:
+        """Throttle encoders to the prefetch window and stop idle ones."""
+        now = time.monotonic()
+        with self._jobs_lock:
+            items = list(self._jobs.items())
+
+        for key, job in items:
+            with job.lock:
+                encoder = job.encoder
+                if encoder is None:
+                    if now - job.last_access > self.idle_timeout and not job.starting:
+                        with self._jobs_lock:
+                            self._jobs.pop(key, None)
                     continue
 
-                for filepath in file_dir.rglob("*"):
-                    if filepath.is_file():
-                        stat = filepath.stat()
-                        files_info.append({
-                            "path": filepath,
-                            "size": stat.st_size,
-                            "mtime": stat.st_mtime,
-                            "age": current_time - stat.st_mtime
-                        })
-                        total_size += stat.st_size
-
-            # Sort by modification time (oldest first)
-            files_info.sort(key=lambda x: x["mtime"])
-
-            deleted_count = 0
-            freed_bytes = 0
-
-            # Remove old files
-            for file_info in files_info:
-                should_delete = False
-
-                # Delete if too old
-                if file_info["age"] > max_age_seconds:
-                    should_delete = True
-
-                # Delete oldest files if over size limit
-                if total_size > max_bytes:
-                    should_delete = True
-                    total_size -= file_info["size"]
-
-                if should_delete:
-                    try:
-                        file_info["path"].unlink()
-                        deleted_count += 1
-                        freed_bytes += file_info["size"]
-                    except Exception as e:
-                        logger.warning(f"Failed to delete {file_info['path']}: {e}")
-
-            # Remove empty directories
-            for file_dir in self.hls_output_dir.iterdir():
-                if file_dir.is_dir():
-                    try:
-                        # Remove empty quality subdirectories
-                        for subdir in file_dir.iterdir():
-                            if subdir.is_dir() and not any(subdir.iterdir()):
-                                subdir.rmdir()
-
-                        # Remove empty file directory
-                        if not any(file_dir.iterdir()):
-                            file_dir.rmdir()
-                    except Exception:
-                        pass
-
-            if deleted_count > 0:
-                logger.info(f"HLS cleanup: deleted {deleted_count} files, freed {freed_bytes / 1024 / 1024:.1f}MB")
-
-        except Exception as e:
-            logger.error(f"HLS cleanup error: {e}")
-
-    def get_segment_file(self, file_id: int, quality: str, segment: str) -> Optional[Path]:
-        """
-        Get path to HLS segment file.
-
-        Args:
-            file_id: Media file ID
-            quality: Quality level (480p, 720p, 1080p)
-            segment: Segment filename
-
-        Returns:
-            Path to segment file or None if not found
-        """
-        segment_path = self.get_hls_directory(file_id) / quality / segment
-
-        if segment_path.exists() and segment_path.is_file():
-            return segment_path
-
-        return None
-
-    def get_playlist_file(self, file_id: int, quality: Optional[str] = None) -> Optional[Path]:
-        """
-        Get path to HLS playlist file.
-
-        Args:
-            file_id: Media file ID
-            quality: Quality level (or None for master playlist)
-
-        Returns:
-            Path to playlist file or None if not found
-        """
-        if quality is None:
-            # Master playlist
-            playlist_path = self.get_hls_directory(file_id) / "master.m3u8"
-        else:
-            # Quality-specific playlist
-            playlist_path = self.get_hls_directory(file_id) / quality / "playlist.m3u8"
-
-        if playlist_path.exists() and playlist_path.is_file():
-            return playlist_path
-
-        return None
+                encoder.refresh()
+                if not encoder.running:
+                    encoder.stop()  # frees its slot
+                    job.encoder = None
+                elif now - job.last_access > self.idle_timeout:
+                    logger.info(f"Stopping idle HLS encoder for file {key}")
+                    encoder.stop()
+                    job.encoder = None
+                elif encoder.next_segment > job.playhead + self.prefetch_segments:
+                    encoder.pause()
+                else:
+                    encoder.resume()
+
+
+@lru_cache()
+def get_hls_service() -> HLSService:
+    """Process-wide HLS service (shared by the routes and the prewarm worker)."""
+    return HLSService()
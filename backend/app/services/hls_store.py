@@ -0,0 +1,216 @@
+"""Indexed on-disk store for HLS segments, evicted a whole title at a time."""
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+from loguru import logger
+
+from app.config import get_settings
+
+INDEX_FILE = "index.json"
+
+# Persist access times at most this often (evictions save at once)
+INDEX_SAVE_INTERVAL = 30.0
+
+# Evicted title directories are renamed to this prefix, then deleted in the background
+TRASH_PREFIX = ".evicted-"
+
+
+class HLSSegmentStore:
+    """
+    Size-bounded store of HLS segments under ``root/<file_id>/<rendition>/``.
+
+    Every segment written is recorded in an in-memory index (the manifest
+    :meth:`lookup` serves from) of per-title size, segment sizes and last
+    access, persisted as ``index.json`` (and
+    rebuilt from disk if missing). The byte budget is enforced as segments
+    are recorded, evicting whole titles least recently used first, so a
+    stream never loses segments out of its middle. :meth:`sweep` also drops
+    titles unused for ``max_age`` seconds; it is meant to run on a timer,
+    not while handling requests. An evicted title's directory is renamed
+    out of the way under the lock and deleted on a background thread, so
+    removing thousands of segments never holds up :meth:`lookup`.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        max_bytes: Optional[int] = None,
+        max_age: Optional[float] = None,
+    ):
+        settings = get_settings()
+        self.root = Path(root)
+        self.max_bytes = max_bytes if max_bytes is not None else int(settings.hls_store_max_gb * 1024 ** 3)
+        self.max_age = max_age if max_age is not None else settings.hls_store_max_age_hours * 3600
+
+        self._lock = threading.Lock()
+        self._titles: Dict[str, Dict[str, Any]] = {}
+        self._bytes = 0
+        self._counters = {"recorded": 0, "evictions": 0, "evicted_bytes": 0}
+        self._last_save = 0.0
+        self._load()
+        # Deletions interrupted by a restart
+        if self.root.is_dir():
+            for path in self.root.glob(f"{TRASH_PREFIX}*"):
+                self._delete_in_background(path)
+
+    def lookup(self, file_id: int, segment: str) -> Optional[Path]:
+        """
+        Path of a recorded segment (``<rendition>/<name>``), or None.
+
+        Served straight from the in-memory manifest, without touching the
+        filesystem; marks the title as watched (persisted with the next
+        write or sweep).
+        """
+        key = str(file_id)
+        with self._lock:
+            title = self._titles.get(key)
+            if title is None or segment not in title["segments"]:
+                return None
+            title["last_access"] = time.time()
+        return self.root / key / segment
+
+    def forget(self, file_id: int, rendition: Optional[str] = None) -> None:
+        """Drop manifest entries for a title (or one rendition) whose files are gone."""
+        key = str(file_id)
+        with self._lock:
+            title = self._titles.get(key)
+            if title is None:
+                return
+            prefix = f"{rendition}/" if rendition else ""
+            gone = [segment for segment in title["segments"] if segment.startswith(prefix)]
+            for segment in gone:
+                size = title["segments"].pop(segment)
+                title["size"] -= size
+                self._bytes -= size
+            if not title["segments"]:
+                del self._titles[key]
+
+    def record(self, file_id: int, segment: str, size: int, keep: Iterable[int] = ()) -> None:
+        """
+        Account for a finished segment (``<rendition>/<name>``) and enforce the budget.
+
+        Titles in ``keep`` (and this one) are never evicted to make room.
+        """
+        key = str(file_id)
+        with self._lock:
+            title = self._titles.setdefault(key, {"size": 0, "last_access": time.time(), "segments": {}})
+            delta = size - title["segments"].get(segment, 0)
+            title["segments"][segment] = size
+            title["size"] += delta
+            self._bytes += delta
+            self._counters["recorded"] += 1
+            if self._bytes > self.max_bytes:
+                self._evict_locked({key, *map(str, keep)})
+            self._save_locked(force=False)
+
+    def sweep(self, keep: Iterable[int] = ()) -> None:
+        """Drop titles unused for ``max_age`` and enforce the byte budget."""
+        keep = set(map(str, keep))
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            expired = [key for key, title in self._titles.items()
+                       if title["last_access"] < cutoff and key not in keep]
+            for key in expired:
+                self._remove_locked(key)
+            self._evict_locked(keep)
+            self._save_locked(force=False)
+
+    def title_bytes(self, file_id: int) -> int:
+        """Bytes stored for a title (0 if none)."""
+        with self._lock:
+            title = self._titles.get(str(file_id))
+            return title["size"] if title else 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Usage and eviction counters."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["titles"] = len(self._titles)
+            stats["bytes"] = self._bytes
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+    def _evict_locked(self, keep: set) -> None:
+        if self._bytes <= self.max_bytes:
+            return
+        for key in sorted(self._titles, key=lambda k: self._titles[k]["last_access"]):
+            if self._bytes <= self.max_bytes:
+                break
+            if key not in keep:
+                self._remove_locked(key)
+
+    def _remove_locked(self, key: str) -> None:
+        title = self._titles.pop(key)
+        trash = self.root / f"{TRASH_PREFIX}{uuid.uuid4().hex}"
+        try:
+            os.rename(self.root / key, trash)
+        except FileNotFoundError:
+            trash = None
+        except OSError as e:
+            logger.warning(f"HLS store: could not move evicted file {key} aside: {e}")
+            trash = self.root / key
+        if trash is not None:
+            self._delete_in_background(trash)
+        self._bytes -= title["size"]
+        self._counters["evictions"] += 1
+        self._counters["evicted_bytes"] += title["size"]
+        self._last_save = 0.0  # persist the eviction on the next save
+        logger.info(f"HLS store: evicted file {key} ({title['size'] / 1024 ** 2:.1f} MB)")
+
+    @staticmethod
+    def _delete_in_background(path: Path) -> None:
+        threading.Thread(target=shutil.rmtree, args=(path,), kwargs={"ignore_errors": True},
+                         daemon=True, name="hls-store-delete").start()
+
+    def _load(self) -> None:
+        try:
+            with open(self.root / INDEX_FILE) as f:
+                titles = json.load(f)
+        except FileNotFoundError:
+            titles = self._scan()
+        except (OSError, ValueError) as e:
+            logger.warning(f"HLS store index unreadable, rebuilding: {e}")
+            titles = self._scan()
+
+        # Drop titles whose directories are gone
+        self._titles = {key: title for key, title in titles.items() if (self.root / key).is_dir()}
+        self._bytes = sum(title["size"] for title in self._titles.values())
+
+    def _scan(self) -> Dict[str, Dict[str, Any]]:
+        titles = {}
+        if self.root.is_dir():
+            for title_dir in self.root.iterdir():
+                if not title_dir.is_dir() or title_dir.name.startswith(TRASH_PREFIX):
+                    continue
+                segments = {}
+                last_access = title_dir.stat().st_mtime
+                for path in title_dir.glob("*/segment_*.ts"):
+                    stat = path.stat()
+                    segments[f"{path.parent.name}/{path.name}"] = stat.st_size
+                    last_access = max(last_access, stat.st_mtime)
+                titles[title_dir.name] = {
+                    "size": sum(segments.values()),
+                    "last_access": last_access,
+                    "segments": segments,
+                }
+        return titles
+
+    def _save_locked(self, force: bool) -> None:
+        now = time.monotonic()
+        if not force and now - self._last_save < INDEX_SAVE_INTERVAL:
+            return
+        self._last_save = now
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp = self.root / f"{INDEX_FILE}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(self._titles, f)
+            os.replace(tmp, self.root / INDEX_FILE)
+        except OSError as e:
+            logger.warning(f"Failed to save HLS store index: {e}")
@@ -0,0 +1,320 @@
+"""Pre-generated preview artifacts: poster frames, seek sprite sheets, WebVTT thumbnail tracks, preview clips."""
+import hashlib
+import math
+import queue
+import subprocess
+import threading
+import uuid
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from loguru import logger
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.services.ffmpeg_process import FFmpegProcess
+from app.services.ffmpeg_service import FFmpegService
+from app.services.transcode_cache import get_transcode_cache, media_fingerprint, transcode_cache_key
+from app.services.transcode_scheduler import TranscodeScheduler, get_transcode_scheduler
+from app.services.transcode_sessions import get_session_manager
+from app.utils.path_utils import resolve_media_path
+
+POSTER = "poster.jpg"
+SPRITE = "sprite.jpg"
+THUMBNAILS = "thumbnails.vtt"
+ARTIFACTS = (POSTER, SPRITE, THUMBNAILS)
+
+# Default preview clip (the one pre-generated and served from the cache)
+PREVIEW_START = "00:00:10"
+PREVIEW_SECONDS = 30
+
+POSTER_WIDTH = 480
+POSTER_POSITION = 0.1  # fraction of the duration, past intros and black frames
+
+# Sprite sheet: up to SPRITE_MAX_TILES thumbnails, at least SPRITE_MIN_INTERVAL seconds apart
+THUMB_WIDTH = 160
+SPRITE_COLUMNS = 10
+SPRITE_MAX_TILES = 100
+SPRITE_MIN_INTERVAL = 10
+
+# Wall-clock limit per artifact encode (seconds)
+ARTIFACT_BUDGET = 120
+
+
+def preview_profile(start_time: str, duration: int) -> str:
+    """Transcode cache profile of a preview clip."""
+    return f"preview-{start_time}-{duration}s"
+
+
+def sprite_layout(duration: Optional[float], width: Optional[int], height: Optional[int]) -> Optional[Dict[str, int]]:
+    """
+    Geometry of a title's sprite sheet.
+
+    Returns:
+        ``interval`` (seconds per thumbnail), ``count``, ``columns``,
+        ``rows`` and tile ``width``/``height``; None without a duration
+    """
+    if not duration or duration <= 0:
+        return None
+    interval = max(SPRITE_MIN_INTERVAL, math.ceil(duration / SPRITE_MAX_TILES))
+    count = max(1, min(SPRITE_MAX_TILES, math.ceil(duration / interval)))
+    columns = min(SPRITE_COLUMNS, count)
+    tile_height = round(THUMB_WIDTH * height / width / 2) * 2 if width and height else 90
+    return {
+        "interval": interval,
+        "count": count,
+        "columns": columns,
+        "rows": math.ceil(count / columns),
+        "width": THUMB_WIDTH,
+        "height": max(tile_height, 2),
+    }
+
+
+def _timestamp(seconds: float) -> str:
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{secs:06.3f}"
+
+
+def build_thumbnail_vtt(layout: Dict[str, int], duration: float, sprite_url: str = SPRITE) -> str:
+    """WebVTT track pointing each interval at its tile of the sprite sheet (``#xywh``)."""
+    lines = ["WEBVTT", ""]
+    interval, columns = layout["interval"], layout["columns"]
+    width, height = layout["width"], layout["height"]
+    for i in range(layout["count"]):
+        start = i * interval
+        end = min((i + 1) * interval, duration)
+        if end <= start:
+            break
+        x, y = (i % columns) * width, (i // columns) * height
+        lines.append(f"{_timestamp(start)} --> {_timestamp(end)}")
+        lines.append(f"{sprite_url}#xywh={x},{y},{width},{height}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+class PreviewService:
+    """
+    Cached preview artifacts, keyed by source content.
+
+    Posters, sprite sheets and their WebVTT tracks live under
+    ``root/<key[:2]>/<key>/``, where the key hashes the file's content
+    fingerprint (its scanned MD5), so renamed or moved files keep their
+    artifacts and duplicates share them. The default preview clip goes to
+    the transcode cache under the key ``/stream/{id}/preview`` looks up.
+    Each artifact is generated once (concurrent requests share the run)
+    inside a transcode scheduler slot and published with an atomic rename.
+
+    :meth:`enqueue` hands file IDs to a background worker that generates
+    everything for them at prewarm priority, so a scan's new files are
+    ready before anyone opens them.
+    """
+
+    def __init__(
+        self,
+        root: Optional[str] = None,
+        scheduler: Optional[TranscodeScheduler] = None,
+        session_factory: Optional[Callable[[], Session]] = None,
+    ):
+        settings = get_settings()
+        if session_factory is None:
+            from app.database import SessionLocal
+            session_factory = SessionLocal
+
+        self.root = Path(root or settings.preview_dir)
+        self.scheduler = scheduler
+        self.session_factory = session_factory
+        self.ffmpeg_path = settings.ffmpeg_path
+        self.ffmpeg_service = FFmpegService()
+
+        self._queue: "queue.Queue[int]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._counters = {"generated": 0, "failed": 0, "hits": 0, "queued": 0}
+
+    def artifact_dir(self, fingerprint: str) -> Path:
+        key = hashlib.sha256(fingerprint.encode()).hexdigest()
+        return self.root / key[:2] / key
+
+    def artifact(self, media_file: Any, input_path: Path, name: str, generate: bool = True,
+                 priority: str = "preview") -> Optional[Path]:
+        """
+        Path of artifact ``name`` (:data:`ARTIFACTS`) for a media file, generating it if needed.
+
+        Returns:
+            The file, or None if it can't be made (no duration for a
+            sprite, FFmpeg failed) or isn't there and ``generate`` is False
+
+        Raises:
+            TranscodeQueueTimeout: if no encoder slot freed up in time
+        """
+        directory = self.artifact_dir(media_fingerprint(media_file.md5_hash, str(input_path)))
+        path = directory / name
+        if path.exists():
+            with self._lock:
+                self._counters["hits"] += 1
+            return path
+        if not generate:
+            return None
+
+        def run() -> Optional[Path]:
+            if path.exists():
+                return path
+            if name == POSTER:
+                return self._render(directory, POSTER, self._poster_command(input_path, media_file.duration),
+                                    priority, media_file.filename)
+            layout = sprite_layout(float(media_file.duration or 0), media_file.width, media_file.height)
+            if layout is None:
+                return None
+            sprite = self._render(directory, SPRITE, self._sprite_command(input_path, layout),
+                                  priority, media_file.filename)
+            if sprite is None:
+                return None
+            self._write_atomic(directory / THUMBNAILS,
+                               build_thumbnail_vtt(layout, float(media_file.duration)).encode())
+            return path
+
+        return get_session_manager().single_flight(f"artifact:{path}", run)
+
+    def preview_clip(self, media_file: Any, input_path: Path, priority: str = "preview") -> Optional[Path]:
+        """
+        The default preview clip, from the transcode cache or encoded into it.
+
+        Returns:
+            The cached clip, or None if it failed or the cache is disabled
+
+        Raises:
+            TranscodeQueueTimeout: if no encoder slot freed up in time
+        """
+        if not get_settings().transcode_cache_enabled:
+            return None
+        cache = get_transcode_cache()
+        fingerprint = media_fingerprint(media_file.md5_hash, str(input_path))
+        key = transcode_cache_key(fingerprint, preview_profile(PREVIEW_START, PREVIEW_SECONDS))
+
+        def run() -> Optional[Path]:
+            if cache.contains(key):
+                return cache.path_for(key)
+            temp_path = cache.temp_path(key)
+            try:
+                with self._slot(priority, f"preview {media_file.filename}") as slot:
+                    ok = self.ffmpeg_service.create_preview_clip_gpu(
+                        input_path=str(input_path),
+                        output_path=str(temp_path),
+                        start_time=PREVIEW_START,
+                        duration=PREVIEW_SECONDS,
+                        use_gpu=slot.gpu
+                    )
+                if not ok:
+                    self._count("failed")
+                    return None
+                self._count("generated")
+                return cache.publish(key, temp_path)
+            finally:
+                cache.discard(temp_path)
+
+        # Shares the run with a concurrent /preview request for the same clip
+        return get_session_manager().single_flight(key, run)
+
+    def pregenerate(self, media_file: Any, input_path: Path, priority: str = "prewarm") -> None:
+        """Generate every artifact (and the preview clip) a file doesn't have yet."""
+        for name in (POSTER, SPRITE):
+            self.artifact(media_file, input_path, name, priority=priority)
+        self.preview_clip(media_file, input_path, priority=priority)
+
+    def enqueue(self, file_ids: Iterable[int]) -> None:
+        """Queue media files for background generation."""
+        for file_id in file_ids:
+            self._queue.put(file_id)
+            self._count("queued")
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._worker_loop, name="preview-worker", daemon=True)
+                self._worker.start()
+
+    def stats(self) -> Dict[str, Any]:
+        """Generation counters and the background backlog."""
+        with self._lock:
+            stats = dict(self._counters)
+        stats["pending"] = self._queue.qsize()
+        return stats
+
+    def _poster_command(self, input_path: Path, duration: Optional[float]) -> List[str]:
+        position = float(duration) * POSTER_POSITION if duration else 10.0
+        return [
+            self.ffmpeg_path, "-hide_banner", "-nostdin", "-loglevel", "error",
+            "-ss", f"{position:.3f}", "-i", str(input_path),
+            "-frames:v", "1", "-vf", f"scale={POSTER_WIDTH}:-2", "-q:v", "3", "-y",
+        ]
+
+    def _sprite_command(self, input_path: Path, layout: Dict[str, int]) -> List[str]:
+        # Decoding keyframes only makes a whole-title pass fast
+        return [
+            self.ffmpeg_path, "-hide_banner", "-nostdin", "-loglevel", "error",
+            "-skip_frame", "nokey", "-i", str(input_path), "-an", "-sn", "-dn",
+            "-vf", (f"fps=1/{layout['interval']},scale={layout['width']}:{layout['height']},"
+                    f"tile={layout['columns']}x{layout['rows']}"),
+            "-frames:v", "1", "-q:v", "5", "-y",
+        ]
+
+    def _render(self, directory: Path, name: str, cmd: List[str], priority: str, label: str) -> Optional[Path]:
+        """Run ``cmd`` with a temp output path appended and publish the result as ``name``."""
+        directory.mkdir(parents=True, exist_ok=True)
+        temp_path = directory / f".{uuid.uuid4().hex}.{name}"
+        try:
+            with self._slot(priority, f"{name} {label}"):
+                process = FFmpegProcess(cmd + [str(temp_path)], f"{name} {label}",
+                                        stdout=subprocess.DEVNULL, wall_budget=ARTIFACT_BUDGET)
+                returncode = process.run()
+            if returncode != 0 or not temp_path.exists():
+                logger.error(f"Failed to generate {name} for {label}: "
+                             f"{process.budget_exceeded or process.error_summary()}")
+                self._count("failed")
+                return None
+            temp_path.replace(directory / name)
+            self._count("generated")
+            return directory / name
+        finally:
+            temp_path.unlink(missing_ok=True)
+
+    def _write_atomic(self, path: Path, data: bytes) -> None:
+        temp_path = path.with_name(f".{uuid.uuid4().hex}.{path.name}")
+        temp_path.write_bytes(data)
+        temp_path.replace(path)
+
+    def _slot(self, priority: str, label: str):
+        scheduler = self.scheduler or get_transcode_scheduler()
+        # Background work waits as long as it takes; requests give up like any transcode
+        timeout = None if priority == "prewarm" else get_settings().transcode_queue_timeout_seconds
+        return scheduler.slot(priority, label=label, timeout=timeout)
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _worker_loop(self) -> None:
+        from app.models import MediaFile
+
+        while True:
+            file_id = self._queue.get()
+            try:
+                db = self.session_factory()
+                try:
+                    media_file = db.get(MediaFile, file_id)
+                    if media_file is None:
+                        continue
+                    db.expunge(media_file)
+                finally:
+                    db.close()
+                input_path = resolve_media_path(media_file.filepath)
+                if input_path and input_path.exists():
+                    self.pregenerate(media_file, input_path)
+            except Exception as e:
+                logger.error(f"Preview generation for file {file_id} failed: {e}")
+
+
+@lru_cache()
+def get_preview_service() -> PreviewService:
+    """Process-wide preview artifact service."""
+    return PreviewService()
@@ -0,0 +1,485 @@
+"""Background pre-warming of transcodes for titles likely to be played next."""
+import math
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.models import DuplicateGroup, MediaFile
+from app.services.comparison_service import (
+    COMPARE_SECONDS, COMPARE_START, ComparisonService, comparison_fps, group_members, output_keys,
+)
+from app.services.ffmpeg_process import FFmpegProcess
+from app.services.ffmpeg_service import FFmpegService
+from app.services.hls_service import HLSService, build_ladder, get_hls_service
+from app.services.stream_profiles import smart_output_key
+from app.services.transcode_cache import get_transcode_cache
+from app.services.transcode_scheduler import TranscodeScheduler, get_transcode_scheduler
+from app.utils.path_utils import resolve_media_path
+
+# Recommendations that copy the video stream: cheap enough to prewarm whole
+COPY_RECOMMENDATIONS = ("remux_only", "audio_transcode")
+
+# Seconds to wait before retrying an item that yielded or found no free slot
+BACKOFF_SECONDS = 5.0
+
+# Sliding window for the CPU budget (seconds)
+CPU_WINDOW = 3600.0
+
+# How often a running prewarm encode checks whether to yield
+POLL_SECONDS = 0.25
+
+# Audio bitrate assumed per HLS rendition when estimating sizes (kbps)
+AUDIO_KBPS = 128
+
+# ("next", file ID) | ("file", file ID) | ("group", duplicate group ID)
+Item = Tuple[str, int]
+
+
+class PrewarmService:
+    """
+    Transcodes titles ahead of playback at the scheduler's lowest priority.
+
+    Candidates, most likely first: the next episode after one that was
+    just played (:meth:`played`), then, every ``interval`` seconds,
+    recently added files and open duplicate groups. For a file:
+
+    - browser-compatible files are skipped (they stream directly);
+    - remuxes and titles up to ``full_max_minutes`` (episodes) get their
+      whole ``/smart`` output published to the transcode cache;
+    - longer transcodes get their first ``head_minutes`` of HLS segments,
+      since ``/smart`` only caches complete outputs.
+
+    Open duplicate groups get their comparison previews.
+
+    Work only starts when a slot is free and nobody is queued, and a
+    running encode is stopped as soon as interactive or preview work
+    queues up or prewarm encodes have used ``cpu_seconds_per_hour`` of
+    CPU time in the last hour; the item is retried later. Nothing is
+    prewarmed that would take prewarmed output past ``max_bytes`` or make
+    the cache or segment store evict anything.
+    """
+
+    def __init__(
+        self,
+        hls_service: Optional[HLSService] = None,
+        scheduler: Optional[TranscodeScheduler] = None,
+        session_factory: Optional[Callable[[], Session]] = None,
+        max_bytes: Optional[int] = None,
+        cpu_seconds_per_hour: Optional[float] = None,
+    ):
+        settings = get_settings()
+        if session_factory is None:
+            from app.database import SessionLocal
+            session_factory = SessionLocal
+
+        self.hls_service = hls_service
+        self.scheduler = scheduler
+        self.session_factory = session_factory
+        self.max_bytes = max_bytes if max_bytes is not None else int(settings.prewarm_max_gb * 1024 ** 3)
+        self.cpu_seconds_per_hour = (cpu_seconds_per_hour if cpu_seconds_per_hour is not None
+                                     else settings.prewarm_cpu_seconds_per_hour)
+        self.interval = settings.prewarm_interval_seconds
+        self.head_seconds = settings.prewarm_head_minutes * 60
+        self.full_max_seconds = settings.prewarm_full_max_minutes * 60
+        self.ffmpeg_service = FFmpegService()
+        self.comparison_service = ComparisonService(scheduler)
+
+        self._queue: Deque[Item] = deque()
+        self._pending: Set[Item] = set()
+        self._cond = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._cache_keys: Set[str] = set()
+        self._hls_titles: Set[int] = set()
+        self._cpu: Deque[Tuple[float, float]] = deque()
+        self._counters = {"queued": 0, "prewarmed": 0, "yielded": 0, "skipped": 0, "over_budget": 0,
+                          "failed": 0}
+
+    def start(self) -> None:
+        """Start the background worker (once)."""
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._worker_loop, name="prewarm-worker", daemon=True)
+                self._worker.start()
+
+    def played(self, file_id: int) -> None:
+        """A title started playing: prewarm the episode after it, ahead of everything else."""
+        self._push(("next", file_id), front=True)
+        self.start()
+
+    def enqueue_files(self, file_ids: List[int]) -> None:
+        """Queue media files for prewarming."""
+        for file_id in file_ids:
+            self._push(("file", file_id))
+        self.start()
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters, backlog and budget usage."""
+        with self._lock:
+            stats = dict(self._counters)
+        with self._cond:
+            stats["pending"] = len(self._queue)
+        stats["bytes"] = self.footprint()
+        stats["max_bytes"] = self.max_bytes
+        stats["cpu_seconds_last_hour"] = round(self._cpu_spent(), 1)
+        stats["cpu_seconds_per_hour"] = self.cpu_seconds_per_hour
+        return stats
+
+    def footprint(self) -> int:
+        """Bytes of prewarmed output still on disk."""
+        cache = get_transcode_cache()
+        with self._lock:
+            keys, titles = list(self._cache_keys), list(self._hls_titles)
+        total = 0
+        for key in keys:
+            if cache.contains(key):
+                try:
+                    total += cache.path_for(key).stat().st_size
+                except OSError:
+                    pass
+        store = self._hls().store
+        return total + sum(store.title_bytes(file_id) for file_id in titles)
+
+    def should_yield(self, process: Optional[FFmpegProcess] = None) -> bool:
+        """True if prewarming must stop now: requests are queued or the CPU budget is spent."""
+        if self._scheduler().has_waiters("preview"):
+            return True
+        if self.cpu_seconds_per_hour:
+            running = process.cpu_used if process is not None else 0.0
+            return self._cpu_spent() + running >= self.cpu_seconds_per_hour
+        return False
+
+    def prewarm_file(self, media_file: Any) -> bool:
+        """
+        Prewarm one media file.
+
+        Returns:
+            False if it should be retried later (no free slot, or it yielded),
+            True otherwise (done, not needed, over budget or failed)
+        """
+        if self.should_yield():
+            return False
+        input_path = resolve_media_path(media_file.filepath)
+        if not input_path or not input_path.exists():
+            return True
+        recommendation = self.ffmpeg_service.is_browser_compatible(
+            video_codec=media_file.video_codec,
+            audio_codec=media_file.audio_codec,
+            container_format=media_file.format
+        )["recommendation"]
+        if recommendation == "direct_stream":
+            self._count("skipped")
+            return True
+
+        duration = float(media_file.duration or 0)
+        if recommendation in COPY_RECOMMENDATIONS or (0 < duration <= self.full_max_seconds):
+            return self._prewarm_smart(media_file, input_path, recommendation, duration)
+        if duration and get_settings().hls_segment_format == "mpegts":
+            return self._prewarm_hls_head(media_file, input_path, duration)
+        self._count("skipped")
+        return True
+
+    def prewarm_group(self, group_id: int) -> bool:
+        """Prepare a duplicate group's comparison previews; same return as :meth:`prewarm_file`."""
+        if not get_settings().transcode_cache_enabled:
+            return True
+        if self.should_yield():
+            return False
+        db = self.session_factory()
+        try:
+            members, files = group_members(db, group_id)
+            fps = comparison_fps(files)
+            # One preview per member, each at most its source bitrate
+            estimate = sum(self._estimate(f.bitrate, COMPARE_SECONDS) for f in files)
+        finally:
+            db.close()
+        if len(members) < 2:
+            return True
+
+        keys = output_keys(members, COMPARE_START, COMPARE_SECONDS, fps)
+        cache = get_transcode_cache()
+        if all(cache.contains(key) for key in keys.values()):
+            return True
+        cache_stats = cache.stats()
+        if not self._fits(cache_stats["bytes"], cache_stats["max_bytes"], estimate):
+            self._count("over_budget")
+            return True
+        label = f"prewarm comparison {group_id}"
+        slot = self._scheduler().try_acquire("prewarm", label=label)
+        if slot is None:
+            return False
+        processes = []
+        try:
+            outputs = self.comparison_service.prepare(members, fps=fps, priority="prewarm", label=label,
+                                                      slot=slot, on_start=processes.append)
+        finally:
+            slot.release()
+            for process in processes:
+                self._record_cpu(process)
+        if outputs is None:
+            self._count("failed")
+            return True
+        with self._lock:
+            self._cache_keys.update(keys.values())
+        self._count("prewarmed")
+        return True
+
+    def _prewarm_smart(self, media_file: Any, input_path: Path, recommendation: str, duration: float) -> bool:
+        """Publish a title's complete ``/smart`` output to the transcode cache."""
+        if not get_settings().transcode_cache_enabled:
+            return True
+        cache = get_transcode_cache()
+        key = smart_output_key(media_file, input_path, recommendation)
+        if cache.contains(key):
+            return True
+        cache_stats = cache.stats()
+        if not self._fits(cache_stats["bytes"], cache_stats["max_bytes"],
+                          self._estimate(media_file.bitrate, duration)):
+            self._count("over_budget")
+            return True
+
+        label = f"prewarm {media_file.filename}"
+        copy_video = recommendation in COPY_RECOMMENDATIONS
+        slot = self._scheduler().try_acquire("prewarm", prefer_gpu=not copy_video, label=label)
+        if slot is None:
+            return False
+        temp_path = cache.temp_path(key)
+        try:
+            cmd = self.ffmpeg_service.build_stream_command(
+                input_path=str(input_path),
+                recommendation=recommendation,
+                width=media_file.width,
+                height=media_file.height,
+                use_gpu=slot.gpu
+            )
+            with open(temp_path, "wb") as output:
+                process = FFmpegProcess(cmd, label, stdout=output).start()
+            if not self._supervise(process):
+                return False
+            if process.returncode != 0:
+                logger.error(f"Prewarm of {media_file.filename} failed (code {process.returncode}): "
+                             f"{process.budget_exceeded or process.error_summary()}")
+                self._count("failed")
+                return True
+            cache.publish(key, temp_path)
+            with self._lock:
+                self._cache_keys.add(key)
+            self._count("prewarmed")
+            logger.info(f"Prewarmed /smart output of {media_file.filename}")
+            return True
+        finally:
+            slot.release()
+            cache.discard(temp_path)
+
+    def _prewarm_hls_head(self, media_file: Any, input_path: Path, duration: float) -> bool:
+        """Encode the first ``head_seconds`` of a title's HLS renditions into the segment store."""
+        hls = self._hls()
+        ladder = build_ladder(media_file.width, media_file.height, media_file.bitrate)
+        segments = math.ceil(self.head_seconds / hls.segment_seconds)
+        kbps = sum(int(r["bitrate"].rstrip("k")) + AUDIO_KBPS for r in ladder)
+        estimate = self._estimate(kbps, min(self.head_seconds, duration))
+        store_stats = hls.store.stats()
+        if hls.store.title_bytes(media_file.id) == 0 and not self._fits(
+                store_stats["bytes"], store_stats["max_bytes"], estimate):
+            self._count("over_budget")
+            return True
+
+        encoders = []
+        ready = hls.prewarm(
+            media_file.id, str(input_path), duration, ladder, segments,
+            has_audio=bool(media_file.audio_codec),
+            should_stop=lambda: self.should_yield(encoders[0].process if encoders else None),
+            on_start=encoders.append
+        )
+        if encoders:
+            self._record_cpu(encoders[0].process)
+        if ready is None:
+            return False
+        with self._lock:
+            self._hls_titles.add(media_file.id)
+        if ready < min(segments, hls.segment_count(duration)) and self.should_yield():
+            self._count("yielded")
+            return False
+        self._count("prewarmed")
+        logger.info(f"Prewarmed {ready} HLS segments of {media_file.filename}")
+        return True
+
+    def _supervise(self, process: FFmpegProcess) -> bool:
+        """Wait for a prewarm encode, stopping it if it must yield; True if it ran to the end."""
+        try:
+            while process.wait(POLL_SECONDS) is None:
+                if self.should_yield(process):
+                    process.terminate()
+                    process.wait(POLL_SECONDS)
+                    self._count("yielded")
+                    return False
+            return True
+        finally:
+            self._record_cpu(process)
+
+    def _fits(self, store_bytes: int, store_max: int, estimate: int) -> bool:
+        """Room for ``estimate`` more bytes in the prewarm budget and in the target store."""
+        return (self.footprint() + estimate <= self.max_bytes
+                and store_bytes + estimate <= store_max)
+
+    @staticmethod
+    def _estimate(bitrate_kbps: Optional[int], seconds: float) -> int:
+        """Upper bound of an output's size from the source (or target) bitrate."""
+        return int((bitrate_kbps or 0) * 1000 / 8 * seconds)
+
+    def _record_cpu(self, process: FFmpegProcess) -> None:
+        with self._lock:
+            self._cpu.append((time.monotonic(), process.cpu_used))
+
+    def _cpu_spent(self) -> float:
+        """CPU seconds used by prewarm encodes within the last :data:`CPU_WINDOW`."""
+        cutoff = time.monotonic() - CPU_WINDOW
+        with self._lock:
+            while self._cpu and self._cpu[0][0] < cutoff:
+                self._cpu.popleft()
+            return sum(used for _, used in self._cpu)
+
+    def _scheduler(self) -> TranscodeScheduler:
+        return self.scheduler or get_transcode_scheduler()
+
+    def _hls(self) -> HLSService:
+        return self.hls_service or get_hls_service()
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _push(self, item: Item, front: bool = False) -> None:
+        with self._cond:
+            if item in self._pending:
+                if not front:
+                    return
+                self._queue.remove(item)
+            else:
+                self._pending.add(item)
+                self._count("queued")
+            if front:
+                self._queue.appendleft(item)
+            else:
+                self._queue.append(item)
+            self._cond.notify()
+
+    def _pop(self, timeout: float) -> Optional[Item]:
+        with self._cond:
+            if not self._queue:
+                self._cond.wait(timeout)
+            if not self._queue:
+                return None
+            item = self._queue.popleft()
+            self._pending.discard(item)
+            return item
+
+    def _enqueue_candidates(self) -> None:
+        """Queue recently added files and open duplicate groups."""
+        settings = get_settings()
+        since = datetime.now() - timedelta(hours=settings.prewarm_recent_hours)
+        db = self.session_factory()
+        try:
+            recent = (
+                db.query(MediaFile.id)
+                .filter(MediaFile.discovered_at >= since, MediaFile.is_deleted.isnot(True))
+                .order_by(MediaFile.discovered_at.desc())
+                .limit(settings.prewarm_max_items)
+                .all()
+            )
+            groups = (
+                db.query(DuplicateGroup.id)
+                .filter(DuplicateGroup.reviewed.isnot(True))
+                .order_by(DuplicateGroup.created_at.desc())
+                .limit(settings.prewarm_max_items)
+                .all()
+            )
+        finally:
+            db.close()
+        for (file_id,) in recent:
+            self._push(("file", file_id))
+        for (group_id,) in groups:
+            self._push(("group", group_id))
+
+    def _load(self, db: Session, file_id: int) -> Optional[MediaFile]:
+        media_file = db.get(MediaFile, file_id)
+        if media_file is not None:
+            db.expunge(media_file)
+        return media_file
+
+    def _next_episode(self, db: Session, file_id: int) -> Optional[MediaFile]:
+        """The best copy of the episode after ``file_id`` in its series (next season's first at the end)."""
+        current = db.get(MediaFile, file_id)
+        if current is None or current.parsed_season is None or current.parsed_episode is None:
+            return None
+        if current.tmdb_id:
+            series = MediaFile.tmdb_id == current.tmdb_id
+        elif current.parsed_title:
+            series = MediaFile.parsed_title == current.parsed_title
+        else:
+            return None
+        later = or_(
+            and_(MediaFile.parsed_season == current.parsed_season,
+                 MediaFile.parsed_episode > current.parsed_episode),
+            MediaFile.parsed_season > current.parsed_season,
+        )
+        following = (
+            db.query(MediaFile)
+            .filter(series, later, MediaFile.is_deleted.isnot(True))
+            .order_by(MediaFile.parsed_season, MediaFile.parsed_episode,
+                      MediaFile.quality_score.desc().nulls_last())
+            .first()
+        )
+        if following is not None:
+            db.expunge(following)
+        return following
+
+    def _run(self, item: Item) -> bool:
+        kind, ident = item
+        if kind == "group":
+            return self.prewarm_group(ident)
+        db = self.session_factory()
+        try:
+            media_file = self._next_episode(db, ident) if kind == "next" else self._load(db, ident)
+        finally:
+            db.close()
+        if media_file is None:
+            return True
+        return self.prewarm_file(media_file)
+
+    def _worker_loop(self) -> None:
+        next_round = 0.0
+        while True:
+            if time.monotonic() >= next_round:
+                next_round = time.monotonic() + self.interval
+                try:
+                    self._enqueue_candidates()
+                except Exception as e:
+                    logger.error(f"Prewarm candidate lookup failed: {e}")
+            item = self._pop(max(next_round - time.monotonic(), 0.0))
+            if item is None:
+                continue
+            try:
+                done = self._run(item)
+            except Exception as e:
+                logger.error(f"Prewarm of {item[0]} {item[1]} failed: {e}")
+                self._count("failed")
+                done = True
+            if not done:
+                self._push(item, front=True)
+                time.sleep(BACKOFF_SECONDS)
+
+
+@lru_cache()
+def get_prewarm_service() -> PrewarmService:
+    """Process-wide prewarm worker."""
+    return PrewarmService()
@@ -1,21 +1,369 @@
 """Quality scoring service for media files."""
+import copy
+from bisect import bisect_right
+from functools import lru_cache
 from typing import Dict, Any, Optional, List, Tuple
 from loguru import logger
+from sqlalchemy import case, func, or_, update
+from sqlalchemy.orm import Session
 
 from app.config import get_settings
 
+# (min height, resolution points, ideal bitrate kbps) - highest tier first
+RESOLUTION_TIERS: List[Tuple[int, int, int]] = [
+    (2160, 100, 50000),  # 4K
+    (1080, 75, 10000),   # 1080p
+    (720, 50, 5000),     # 720p
+    (480, 25, 2500),     # 480p
+    (0, 10, 1000),       # SD
+]
+
+# (codec name fragments, points) - first match wins
+CODEC_SCORES: List[Tuple[Tuple[str, ...], int]] = [
+    (("hevc", "h265", "x265"), 20),
+    (("avc", "h264", "x264"), 15),
+    (("vp9",), 18),
+    (("av1",), 22),
+]
+
+HDR_TYPES = ["HDR10", "Dolby Vision", "HDR10+", "HLG"]
+
+DEFAULT_PROFILE = "default"
+
+# Named scoring profiles. "default" is the canonical score stored in
+# media_files.quality_score (and mirrored in SQL); the others are used to
+# evaluate duplicate keep/delete decisions under different priorities.
+# Custom profiles can be added via QUALITY_PROFILES (JSON; each "extends"
+# "default" unless it names another profile, and may not reuse these names).
+BUILTIN_PROFILES: Dict[str, Dict[str, Any]] = {
+    DEFAULT_PROFILE: {
+        "resolution": [list(tier) for tier in RESOLUTION_TIERS],
+        "codecs": [[list(fragments), points] for fragments, points in CODEC_SCORES],
+        "bitrate_points": 30,
+        "surround_points": 15,
+        "stereo_points": 10,
+        "extra_audio_track_points": 3,
+        "extra_audio_max": 10,
+        "subtitle_track_points": 2,
+        "subtitle_max": 10,
+        "hdr_types": HDR_TYPES,
+        "hdr_points": 15,
+        "max_score": 200,
+    },
+    # Keep the most faithful copy: resolution, bitrate, HDR and extra tracks
+    "archive": {
+        "extends": DEFAULT_PROFILE,
+        "resolution": [[2160, 120, 60000], [1080, 80, 15000], [720, 45, 6000], [480, 20, 3000], [0, 5, 1500]],
+        "bitrate_points": 45,
+        "surround_points": 20,
+        "extra_audio_track_points": 5,
+        "extra_audio_max": 15,
+        "subtitle_track_points": 3,
+        "subtitle_max": 15,
+        "hdr_points": 25,
+        "max_score": 250,
+    },
+    # Keep what plays everywhere: 1080p/720p H.264 stereo beats 4K HEVC
+    "mobile": {
+        "extends": DEFAULT_PROFILE,
+        "resolution": [[2160, 55, 50000], [1080, 90, 8000], [720, 80, 4000], [480, 45, 2000], [0, 15, 1000]],
+        "codecs": [[["avc", "h264", "x264"], 30], [["vp9"], 15], [["hevc", "h265", "x265"], 10], [["av1"], 10]],
+        "bitrate_points": 10,
+        "surround_points": 8,
+        "stereo_points": 12,
+        "extra_audio_track_points": 1,
+        "extra_audio_max": 3,
+        "hdr_points": 0,
+    },
+    # Keep the smallest acceptable copy: efficient codecs, bitrate penalised
+    "space-saver": {
+        "extends": DEFAULT_PROFILE,
+        "resolution": [[2160, 70, 20000], [1080, 75, 5000], [720, 55, 2500], [480, 25, 1200], [0, 10, 600]],
+        "codecs": [[["av1"], 35], [["hevc", "h265", "x265"], 30], [["vp9"], 25], [["avc", "h264", "x264"], 10]],
+        "bitrate_points": -30,
+        "surround_points": 10,
+        "stereo_points": 10,
+        "hdr_points": 5,
+    },
+}
+
+# Track-count lookups are precomputed up to this many tracks
+_TRACK_TABLE_SIZE = 32
+
+# A negative bitrate weight keeps penalising up to this multiple of the ideal bitrate
+BITRATE_PENALTY_CAP = 4
+
+
+# Settings a profile spec may contain
+PROFILE_KEYS = frozenset(BUILTIN_PROFILES[DEFAULT_PROFILE]) | {"extends"}
+
+
+def get_profile_specs() -> Dict[str, Dict[str, Any]]:
+    """Return built-in profiles merged with custom profiles from settings."""
+    return _merge_profile_specs(get_settings().quality_profiles_dict)
+
+
+def _merge_profile_specs(custom: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Built-in profiles plus ``custom`` ones, which extend "default" unless they say otherwise."""
+    specs = dict(BUILTIN_PROFILES)
+    specs.update({name: {"extends": DEFAULT_PROFILE, **spec} for name, spec in custom.items()})
+    return specs
+
+
+def _resolve_profile_spec(name: str, specs: Dict[str, Dict[str, Any]], seen: Tuple[str, ...] = ()) -> Dict[str, Any]:
+    """Resolve a profile's "extends" chain into a flat spec."""
+    if name not in specs:
+        raise KeyError(f"Unknown quality profile: {name}")
+    if name in seen:
+        raise ValueError(f"Circular quality profile inheritance: {' -> '.join(seen + (name,))}")
+
+    spec = copy.deepcopy(specs[name])
+    parent = spec.pop("extends", None)
+    if parent:
+        resolved = _resolve_profile_spec(parent, specs, seen + (name,))
+        resolved.update(spec)
+        return resolved
+    return spec
+
+
+class ScoringProfile:
+    """
+    A quality profile compiled into lookup tables for fast evaluation.
+
+    Resolution tiers become sorted height/points/ideal-bitrate arrays searched
+    with bisect, track bonuses become precomputed tables, and codec names are
+    memoised after their first match.
+    """
+
+    def __init__(self, name: str, spec: Dict[str, Any]):
+        self.name = name
+
+        tiers = sorted(spec["resolution"], key=lambda tier: tier[0])
+        self.tier_heights = [int(tier[0]) for tier in tiers]
+        self.tier_points = [int(tier[1]) for tier in tiers]
+        self.tier_ideal_bitrates = [int(tier[2]) for tier in tiers]
+
+        self.codec_rules = [(tuple(fragments), int(points)) for fragments, points in spec["codecs"]]
+        self._codec_points: Dict[str, int] = {}
+
+        self.bitrate_points = int(spec["bitrate_points"])
+        self.surround_points = int(spec["surround_points"])
+        self.stereo_points = int(spec["stereo_points"])
+        self.hdr_types = frozenset(spec["hdr_types"])
+        self.hdr_points = int(spec["hdr_points"])
+        self.max_score = int(spec["max_score"])
+
+        self.extra_audio_points = int(spec["extra_audio_track_points"])
+        self.extra_audio_max = int(spec["extra_audio_max"])
+        self.subtitle_points = int(spec["subtitle_track_points"])
+        self.subtitle_max = int(spec["subtitle_max"])
+        self.extra_audio_table = [self._extra_audio_score(n) for n in range(_TRACK_TABLE_SIZE)]
+        self.subtitle_table = [self._subtitle_score(n) for n in range(_TRACK_TABLE_SIZE)]
+
+    def codec_points(self, video_codec: Optional[str]) -> int:
+        """Points for a codec name (first matching rule wins)."""
+        codec = (video_codec or "").lower()
+        points = self._codec_points.get(codec)
+        if points is None:
+            points = next(
+                (pts for fragments, pts in self.codec_rules if any(f in codec for f in fragments)),
+                0,
+            )
+            self._codec_points[codec] = points
+        return points
+
+    def tier_index(self, height: int) -> int:
+        """Index of the resolution tier a height falls into."""
+        return max(bisect_right(self.tier_heights, height) - 1, 0)
+
+    def score(self, metadata: Dict[str, Any]) -> int:
+        """Score a single file's metadata under this profile."""
+        score = 0
+
+        height = metadata.get("height")
+        bitrate = metadata.get("bitrate")
+        if height:
+            idx = self.tier_index(height)
+            score += self.tier_points[idx]
+
+            if bitrate:
+                ideal = self.tier_ideal_bitrates[idx]
+                # Positive weights reward bitrate up to the ideal; negative ones penalise it past that too
+                cap = ideal if self.bitrate_points >= 0 else ideal * BITRATE_PENALTY_CAP
+                score += int(min(bitrate, cap) * self.bitrate_points // ideal)
+
+        score += self.codec_points(metadata.get("video_codec"))
+
+        audio_channels = metadata.get("audio_channels")
+        if audio_channels is None:
+            audio_channels = 2
+        score += self.surround_points if audio_channels >= 5 else self.stereo_points
+
+        audio_tracks = metadata.get("audio_track_count") or 1
+        score += self.extra_audio_table[audio_tracks] if audio_tracks < _TRACK_TABLE_SIZE else self._extra_audio_score(audio_tracks)
+
+        subtitles = metadata.get("subtitle_track_count") or 0
+        score += self.subtitle_table[subtitles] if subtitles < _TRACK_TABLE_SIZE else self._subtitle_score(subtitles)
+
+        if metadata.get("hdr_type") in self.hdr_types:
+            score += self.hdr_points
+
+        return min(score, self.max_score)
+
+    def score_many(self, rows: List[Dict[str, Any]]) -> List[int]:
+        """Score a batch of metadata rows; returns scores in input order."""
+        score = self.score
+        return [score(row) for row in rows]
+
+    def _extra_audio_score(self, tracks: int) -> int:
+        return min((tracks - 1) * self.extra_audio_points, self.extra_audio_max) if tracks > 1 else 0
+
+    def _subtitle_score(self, tracks: int) -> int:
+        return min(tracks * self.subtitle_points, self.subtitle_max) if tracks > 0 else 0
+
+
+def validate_custom_profiles(custom: Any) -> None:
+    """
+    Check custom profiles (parsed ``QUALITY_PROFILES``) by compiling each one.
+
+    Built-in names can't be redefined: "default" is also the score the
+    database computes.
+
+    Raises:
+        ValueError: describing the first invalid profile
+    """
+    if not isinstance(custom, dict):
+        raise ValueError("QUALITY_PROFILES must be a JSON object of named profiles")
+    for name, spec in custom.items():
+        if name in BUILTIN_PROFILES:
+            raise ValueError(f"Quality profile '{name}' is built in and can't be redefined")
+        if not isinstance(spec, dict):
+            raise ValueError(f"Quality profile '{name}' must be a JSON object")
+        unknown = set(spec) - PROFILE_KEYS
+        if unknown:
+            raise ValueError(f"Quality profile '{name}' has unknown settings: {', '.join(sorted(unknown))}")
+
+    specs = _merge_profile_specs(custom)
+    for name in custom:
+        try:
+            spec = _resolve_profile_spec(name, specs)
+            if any(not isinstance(tier, list) or len(tier) != 3 for tier in spec["resolution"]):
+                raise ValueError("resolution tiers must be [min height, points, ideal kbps]")
+            if any(not isinstance(rule, list) or len(rule) != 2 for rule in spec["codecs"]):
+                raise ValueError("codec rules must be [[name fragments], points]")
+            profile = ScoringProfile(name, spec)
+        except KeyError as e:
+            raise ValueError(f"Quality profile '{name}': {e.args[0]}") from e
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Quality profile '{name}': {e}") from e
+        if min(profile.tier_ideal_bitrates) <= 0:
+            raise ValueError(f"Quality profile '{name}': ideal bitrates must be positive")
+
+
+@lru_cache(maxsize=None)
+def get_scoring_profile(name: str = DEFAULT_PROFILE) -> ScoringProfile:
+    """Compile a named profile once per process."""
+    spec = _resolve_profile_spec(name, get_profile_specs())
+    logger.debug(f"Compiled quality profile '{name}'")
+    return ScoringProfile(name, spec)
+
+
+def quality_score_sql(
+    height,
+    video_codec,
+    bitrate,
+    audio_channels,
+    audio_track_count,
+    subtitle_track_count,
+    hdr_type,
+):
+    """
+    Build the quality score as a SQL expression over the given columns.
+
+    Generated from the compiled default profile's tables, so it scores
+    exactly like ``QualityService.calculate_quality_score`` (and the
+    ``media_quality_score()`` function installed by migration 005) and
+    ranking and rescoring can run inside the database. NULLs take the same
+    defaults the Python implementation uses for missing metadata.
+
+    Args:
+        height, video_codec, ...: Column expressions (e.g. ``MediaFile.height``)
+
+    Returns:
+        SQLAlchemy integer expression (0 to the profile's ``max_score``)
+    """
+    profile = get_scoring_profile(DEFAULT_PROFILE)
+    has_height = func.coalesce(height, 0) > 0
+
+    # Highest tier first; anything below the second-lowest falls into the lowest
+    tiers = list(zip(profile.tier_heights, profile.tier_points, profile.tier_ideal_bitrates))[::-1]
+    resolution_score = case(
+        *[(height >= min_height, points) for min_height, points, _ in tiers[:-1]],
+        else_=tiers[-1][1],
+    )
+    ideal_bitrate = case(
+        *[(height >= min_height, ideal) for min_height, _, ideal in tiers[:-1]],
+        else_=tiers[-1][2],
+    )
+
+    codec = func.lower(func.coalesce(video_codec, ""))
+    codec_score = case(
+        *[
+            (or_(*[codec.contains(fragment) for fragment in fragments]), points)
+            for fragments, points in profile.codec_rules
+        ],
+        else_=0,
+    )
+
+    bitrate_score = case(
+        (or_(func.coalesce(bitrate, 0) <= 0, ~has_height), 0),
+        (bitrate >= ideal_bitrate, profile.bitrate_points),
+        else_=(bitrate * profile.bitrate_points) // ideal_bitrate,
+    )
+
+    audio_score = case((func.coalesce(audio_channels, 2) >= 5, profile.surround_points),
+                       else_=profile.stereo_points)
+
+    extra_audio = func.coalesce(audio_track_count, 1) - 1
+    multi_audio_score = case(
+        (extra_audio <= 0, 0),
+        (extra_audio * profile.extra_audio_points >= profile.extra_audio_max, profile.extra_audio_max),
+        else_=extra_audio * profile.extra_audio_points,
+    )
+
+    subtitle_tracks = func.coalesce(subtitle_track_count, 0)
+    subtitle_score = case(
+        (subtitle_tracks <= 0, 0),
+        (subtitle_tracks * profile.subtitle_points >= profile.subtitle_max, profile.subtitle_max),
+        else_=subtitle_tracks * profile.subtitle_points,
+    )
+
+    hdr_score = case((hdr_type.in_(sorted(profile.hdr_types)), profile.hdr_points), else_=0)
+
+    total = (
+        case((has_height, resolution_score), else_=0)
+        + codec_score
+        + bitrate_score
+        + audio_score
+        + multi_audio_score
+        + subtitle_score
+        + hdr_score
+    )
+    return case((total > profile.max_score, profile.max_score), else_=total)
+
 
 class QualityService:
     """Service for calculating media file quality scores (0-200 scale)."""
 
-    def __init__(self):
+    def __init__(self, profile: str = DEFAULT_PROFILE):
         self.settings = get_settings()
+        self.profile = get_scoring_profile(profile)
 
     def calculate_quality_score(self, metadata: Dict[str, Any]) -> int:
         """
         Calculate quality score based on MediaVault scoring algorithm.
 
-        Scoring breakdown (0-200 scale):
+        Scoring breakdown for the default profile (0-200 scale):
         - Resolution: 4K=100, 1080p=75, 720p=50, 480p=25, SD=10
         - Codec: H.265=20, H.264=15, VP9=18, AV1=22
         - Bitrate: Normalized 0-30 (based on resolution-specific ideals)
@@ -30,66 +378,46 @@ class QualityService:
         Returns:
             Quality score (0-200)
         """
-        score = 0
+        return self.profile.score(metadata)
+
+    def score_many(self, files_metadata: List[Dict[str, Any]]) -> List[int]:
+        """Batch-score metadata rows under this service's profile."""
+        return self.profile.score_many(files_metadata)
+
+    def score_expression(self):
+        """SQL expression computing the default-profile score from MediaFile columns."""
+        from app.models import MediaFile
+
+        return quality_score_sql(
+            height=MediaFile.height,
+            video_codec=MediaFile.video_codec,
+            bitrate=MediaFile.bitrate,
+            audio_channels=MediaFile.audio_channels,
+            audio_track_count=MediaFile.audio_track_count,
+            subtitle_track_count=MediaFile.subtitle_track_count,
+            hdr_type=MediaFile.hdr_type,
+        )
 
-        # Resolution score (0-100)
-        height = metadata.get("height")
-        if height:
-            if height >= 2160:  # 4K
-                score += 100
-            elif height >= 1080:  # 1080p
-                score += 75
-            elif height >= 720:  # 720p
-                score += 50
-            elif height >= 480:  # 480p
-                score += 25
-            else:  # SD
-                score += 10
-
-        # Codec score (0-22)
-        video_codec = metadata.get("video_codec", "").lower()
-        if "hevc" in video_codec or "h265" in video_codec or "x265" in video_codec:
-            score += 20
-        elif "avc" in video_codec or "h264" in video_codec or "x264" in video_codec:
-            score += 15
-        elif "vp9" in video_codec:
-            score += 18
-        elif "av1" in video_codec:
-            score += 22
-
-        # Bitrate score (0-30)
-        bitrate_score = self._calculate_bitrate_score(
-            bitrate=metadata.get("bitrate", 0),
-            height=height
+    def rescore_all(self, db: Session) -> int:
+        """
+        Recompute quality_score for every media file in a single UPDATE.
+
+        The scoring runs entirely inside the database, so no rows are
+        loaded into Python.
+
+        Returns:
+            Number of rows updated
+        """
+        from app.models import MediaFile
+
+        result = db.execute(
+            update(MediaFile)
+            .values(quality_score=self.score_expression())
+            .execution_options(synchronize_session=False)
         )
-        score += bitrate_score
-
-        # Audio channels score (0-15)
-        audio_channels = metadata.get("audio_channels", 2)
-        if audio_channels >= 5:  # 5.1 or higher
-            score += 15
-        else:  # 2.0
-            score += 10
-
-        # Multi-audio tracks score (max 10)
-        audio_track_count = metadata.get("audio_track_count", 1)
-        if audio_track_count > 1:
-            multi_audio_score = min((audio_track_count - 1) * 3, 10)
-            score += multi_audio_score
-
-        # Subtitle tracks score (max 10)
-        subtitle_track_count = metadata.get("subtitle_track_count", 0)
-        if subtitle_track_count > 0:
-            subtitle_score = min(subtitle_track_count * 2, 10)
-            score += subtitle_score
-
-        # HDR score (+15)
-        hdr_type = metadata.get("hdr_type", "SDR")
-        if hdr_type in ["HDR10", "Dolby Vision", "HDR10+", "HLG"]:
-            score += 15
-
-        # Cap at 200
-        return min(score, 200)
+        db.commit()
+        logger.info(f"Rescored {result.rowcount} media files in database")
+        return result.rowcount
 
     def rank_files(self, files_metadata: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
@@ -97,8 +425,14 @@ class QualityService:
         """
         ranked: List[Dict[str, Any]] = []
 
-        for meta in files_metadata:
-            score = meta.get("quality_score")
+        # Stored scores are default-profile scores; other profiles rescore
+        # the whole batch in one pass.
+        if self.profile.name != DEFAULT_PROFILE:
+            scores = self.score_many(files_metadata)
+        else:
+            scores = [meta.get("quality_score") for meta in files_metadata]
+
+        for meta, score in zip(files_metadata, scores):
             if score in (None, 0):
                 score = self.calculate_quality_score(meta)
             enriched = dict(meta)
@@ -129,42 +463,3 @@ class QualityService:
                 return True, "Foreign-film heuristic triggered (non-English audio with English subtitles)."
 
         return False, ""
-
-    def _calculate_bitrate_score(self, bitrate: int, height: Optional[int]) -> int:
-        """
-        Calculate bitrate score normalized to resolution.
-
-        Ideal bitrates (kbps):
-        - 4K: 50000
-        - 1080p: 10000
-        - 720p: 5000
-        - 480p: 2500
-        - SD: 1000
-
-        Args:
-            bitrate: Bitrate in kbps
-            height: Video height in pixels
-
-        Returns:
-            Bitrate score (0-30)
-        """
-        if not bitrate or not height:
-            return 0
-
-        # Determine ideal bitrate based on resolution
-        if height >= 2160:  # 4K
-            ideal_bitrate = 50000
-        elif height >= 1080:  # 1080p
-            ideal_bitrate = 10000
-        elif height >= 720:  # 720p
-            ideal_bitrate = 5000
-        elif height >= 480:  # 480p
-            ideal_bitrate = 2500
-        else:  # SD
-            ideal_bitrate = 1000
-
-        # Calculate ratio (cap at 1.0 to avoid bonus for excessively high bitrates)
-        ratio = min(bitrate / ideal_bitrate, 1.0)
-
-        # Scale to 0-30
-        return int(ratio * 30)
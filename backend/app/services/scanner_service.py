@@ -1,16 +1,19 @@
 """Scanner service for NAS file discovery and metadata extraction."""
 import os
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 from loguru import logger
-import guessit
 
+from sqlalchemy import update
 from sqlalchemy.orm import Session
 from app.models import MediaFile, ScanHistory, ArchiveFile
 from app.services.nas_service import NASService
 from app.services.ffmpeg_service import FFmpegService
 from app.services.quality_service import QualityService
 from app.services.tmdb_service import TMDbService
+from app.services.filename_parser import get_filename_parser
+from app.services.preview_service import get_preview_service
+from app.services.prewarm_service import get_prewarm_service
 from app.config import get_settings
 
 settings = get_settings()
@@ -25,6 +28,7 @@ class ScannerService:
         self.ffmpeg_service = FFmpegService()
         self.quality_service = QualityService()
         self.tmdb_service = TMDbService()
+        self.filename_parser = get_filename_parser()
         self.video_extensions = settings.video_extensions_list
         self.archive_extensions = ['.rar', '.zip', '.7z', '.tar', '.gz', '.bz2']
 
@@ -65,6 +69,8 @@ class ScannerService:
         errors_count = 0
         archives_found = 0
         archives_new = 0
+        enrich_ids: List[int] = []  # Files needing TMDb enrichment after discovery
+        preview_ids: List[int] = []  # New or changed files to generate previews for
 
         try:
             for scan_path in paths:
@@ -93,6 +99,9 @@ class ScannerService:
                 archives_found += len(archive_files)
                 logger.info(f"Found {len(archive_files)} archive files in {scan_path}")
 
+                # Parse every name this pass needs in one batch
+                self._prewarm_parses(video_files, archive_files, scan_type)
+
                 # Process video files
                 for filepath in video_files:
                     try:
@@ -116,6 +125,10 @@ class ScannerService:
                             else:
                                 files_new += 1
 
+                            if media_file.parsed_title and not media_file.tmdb_id:
+                                enrich_ids.append(media_file.id)
+                            preview_ids.append(media_file.id)
+
                             if (files_new + files_updated) % 10 == 0:
                                 logger.info(f"Processed {files_new + files_updated}/{files_found} files...")
                         else:
@@ -145,7 +158,7 @@ class ScannerService:
                             continue
 
                         # Parse filename for metadata
-                        parsed = guessit.guessit(file_info['filename'])
+                        parsed = self.filename_parser.parse(file_info['filename'])
 
                         # Determine archive type
                         archive_type = os.path.splitext(filepath)[1][1:]  # Remove leading dot
@@ -196,6 +209,18 @@ class ScannerService:
                 logger.error(f"Error committing archives: {e}")
                 self.db.rollback()
 
+            # Enrich with TMDb/IMDB metadata once per distinct title
+            if enrich_ids:
+                self._enrich_batch(enrich_ids)
+
+            # Posters, sprite sheets and preview clips, in the background
+            if preview_ids and settings.preview_pregenerate:
+                get_preview_service().enqueue(preview_ids)
+
+            # Transcodes of what was just added, at the lowest priority
+            if preview_ids and settings.prewarm_enabled:
+                get_prewarm_service().enqueue_files(preview_ids[:settings.prewarm_max_items])
+
             # Update scan history
             scan_history.scan_completed_at = datetime.now()
             scan_history.duration_seconds = int((scan_history.scan_completed_at - scan_history.scan_started_at).total_seconds())
@@ -250,8 +275,8 @@ class ScannerService:
                 logger.warning(f"Failed to extract metadata: {filepath}")
                 return None
 
-            # Parse filename with guessit
-            parsed = guessit.guessit(file_info["filename"])
+            # Parse filename with guessit (cached)
+            parsed = self.filename_parser.parse(file_info["filename"])
 
             # Calculate MD5 hash (expensive, but necessary)
             md5_hash = self.ffmpeg_service.calculate_md5(filepath)
@@ -305,27 +330,6 @@ class ScannerService:
             else:
                 media_file.media_type = "movie"
 
-            # Enrich with TMDb/IMDB metadata
-            if media_file.parsed_title and not media_file.tmdb_id:
-                try:
-                    tmdb_data = self.tmdb_service.enrich_media_metadata(
-                        title=media_file.parsed_title,
-                        year=media_file.parsed_year,
-                        media_type=media_file.media_type
-                    )
-
-                    if tmdb_data:
-                        media_file.tmdb_id = tmdb_data.get('tmdb_id')
-                        media_file.tmdb_type = tmdb_data.get('tmdb_type')
-                        media_file.tmdb_title = tmdb_data.get('tmdb_title')
-                        media_file.tmdb_year = tmdb_data.get('tmdb_year')
-                        media_file.tmdb_overview = tmdb_data.get('tmdb_overview')
-                        media_file.tmdb_poster_path = tmdb_data.get('tmdb_poster_path')
-                        media_file.imdb_id = tmdb_data.get('imdb_id')
-                        logger.debug(f"TMDb enriched: {media_file.parsed_title} (TMDb ID: {media_file.tmdb_id}, IMDB: {media_file.imdb_id})")
-                except Exception as e:
-                    logger.warning(f"TMDb enrichment failed for {media_file.parsed_title}: {e}")
-
             # Timestamps
             media_file.last_scanned_at = datetime.now()
             media_file.metadata_updated_at = datetime.now()
@@ -343,3 +347,100 @@ class ScannerService:
             logger.error(f"Error processing file {filepath}: {e}")
             self.db.rollback()
             return None
+
+    def _prewarm_parses(self, video_files: List[str], archive_files: List[str], scan_type: str) -> None:
+        """
+        Resolve filename parses for files this pass will process.
+
+        Cached names come back from one query per chunk; cold names (a first
+        scan of a library) are parsed in a process pool. The per-file calls
+        in the scan loop then hit the in-process LRU.
+        """
+        if scan_type == "incremental":
+            video_files = self._unknown_paths(MediaFile, video_files)
+        archive_files = self._unknown_paths(ArchiveFile, archive_files)
+
+        names = [os.path.basename(path) for path in video_files + archive_files]
+        if names:
+            self.filename_parser.parse_many(names)
+
+    def _unknown_paths(self, model, paths: List[str]) -> List[str]:
+        """Paths not yet recorded in ``model``'s table."""
+        known = set()
+        for i in range(0, len(paths), 1000):
+            chunk = paths[i:i + 1000]
+            known.update(row[0] for row in self.db.query(model.filepath).filter(model.filepath.in_(chunk)))
+        return [path for path in paths if path not in known]
+
+    def _enrich_batch(self, media_file_ids: List[int]) -> int:
+        """
+        Enrich a scan batch with TMDb/IMDB metadata, one lookup per title.
+
+        Collects the distinct (parsed_title, parsed_year, media_type) tuples
+        among the given files, resolves them concurrently over one pooled
+        TMDb client (the shared token bucket enforces the rate limit), and
+        writes results back with a single bulk UPDATE.
+
+        Returns:
+            Number of media files enriched
+        """
+        rows = (
+            self.db.query(
+                MediaFile.id,
+                MediaFile.parsed_title,
+                MediaFile.parsed_year,
+                MediaFile.media_type,
+            )
+            .filter(MediaFile.id.in_(media_file_ids))
+            .filter(MediaFile.parsed_title.isnot(None))
+            .filter(MediaFile.tmdb_id.is_(None))
+            .all()
+        )
+
+        titles: Dict[Tuple[str, Optional[int], str], List[int]] = {}
+        for file_id, title, year, media_type in rows:
+            titles.setdefault((title, year, media_type), []).append(file_id)
+
+        if not titles:
+            return 0
+
+        logger.info(f"Enriching {len(rows)} files from {len(titles)} distinct titles via TMDb...")
+
+        keys = list(titles.keys())
+        try:
+            results = self.tmdb_service.enrich_many(keys)
+        except Exception as e:
+            logger.warning(f"TMDb batch enrichment failed: {e}")
+            return 0
+
+        now = datetime.now()
+        updates = []
+        for key, tmdb_data in zip(keys, results):
+            if not tmdb_data:
+                continue
+            for file_id in titles[key]:
+                updates.append({
+                    "id": file_id,
+                    "tmdb_id": tmdb_data.get('tmdb_id'),
+                    "tmdb_type": tmdb_data.get('tmdb_type'),
+                    "tmdb_title": tmdb_data.get('tmdb_title'),
+                    "tmdb_year": tmdb_data.get('tmdb_year'),
+                    "tmdb_overview": tmdb_data.get('tmdb_overview'),
+                    "tmdb_poster_path": tmdb_data.get('tmdb_poster_path'),
+                    "imdb_id": tmdb_data.get('imdb_id'),
+                    "tmdb_last_updated": now,
+                })
+
+        if not updates:
+            return 0
+
+        try:
+            self.db.execute(update(MediaFile), updates)
+            self.db.commit()
+        except Exception as e:
+            logger.error(f"Failed to write TMDb enrichment: {e}")
+            self.db.rollback()
+            return 0
+
+        logger.info(f"TMDb enriched {len(updates)} files ({len(titles)} titles looked up)")
+        return len(updates)
@@ -0,0 +1,244 @@
+"""Transcode profile negotiation: pick a ladder rung from client bandwidth hints."""
+import ipaddress
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, NamedTuple, Optional, Tuple
+
+from fastapi import Request
+
+from app.config import get_settings
+from app.services.hls_service import MIN_RENDITION_KBPS, build_ladder
+from app.services.transcode_cache import media_fingerprint, transcode_cache_key
+from app.utils.file_response import ThroughputMeter
+
+# Audio bitrate of transcoded /smart and /progressive output (kbps)
+AUDIO_KBPS = 192
+
+# Browsers report at most this downlink (Mbit/s): a value there means "at least"
+DOWNLINK_HINT_CAP_MBPS = 10.0
+
+# Largest rung (by height) worth sending to a device class
+DEVICE_MAX_HEIGHT = {"mobile": 720, "tablet": 1080}
+DEVICES = ("mobile", "tablet", "desktop", "tv")
+
+# Client hints a response asks browsers to send on later requests
+ACCEPT_CH = "Downlink, Save-Data, Sec-CH-UA-Mobile"
+
+# Measured throughput is remembered per client for this long (seconds)
+THROUGHPUT_TTL = 3600.0
+THROUGHPUT_CLIENTS = 1024
+
+_TV_AGENTS = re.compile(r"SMART-TV|SmartTV|AppleTV|CrKey|AFT[A-Z]|BRAVIA|Web0S|Tizen", re.IGNORECASE)
+_TABLET_AGENTS = re.compile(r"iPad|Tablet", re.IGNORECASE)
+_MOBILE_AGENTS = re.compile(r"Mobi|iPhone|Android", re.IGNORECASE)
+
+
+class ClientHints(NamedTuple):
+    """What is known about a client's link and screen."""
+    downlink_kbps: Optional[float] = None  # declared by the client
+    measured_kbps: Optional[float] = None  # seen on earlier streams to it
+    save_data: bool = False
+    device: Optional[str] = None  # one of DEVICES
+
+    def budget_kbps(self) -> Optional[float]:
+        """Total bitrate a stream to this client may use, or None if unconstrained."""
+        settings = get_settings()
+        known = [kbps for kbps in (self.downlink_kbps, self.measured_kbps) if kbps]
+        budget = min(known) * settings.stream_bandwidth_headroom if known else None
+        if self.save_data:
+            budget = min(budget or settings.stream_save_data_kbps, settings.stream_save_data_kbps)
+        return budget
+
+
+class StreamProfile(NamedTuple):
+    """A ladder rung to transcode to, with its video bitrate cap."""
+    name: str
+    width: int
+    height: int
+    video_kbps: int
+
+    @property
+    def cache_profile(self) -> str:
+        return f"{self.name}-{self.video_kbps}k"
+
+
+class ThroughputHistory:
+    """Delivery rates measured per client, smoothed and bounded."""
+
+    def __init__(self, max_clients: int = THROUGHPUT_CLIENTS, ttl: float = THROUGHPUT_TTL,
+                 weight: float = 0.5):
+        self.max_clients = max_clients
+        self.ttl = ttl
+        self.weight = weight
+        self._lock = threading.Lock()
+        self._rates: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def meter(self, client: str) -> ThroughputMeter:
+        """A meter for one response that records into this history."""
+        return ThroughputMeter(lambda kbps: self.record(client, kbps))
+
+    def record(self, client: str, kbps: float) -> None:
+        with self._lock:
+            previous = self._current_locked(client)
+            if previous is not None:
+                kbps = self.weight * kbps + (1 - self.weight) * previous
+            self._rates[client] = (kbps, time.monotonic())
+            self._rates.move_to_end(client)
+            while len(self._rates) > self.max_clients:
+                self._rates.popitem(last=False)
+
+    def estimate(self, client: str) -> Optional[float]:
+        """Smoothed kbit/s measured for ``client``, if recent."""
+        with self._lock:
+            return self._current_locked(client)
+
+    def _current_locked(self, client: str) -> Optional[float]:
+        entry = self._rates.get(client)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[1] > self.ttl:
+            del self._rates[client]
+            return None
+        return entry[0]
+
+
+@lru_cache()
+def get_throughput_history() -> ThroughputHistory:
+    """Process-wide per-client throughput history."""
+    return ThroughputHistory()
+
+
+def client_key(request: Request) -> str:
+    """
+    Identify a client across requests.
+
+    The socket peer, unless that is a trusted proxy
+    (``stream_trusted_proxies``); then the address the proxy saw:
+    ``X-Real-IP``, else the last ``X-Forwarded-For`` hop (the one it
+    appended). Earlier hops, and these headers from anyone else, come from
+    the client and can be anything.
+    """
+    peer = request.client.host if request.client else ""
+    if not _trusted_proxy(peer):
+        return peer
+    real_ip = request.headers.get("x-real-ip", "").strip()
+    if real_ip:
+        return real_ip
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        return forwarded.split(",")[-1].strip()
+    return peer
+
+
+def _trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in _proxy_networks(get_settings().stream_trusted_proxies))
+
+
+@lru_cache(maxsize=4)
+def _proxy_networks(spec: str) -> Tuple[Any, ...]:
+    return tuple(ipaddress.ip_network(entry.strip(), strict=False) for entry in spec.split(",") if entry.strip())
+
+
+def device_class(request: Request) -> Optional[str]:
+    """``mobile``, ``tablet``, ``tv`` or ``desktop`` from client hints or the User-Agent."""
+    if request.headers.get("sec-ch-ua-mobile") == "?1":
+        return "mobile"
+    agent = request.headers.get("user-agent", "")
+    if not agent:
+        return None
+    if _TV_AGENTS.search(agent):
+        return "tv"
+    if _TABLET_AGENTS.search(agent):
+        return "tablet"
+    if _MOBILE_AGENTS.search(agent):
+        return "mobile"
+    return "desktop"
+
+
+def client_hints(request: Request, downlink: Optional[float] = None, device: Optional[str] = None) -> ClientHints:
+    """
+    Gather a request's bandwidth hints.
+
+    Args:
+        request: Incoming request (``Downlink``, ``Save-Data``, ``Sec-CH-UA-Mobile``
+            and ``User-Agent`` headers; the client address for measured throughput)
+        downlink: Declared downlink in Mbit/s (e.g. ``navigator.connection.downlink``);
+            overrides the ``Downlink`` header
+        device: Device class overriding the one derived from headers
+    """
+    if downlink is None:
+        try:
+            downlink = float(request.headers.get("downlink", ""))
+        except ValueError:
+            downlink = None
+    # At the reporting cap the real link may be much faster: not a constraint
+    downlink_kbps = downlink * 1000 if downlink and 0 < downlink < DOWNLINK_HINT_CAP_MBPS else None
+    save_data = request.headers.get("save-data", "").strip().lower() == "on"
+    return ClientHints(
+        downlink_kbps=downlink_kbps,
+        measured_kbps=get_throughput_history().estimate(client_key(request)),
+        save_data=save_data,
+        device=device if device in DEVICES else device_class(request),
+    )
+
+
+def estimate_bitrate_kbps(media_file: Any) -> Optional[int]:
+    """A file's overall bitrate: as probed (stored in kbps), else from its size and duration."""
+    if media_file.bitrate:
+        return int(media_file.bitrate)
+    if getattr(media_file, "file_size", None) and media_file.duration:
+        return int(media_file.file_size * 8 / float(media_file.duration) / 1000)
+    return None
+
+
+def select_profile(media_file: Any, hints: ClientHints, max_height: Optional[int] = None,
+                   transcoding: bool = False) -> Optional[StreamProfile]:
+    """
+    The best ladder rung for a client, or None if the source suits it as is.
+
+    The source (size and bitrate) is kept when its estimated bitrate fits
+    the client's budget. When the video is re-encoded anyway
+    (``transcoding``) it must also fit the device class and ``max_height``;
+    a source that would otherwise be sent as is isn't transcoded just to
+    shrink it. Otherwise the tallest rung within those heights whose video
+    bitrate plus audio fits the budget is chosen; if none does, the
+    smallest with its bitrate lowered to fit (not below
+    :data:`MIN_RENDITION_KBPS`).
+    """
+    budget = hints.budget_kbps()
+    heights = [h for h in (DEVICE_MAX_HEIGHT.get(hints.device), max_height) if h]
+    height_cap = min(heights) if heights else None
+    source_kbps = estimate_bitrate_kbps(media_file)
+
+    fits_budget = budget is None or (source_kbps is not None and source_kbps <= budget)
+    fits_device = height_cap is None or not media_file.height or media_file.height <= height_cap
+    if fits_budget and (fits_device or not transcoding):
+        return None
+
+    ladder = build_ladder(media_file.width, media_file.height, source_kbps)
+    rungs = [r for r in ladder if height_cap is None or r["height"] <= height_cap] or ladder[-1:]
+    for rung in rungs:
+        kbps = int(rung["bitrate"].rstrip("k"))
+        if budget is None or kbps + AUDIO_KBPS <= budget:
+            return StreamProfile(rung["name"], rung["width"], rung["height"], kbps)
+
+    lowest = rungs[-1]
+    kbps = min(int(lowest["bitrate"].rstrip("k")), max(int(budget - AUDIO_KBPS), MIN_RENDITION_KBPS))
+    return StreamProfile(lowest["name"], lowest["width"], lowest["height"], kbps)
+
+
+def smart_output_key(media_file: Any, input_path: Path, recommendation: str,
+                     profile: Optional[StreamProfile] = None) -> str:
+    """Transcode cache key of a file's complete ``/smart`` output (at the source size or ``profile``)."""
+    fingerprint = media_fingerprint(media_file.md5_hash, str(input_path))
+    if profile is not None:
+        return transcode_cache_key(fingerprint, f"smart-{profile.cache_profile}", profile.width, profile.height)
+    return transcode_cache_key(fingerprint, f"smart-{recommendation}", media_file.width, media_file.height)
@@ -0,0 +1,363 @@
+"""Registry of client stream sessions: who is streaming what, how, and how well."""
+import itertools
+import threading
+import time
+from collections import defaultdict, deque
+from functools import lru_cache
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from app.services.hls_service import get_hls_service
+from app.services.prewarm_service import get_prewarm_service
+from app.services.preview_service import get_preview_service
+from app.services.transcode_cache import get_transcode_cache
+from app.services.transcode_scheduler import get_transcode_scheduler
+from app.services.transcode_sessions import get_session_manager
+from app.utils.file_response import ThroughputMeter
+
+METHODS = ("direct", "range", "cached", "remux", "audio_transcode", "transcode", "progressive", "hls")
+
+# Waiting this long for the next chunk, or for a later request's first byte, is a stall
+STALL_SECONDS = 2.0
+
+# A session ends once it has had no open response for this long
+IDLE_SECONDS = 30.0
+
+# A response silent this long is assumed gone (its body never started or was dropped)
+ABANDON_SECONDS = 600.0
+
+# Finished sessions kept for /sessions
+RECENT_SESSIONS = 200
+
+# Time-to-first-byte histogram buckets (seconds)
+TTFB_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# (name suffix, labels, value)
+Sample = Tuple[str, Dict[str, str], float]
+# (name, type, help, samples)
+MetricFamily = Tuple[str, str, str, List[Sample]]
+
+
+class StreamSession:
+    """
+    One client watching one file by one method.
+
+    Consecutive requests (range requests, HLS segments, seeks) from the
+    same client for the same file and method add to the same session
+    until it has been idle for :data:`IDLE_SECONDS`.
+    """
+
+    def __init__(self, session_id: int, file_id: int, method: str, client: str):
+        self.id = session_id
+        self.file_id = file_id
+        self.method = method
+        self.client = client
+        self.started_at = time.time()
+        self.ended_at: Optional[float] = None
+        self.detail: Optional[str] = None  # e.g. the negotiated profile
+        self.progress: Optional[Callable[[], Dict[str, float]]] = None  # FFmpeg progress, if transcoding
+
+        self.requests = 0
+        self.open_responses = 0
+        self.bytes = 0
+        self.send_seconds = 0.0
+        self.ttfb: Optional[float] = None
+        self.stalls = 0
+        self.stall_seconds = 0.0
+        self.best_kbps: Optional[float] = None
+        self.last_activity = time.monotonic()
+        self._opened = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON-friendly state."""
+        active = (self.ended_at or time.time()) - self.started_at
+        progress = self.progress() if self.progress else {}
+        return {
+            "id": self.id,
+            "file_id": self.file_id,
+            "method": self.method,
+            "detail": self.detail,
+            "client": self.client,
+            "started_at": self.started_at,
+            "ended_at": self.ended_at,
+            "seconds": round(active, 1),
+            "requests": self.requests,
+            "open_responses": self.open_responses,
+            "bytes": self.bytes,
+            "average_kbps": round(self.bytes * 8 / 1000 / active, 1) if active > 0 else None,
+            "throughput_kbps": round(self.best_kbps, 1) if self.best_kbps else None,
+            "ttfb": round(self.ttfb, 3) if self.ttfb is not None else None,
+            "stalls": self.stalls,
+            "stall_seconds": round(self.stall_seconds, 2),
+            "ffmpeg_speed": progress.get("speed"),
+        }
+
+
+class StreamTracker(ThroughputMeter):
+    """
+    One response of a stream session.
+
+    Given to responses as their throughput meter: every chunk sent is
+    recorded against the session, and closing it ends the response.
+    """
+
+    def __init__(self, registry: "StreamRegistry", session: StreamSession,
+                 on_close: Optional[Callable[[float], None]] = None):
+        super().__init__(on_close or (lambda kbps: None))
+        self.registry = registry
+        self.session = session
+        self.opened = time.monotonic()
+        self.last_sent: Optional[float] = None
+
+    def record(self, nbytes: int, seconds: float) -> None:
+        super().record(nbytes, seconds)
+        self.registry._record(self, nbytes, seconds)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        super().close()
+        self.registry._close(self)
+
+
+class StreamRegistry:
+    """
+    In-process record of every stream being served.
+
+    Tracks bytes, client throughput (best rate over measurement windows),
+    time to first byte, stalls (waits for data of :data:`STALL_SECONDS`
+    or more once playback started) and, for transcodes, FFmpeg's speed.
+    Active sessions and the last :data:`RECENT_SESSIONS` finished ones are
+    listed by :meth:`sessions`; :meth:`metrics` gives per-method totals.
+    """
+
+    def __init__(self, idle_seconds: float = IDLE_SECONDS, recent: int = RECENT_SESSIONS):
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._active: Dict[Tuple[str, int, str], StreamSession] = {}
+        self._recent: Deque[StreamSession] = deque(maxlen=recent)
+        self._totals: Dict[str, Dict[str, float]] = defaultdict(
+            lambda: {"sessions": 0, "requests": 0, "bytes": 0, "stalls": 0, "stall_seconds": 0.0}
+        )
+        self._ttfb: Dict[str, List[float]] = defaultdict(lambda: [0] * len(TTFB_BUCKETS))
+        self._ttfb_sum: Dict[str, float] = defaultdict(float)
+        self._ttfb_count: Dict[str, int] = defaultdict(int)
+
+    def open(self, file_id: int, method: str, client: str,
+             on_close: Optional[Callable[[float], None]] = None) -> StreamTracker:
+        """
+        Start tracking a response, joining the client's session for this file and method.
+
+        Args:
+            file_id: Media file being streamed
+            method: One of :data:`METHODS`
+            client: Client identity (address)
+            on_close: Gets the response's measured throughput (kbit/s) when it ends
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._sweep_locked(now)
+            key = (client, file_id, method)
+            session = self._active.get(key)
+            if session is None:
+                session = StreamSession(next(self._ids), file_id, method, client)
+                self._active[key] = session
+                self._totals[method]["sessions"] += 1
+            session.requests += 1
+            session.open_responses += 1
+            session.last_activity = now
+            self._totals[method]["requests"] += 1
+        return StreamTracker(self, session, on_close)
+
+    def sessions(self) -> Dict[str, Any]:
+        """Active sessions, recently finished ones (newest first) and per-method totals."""
+        with self._lock:
+            self._sweep_locked(time.monotonic())
+            active = list(self._active.values())
+            recent = list(self._recent)
+            totals = {method: dict(values) for method, values in self._totals.items()}
+        return {
+            "active": [s.snapshot() for s in active],
+            "recent": [s.snapshot() for s in reversed(recent)],
+            "totals": totals,
+        }
+
+    def metrics(self) -> List[MetricFamily]:
+        """Stream metrics as Prometheus families."""
+        with self._lock:
+            self._sweep_locked(time.monotonic())
+            active = defaultdict(int)
+            for session in self._active.values():
+                active[session.method] += 1
+            totals = {method: dict(values) for method, values in self._totals.items()}
+            buckets = {method: list(counts) for method, counts in self._ttfb.items()}
+            ttfb_sum, ttfb_count = dict(self._ttfb_sum), dict(self._ttfb_count)
+
+        def per_method(values: Dict[str, float]) -> List[Sample]:
+            return [("", {"method": method}, value) for method, value in sorted(values.items())]
+
+        histogram: List[Sample] = []
+        for method in sorted(buckets):
+            for bound, count in zip(TTFB_BUCKETS, buckets[method]):
+                histogram.append(("_bucket", {"method": method, "le": f"{bound:g}"}, count))
+            histogram.append(("_bucket", {"method": method, "le": "+Inf"}, ttfb_count[method]))
+            histogram.append(("_sum", {"method": method}, round(ttfb_sum[method], 6)))
+            histogram.append(("_count", {"method": method}, ttfb_count[method]))
+
+        def total(name: str) -> Dict[str, float]:
+            return {method: values[name] for method, values in totals.items()}
+
+        return [
+            ("mediavault_stream_sessions_active", "gauge", "Stream sessions being served",
+             per_method({m: active.get(m, 0) for m in set(active) | set(totals)})),
+            ("mediavault_stream_sessions_total", "counter", "Stream sessions started",
+             per_method(total("sessions"))),
+            ("mediavault_stream_requests_total", "counter", "Stream requests (ranges, segments, seeks)",
+             per_method(total("requests"))),
+            ("mediavault_stream_bytes_total", "counter", "Bytes sent to stream clients",
+             per_method(total("bytes"))),
+            ("mediavault_stream_stalls_total", "counter", "Waits for data once playback had started",
+             per_method(total("stalls"))),
+            ("mediavault_stream_stall_seconds_total", "counter", "Time spent in stalls",
+             per_method({m: round(v, 3) for m, v in total("stall_seconds").items()})),
+            ("mediavault_stream_ttfb_seconds", "histogram", "Time from request to first byte sent",
+             histogram),
+        ]
+
+    def _record(self, tracker: StreamTracker, nbytes: int, seconds: float) -> None:
+        now = time.monotonic()
+        sent_at = now - seconds
+        session = tracker.session
+        with self._lock:
+            totals = self._totals[session.method]
+            if tracker.last_sent is None:
+                wait = sent_at - tracker.opened
+                self._observe_ttfb_locked(session.method, wait)
+                if session.ttfb is None:
+                    session.ttfb = wait
+                    wait = 0.0  # startup, not a stall
+            else:
+                wait = sent_at - tracker.last_sent
+            if wait >= STALL_SECONDS:
+                session.stalls += 1
+                session.stall_seconds += wait
+                totals["stalls"] += 1
+                totals["stall_seconds"] += wait
+            tracker.last_sent = now
+            session.bytes += nbytes
+            session.send_seconds += seconds
+            session.last_activity = now
+            totals["bytes"] += nbytes
+
+    def _close(self, tracker: StreamTracker) -> None:
+        session = tracker.session
+        with self._lock:
+            session.open_responses -= 1
+            session.last_activity = time.monotonic()
+            if tracker.best_kbps is not None:
+                session.best_kbps = max(session.best_kbps or 0.0, tracker.best_kbps)
+
+    def _observe_ttfb_locked(self, method: str, seconds: float) -> None:
+        counts = self._ttfb[method]
+        for i, bound in enumerate(TTFB_BUCKETS):
+            if seconds <= bound:
+                counts[i] += 1
+        self._ttfb_sum[method] += seconds
+        self._ttfb_count[method] += 1
+
+    def _sweep_locked(self, now: float) -> None:
+        for key, session in list(self._active.items()):
+            idle = now - session.last_activity
+            if (session.open_responses <= 0 and idle >= self.idle_seconds) or idle >= ABANDON_SECONDS:
+                session.ended_at = time.time() - (idle if session.open_responses <= 0 else 0.0)
+                del self._active[key]
+                self._recent.append(session)
+
+
+@lru_cache()
+def get_stream_registry() -> StreamRegistry:
+    """Process-wide stream session registry."""
+    return StreamRegistry()
+
+
+def service_metrics() -> List[MetricFamily]:
+    """Transcode scheduler, FFmpeg session, cache and background worker metrics."""
+    scheduler = get_transcode_scheduler().stats()
+    sessions = get_session_manager().stats()
+    cache = get_transcode_cache().stats()
+    store = get_hls_service().store.stats()
+    previews = get_preview_service().stats()
+    prewarm = get_prewarm_service().stats()
+
+    def gauge(name: str, help_text: str, value: float, labels: Optional[Dict[str, str]] = None) -> MetricFamily:
+        return name, "gauge", help_text, [("", labels or {}, value)]
+
+    def counter(name: str, help_text: str, value: float) -> MetricFamily:
+        return name, "counter", help_text, [("", {}, value)]
+
+    devices = ("gpu", "cpu")
+    # Aggregates only: per-session labels (keys, filenames) would be unbounded series
+    speeds = [s["progress"]["speed"] for s in sessions["active"] if s["progress"].get("speed") is not None]
+    return [
+        ("mediavault_transcode_slots", "gauge", "Encoder slots per device",
+         [("", {"device": d}, scheduler[d]["slots"]) for d in devices]),
+        ("mediavault_transcode_slots_used", "gauge", "Encoder slots in use per device",
+         [("", {"device": d}, scheduler[d]["used"]) for d in devices]),
+        gauge("mediavault_transcode_queue_length", "Jobs waiting for an encoder slot", len(scheduler["queue"])),
+        counter("mediavault_transcode_granted_total", "Encoder slots granted", scheduler["granted"]),
+        counter("mediavault_transcode_queued_total", "Jobs that had to queue", scheduler["queued"]),
+        counter("mediavault_transcode_queue_timeouts_total", "Jobs that gave up waiting", scheduler["timeouts"]),
+        counter("mediavault_transcode_cpu_fallbacks_total", "GPU jobs run on the CPU",
+                scheduler["cpu_fallbacks"]),
+        gauge("mediavault_ffmpeg_sessions_active", "Shared FFmpeg stream sessions", len(sessions["active"])),
+        gauge("mediavault_ffmpeg_viewers", "Viewers of shared FFmpeg sessions",
+              sum(s["viewers"] for s in sessions["active"])),
+        ("mediavault_ffmpeg_speed_min", "gauge", "Slowest running encode (1 = realtime)",
+         [("", {}, min(speeds))] if speeds else []),
+        ("mediavault_ffmpeg_speed_avg", "gauge", "Mean speed of running encodes (1 = realtime)",
+         [("", {}, sum(speeds) / len(speeds))] if speeds else []),
+        counter("mediavault_ffmpeg_sessions_started_total", "FFmpeg sessions started", sessions["started"]),
+        counter("mediavault_ffmpeg_sessions_joined_total", "Viewers joining a running session", sessions["joined"]),
+        gauge("mediavault_transcode_cache_bytes", "Transcode cache size", cache["bytes"]),
+        gauge("mediavault_transcode_cache_max_bytes", "Transcode cache budget", cache["max_bytes"]),
+        gauge("mediavault_transcode_cache_entries", "Cached transcodes", cache["entries"]),
+        counter("mediavault_transcode_cache_hits_total", "Transcode cache hits", cache["hits"]),
+        counter("mediavault_transcode_cache_misses_total", "Transcode cache misses", cache["misses"]),
+        counter("mediavault_transcode_cache_evicted_bytes_total", "Bytes evicted from the transcode cache",
+                cache["evicted_bytes"]),
+        gauge("mediavault_hls_store_bytes", "HLS segment store size", store["bytes"]),
+        gauge("mediavault_hls_store_max_bytes", "HLS segment store budget", store["max_bytes"]),
+        gauge("mediavault_hls_store_titles", "Titles with stored HLS segments", store["titles"]),
+        counter("mediavault_hls_store_evicted_bytes_total", "Bytes evicted from the HLS store",
+                store["evicted_bytes"]),
+        counter("mediavault_preview_generated_total", "Preview artifacts generated", previews["generated"]),
+        counter("mediavault_preview_failed_total", "Preview artifacts that failed", previews["failed"]),
+        gauge("mediavault_preview_pending", "Files waiting for preview generation", previews["pending"]),
+        counter("mediavault_prewarm_completed_total", "Titles prewarmed", prewarm["prewarmed"]),
+        counter("mediavault_prewarm_yielded_total", "Prewarm encodes stopped for other work", prewarm["yielded"]),
+        gauge("mediavault_prewarm_pending", "Prewarm backlog", prewarm["pending"]),
+        gauge("mediavault_prewarm_bytes", "Prewarmed output on disk", prewarm["bytes"]),
+        gauge("mediavault_prewarm_cpu_seconds_last_hour", "CPU time used by prewarm encodes in the last hour",
+              prewarm["cpu_seconds_last_hour"]),
+    ]
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_metrics(families: Iterable[MetricFamily]) -> str:
+    """Prometheus text exposition format (0.0.4)."""
+    lines = []
+    for name, kind, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for suffix, labels, value in samples:
+            label_text = ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+            lines.append(f"{name}{suffix}{{{label_text}}} {_number(value)}" if label_text
+                         else f"{name}{suffix} {_number(value)}")
+    return "\n".join(lines) + "\n"
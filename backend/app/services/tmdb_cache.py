@@ -0,0 +1,213 @@
+"""Two-level (in-process LRU + database) cache for TMDb API responses."""
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.models import TMDbCacheEntry
+
+# Returned by TMDbCache.get when nothing usable is cached. A cached
+# negative result is returned as None.
+MISS = object()
+
+_NON_WORD = re.compile(r"[^\w\s]")
+
+
+class TMDbCache:
+    """
+    Cache of TMDb lookups keyed by normalized (endpoint, query, year).
+
+    Lookups check an in-process LRU first, then the ``tmdb_cache`` table.
+    Found results live for ``tmdb_cache_ttl_hours``; misses ("no match on
+    TMDb") are cached too, with the shorter ``tmdb_cache_negative_ttl_hours``
+    so new releases are picked up. Errors are never cached.
+    """
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Session]] = None,
+        memory_size: Optional[int] = None,
+        ttl_hours: Optional[int] = None,
+        negative_ttl_hours: Optional[int] = None,
+    ):
+        settings = get_settings()
+        if session_factory is None:
+            from app.database import SessionLocal
+            session_factory = SessionLocal
+
+        self.session_factory = session_factory
+        self.memory_size = memory_size if memory_size is not None else settings.tmdb_cache_memory_size
+        self.ttl = timedelta(hours=ttl_hours if ttl_hours is not None else settings.tmdb_cache_ttl_hours)
+        self.negative_ttl = timedelta(
+            hours=negative_ttl_hours if negative_ttl_hours is not None else settings.tmdb_cache_negative_ttl_hours
+        )
+
+        self._memory: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "memory_hits": 0,
+            "db_hits": 0,
+            "negative_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "errors": 0,
+        }
+
+    @staticmethod
+    def normalize_query(query: Optional[str]) -> str:
+        """Lowercase, strip punctuation and collapse whitespace."""
+        if not query:
+            return ""
+        return " ".join(_NON_WORD.sub(" ", query.lower()).split())
+
+    @classmethod
+    def make_key(cls, endpoint: str, query: Optional[str] = None, year: Optional[int] = None) -> str:
+        """Build the cache key for an (endpoint, query, year) lookup."""
+        return f"{endpoint}|{cls.normalize_query(query)}|{year or ''}"
+
+    def get(self, endpoint: str, query: Optional[str] = None, year: Optional[int] = None) -> Any:
+        """
+        Look up a cached response.
+
+        Returns:
+            Cached value, None for a cached negative result, or MISS
+        """
+        key = self.make_key(endpoint, query, year)
+
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                value, expires = cached
+                if expires > time.time():
+                    self._memory.move_to_end(key)
+                    self._count("memory_hits", negative=value is None)
+                    return value
+                del self._memory[key]
+
+        try:
+            db = self.session_factory()
+            try:
+                entry = (
+                    db.query(TMDbCacheEntry)
+                    .filter(TMDbCacheEntry.cache_key == key)
+                    .filter(TMDbCacheEntry.expires_at > datetime.utcnow())
+                    .first()
+                )
+                if entry is not None:
+                    value = None if entry.is_negative else entry.response
+                    self._remember(key, value, entry.expires_at)
+                    with self._lock:
+                        self._count("db_hits", negative=value is None)
+                    return value
+            finally:
+                db.close()
+        except Exception as e:
+            logger.warning(f"TMDb cache lookup failed for {key}: {e}")
+            with self._lock:
+                self._counters["errors"] += 1
+
+        with self._lock:
+            self._counters["misses"] += 1
+        return MISS
+
+    def set(self, endpoint: str, query: Optional[str], year: Optional[int], value: Any) -> None:
+        """Store a response (None records a negative result)."""
+        key = self.make_key(endpoint, query, year)
+        is_negative = value is None
+        now = datetime.utcnow()
+        expires_at = now + (self.negative_ttl if is_negative else self.ttl)
+
+        self._remember(key, value, expires_at)
+
+        try:
+            db = self.session_factory()
+            try:
+                entry = db.query(TMDbCacheEntry).filter(TMDbCacheEntry.cache_key == key).first()
+                if entry is None:
+                    entry = TMDbCacheEntry(
+                        cache_key=key,
+                        endpoint=endpoint,
+                        query=self.normalize_query(query)[:500] or None,
+                        year=year,
+                    )
+                    db.add(entry)
+                entry.response = value
+                entry.is_negative = is_negative
+                entry.fetched_at = now
+                entry.expires_at = expires_at
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+            with self._lock:
+                self._counters["stores"] += 1
+        except Exception as e:
+            logger.warning(f"TMDb cache store failed for {key}: {e}")
+            with self._lock:
+                self._counters["errors"] += 1
+
+    def purge_expired(self) -> int:
+        """Delete expired rows from the cache table."""
+        db = self.session_factory()
+        try:
+            deleted = (
+                db.query(TMDbCacheEntry)
+                .filter(TMDbCacheEntry.expires_at <= datetime.utcnow())
+                .delete(synchronize_session=False)
+            )
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    def clear_memory(self) -> None:
+        """Drop the in-process layer (the table is untouched)."""
+        with self._lock:
+            self._memory.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and memory-layer occupancy."""
+        with self._lock:
+            counters = dict(self._counters)
+            memory_entries = len(self._memory)
+
+        hits = counters["memory_hits"] + counters["db_hits"]
+        lookups = hits + counters["misses"]
+        return {
+            **counters,
+            "hits": hits,
+            "lookups": lookups,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": memory_entries,
+            "memory_size": self.memory_size,
+        }
+
+    def _remember(self, key: str, value: Any, expires_at: datetime) -> None:
+        if self.memory_size <= 0:
+            return
+        expires = time.time() + (expires_at - datetime.utcnow()).total_seconds()
+        with self._lock:
+            self._memory[key] = (value, expires)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _count(self, counter: str, negative: bool) -> None:
+        self._counters[counter] += 1
+        if negative:
+            self._counters["negative_hits"] += 1
+
+
+@lru_cache()
+def get_tmdb_cache() -> TMDbCache:
+    """Process-wide TMDb cache shared by all TMDbService instances."""
+    return TMDbCache()
@@ -0,0 +1,173 @@
+"""Async HTTP client for the TMDb API with a process-wide token bucket."""
+import asyncio
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+import httpx
+from loguru import logger
+
+from app.config import get_settings
+
+# Status codes worth retrying: throttling and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by every TMDb request in the process.
+
+    Callers reserve a token and are told how long to wait for it, so many
+    requests (from any thread or event loop) can be in flight at once while
+    the aggregate rate stays within budget. Tokens can go negative: each
+    reservation queues behind the ones already handed out.
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_limit(cls, limit: int, period: float) -> "TokenBucket":
+        """
+        Bucket that never exceeds ``limit`` requests in any ``period`` window.
+
+        Half the budget is available as a burst and the other half refills
+        over the period, so burst + refill within one window equals ``limit``.
+        """
+        half = max(limit / 2.0, 1.0)
+        return cls(capacity=half, refill_per_second=half / period)
+
+    def reserve(self) -> float:
+        """Take a token and return the seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.refill_per_second)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.refill_per_second
+
+    async def acquire(self) -> None:
+        """Wait (without blocking the event loop) until a token is available."""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def acquire_sync(self) -> None:
+        """Blocking variant of :meth:`acquire` for synchronous callers."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+@lru_cache()
+def get_token_bucket() -> TokenBucket:
+    """Process-wide TMDb rate limiter (``tmdb_rate_limit`` per 10 seconds)."""
+    return TokenBucket.for_limit(get_settings().tmdb_rate_limit, 10.0)
+
+
+class TMDbClient:
+    """
+    Pooled ``httpx.AsyncClient`` wrapper for TMDb.
+
+    Every request takes a token from the shared bucket, reuses keep-alive
+    connections, and is retried with exponential backoff on 429/5xx and
+    transport errors (honouring ``Retry-After`` when TMDb sends it).
+
+    Use as an async context manager::
+
+        async with TMDbClient() as client:
+            data = await client.get_json("search/movie", {"query": "Alien"})
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        read_token: Optional[str] = None,
+        bucket: Optional[TokenBucket] = None,
+        max_connections: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        backoff_seconds: Optional[float] = None,
+        timeout: float = 10.0,
+    ):
+        settings = get_settings()
+        self.base_url = base_url or settings.tmdb_base_url
+        self.read_token = read_token if read_token is not None else settings.tmdb_read_access_token
+        self.bucket = bucket or get_token_bucket()
+        self.max_connections = max_connections or settings.tmdb_max_connections
+        self.max_retries = max_retries if max_retries is not None else settings.tmdb_max_retries
+        self.backoff_seconds = backoff_seconds if backoff_seconds is not None else settings.tmdb_retry_backoff_seconds
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def __aenter__(self) -> "TMDbClient":
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={
+                'Authorization': f'Bearer {self.read_token}',
+                'Content-Type': 'application/json;charset=utf-8'
+            },
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ),
+            timeout=self.timeout,
+        )
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        GET ``path`` (relative to the API base URL) and return the JSON body.
+
+        Raises:
+            httpx.HTTPStatusError: Non-retryable status, or retries exhausted
+            httpx.TransportError: Connection failures after retries
+        """
+        if self._client is None:
+            raise RuntimeError("TMDbClient must be used as an async context manager")
+
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                response = await self._client.get(path, params=params)
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.debug(f"TMDb {path} transport error ({e}), retrying in {delay:.2f}s")
+            else:
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response.json()
+                if attempt >= self.max_retries:
+                    response.raise_for_status()
+                delay = self._retry_after(response) or self._backoff(attempt)
+                logger.debug(f"TMDb {path} returned {response.status_code}, retrying in {delay:.2f}s")
+
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _backoff(self, attempt: int) -> float:
+        return self.backoff_seconds * (2 ** attempt)
+
+    @staticmethod
+    def _retry_after(response: httpx.Response) -> Optional[float]:
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            return None
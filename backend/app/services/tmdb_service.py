@@ -1,59 +1,92 @@
 """TMDb (The Movie Database) API service for metadata enrichment."""
-import time
-from typing import Optional, Dict, Any
-import requests
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Callable, Awaitable, List, Tuple
 from loguru import logger
 
 from app.config import get_settings
+from app.services.tmdb_cache import TMDbCache, MISS, get_tmdb_cache
+from app.services.tmdb_client import TMDbClient, TokenBucket
 
 settings = get_settings()
 
 
-class TMDbService:
-    """Service for interacting with The Movie Database API."""
+def _run_sync(coro: Awaitable[Any]) -> Any:
+    """Run a coroutine to completion from synchronous code, even under a running event loop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    # asyncio.run() refuses to nest: give the coroutine a loop of its own
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
 
-    def __init__(self):
+class TMDbService:
+    """
+    Service for interacting with The Movie Database API.
+
+    Requests go through :class:`TMDbClient` (pooled httpx client, shared
+    token bucket, retries). The synchronous methods run their own short
+    event loop (on a worker thread when called from inside a running
+    one, e.g. an ``async def`` route); batch callers should use :meth:`enrich_many` so all titles
+    share one connection pool and overlap in flight.
+    """
+
+    def __init__(
+        self,
+        cache: Optional[TMDbCache] = None,
+        base_url: Optional[str] = None,
+        bucket: Optional[TokenBucket] = None,
+    ):
         self.api_key = settings.tmdb_api_key
         self.read_token = settings.tmdb_read_access_token
-        self.base_url = settings.tmdb_base_url
-        self.rate_limit = settings.tmdb_rate_limit
-
-        # Rate limiting
-        self.request_times = []
-
-        # Session for connection pooling
-        self.session = requests.Session()
-        self.session.headers.update({
-            'Authorization': f'Bearer {self.read_token}',
-            'Content-Type': 'application/json;charset=utf-8'
-        })
-
-    def _rate_limit(self):
-        """Implement rate limiting (40 requests per 10 seconds)."""
-        now = time.time()
-        self.request_times = [t for t in self.request_times if now - t < 10]
-
-        if len(self.request_times) >= self.rate_limit:
-            sleep_time = 10 - (now - self.request_times[0])
-            if sleep_time > 0:
-                logger.debug(f"Rate limit reached, sleeping {sleep_time:.2f}s")
-                time.sleep(sleep_time)
-                self.request_times = []
-
-        self.request_times.append(now)
+        self.base_url = base_url or settings.tmdb_base_url
+        self.bucket = bucket  # None -> process-wide bucket
+
+        # Shared response cache (in-process LRU + tmdb_cache table)
+        if cache is None and settings.tmdb_cache_enabled:
+            cache = get_tmdb_cache()
+        self.cache = cache
+
+    def client(self) -> TMDbClient:
+        """New pooled client; use as ``async with service.client() as client``."""
+        return TMDbClient(base_url=self.base_url, read_token=self.read_token, bucket=self.bucket)
+
+    async def _cached_lookup(
+        self,
+        endpoint: str,
+        query: Optional[str],
+        year: Optional[int],
+        fetch: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        Return a cached result or await ``fetch`` and cache what it returns.
+
+        ``fetch`` returns None when TMDb has no match (cached as a negative
+        result) and raises on request errors (never cached). The cache's
+        database round-trips run on worker threads, so lookups gathered by
+        :meth:`enrich_many_async` don't queue behind each other on the loop.
+        """
+        if self.cache is not None:
+            cached = await asyncio.to_thread(self.cache.get, endpoint, query, year)
+            if cached is not MISS:
+                return cached
+
+        result = await fetch()
+
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.set, endpoint, query, year, result)
+        return result
 
-    def search_tv(self, title: str, year: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    async def search_tv_async(self, client: TMDbClient, title: str, year: Optional[int] = None) -> Optional[Dict[str, Any]]:
         """Search for a TV show."""
-        self._rate_limit()
-
-        params = {'query': title, 'include_adult': False}
-        if year:
-            params['first_air_date_year'] = year
+        async def fetch():
+            params = {'query': title, 'include_adult': 'false'}
+            if year:
+                params['first_air_date_year'] = year
 
-        try:
-            response = self.session.get(f"{self.base_url}search/tv", params=params, timeout=10)
-            response.raise_for_status()
-            results = response.json().get('results', [])
+            results = (await client.get_json("search/tv", params)).get('results', [])
 
             if results:
                 show = results[0]
@@ -66,22 +99,22 @@ class TMDbService:
                     'tmdb_poster_path': show.get('poster_path'),
                 }
             return None
+
+        try:
+            result = await self._cached_lookup("search/tv", title, year, fetch)
+            return dict(result) if result else None
         except Exception as e:
             logger.error(f"TMDb search error: {e}")
             return None
 
-    def search_movie(self, title: str, year: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    async def search_movie_async(self, client: TMDbClient, title: str, year: Optional[int] = None) -> Optional[Dict[str, Any]]:
         """Search for a movie."""
-        self._rate_limit()
-
-        params = {'query': title, 'include_adult': False}
-        if year:
-            params['year'] = year
+        async def fetch():
+            params = {'query': title, 'include_adult': 'false'}
+            if year:
+                params['year'] = year
 
-        try:
-            response = self.session.get(f"{self.base_url}search/movie", params=params, timeout=10)
-            response.raise_for_status()
-            results = response.json().get('results', [])
+            results = (await client.get_json("search/movie", params)).get('results', [])
 
             if results:
                 movie = results[0]
@@ -94,33 +127,80 @@ class TMDbService:
                     'tmdb_poster_path': movie.get('poster_path'),
                 }
             return None
+
+        try:
+            result = await self._cached_lookup("search/movie", title, year, fetch)
+            return dict(result) if result else None
         except Exception as e:
             logger.error(f"TMDb search error: {e}")
             return None
 
-    def get_external_ids(self, tmdb_id: int, media_type: str) -> Optional[str]:
+    async def get_external_ids_async(self, client: TMDbClient, tmdb_id: int, media_type: str) -> Optional[str]:
         """Get IMDB ID for a TMDb entry."""
-        self._rate_limit()
+        async def fetch():
+            data = await client.get_json(f"{media_type}/{tmdb_id}/external_ids")
+            return data.get('imdb_id')
 
         try:
-            endpoint = f"{media_type}/{tmdb_id}/external_ids"
-            response = self.session.get(f"{self.base_url}{endpoint}", timeout=10)
-            response.raise_for_status()
-            return response.json().get('imdb_id')
+            return await self._cached_lookup(f"{media_type}/external_ids", str(tmdb_id), None, fetch)
         except Exception as e:
             logger.error(f"TMDb external IDs error: {e}")
             return None
 
-    def enrich_media_metadata(self, title: str, year: Optional[int], media_type: str) -> Optional[Dict[str, Any]]:
+    async def enrich_media_metadata_async(
+        self,
+        client: TMDbClient,
+        title: str,
+        year: Optional[int],
+        media_type: str
+    ) -> Optional[Dict[str, Any]]:
         """Enrich media file with TMDb and IMDB metadata."""
         if not title:
             return None
 
-        result = self.search_tv(title, year) if media_type == "tv" else self.search_movie(title, year)
+        if media_type == "tv":
+            result = await self.search_tv_async(client, title, year)
+        else:
+            result = await self.search_movie_async(client, title, year)
 
         if result and result.get('tmdb_id'):
-            imdb_id = self.get_external_ids(result['tmdb_id'], result['tmdb_type'])
+            imdb_id = await self.get_external_ids_async(client, result['tmdb_id'], result['tmdb_type'])
             if imdb_id:
                 result['imdb_id'] = imdb_id
 
         return result
+
+    async def enrich_many_async(
+        self,
+        titles: List[Tuple[str, Optional[int], str]]
+    ) -> List[Optional[Dict[str, Any]]]:
+        """Enrich (title, year, media_type) tuples concurrently over one client."""
+        async with self.client() as client:
+            return await asyncio.gather(*(
+                self.enrich_media_metadata_async(client, title, year, media_type)
+                for title, year, media_type in titles
+            ))
+
+    def enrich_many(self, titles: List[Tuple[str, Optional[int], str]]) -> List[Optional[Dict[str, Any]]]:
+        """Synchronous wrapper for :meth:`enrich_many_async`."""
+        return _run_sync(self.enrich_many_async(titles))
+
+    def search_tv(self, title: str, year: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Search for a TV show."""
+        return _run_sync(self._with_client(self.search_tv_async, title, year))
+
+    def search_movie(self, title: str, year: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Search for a movie."""
+        return _run_sync(self._with_client(self.search_movie_async, title, year))
+
+    def get_external_ids(self, tmdb_id: int, media_type: str) -> Optional[str]:
+        """Get IMDB ID for a TMDb entry."""
+        return _run_sync(self._with_client(self.get_external_ids_async, tmdb_id, media_type))
+
+    def enrich_media_metadata(self, title: str, year: Optional[int], media_type: str) -> Optional[Dict[str, Any]]:
+        """Enrich media file with TMDb and IMDB metadata."""
+        return _run_sync(self._with_client(self.enrich_media_metadata_async, title, year, media_type))
+
+    async def _with_client(self, method: Callable[..., Awaitable[Any]], *args) -> Any:
+        async with self.client() as client:
+            return await method(client, *args)
@@ -0,0 +1,231 @@
+"""Content-addressed on-disk cache for transcoded media."""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from loguru import logger
+
+from app.config import get_settings
+
+INDEX_FILE = "index.json"
+
+# Persist access stats at most this often (publishes/evictions save at once)
+INDEX_SAVE_INTERVAL = 30.0
+
+
+def media_fingerprint(md5_hash: Optional[str], path: str) -> str:
+    """
+    Identify source content for cache keys.
+
+    Uses the scanned MD5 when available so renamed or moved files keep
+    their cache entries; otherwise falls back to path, size and mtime.
+    """
+    if md5_hash:
+        return md5_hash
+    stat = os.stat(path)
+    return f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def transcode_cache_key(fingerprint: str, profile: str, width: Optional[int] = None,
+                        height: Optional[int] = None) -> str:
+    """Cache key for (source content, output profile, resolution)."""
+    resolution = f"{width}x{height}" if width and height else "source"
+    return hashlib.sha256(f"{fingerprint}|{profile}|{resolution}".encode()).hexdigest()
+
+
+class TranscodeCache:
+    """
+    Size-bounded cache of finished transcodes, keyed by :func:`transcode_cache_key`.
+
+    Outputs are written to a temp file under the cache root and published
+    with an atomic rename, so readers never see partial files. When the
+    total size exceeds the budget, entries are evicted least recently used
+    first (``lru``) or least frequently used first (``lfu``, ties broken by
+    age). The index (size, hits, last access) is kept in memory and
+    persisted as ``index.json``; it is rebuilt from disk if missing, and
+    files published by other worker processes are adopted on lookup.
+    """
+
+    def __init__(
+        self,
+        root: Optional[str] = None,
+        max_bytes: Optional[int] = None,
+        policy: Optional[str] = None,
+    ):
+        settings = get_settings()
+        self.root = Path(root or settings.transcode_cache_dir)
+        self.max_bytes = max_bytes if max_bytes is not None else int(settings.transcode_cache_max_gb * 1024 ** 3)
+        self.policy = (policy or settings.transcode_cache_policy).lower()
+        if self.policy not in ("lru", "lfu"):
+            raise ValueError(f"Unknown transcode cache policy: {self.policy}")
+
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._counters = {"hits": 0, "misses": 0, "publishes": 0, "evictions": 0, "evicted_bytes": 0}
+        self._last_save = 0.0
+        self._load()
+
+    def path_for(self, key: str) -> Path:
+        """Final location of a cache entry."""
+        return self.root / key[:2] / f"{key}.mp4"
+
+    def temp_path(self, key: str) -> Path:
+        """Unique temp file on the cache filesystem, for :meth:`publish`."""
+        tmp_dir = self.root / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        # Keep the .mp4 suffix so ffmpeg can infer the muxer
+        return tmp_dir / f"{key}.{uuid.uuid4().hex}.mp4"
+
+    def lookup(self, key: str) -> Optional[Path]:
+        """Return the cached file for ``key`` (recording a hit) or None."""
+        path = self.path_for(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not path.exists():
+                # Removed behind our back
+                del self._entries[key]
+                entry = None
+            if entry is None and path.exists():
+                # Published by another worker process
+                stat = path.stat()
+                entry = {"size": stat.st_size, "hits": 0, "created": stat.st_mtime, "last_access": stat.st_mtime}
+                self._entries[key] = entry
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+
+            entry["hits"] += 1
+            entry["last_access"] = time.time()
+            self._counters["hits"] += 1
+            self._save_locked(force=False)
+        return path
+
+    def contains(self, key: str) -> bool:
+        """True if ``key`` is cached (doesn't count as a hit or miss)."""
+        with self._lock:
+            return key in self._entries and self.path_for(key).exists()
+
+    def publish(self, key: str, temp_path: Path) -> Path:
+        """
+        Atomically move a finished output into the cache.
+
+        Returns:
+            Final cache path
+        """
+        final = self.path_for(key)
+        final.parent.mkdir(parents=True, exist_ok=True)
+        size = temp_path.stat().st_size
+        os.replace(temp_path, final)
+
+        with self._lock:
+            now = time.time()
+            self._entries[key] = {"size": size, "hits": 0, "created": now, "last_access": now}
+            self._counters["publishes"] += 1
+            self._evict_locked(keep=key)
+            self._save_locked(force=True)
+
+        logger.info(f"Transcode cache: published {key[:12]} ({size / 1024 ** 2:.1f} MB)")
+        return final
+
+    def discard(self, temp_path: Path) -> None:
+        """Remove an unfinished temp output."""
+        try:
+            temp_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current usage."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = sum(entry["size"] for entry in self._entries.values())
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["max_bytes"] = self.max_bytes
+        stats["policy"] = self.policy
+        return stats
+
+    def _evict_locked(self, keep: Optional[str] = None) -> None:
+        total = sum(entry["size"] for entry in self._entries.values())
+        if total <= self.max_bytes:
+            return
+
+        if self.policy == "lfu":
+            order = sorted(self._entries, key=lambda k: (self._entries[k]["hits"], self._entries[k]["last_access"]))
+        else:
+            order = sorted(self._entries, key=lambda k: self._entries[k]["last_access"])
+
+        for key in order:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            entry = self._entries.pop(key)
+            try:
+                self.path_for(key).unlink()
+            except FileNotFoundError:
+                pass
+            total -= entry["size"]
+            self._counters["evictions"] += 1
+            self._counters["evicted_bytes"] += entry["size"]
+            logger.info(f"Transcode cache: evicted {key[:12]} ({entry['size'] / 1024 ** 2:.1f} MB)")
+
+    def _load(self) -> None:
+        index = self.root / INDEX_FILE
+        try:
+            with open(index) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            entries = self._scan()
+        except (OSError, ValueError) as e:
+            logger.warning(f"Transcode cache index unreadable, rebuilding: {e}")
+            entries = self._scan()
+
+        # Drop entries whose files are gone
+        self._entries = {key: entry for key, entry in entries.items() if self.path_for(key).exists()}
+
+        # Leftovers from interrupted transcodes
+        tmp_dir = self.root / "tmp"
+        if tmp_dir.is_dir():
+            for leftover in tmp_dir.glob("*.mp4"):
+                self.discard(leftover)
+
+    def _scan(self) -> Dict[str, Dict[str, Any]]:
+        entries = {}
+        if self.root.is_dir():
+            for path in self.root.glob("??/*.mp4"):
+                stat = path.stat()
+                entries[path.stem] = {
+                    "size": stat.st_size,
+                    "hits": 0,
+                    "created": stat.st_mtime,
+                    "last_access": stat.st_atime,
+                }
+        return entries
+
+    def _save_locked(self, force: bool) -> None:
+        now = time.monotonic()
+        if not force and now - self._last_save < INDEX_SAVE_INTERVAL:
+            return
+        self._last_save = now
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp = self.root / f"{INDEX_FILE}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp, self.root / INDEX_FILE)
+        except OSError as e:
+            logger.warning(f"Failed to save transcode cache index: {e}")
+
+
+@lru_cache()
+def get_transcode_cache() -> TranscodeCache:
+    """Process-wide transcode cache."""
+    return TranscodeCache()
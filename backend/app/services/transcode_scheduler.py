@@ -0,0 +1,201 @@
+"""Admission control for FFmpeg encodes: slots per encoder type, priority queueing."""
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional
+
+from loguru import logger
+
+from app.config import get_settings
+from app.services.ffmpeg_service import FFmpegService
+
+# Priority classes, most urgent first
+PRIORITIES = ("interactive", "preview", "prewarm")
+
+
+class TranscodeQueueTimeout(Exception):
+    """No encoder slot became free in time; ``position`` is where the request stood in the queue."""
+
+    def __init__(self, position: int):
+        super().__init__(f"Transcode queue full (position {position})")
+        self.position = position
+
+
+class TranscodeSlot:
+    """A granted encoder slot; ``gpu`` says which encoder the job should use."""
+
+    def __init__(self, scheduler: "TranscodeScheduler", device: str, priority: str, label: str):
+        self.scheduler = scheduler
+        self.device = device
+        self.priority = priority
+        self.label = label
+        self.granted_at = time.monotonic()
+        self._released = False
+
+    @property
+    def gpu(self) -> bool:
+        return self.device == "gpu"
+
+    def release(self) -> None:
+        """Give the slot back (idempotent)."""
+        if not self._released:
+            self._released = True
+            self.scheduler._release(self)
+
+
+class _Waiter:
+    def __init__(self, priority: str, prefer_gpu: bool, label: str, seq: int):
+        self.rank = PRIORITIES.index(priority)
+        self.priority = priority
+        self.prefer_gpu = prefer_gpu
+        self.label = label
+        self.seq = seq
+        self.queued_at = time.monotonic()
+        self.device: Optional[str] = None
+
+
+class TranscodeScheduler:
+    """
+    Limits concurrent encodes per encoder type and queues the rest by priority.
+
+    GPU slots cap NVENC sessions (consumer cards allow only a few), CPU
+    slots cap libx264 encodes so playback can't starve scans. A job that
+    prefers the GPU falls back to a CPU slot when all GPU slots are busy;
+    with no GPU (``gpu_slots=0``) everything runs on CPU slots. Waiters
+    are served interactive first, then preview, then prewarm, FIFO within
+    a class; a freed slot goes to the first waiter that can use it.
+    """
+
+    def __init__(self, gpu_slots: int = 0, cpu_slots: int = 1):
+        self.slots = {"gpu": max(0, gpu_slots), "cpu": max(1, cpu_slots)}
+        self._used = {"gpu": 0, "cpu": 0}
+        self._cond = threading.Condition()
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._active: List[TranscodeSlot] = []
+        self._counters = {"granted": 0, "queued": 0, "cpu_fallbacks": 0, "timeouts": 0}
+
+    def acquire(self, priority: str = "interactive", prefer_gpu: bool = True, label: str = "",
+                timeout: Optional[float] = None) -> TranscodeSlot:
+        """
+        Wait for an encoder slot.
+
+        Raises:
+            TranscodeQueueTimeout: if none was granted within ``timeout`` seconds
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown transcode priority: {priority}")
+
+        with self._cond:
+            waiter = _Waiter(priority, prefer_gpu, label, next(self._seq))
+            self._queue.append(waiter)
+            self._queue.sort(key=lambda w: (w.rank, w.seq))
+            self._dispatch_locked()
+            if waiter.device is None:
+                if timeout != 0:
+                    self._counters["queued"] += 1
+                    logger.info(f"Transcode queued ({label}, {priority}): position {self._position_locked(waiter)}")
+                if not self._cond.wait_for(lambda: waiter.device is not None, timeout):
+                    position = self._position_locked(waiter)
+                    self._queue.remove(waiter)
+                    self._counters["timeouts"] += 1
+                    raise TranscodeQueueTimeout(position)
+
+            slot = TranscodeSlot(self, waiter.device, priority, label)
+            self._active.append(slot)
+        return slot
+
+    def try_acquire(self, priority: str = "prewarm", prefer_gpu: bool = True,
+                    label: str = "") -> Optional[TranscodeSlot]:
+        """A slot if one is free right now and nobody is queued ahead, else None."""
+        try:
+            return self.acquire(priority, prefer_gpu, label, timeout=0)
+        except TranscodeQueueTimeout:
+            return None
+
+    @contextmanager
+    def slot(self, priority: str = "interactive", prefer_gpu: bool = True, label: str = "",
+             timeout: Optional[float] = None) -> Iterator[TranscodeSlot]:
+        """Hold a slot for the duration of a ``with`` block."""
+        slot = self.acquire(priority, prefer_gpu, label, timeout)
+        try:
+            yield slot
+        finally:
+            slot.release()
+
+    def has_waiters(self, priority: str = "interactive") -> bool:
+        """True if anyone of ``priority`` (or more urgent) is queued."""
+        rank = PRIORITIES.index(priority)
+        with self._cond:
+            return any(w.rank <= rank for w in self._queue)
+
+    def stats(self) -> Dict[str, Any]:
+        """Slot usage, running jobs and the queue with positions."""
+        now = time.monotonic()
+        with self._cond:
+            stats: Dict[str, Any] = dict(self._counters)
+            for device in ("gpu", "cpu"):
+                stats[device] = {"slots": self.slots[device], "used": self._used[device]}
+            stats["running"] = [
+                {"label": s.label, "priority": s.priority, "device": s.device,
+                 "seconds": round(now - s.granted_at, 1)}
+                for s in self._active
+            ]
+            stats["queue"] = [
+                {"label": w.label, "priority": w.priority, "position": position,
+                 "waiting": round(now - w.queued_at, 1)}
+                for position, w in enumerate(self._queue, 1)
+            ]
+        return stats
+
+    def _release(self, slot: TranscodeSlot) -> None:
+        with self._cond:
+            self._used[slot.device] -= 1
+            self._active.remove(slot)
+            self._dispatch_locked()
+
+    def _dispatch_locked(self) -> None:
+        granted = False
+        for waiter in list(self._queue):
+            device = self._free_device_locked(waiter.prefer_gpu)
+            if device is None:
+                if all(self._used[d] >= self.slots[d] for d in self.slots):
+                    break
+                continue
+            if waiter.prefer_gpu and device == "cpu" and self.slots["gpu"]:
+                self._counters["cpu_fallbacks"] += 1
+            self._used[device] += 1
+            waiter.device = device
+            self._queue.remove(waiter)
+            self._counters["granted"] += 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _free_device_locked(self, prefer_gpu: bool) -> Optional[str]:
+        if prefer_gpu and self._used["gpu"] < self.slots["gpu"]:
+            return "gpu"
+        if self._used["cpu"] < self.slots["cpu"]:
+            return "cpu"
+        return None
+
+    def _position_locked(self, waiter: _Waiter) -> int:
+        return self._queue.index(waiter) + 1
+
+
+def default_cpu_slots() -> int:
+    """Half the cores (at least one), leaving the rest for scans and the API."""
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+@lru_cache()
+def get_transcode_scheduler() -> TranscodeScheduler:
+    """Process-wide transcode scheduler (CPU-only when NVENC isn't available)."""
+    settings = get_settings()
+    gpu_slots = settings.transcode_gpu_slots if FFmpegService().check_gpu_encoding_available() else 0
+    cpu_slots = settings.transcode_cpu_slots or default_cpu_slots()
+    logger.info(f"Transcode scheduler: {gpu_slots} GPU slots, {cpu_slots} CPU slots")
+    return TranscodeScheduler(gpu_slots=gpu_slots, cpu_slots=cpu_slots)
@@ -0,0 +1,442 @@
+"""Shared FFmpeg transcode sessions for concurrent viewers of the same output."""
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import Future
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from loguru import logger
+
+from app.config import get_settings
+from app.services.ffmpeg_process import FFmpegProcess
+from app.services.transcode_cache import get_transcode_cache
+from app.services.transcode_scheduler import TranscodeScheduler, TranscodeSlot, get_transcode_scheduler
+from app.utils.fmp4 import FragmentIndex
+
+# Bytes per read from FFmpeg stdout and per chunk sent to subscribers
+SESSION_CHUNK_SIZE = 65536
+
+
+class TranscodeSession:
+    """
+    One FFmpeg process whose stdout is spooled to a file for many readers.
+
+    A pump thread appends FFmpeg output to the spool; subscribers read it
+    from any offset with ``pread`` and wait on a condition for more, so a
+    late joiner (second tab, player retry) starts from the beginning
+    without a second encode. The spooled fragmented MP4 is indexed as it
+    grows, so a seek within what has already been produced can be served
+    from the spool. Reference counting is done by the manager.
+
+    ``base_key`` identifies the output regardless of where it starts;
+    ``start_time`` is the source position (seconds) FFmpeg started from.
+    """
+
+    def __init__(self, key: str, cmd: List[str], label: str, spool_path: Path,
+                 cache_key: Optional[str] = None, base_key: Optional[str] = None,
+                 start_time: float = 0.0):
+        self.key = key
+        self.cmd = cmd
+        self.label = label
+        self.spool_path = spool_path
+        self.cache_key = cache_key
+        self.base_key = base_key or key
+        self.start_time = start_time
+        self.index = FragmentIndex()
+
+        self.size = 0
+        self.done = False
+        self.stopped = False
+        self.published = False
+        self.returncode: Optional[int] = None
+        self.subscribers = 0
+        self.slot: Optional[TranscodeSlot] = None
+
+        self._cond = threading.Condition()
+        self._fd: Optional[int] = None
+        self._process: Optional[FFmpegProcess] = None
+        self._linger_timer: Optional[threading.Timer] = None
+        self._on_finish: Optional[Callable[["TranscodeSession"], None]] = None
+
+    def start(self, on_finish: Callable[["TranscodeSession"], None]) -> None:
+        """Launch FFmpeg and the threads that spool its output."""
+        self._on_finish = on_finish
+        self.spool_path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(self.spool_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+
+        self._process = FFmpegProcess(self.cmd, f"session {self.key[:12]}, {self.label}").start()
+        threading.Thread(target=self._pump, daemon=True).start()
+
+    @property
+    def progress(self) -> Dict[str, float]:
+        """FFmpeg's latest ``-progress`` figures (speed, fps, out_time, ...)."""
+        return dict(self._process.progress) if self._process else {}
+
+    def read(self, offset: int, length: int = SESSION_CHUNK_SIZE,
+             cancel: Optional[threading.Event] = None) -> bytes:
+        """
+        Read spooled output at ``offset``, waiting while FFmpeg catches up.
+
+        Returns:
+            Up to ``length`` bytes; empty once the session has ended and
+            everything before it has been read, or once ``cancel`` is set
+        """
+        with self._cond:
+            while offset >= self.size and not self.done:
+                if cancel is not None and cancel.is_set():
+                    return b""
+                self._cond.wait(timeout=0.25 if cancel is not None else 1.0)
+            if offset >= self.size:
+                return b""
+            length = min(length, self.size - offset)
+            fd = self._fd
+        return os.pread(fd, length, offset)
+
+    def seek_offset(self, seconds: float) -> Optional[Tuple[int, float]]:
+        """
+        Spool offset of the fragment covering source time ``seconds``.
+
+        Only fragments that are already followed by more output (or by the
+        end of the session) qualify, so playback from there won't stall.
+
+        Returns:
+            ``(offset, fragment_time)`` or None if not produced yet
+        """
+        with self._cond:
+            relative = seconds - self.start_time
+            last = self.index.last_time
+            if relative < 0 or last is None or (relative >= last and not self.done):
+                return None
+            fragment = self.index.fragment_at(relative)
+            if fragment is None:
+                return None
+            fragment_time, offset = fragment
+            return offset, self.start_time + fragment_time
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until FFmpeg has exited and the output is final; returns :attr:`done`."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.done, timeout)
+            return self.done
+
+    def init_segment(self) -> bytes:
+        """The ``ftyp`` + ``moov`` header of the spooled output."""
+        with self._cond:
+            init_end, fd = self.index.init_end, self._fd
+        return os.pread(fd, init_end, 0) if init_end else b""
+
+    def stop(self) -> None:
+        """Terminate FFmpeg (if still running)."""
+        with self._cond:
+            self.stopped = True
+        process = self._process
+        if process and process.running:
+            logger.info(f"Stopping FFmpeg session {self.key[:12]} ({self.label})")
+            process.terminate()
+
+    def close(self) -> None:
+        """Release the spool (removing it unless it was published to the cache)."""
+        with self._cond:
+            fd, self._fd = self._fd, None
+        if fd is not None:
+            os.close(fd)
+        if not self.published:
+            try:
+                self.spool_path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _pump(self) -> None:
+        process = self._process
+        try:
+            while True:
+                chunk = process.stdout.read(SESSION_CHUNK_SIZE)
+                if not chunk:
+                    break
+                os.write(self._fd, chunk)
+                with self._cond:
+                    self.size += len(chunk)
+                    self.index.update(self._read_at, self.size)
+                    self._cond.notify_all()
+        except Exception as e:
+            logger.error(f"FFmpeg session {self.key[:12]} spool error: {e}")
+            process.terminate()
+        finally:
+            self.returncode = process.wait()
+            if process.budget_exceeded or (self.returncode not in (0, -15) and not self.stopped):  # -15 is SIGTERM
+                logger.error(f"FFmpeg session {self.key[:12]} failed (code {self.returncode}): "
+                             f"{process.budget_exceeded or process.error_summary()}")
+            else:
+                logger.info(f"FFmpeg session {self.key[:12]} ended ({self.label}, {self.size} bytes)")
+            self._on_finish(self)
+
+    def _read_at(self, offset: int, length: int) -> bytes:
+        return os.pread(self._fd, length, offset)
+
+    def _mark_done(self) -> None:
+        with self._cond:
+            self.done = True
+            self._cond.notify_all()
+
+
+class TranscodeSessionManager:
+    """
+    Coalesces identical transcode requests onto one FFmpeg process.
+
+    Streaming requests :meth:`open` a session by key (content, profile,
+    resolution) and iterate :meth:`stream`; the session is shared by every
+    concurrent viewer and FFmpeg is stopped once the last one has been gone
+    for ``linger`` seconds (long enough for a player's reconnect). A session
+    that completes with a ``cache_key`` publishes its spool straight into
+    the transcode cache. :meth:`single_flight` does the same coalescing for
+    blocking transcodes that write a file.
+
+    Coalescing is per process; with several workers, identical requests
+    routed to different workers still transcode separately.
+    """
+
+    def __init__(self, spool_dir: Optional[str] = None, linger: Optional[float] = None,
+                 scheduler: Optional[TranscodeScheduler] = None):
+        settings = get_settings()
+        self.spool_dir = Path(spool_dir or Path(tempfile.gettempdir()) / "mediavault_sessions")
+        self.linger = linger if linger is not None else settings.transcode_session_linger_seconds
+        self.scheduler = scheduler
+        self.queue_timeout = settings.transcode_queue_timeout_seconds
+
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, TranscodeSession] = {}
+        self._flights: Dict[str, Future] = {}
+        self._counters = {"started": 0, "joined": 0, "stopped_idle": 0, "completed": 0, "coalesced_runs": 0,
+                          "seek_reused": 0}
+
+    def open(self, key: str, cmd: Union[List[str], Callable[[bool], List[str]]], label: str,
+             cache_key: Optional[str] = None, base_key: Optional[str] = None, start_time: float = 0.0,
+             priority: Optional[str] = None, prefer_gpu: bool = True) -> TranscodeSession:
+        """
+        Subscribe to the running session for ``key``, starting it if needed.
+
+        With ``priority``, starting FFmpeg first waits for a transcode
+        scheduler slot, held until FFmpeg exits (joining needs none), and
+        ``cmd`` may be a callable taking ``use_gpu`` that is built once the
+        slot's encoder is known.
+
+        Every call must be paired with :meth:`release` (done by :meth:`stream`,
+        or a :meth:`releaser`).
+
+        Raises:
+            TranscodeQueueTimeout: if no slot freed up in time
+        """
+        with self._lock:
+            session = self._join_locked(key)
+            if session is not None:
+                return session
+
+        slot = None
+        if priority is not None:
+            scheduler = self.scheduler or get_transcode_scheduler()
+            slot = scheduler.acquire(priority, prefer_gpu, label, timeout=self.queue_timeout)
+
+        try:
+            with self._lock:
+                # Someone may have started it while we were queued
+                session = self._join_locked(key)
+                if session is None:
+                    if callable(cmd):
+                        cmd = cmd(slot.gpu if slot else prefer_gpu)
+                    if cache_key:
+                        spool_path = get_transcode_cache().temp_path(cache_key)
+                    else:
+                        spool_path = self.spool_dir / f"{key}.{uuid.uuid4().hex}.mp4"
+                    session = TranscodeSession(key, cmd, label, spool_path, cache_key, base_key, start_time)
+                    session.slot, slot = slot, None
+                    self._sessions[key] = session
+                    self._counters["started"] += 1
+                    try:
+                        session.start(self._finished)
+                    except Exception:
+                        del self._sessions[key]
+                        session.close()
+                        if session.slot:
+                            session.slot.release()
+                        raise
+                    self._subscribe_locked(session)
+        finally:
+            # Unused (joined a session) or the session could not be set up
+            if slot is not None:
+                slot.release()
+        return session
+
+    def find_seekable(self, base_key: str, seconds: float) -> Optional[Tuple[TranscodeSession, int, float]]:
+        """
+        Subscribe to a running session of ``base_key`` that already covers ``seconds``.
+
+        Returns:
+            ``(session, spool_offset, fragment_time)``, or None if no session
+            has produced that position yet (the caller starts a new one)
+        """
+        with self._lock:
+            for session in self._sessions.values():
+                if session.base_key != base_key:
+                    continue
+                found = session.seek_offset(seconds)
+                if found is not None:
+                    self._counters["seek_reused"] += 1
+                    self._subscribe_locked(session)
+                    return session, found[0], found[1]
+        return None
+
+    def release(self, session: TranscodeSession) -> None:
+        """Drop a subscriber; idle sessions stop after the linger period."""
+        with self._lock:
+            session.subscribers -= 1
+            if session.subscribers > 0:
+                return
+            if session.done:
+                session.close()
+                return
+            if self.linger > 0:
+                session._linger_timer = threading.Timer(self.linger, self._stop_if_idle, args=(session,))
+                session._linger_timer.daemon = True
+                session._linger_timer.start()
+                return
+            self._unregister_locked(session)
+        session.stop()
+
+    def releaser(self, session: TranscodeSession) -> Callable[[], None]:
+        """
+        A function that releases one subscription to ``session``; later calls do nothing.
+
+        Lets a response release its subscription however it ends, including
+        when its body never starts (client gone before the first byte).
+        """
+        lock = threading.Lock()
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            with lock:
+                if released:
+                    return
+                released = True
+            self.release(session)
+        return release
+
+    def stream(self, session: TranscodeSession, offset: int = 0, prefix: bytes = b"",
+               cancel: Optional[threading.Event] = None,
+               release: Optional[Callable[[], None]] = None) -> Iterator[bytes]:
+        """
+        Yield ``prefix`` then the session's output from ``offset``; releases on exit.
+
+        Setting ``cancel`` (client gone) ends the stream even while it is
+        waiting for FFmpeg, so the subscription is dropped straight away.
+        ``release`` (from :meth:`releaser`) replaces :meth:`release` when
+        the caller also releases elsewhere.
+        """
+        try:
+            if prefix:
+                yield prefix
+            while True:
+                chunk = session.read(offset, cancel=cancel)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                yield chunk
+        finally:
+            if release is not None:
+                release()
+            else:
+                self.release(session)
+
+    def single_flight(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Run ``fn`` once for concurrent callers with the same key and share its result."""
+        with self._lock:
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._flights[key] = future
+            else:
+                self._counters["coalesced_runs"] += 1
+
+        if not leader:
+            logger.info(f"Waiting for in-flight transcode {key[:12]}")
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Session counters and currently running sessions."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["active"] = [
+                {"key": s.key[:12], "label": s.label, "start_time": s.start_time,
+                 "viewers": s.subscribers, "bytes": s.size, "progress": s.progress}
+                for s in self._sessions.values()
+            ]
+        return stats
+
+    def _join_locked(self, key: str) -> Optional[TranscodeSession]:
+        session = self._sessions.get(key)
+        if session is not None:
+            self._counters["joined"] += 1
+            logger.info(f"Joining FFmpeg session {key[:12]} ({session.subscribers} viewers)")
+            self._subscribe_locked(session)
+        return session
+
+    def _subscribe_locked(self, session: TranscodeSession) -> None:
+        session.subscribers += 1
+        if session._linger_timer is not None:
+            session._linger_timer.cancel()
+            session._linger_timer = None
+
+    def _stop_if_idle(self, session: TranscodeSession) -> None:
+        with self._lock:
+            if session.subscribers > 0 or session.done:
+                return
+            self._counters["stopped_idle"] += 1
+            self._unregister_locked(session)
+        session.stop()
+
+    def _unregister_locked(self, session: TranscodeSession) -> None:
+        if self._sessions.get(session.key) is session:
+            del self._sessions[session.key]
+
+    def _finished(self, session: TranscodeSession) -> None:
+        if session.slot:
+            session.slot.release()
+        publish = session.cache_key and session.returncode == 0 and not session.stopped
+        if publish:
+            try:
+                get_transcode_cache().publish(session.cache_key, session.spool_path)
+                session.published = True
+            except OSError as e:
+                logger.warning(f"Failed to publish session {session.key[:12]} to cache: {e}")
+
+        # Marked done under the manager lock so release() can't close the
+        # spool before it has been published
+        with self._lock:
+            self._unregister_locked(session)
+            session._mark_done()
+            if session.returncode == 0:
+                self._counters["completed"] += 1
+            if session.subscribers == 0:
+                session.close()
+
+
+@lru_cache()
+def get_session_manager() -> TranscodeSessionManager:
+    """Process-wide transcode session manager."""
+    return TranscodeSessionManager()
@@ -0,0 +1,554 @@
+"""Byte-range file responses for media streaming."""
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from secrets import token_hex
+from functools import lru_cache
+from typing import BinaryIO, Callable, Deque, List, Mapping, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import Request
+from fastapi.responses import Response
+from starlette.background import BackgroundTask
+from starlette.types import Receive, Scope, Send
+
+from app.config import get_settings
+
+VIDEO_CONTENT_TYPES = {
+    ".mp4": "video/mp4",
+    ".mkv": "video/x-matroska",
+    ".avi": "video/x-msvideo",
+    ".mov": "video/quicktime",
+    ".webm": "video/webm",
+    ".m4v": "video/x-m4v",
+    ".wmv": "video/x-ms-wmv",
+    ".flv": "video/x-flv",
+    ".mpg": "video/mpeg",
+    ".mpeg": "video/mpeg",
+    ".ts": "video/mp2t",
+}
+
+# ASGI extension for zero-copy file bodies (os.sendfile in the server)
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+# Range headers listing more ranges than this are ignored (RFC 7233 section 6.1)
+MAX_RANGES = 16
+
+
+def video_content_type(filename: str) -> str:
+    """MIME type for a video filename (defaults to video/mp4)."""
+    return VIDEO_CONTENT_TYPES.get(os.path.splitext(filename)[1].lower(), "video/mp4")
+
+
+@lru_cache()
+def get_io_executor() -> ThreadPoolExecutor:
+    """
+    Thread pool dedicated to streaming reads.
+
+    Kept separate from AnyIO's default limiter so slow NAS reads for many
+    viewers can't starve request handlers (which share that limiter).
+    """
+    return ThreadPoolExecutor(
+        max_workers=get_settings().stream_io_workers,
+        thread_name_prefix="stream-io",
+    )
+
+
+class AdaptiveChunkSizer:
+    """
+    Picks read sizes between ``minimum`` and ``maximum`` (powers of two).
+
+    Starts from roughly ``target_seconds`` of video at ``bitrate`` (bits/s, or the
+    minimum when unknown), then follows measured client throughput: a chunk
+    the client drains quickly doubles the size, one that stalls halves it.
+    """
+
+    def __init__(
+        self,
+        minimum: int,
+        maximum: int,
+        bitrate: Optional[int] = None,
+        target_seconds: float = 0.5,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        initial = int(bitrate / 8 * target_seconds) if bitrate else minimum
+        self.size = self._clamp(initial)
+
+    def record(self, nbytes: int, seconds: float) -> None:
+        """Feed back how long the client took to accept ``nbytes``."""
+        target = nbytes / max(seconds, 1e-6) * self.target_seconds
+        if target >= self.size * 2:
+            self.size = self._clamp(self.size * 2)
+        elif target < self.size / 2:
+            self.size = self._clamp(self.size // 2)
+
+    def _clamp(self, size: int) -> int:
+        size = max(self.minimum, min(self.maximum, size))
+        return 1 << (size.bit_length() - 1)
+
+
+class ThroughputMeter:
+    """
+    Measures how fast a client accepts a response body.
+
+    Time spent handing chunks to the server is summed over windows of at
+    least ``window_bytes`` (large enough to get past socket buffers) and
+    the best window's rate is kept: a player with a full buffer stops
+    reading, which would drag an average down. When the response ends,
+    ``on_close`` gets that rate in kbit/s, if a full window was measured.
+    """
+
+    def __init__(self, on_close: Callable[[float], None], window_bytes: int = 8 * 1024 * 1024):
+        self.on_close = on_close
+        self.window_bytes = window_bytes
+        self.best_kbps: Optional[float] = None
+        self._bytes = 0
+        self._seconds = 0.0
+        self._closed = False
+
+    def record(self, nbytes: int, seconds: float) -> None:
+        """Feed back how long the client took to accept ``nbytes``."""
+        self._bytes += nbytes
+        self._seconds += seconds
+        if self._bytes >= self.window_bytes:
+            kbps = self._bytes * 8 / 1000 / max(self._seconds, 1e-6)
+            self.best_kbps = max(self.best_kbps or 0.0, kbps)
+            self._bytes, self._seconds = 0, 0.0
+
+    def close(self) -> None:
+        """Report the measured rate (once)."""
+        if self._closed:
+            return
+        self._closed = True
+        if self.best_kbps is not None:
+            self.on_close(self.best_kbps)
+
+
+class RangeNotSatisfiable(Exception):
+    """No requested byte range overlaps the file."""
+
+
+def parse_range_header(header: str, file_size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parse a ``Range`` header into inclusive ``(start, end)`` byte pairs.
+
+    Supports ``a-b``, open-ended ``a-`` and suffix ``-n`` specs and lists of
+    them. Ends past EOF are clamped, unsatisfiable specs are dropped, and
+    overlapping or adjacent ranges are coalesced (RFC 7233 section 2.1/4.1).
+
+    Returns:
+        Sorted, merged ranges, or None if the header is malformed, not in
+        ``bytes`` units or lists more than :data:`MAX_RANGES` ranges (the
+        Range header is then ignored)
+
+    Raises:
+        RangeNotSatisfiable: The header is valid but no range overlaps the file
+    """
+    units, _, spec = header.partition("=")
+    if units.strip().lower() != "bytes" or not spec.strip():
+        return None
+    # Many tiny ranges would cost a part header each: not worth serving
+    if spec.count(",") >= MAX_RANGES:
+        return None
+
+    ranges: List[Tuple[int, int]] = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start_str, sep, end_str = part.partition("-")
+        start_str, end_str = start_str.strip(), end_str.strip()
+        if not sep or not (start_str.isdigit() or end_str.isdigit()):
+            return None
+        if start_str and end_str and not (start_str.isdigit() and end_str.isdigit()):
+            return None
+
+        if not start_str:
+            # Suffix range: the last N bytes
+            length = int(end_str)
+            if length == 0 or file_size == 0:
+                continue
+            start, end = max(file_size - length, 0), file_size - 1
+        else:
+            start = int(start_str)
+            if end_str and int(end_str) < start:
+                return None
+            if start >= file_size:
+                continue
+            end = min(int(end_str), file_size - 1) if end_str else file_size - 1
+        ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def strong_etag(stat_result: os.stat_result) -> str:
+    """Strong validator from inode, size and mtime (changes on any rewrite)."""
+    return f'"{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def _etag_list(header: str) -> List[str]:
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+
+def _etag_matches(header: str, etag: str, weak: bool) -> bool:
+    """Evaluate an If-Match / If-None-Match list (weak comparison if ``weak``)."""
+    for tag in _etag_list(header):
+        if tag == "*":
+            return True
+        if weak:
+            if tag.removeprefix("W/") == etag:
+                return True
+        elif tag == etag:
+            return True
+    return False
+
+
+def _http_date(value: str) -> Optional[int]:
+    try:
+        return int(parsedate_to_datetime(value).timestamp())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+class RangeFileResponse(Response):
+    """
+    Response that sends ``count`` bytes of a file starting at ``offset``.
+
+    When the ASGI server offers the ``http.response.zerocopysend`` extension
+    the body is handed over as a file descriptor and the kernel copies it
+    straight to the socket. Otherwise reads run on the dedicated streaming
+    I/O pool with read-ahead, in chunks sized by :class:`AdaptiveChunkSizer`
+    from ``bitrate`` and client throughput, which is also reported to
+    ``meter``. HEAD requests send headers only.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        offset: int,
+        count: int,
+        status_code: int = 200,
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: Optional[str] = None,
+        background: Optional[BackgroundTask] = None,
+        bitrate: Optional[int] = None,
+        meter: Optional[ThroughputMeter] = None,
+    ):
+        self.path = path
+        self.offset = offset
+        self.count = count
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = background
+        self.bitrate = bitrate
+        self.meter = meter
+        self.init_headers(headers)
+        self.headers["content-length"] = str(count)
+        self.headers.setdefault("accept-ranges", "bytes")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+
+            if scope["method"].upper() == "HEAD" or self.count == 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            else:
+                zerocopy = ZEROCOPY_EXTENSION in scope.get("extensions", {})
+                with open(self.path, "rb") as file:
+                    await self._send_body(send, file, zerocopy)
+        finally:
+            if self.meter is not None:
+                self.meter.close()
+
+        if self.background is not None:
+            await self.background()
+
+    async def _send_body(self, send: Send, file: BinaryIO, zerocopy: bool) -> None:
+        await self._send_range(send, file, self.offset, self.count, zerocopy, more_body=False)
+
+    async def _send_range(
+        self,
+        send: Send,
+        file: BinaryIO,
+        offset: int,
+        count: int,
+        zerocopy: bool,
+        more_body: bool,
+    ) -> None:
+        if zerocopy:
+            started = time.monotonic()
+            await send({
+                "type": ZEROCOPY_EXTENSION,
+                "file": file,
+                "offset": offset,
+                "count": count,
+                "more_body": more_body,
+            })
+            if self.meter is not None:
+                self.meter.record(count, time.monotonic() - started)
+            return
+
+        settings = get_settings()
+        sizer = AdaptiveChunkSizer(settings.stream_chunk_min, settings.stream_chunk_max, self.bitrate)
+        executor = get_io_executor()
+        fd = file.fileno()
+        end = offset + count
+        next_offset = offset
+        # Reads in flight: the chunk being sent plus read-ahead
+        pending: Deque[Tuple[int, Future]] = deque()
+
+        def schedule_reads() -> None:
+            nonlocal next_offset
+            while len(pending) <= settings.stream_read_ahead_chunks and next_offset < end:
+                size = min(sizer.size, end - next_offset)
+                pending.append((size, executor.submit(os.pread, fd, size, next_offset)))
+                next_offset += size
+
+        try:
+            schedule_reads()
+            while pending:
+                size, future = pending.popleft()
+                chunk = await asyncio.wrap_future(future)
+                if len(chunk) < size:
+                    # File shrank underneath us; close the body rather than hang
+                    await send({"type": "http.response.body", "body": chunk, "more_body": False})
+                    raise RuntimeError(f"{self.path} ended before the requested range")
+                schedule_reads()
+
+                started = time.monotonic()
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": more_body or bool(pending),
+                })
+                elapsed = time.monotonic() - started
+                sizer.record(len(chunk), elapsed)
+                if self.meter is not None:
+                    self.meter.record(len(chunk), elapsed)
+        finally:
+            # Don't close the file under reads still running in the pool
+            running = [future for _, future in pending if not future.cancel()]
+            if running:
+                await asyncio.gather(*(asyncio.wrap_future(f) for f in running), return_exceptions=True)
+
+
+class MultipartRangeFileResponse(RangeFileResponse):
+    """206 ``multipart/byteranges`` response for several disjoint ranges."""
+
+    def __init__(
+        self,
+        path: str,
+        ranges: List[Tuple[int, int]],
+        file_size: int,
+        content_type: str,
+        headers: Optional[Mapping[str, str]] = None,
+        background: Optional[BackgroundTask] = None,
+        bitrate: Optional[int] = None,
+        meter: Optional[ThroughputMeter] = None,
+    ):
+        boundary = token_hex(13)
+        self.parts: List[Tuple[bytes, int, int]] = []
+        for index, (start, end) in enumerate(ranges):
+            separator = "\r\n" if index else ""
+            part_header = (
+                f"{separator}--{boundary}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n"
+            ).encode("latin-1")
+            self.parts.append((part_header, start, end - start + 1))
+        self.closing = f"\r\n--{boundary}--\r\n".encode("latin-1")
+
+        count = sum(len(part_header) + length for part_header, _, length in self.parts) + len(self.closing)
+        super().__init__(
+            path,
+            offset=0,
+            count=count,
+            status_code=206,
+            headers=headers,
+            media_type=f"multipart/byteranges; boundary={boundary}",
+            background=background,
+            bitrate=bitrate,
+            meter=meter,
+        )
+
+    async def _send_body(self, send: Send, file: BinaryIO, zerocopy: bool) -> None:
+        for part_header, start, length in self.parts:
+            await send({"type": "http.response.body", "body": part_header, "more_body": True})
+            await self._send_range(send, file, start, length, zerocopy, more_body=True)
+        await send({"type": "http.response.body", "body": self.closing, "more_body": False})
+
+
+def accel_redirect_uri(file_path: str) -> Optional[str]:
+    """
+    Internal nginx URI for ``file_path``, or None if it can't be handed off.
+
+    Requires ``stream_accel_redirect_root`` (the directory nginx serves from
+    its ``internal`` location) and a file underneath it.
+    """
+    settings = get_settings()
+    root = settings.stream_accel_redirect_root.strip()
+    if not root:
+        return None
+    try:
+        relative = Path(file_path).resolve().relative_to(Path(root).resolve())
+    except ValueError:
+        return None
+    prefix = settings.stream_accel_redirect_prefix.rstrip("/")
+    return f"{prefix}/{quote(relative.as_posix())}"
+
+
+def file_range_response(
+    request: Request,
+    file_path: str,
+    content_type: str = "video/mp4",
+    background: Optional[BackgroundTask] = None,
+    headers: Optional[Mapping[str, str]] = None,
+    bitrate: Optional[int] = None,
+    meter: Optional[ThroughputMeter] = None,
+) -> Response:
+    """
+    Serve a file with HTTP Range and conditional request support.
+
+    Files under ``stream_accel_redirect_root`` are handed to nginx with
+    ``X-Accel-Redirect`` (nginx then handles ranges, validators and sendfile
+    itself). Everything else gets a strong ETag and Last-Modified, honours
+    If-Match/If-Unmodified-Since (412), If-None-Match/If-Modified-Since (304)
+    and If-Range, and answers Range with 206 (single or multipart) or 416.
+
+    Args:
+        request: Incoming request (Range and conditional headers)
+        file_path: Absolute path to the media file
+        content_type: MIME type of the media file
+        background: Task to run after the body has been sent
+        headers: Extra headers for successful responses (e.g. Cache-Control)
+        bitrate: Media bitrate in bits/s, to size the first reads
+        meter: Measures the client's throughput while the body is sent
+            (closed at once for responses without one)
+
+    Returns:
+        200/206/304/412/416 response, or an empty response carrying
+        X-Accel-Redirect
+    """
+    response = _file_range_response(request, file_path, content_type, background, headers, bitrate, meter)
+    if meter is not None and not isinstance(response, RangeFileResponse):
+        meter.close()
+    return response
+
+
+def _file_range_response(
+    request: Request,
+    file_path: str,
+    content_type: str,
+    background: Optional[BackgroundTask],
+    headers: Optional[Mapping[str, str]],
+    bitrate: Optional[int],
+    meter: Optional[ThroughputMeter],
+) -> Response:
+    accel_uri = accel_redirect_uri(file_path)
+    if accel_uri:
+        return Response(
+            headers={**(headers or {}), "X-Accel-Redirect": accel_uri, "Content-Type": content_type},
+            background=background,
+        )
+
+    stat_result = os.stat(file_path)
+    file_size = stat_result.st_size
+    etag = strong_etag(stat_result)
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    validators = {**(headers or {}), "ETag": etag, "Last-Modified": last_modified, "Accept-Ranges": "bytes"}
+    request_headers = request.headers
+    mtime = int(stat_result.st_mtime)
+
+    # Preconditions, in RFC 7232 section 6 order
+    if_match = request_headers.get("if-match")
+    if if_match is not None:
+        if not _etag_matches(if_match, etag, weak=False):
+            return Response(status_code=412, headers=validators)
+    else:
+        unmodified_since = _http_date(request_headers.get("if-unmodified-since", ""))
+        if unmodified_since is not None and mtime > unmodified_since:
+            return Response(status_code=412, headers=validators)
+
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, etag, weak=True):
+            return Response(status_code=304, headers=validators)
+    else:
+        modified_since = _http_date(request_headers.get("if-modified-since", ""))
+        if modified_since is not None and mtime <= modified_since:
+            return Response(status_code=304, headers=validators)
+
+    ranges = None
+    range_header = request_headers.get("range")
+    if range_header and _if_range_allows(request_headers.get("if-range"), etag, mtime):
+        try:
+            ranges = parse_range_header(range_header, file_size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**validators, "Content-Range": f"bytes */{file_size}"})
+
+    if not ranges:
+        return RangeFileResponse(
+            file_path,
+            offset=0,
+            count=file_size,
+            headers=validators,
+            media_type=content_type,
+            background=background,
+            bitrate=bitrate,
+            meter=meter,
+        )
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        return RangeFileResponse(
+            file_path,
+            offset=start,
+            count=end - start + 1,
+            status_code=206,
+            headers={**validators, "Content-Range": f"bytes {start}-{end}/{file_size}"},
+            media_type=content_type,
+            background=background,
+            bitrate=bitrate,
+            meter=meter,
+        )
+
+    return MultipartRangeFileResponse(
+        file_path,
+        ranges,
+        file_size,
+        content_type,
+        headers=validators,
+        background=background,
+        bitrate=bitrate,
+        meter=meter,
+    )
+
+
+def _if_range_allows(if_range: Optional[str], etag: str, mtime: int) -> bool:
+    """True if the Range header applies (no If-Range, or its validator matches)."""
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        # Strong comparison only; weak tags never match
+        return if_range == etag
+    return _http_date(if_range) == mtime
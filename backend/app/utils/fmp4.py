@@ -0,0 +1,127 @@
+"""Minimal fragmented MP4 parsing: locate the init segment and fragment start times."""
+import struct
+from bisect import bisect_right
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# read_at(offset, length) -> bytes
+ReadAt = Callable[[int, int], bytes]
+
+
+def iter_boxes(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[str, int, int]]:
+    """Yield ``(type, payload_start, box_end)`` for complete boxes in ``data[start:end]``."""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack(">I4s", data[pos:pos + 8])
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = struct.unpack(">Q", data[pos + 8:pos + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield box_type.decode("latin-1"), pos + header, pos + size
+        pos += size
+
+
+def _find(data: bytes, start: int, end: int, box_type: str) -> Optional[Tuple[int, int]]:
+    for found, payload, box_end in iter_boxes(data, start, end):
+        if found == box_type:
+            return payload, box_end
+    return None
+
+
+class FragmentIndex:
+    """
+    Incrementally built index of a fragmented MP4 byte stream.
+
+    Records where the init segment (``ftyp`` + ``moov``) ends, each track's
+    timescale, and the byte offset and start time of every ``moof``
+    fragment of the video track. With ``frag_keyframe`` every fragment
+    starts on a keyframe, so any fragment offset is a valid place to
+    resume playback after re-sending the init segment.
+    """
+
+    def __init__(self):
+        self.init_end: Optional[int] = None
+        self.timescales: Dict[int, int] = {}
+        self.video_track: Optional[int] = None
+        self.times: List[float] = []
+        self.offsets: List[int] = []
+        self._pos = 0
+
+    def update(self, read_at: ReadAt, size: int) -> None:
+        """Index any complete top-level boxes between the last position and ``size``."""
+        while self._pos + 8 <= size:
+            header = read_at(self._pos, min(16, size - self._pos))
+            box_size, box_type = struct.unpack(">I4s", header[:8])
+            if box_size == 1:
+                if len(header) < 16:
+                    return
+                box_size = struct.unpack(">Q", header[8:16])[0]
+            if box_size < 8 or self._pos + box_size > size:
+                return  # incomplete (or open-ended) box
+
+            if box_type == b"moov":
+                self._parse_moov(read_at(self._pos, box_size))
+                self.init_end = self._pos + box_size
+            elif box_type == b"moof":
+                self._parse_moof(read_at(self._pos, box_size), self._pos)
+            self._pos += box_size
+
+    def fragment_at(self, seconds: float) -> Optional[Tuple[float, int]]:
+        """Latest fragment starting at or before ``seconds``, as ``(time, offset)``."""
+        i = bisect_right(self.times, seconds)
+        if i == 0:
+            return None
+        return self.times[i - 1], self.offsets[i - 1]
+
+    @property
+    def last_time(self) -> Optional[float]:
+        """Start time of the newest indexed fragment."""
+        return self.times[-1] if self.times else None
+
+    def _parse_moov(self, data: bytes) -> None:
+        for box_type, payload, box_end in iter_boxes(data, 8):
+            if box_type != "trak":
+                continue
+            tkhd = _find(data, payload, box_end, "tkhd")
+            mdia = _find(data, payload, box_end, "mdia")
+            if not tkhd or not mdia:
+                continue
+            version = data[tkhd[0]]
+            track_id = struct.unpack(">I", data[tkhd[0] + (20 if version == 1 else 12):][:4])[0]
+
+            mdhd = _find(data, mdia[0], mdia[1], "mdhd")
+            hdlr = _find(data, mdia[0], mdia[1], "hdlr")
+            if mdhd:
+                version = data[mdhd[0]]
+                self.timescales[track_id] = struct.unpack(">I", data[mdhd[0] + (20 if version == 1 else 12):][:4])[0]
+            if hdlr and data[hdlr[0] + 8:hdlr[0] + 12] == b"vide" and self.video_track is None:
+                self.video_track = track_id
+
+    def _parse_moof(self, data: bytes, offset: int) -> None:
+        for box_type, payload, box_end in iter_boxes(data, 8):
+            if box_type != "traf":
+                continue
+            tfhd = _find(data, payload, box_end, "tfhd")
+            tfdt = _find(data, payload, box_end, "tfdt")
+            if not tfhd or not tfdt:
+                continue
+            track_id = struct.unpack(">I", data[tfhd[0] + 4:tfhd[0] + 8])[0]
+            if self.video_track is not None and track_id != self.video_track:
+                continue
+            timescale = self.timescales.get(track_id)
+            if not timescale:
+                continue
+            version = data[tfdt[0]]
+            if version == 1:
+                decode_time = struct.unpack(">Q", data[tfdt[0] + 4:tfdt[0] + 12])[0]
+            else:
+                decode_time = struct.unpack(">I", data[tfdt[0] + 4:tfdt[0] + 8])[0]
+            self.times.append(decode_time / timescale)
+            self.offsets.append(offset)
+            return
@@ -0,0 +1,86 @@
+"""Microbenchmark: guessit filename parsing before/after the parse cache."""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add backend directory to Python path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.services.filename_parser import FilenameParser, guessit_parse, GUESSIT_VERSION
+
+
+def generate_names(count: int = 2000) -> list:
+    """Generate realistic scene-style release names."""
+    shows = ["Red.Dwarf", "The.Office.US", "Doctor.Who.2005", "Blackadder", "Peep.Show"]
+    movies = ["Alien", "Blade.Runner", "The.Thing", "Heat", "Ronin"]
+    tags = ["720p.BluRay.x264-GROUP", "1080p.WEB-DL.DDP5.1.H.264-NTb", "2160p.UHD.BluRay.HDR.x265-FGT"]
+
+    names = []
+    i = 0
+    while len(names) < count:
+        show = shows[i % len(shows)]
+        season, episode = i // 100 + 1, i % 100 + 1
+        names.append(f"{show}.S{season:02d}E{episode:02d}.{tags[i % len(tags)]}.mkv")
+        movie = movies[i % len(movies)]
+        names.append(f"{movie}.{1970 + i % 50}.{tags[(i + 1) % len(tags)]}.mkv")
+        i += 1
+    return names[:count]
+
+
+def rate(count: int, seconds: float) -> str:
+    return f"{count / seconds:,.0f} parses/sec ({seconds:.2f}s)"
+
+
+def main():
+    """Run the benchmark."""
+    names = generate_names(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
+    sample = names[:200]
+
+    print("=" * 60)
+    print(f"FILENAME PARSE BENCHMARK (guessit {GUESSIT_VERSION}, {len(names)} names)")
+    print("=" * 60)
+
+    # Before: raw guessit, one call per file
+    start = time.perf_counter()
+    for name in sample:
+        guessit_parse(name)
+    print(f"{'Raw guessit (serial):':<35}{rate(len(sample), time.perf_counter() - start)}")
+
+    db_path = os.path.join(tempfile.mkdtemp(), "parse_cache.db")
+    engine = create_engine(f"sqlite:///{db_path}")
+    from app.database import Base
+    Base.metadata.create_all(bind=engine, tables=[Base.metadata.tables["filename_parse_cache"]])
+    session_factory = sessionmaker(bind=engine)
+
+    for workers in sorted({1, os.cpu_count() or 1}):
+        parser = FilenameParser(session_factory=session_factory, pool_min_batch=1, pool_workers=workers)
+        with engine.begin() as conn:
+            conn.exec_driver_sql("DELETE FROM filename_parse_cache")
+        start = time.perf_counter()
+        parser.parse_many(names)
+        label = f"Cold batch ({workers} worker{'s' if workers > 1 else ''}):"
+        print(f"{label:<35}{rate(len(names), time.perf_counter() - start)}")
+
+    # After: persisted cache, empty LRU (new process / next scan)
+    parser.clear_memory()
+    start = time.perf_counter()
+    parser.parse_many(names)
+    print(f"{'Persisted cache (batch query):':<35}{rate(len(names), time.perf_counter() - start)}")
+
+    # After: in-process LRU, per-file calls as the scan loop makes them
+    start = time.perf_counter()
+    for name in names:
+        parser.parse(name)
+    print(f"{'Memoized LRU (per-file calls):':<35}{rate(len(names), time.perf_counter() - start)}")
+
+    print(f"\nStats: {parser.stats()}")
+    os.unlink(db_path)
+
+
+if __name__ == "__main__":
+    main()
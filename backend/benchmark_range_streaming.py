@@ -0,0 +1,136 @@
+"""Benchmark: concurrent range readers against the direct-stream response."""
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Add backend directory to Python path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+from app.utils.file_response import file_range_response
+
+RANGE_SIZE = 8 * 1024 * 1024  # what a browser player typically asks for
+
+
+def legacy_range_response(request: Request, file_path: str, content_type: str = "video/mp4"):
+    """The previous implementation: 8 KB reads in a sync generator."""
+    file_size = os.path.getsize(file_path)
+    start_str, end_str = request.headers["range"].replace("bytes=", "").split("-")
+    start = int(start_str)
+    end = int(end_str) if end_str else file_size - 1
+
+    def iter_file():
+        with open(file_path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = f.read(min(8192, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+
+    return StreamingResponse(iter_file(), status_code=206, headers={
+        "Content-Range": f"bytes {start}-{end}/{file_size}",
+        "Content-Length": str(end - start + 1),
+        "Content-Type": content_type,
+    })
+
+
+def build_app(file_path: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/legacy")
+    def legacy(request: Request):
+        return legacy_range_response(request, file_path)
+
+    @app.get("/stream")
+    def stream(request: Request):
+        return file_range_response(request, file_path)
+
+    return app
+
+
+def create_test_file(size_mb: int) -> str:
+    """Create a temporary test file of given size."""
+    print(f"Creating {size_mb}MB test file...")
+    with tempfile.NamedTemporaryFile(mode="wb", suffix=".mkv", delete=False) as f:
+        for _ in range(size_mb):
+            f.write(os.urandom(1024 * 1024))
+        return f.name
+
+
+def start_server(app: FastAPI) -> tuple:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, port
+
+
+async def reader(client: httpx.AsyncClient, url: str, file_size: int, offset: int) -> int:
+    """Read the whole file as consecutive ranges, like a player would."""
+    received = 0
+    position = offset
+    for _ in range(0, file_size, RANGE_SIZE):
+        end = min(position + RANGE_SIZE, file_size) - 1
+        response = await client.get(url, headers={"Range": f"bytes={position}-{end}"})
+        received += len(response.content)
+        position = 0 if end + 1 >= file_size else end + 1
+    return received
+
+
+async def run_readers(url: str, file_size: int, readers: int) -> tuple:
+    limits = httpx.Limits(max_connections=readers)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        offsets = [(i * file_size // readers) // RANGE_SIZE * RANGE_SIZE for i in range(readers)]
+        totals = await asyncio.gather(*(reader(client, url, file_size, o) for o in offsets))
+        return sum(totals), time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+
+def main():
+    """Run the benchmark."""
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    reader_counts = [int(n) for n in (sys.argv[2] if len(sys.argv) > 2 else "1,4,16").split(",")]
+
+    print("=" * 60)
+    print("RANGE STREAMING BENCHMARK")
+    print("=" * 60)
+
+    file_path = create_test_file(size_mb)
+    server, port = start_server(build_app(file_path))
+    file_size = os.path.getsize(file_path)
+
+    try:
+        for readers in reader_counts:
+            print(f"\n{readers} concurrent reader(s), {size_mb}MB each in {RANGE_SIZE >> 20}MB ranges")
+            print("-" * 60)
+            for name in ("legacy", "stream"):
+                total, wall, cpu = asyncio.run(run_readers(f"http://127.0.0.1:{port}/{name}", file_size, readers))
+                mb = total / (1024 * 1024)
+                print(f"{name:<8} {mb / wall:8.1f} MB/s   {cpu / (mb / 1024):6.2f} CPU-s per GB (client+server)")
+    finally:
+        server.should_exit = True
+        os.unlink(file_path)
+
+    print("\n" + "=" * 60)
+    print("BENCHMARK COMPLETE")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
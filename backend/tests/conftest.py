@@ -1,5 +1,11 @@
+import json
 import os
 import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
 import pytest
 
 
@@ -22,3 +28,116 @@ def env_settings(monkeypatch):
     monkeypatch.setenv("TMDB_READ_ACCESS_TOKEN", "token")
     monkeypatch.setenv("AZURE_OPENAI_KEY", "azure-key")
     monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", "https://example.com")
+
+
+class FakeTMDbServer:
+    """
+    Local stand-in for the TMDb API, for offline client and throughput tests.
+
+    Serves ``search/movie``, ``search/tv`` and ``{type}/{id}/external_ids``
+    under ``/3/``. ``failures`` is a list of status codes returned (in
+    order) before normal responses resume; ``latency`` delays every reply.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.failures = []
+        self.requests = []
+        self.client_ports = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                status, payload = server.handle(self.path, self.client_address[1])
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if status == 429:
+                    self.send_header("Retry-After", "0")
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/3/"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def handle(self, raw_path, client_port):
+        with self._lock:
+            self.requests.append(raw_path)
+            self.client_ports.add(client_port)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            failure = self.failures.pop(0) if self.failures else None
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            if failure:
+                return failure, {"status_message": "fake failure"}
+
+            url = urlparse(raw_path)
+            path = url.path[len("/3/"):]
+            query = parse_qs(url.query).get("query", [""])[0]
+            if path in ("search/movie", "search/tv"):
+                if query.lower().startswith("unknown"):
+                    return 200, {"results": []}
+                item_id = sum(query.encode()) + len(query)
+                if path == "search/tv":
+                    return 200, {"results": [{"id": item_id, "name": query, "first_air_date": "1988-02-15"}]}
+                return 200, {"results": [{"id": item_id, "title": query, "release_date": "1979-05-25"}]}
+            if path.endswith("/external_ids"):
+                return 200, {"imdb_id": f"tt{path.split('/')[1]}"}
+            return 404, {"status_message": "not found"}
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def count(self, prefix):
+        return sum(1 for path in self.requests if path.startswith(f"/3/{prefix}"))
+
+
+@pytest.fixture
+def fake_tmdb_server():
+    """Run a FakeTMDbServer on an ephemeral localhost port."""
+    server = FakeTMDbServer()
+    server.thread.start()
+    yield server
+    server.httpd.shutdown()
+    server.httpd.server_close()
+
+
+def _box(box_type, payload):
+    import struct
+    return struct.pack(">I4s", 8 + len(payload), box_type.encode()) + payload
+
+
+def build_fmp4(fragment_times, timescale=1000, mdat_size=4096):
+    """Minimal fragmented MP4: ftyp + moov (one video track) + moof/mdat per fragment."""
+    import struct
+    tkhd = _box("tkhd", b"\x00\x00\x00\x03" + struct.pack(">III", 0, 0, 1) + b"\x00" * 68)
+    mdhd = _box("mdhd", b"\x00\x00\x00\x00" + struct.pack(">IIII", 0, 0, timescale, 0) + b"\x00" * 4)
+    hdlr = _box("hdlr", b"\x00" * 8 + b"vide" + b"\x00" * 13)
+    moov = _box("moov", _box("trak", tkhd + _box("mdia", mdhd + hdlr)))
+    data = _box("ftyp", b"isom\x00\x00\x02\x00") + moov
+    for i, seconds in enumerate(fragment_times):
+        tfhd = _box("tfhd", b"\x00\x02\x00\x00" + struct.pack(">I", 1))
+        tfdt = _box("tfdt", b"\x01\x00\x00\x00" + struct.pack(">Q", int(seconds * timescale)))
+        data += _box("moof", _box("mfhd", struct.pack(">II", 0, i + 1)) + _box("traf", tfhd + tfdt))
+        data += _box("mdat", bytes([i % 256]) * mdat_size)
+    return data
+
+
+@pytest.fixture
+def make_fmp4():
+    """Factory for synthetic fragmented MP4 byte strings."""
+    return build_fmp4
@@ -0,0 +1,64 @@
+import sys
+
+from app.config import get_settings
+from app.services import transcode_cache
+from app.services.comparison_service import COMPOSITE, ComparisonMember, ComparisonService, output_keys
+from app.services.transcode_scheduler import TranscodeScheduler
+
+MEMBERS = [
+    ComparisonMember(1, "/media/a.mkv", "md5-a"),
+    ComparisonMember(2, "/media/b.mkv", "md5-b", offset=1.5),
+]
+
+
+def test_one_command_aligns_every_version():
+    outputs = {"1": "/tmp/1.mp4", "2": "/tmp/2.mp4", COMPOSITE: "/tmp/c.mp4"}
+    cmd = ComparisonService().command(MEMBERS, 10.0, 30, 23.976, outputs, "hstack", use_gpu=False)
+
+    assert cmd.count("-i") == 2
+    assert cmd[cmd.index("/media/b.mkv") - 5:cmd.index("/media/b.mkv")] == ["-ss", "11.500", "-t", "30", "-i"]
+    graph = cmd[cmd.index("-filter_complex") + 1]
+    assert "[0:v:0]setpts=PTS-STARTPTS,fps=23.976,split=2[a0][b0]" in graph
+    assert "[s0][s1]hstack=inputs=2[cv]" in graph
+    assert cmd.count("-map") == 6 and "1:a:0?" in cmd
+    assert all(path in cmd for path in outputs.values())
+
+
+def test_member_previews_are_shared_across_comparisons():
+    keys = output_keys(MEMBERS, 10.0, 30, 24.0, layout="vstack")
+    assert set(keys) == {"1", "2", COMPOSITE}
+
+    # The same version and span in another comparison reuses its preview
+    other = output_keys([MEMBERS[1], ComparisonMember(3, "/media/c.mkv", "md5-c")], 10.0, 30, 24.0)
+    assert other["2"] == keys["2"] and COMPOSITE not in other
+    assert output_keys(MEMBERS, 10.0, 30, 24.0, layout="hstack")[COMPOSITE] != keys[COMPOSITE]
+
+
+class FakeComparisonService(ComparisonService):
+    def __init__(self):
+        super().__init__(scheduler=TranscodeScheduler(gpu_slots=0, cpu_slots=1))
+        self.runs = []
+
+    def command(self, members, start, seconds, fps, outputs, layout, use_gpu):
+        self.runs.append(sorted(outputs))
+        script = "import sys\nfor path in sys.argv[1:]: open(path, 'wb').write(b'mp4')"
+        return [sys.executable, "-c", script, *map(str, outputs.values())]
+
+
+def test_missing_outputs_are_encoded_in_one_job_then_cached(tmp_path, monkeypatch):
+    monkeypatch.setenv("TRANSCODE_CACHE_DIR", str(tmp_path / "cache"))
+    get_settings.cache_clear()
+    transcode_cache.get_transcode_cache.cache_clear()
+    try:
+        service = FakeComparisonService()
+        first = service.prepare(MEMBERS, layout=None)
+        assert set(first) == {"1", "2"} and first["1"].read_bytes() == b"mp4"
+
+        # Adding a composite only encodes the composite
+        second = service.prepare(MEMBERS, layout="hstack")
+        assert second["1"] == first["1"] and second[COMPOSITE].exists()
+        assert service.prepare(MEMBERS, layout="hstack") == second
+        assert service.runs == [["1", "2"], [COMPOSITE]]
+    finally:
+        get_settings.cache_clear()
+        transcode_cache.get_transcode_cache.cache_clear()
@@ -0,0 +1,58 @@
+import sys
+import time
+
+from app.services.ffmpeg_process import FFmpegProcess, with_progress
+
+# Stand-in for FFmpeg -progress output mixed with log lines on stderr
+PROGRESS_SCRIPT = (
+    "import sys\n"
+    "for i in range(120):\n"
+    "    sys.stderr.write(f'log line {i}\\n')\n"
+    "sys.stderr.write('frame=240\\nfps=59.94\\nout_time_us=8000000\\nspeed=2.5x\\nprogress=end\\n')\n"
+    "sys.stderr.write('Conversion failed!\\n')\n"
+    "sys.exit(1)\n"
+)
+
+
+def test_progress_is_parsed_and_stderr_is_bounded():
+    process = FFmpegProcess([sys.executable, "-c", PROGRESS_SCRIPT], "test", stdout=None,
+                            wall_budget=0, cpu_budget=0)
+    assert process.run() == 1
+
+    assert process.progress == {"frame": 240, "fps": 59.94, "out_time": 8.0, "speed": 2.5}
+    assert len(process.stderr_tail) == 50
+    assert process.stderr_tail[-1] == "Conversion failed!"
+    assert "progress=end" not in process.error_summary()
+
+
+def test_wall_budget_stops_and_reaps_the_process():
+    exited = []
+    process = FFmpegProcess([sys.executable, "-c", "import time; time.sleep(30)"], "test", stdout=None,
+                            wall_budget=0.5, cpu_budget=0, on_exit=exited.append)
+    started = time.monotonic()
+    process.start()
+
+    assert process.wait(timeout=10) is not None
+    assert time.monotonic() - started < 5
+    assert process.budget_exceeded.startswith("wall-clock")
+    assert exited == [process] and not process.running
+
+
+def test_paused_time_does_not_count_against_the_wall_budget():
+    process = FFmpegProcess([sys.executable, "-c", "import time; time.sleep(30)"], "test", stdout=None,
+                            wall_budget=0, cpu_budget=0).start()
+    try:
+        process.pause()
+        time.sleep(0.3)
+        assert process.wall_seconds() < 0.2
+        process.resume()
+    finally:
+        process.terminate()
+    assert process.wait(timeout=10) is not None and process.stopped
+
+
+def test_progress_args_are_only_added_to_ffmpeg():
+    assert with_progress(["/usr/bin/ffmpeg", "-i", "in"]) == [
+        "/usr/bin/ffmpeg", "-progress", "pipe:2", "-nostats", "-i", "in"
+    ]
+    assert with_progress(["python", "-c", "pass"]) == ["python", "-c", "pass"]
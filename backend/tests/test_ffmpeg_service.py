@@ -0,0 +1,57 @@
+from app.services.ffmpeg_service import FFmpegService
+
+
+def recommend(video, audio, container):
+    return FFmpegService().is_browser_compatible(video, audio, container)["recommendation"]
+
+
+def test_recommendations_prefer_copying_streams():
+    assert recommend("h264", "aac", "mp4") == "direct_stream"
+    assert recommend("h264", "aac", "matroska,webm") == "remux_only"
+    assert recommend("h264", "dts", "matroska,webm") == "audio_transcode"
+    assert recommend("h264", "ac3", "mp4") == "audio_transcode"
+    # Vorbis can't be copied into MP4
+    assert recommend("vp9", "vorbis", "matroska,webm") == "audio_transcode"
+    assert recommend("hevc", "aac", "matroska,webm") == "hls_transcode"
+
+
+def test_stream_commands_copy_video_unless_transcoding():
+    service = FFmpegService()
+    service._gpu_available = False
+
+    remux = service.build_stream_command("/media/a.mkv", "remux_only")
+    assert remux[remux.index("-c:v") + 1] == "copy"
+    assert remux[remux.index("-c:a") + 1] == "copy"
+    assert "-hwaccel" not in remux
+    assert remux[-3:] == ["-f", "mp4", "pipe:1"]
+    assert "frag_keyframe+empty_moov+default_base_moof" in remux
+
+    audio = service.build_stream_command("/media/a.mkv", "audio_transcode")
+    assert audio[audio.index("-c:v") + 1] == "copy"
+    assert audio[audio.index("-c:a") + 1] == "aac"
+
+    # No NVENC: full transcodes fall back to libx264
+    full = service.build_stream_command("/media/a.mkv", "hls_transcode", 1280, 720)
+    assert full[full.index("-c:v") + 1] == "libx264"
+    assert "scale=1280:720" in full
+    assert "-maxrate" not in full
+    capped = service.build_stream_command("/media/a.mkv", "hls_transcode", 854, 480, max_kbps=1500)
+    assert capped[capped.index("-maxrate") + 1] == "1500k" and capped[capped.index("-bufsize") + 1] == "3000k"
+    assert "-maxrate" not in service.build_stream_command("/media/a.mkv", "remux_only", max_kbps=1500)
+
+    service._gpu_available = True
+    gpu = service.build_stream_command("/media/a.mkv", "hls_transcode", 1280, 720)
+    assert gpu[gpu.index("-c:v") + 1] == "h264_nvenc"
+    assert "scale_cuda=1280:720" in gpu
+    # Copy paths never touch the GPU
+    assert "-hwaccel" not in service.build_stream_command("/media/a.mkv", "remux_only")
+
+
+def test_stream_command_seeks_on_input():
+    service = FFmpegService()
+    service._gpu_available = False
+
+    cmd = service.build_stream_command("/media/a.mkv", "remux_only", start_time=754.25)
+    assert cmd[cmd.index("-ss") + 1] == "754.250"
+    assert cmd.index("-ss") < cmd.index("-i")
+    assert "-ss" not in service.build_stream_command("/media/a.mkv", "remux_only")
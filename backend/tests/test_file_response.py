@@ -0,0 +1,216 @@
+import asyncio
+import os
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.config import get_settings
+
+
+def make_client(path):
+    from app.utils.file_response import file_range_response
+
+    app = FastAPI()
+
+    @app.api_route("/file", methods=["GET", "HEAD"])
+    def serve(request: Request):
+        return file_range_response(request, str(path), "video/x-matroska")
+
+    return TestClient(app)
+
+
+def write_file(tmp_path, size=300_000):
+    path = tmp_path / "movie.mkv"
+    path.write_bytes(os.urandom(size))
+    return path
+
+
+def test_full_and_ranged_reads(tmp_path):
+    path = write_file(tmp_path)
+    data = path.read_bytes()
+    client = make_client(path)
+
+    full = client.get("/file")
+    assert full.status_code == 200
+    assert full.content == data
+    assert full.headers["content-type"] == "video/x-matroska"
+    assert full.headers["accept-ranges"] == "bytes"
+
+    part = client.get("/file", headers={"Range": "bytes=1000-2999"})
+    assert part.status_code == 206
+    assert part.content == data[1000:3000]
+    assert part.headers["content-range"] == f"bytes 1000-2999/{len(data)}"
+    assert part.headers["content-length"] == "2000"
+
+    head = client.head("/file")
+    assert head.status_code == 200
+    assert head.content == b""
+    assert head.headers["content-length"] == str(len(data))
+
+
+def test_zerocopy_extension_hands_over_file_descriptor(tmp_path):
+    from app.utils.file_response import RangeFileResponse, ZEROCOPY_EXTENSION
+
+    path = write_file(tmp_path)
+    messages = []
+
+    async def send(message):
+        if message["type"] == ZEROCOPY_EXTENSION:
+            file = message["file"]
+            file.seek(message["offset"])
+            message = dict(message, body=file.read(message["count"]))
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "extensions": {ZEROCOPY_EXTENSION: {}}}
+    response = RangeFileResponse(str(path), offset=10, count=90, status_code=206, media_type="video/mp4")
+    asyncio.run(response(scope, None, send))
+
+    assert [m["type"] for m in messages] == ["http.response.start", ZEROCOPY_EXTENSION]
+    assert messages[1]["body"] == path.read_bytes()[10:100]
+
+
+def test_accel_redirect_handoff_for_files_under_root(tmp_path, monkeypatch):
+    path = tmp_path / "tv" / "Red Dwarf" / "S01E01 #1.mkv"
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b"x" * 100)
+
+    monkeypatch.setenv("STREAM_ACCEL_REDIRECT_ROOT", str(tmp_path))
+    get_settings.cache_clear()
+    try:
+        response = make_client(path).get("/file", headers={"Range": "bytes=0-9"})
+    finally:
+        get_settings.cache_clear()
+
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response.headers["x-accel-redirect"] == "/_mediavault_media/tv/Red%20Dwarf/S01E01%20%231.mkv"
+
+
+def test_parse_range_header_suffix_clamp_and_merge():
+    from app.utils.file_response import parse_range_header, RangeNotSatisfiable
+
+    assert parse_range_header("bytes=-500", 1000) == [(500, 999)]
+    assert parse_range_header("bytes=-5000", 1000) == [(0, 999)]
+    assert parse_range_header("bytes=900-5000", 1000) == [(900, 999)]
+    assert parse_range_header("bytes=0-99, 100-199, 500-, 50-60", 1000) == [(0, 199), (500, 999)]
+    assert parse_range_header("bytes=2000-3000, 10-19", 1000) == [(10, 19)]
+    assert parse_range_header("items=0-10", 1000) is None
+    assert parse_range_header("bytes=20-10", 1000) is None
+    assert parse_range_header("bytes=abc", 1000) is None
+    # Too many ranges: the header is ignored rather than answered part by part
+    assert parse_range_header("bytes=" + ",".join(f"{i}-{i}" for i in range(0, 400, 2)), 1000) is None
+
+    try:
+        parse_range_header("bytes=1000-", 1000)
+    except RangeNotSatisfiable:
+        pass
+    else:
+        raise AssertionError("expected RangeNotSatisfiable")
+
+
+def test_suffix_multipart_and_unsatisfiable_ranges(tmp_path):
+    path = write_file(tmp_path, size=10_000)
+    data = path.read_bytes()
+    client = make_client(path)
+
+    suffix = client.get("/file", headers={"Range": "bytes=-500"})
+    assert suffix.status_code == 206
+    assert suffix.content == data[-500:]
+    assert suffix.headers["content-range"] == "bytes 9500-9999/10000"
+
+    multi = client.get("/file", headers={"Range": "bytes=0-9,5000-5009"})
+    assert multi.status_code == 206
+    content_type = multi.headers["content-type"]
+    assert content_type.startswith("multipart/byteranges; boundary=")
+    assert int(multi.headers["content-length"]) == len(multi.content)
+    boundary = content_type.split("boundary=")[1].encode()
+    parts = multi.content.split(b"--" + boundary)
+    assert parts[-1] == b"--\r\n"
+    assert parts[1].endswith(b"\r\n\r\n" + data[0:10] + b"\r\n")
+    assert b"Content-Range: bytes 5000-5009/10000" in parts[2]
+    assert parts[2].endswith(b"\r\n\r\n" + data[5000:5010] + b"\r\n")
+
+    unsatisfiable = client.get("/file", headers={"Range": "bytes=20000-"})
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers["content-range"] == "bytes */10000"
+
+
+def test_conditional_requests_revalidate_cheaply(tmp_path):
+    path = write_file(tmp_path, size=10_000)
+    client = make_client(path)
+
+    first = client.get("/file")
+    etag, last_modified = first.headers["etag"], first.headers["last-modified"]
+    assert etag.startswith('"') and not etag.startswith("W/")
+
+    assert client.get("/file", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/file", headers={"If-None-Match": f'"other", W/{etag}'}).status_code == 304
+    assert client.get("/file", headers={"If-Modified-Since": last_modified}).status_code == 304
+    assert client.get("/file", headers={"If-Match": '"stale"'}).status_code == 412
+
+    ranged = client.get("/file", headers={"Range": "bytes=0-99", "If-Range": etag})
+    assert ranged.status_code == 206
+    assert len(ranged.content) == 100
+
+    # File replaced: new ETag, so If-Range falls back to the full body
+    path.write_bytes(os.urandom(20_000))
+    stale = client.get("/file", headers={"Range": "bytes=0-99", "If-Range": etag})
+    assert stale.status_code == 200
+    assert len(stale.content) == 20_000
+    assert stale.headers["etag"] != etag
+    assert client.get("/file", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_adaptive_chunk_sizer_follows_bitrate_and_throughput():
+    from app.utils.file_response import AdaptiveChunkSizer
+
+    kb = 1024
+    assert AdaptiveChunkSizer(256 * kb, 4096 * kb).size == 256 * kb
+    # 40 Mbit/s 4K remux: half a second is ~2.4 MB -> 2 MB reads
+    sizer = AdaptiveChunkSizer(256 * kb, 4096 * kb, bitrate=40_000_000)
+    assert sizer.size == 2048 * kb
+
+    sizer.record(sizer.size, 0.001)  # client drains instantly
+    sizer.record(sizer.size, 0.001)
+    assert sizer.size == 4096 * kb
+    for _ in range(10):
+        sizer.record(sizer.size, 10.0)  # client stalls
+    assert sizer.size == 256 * kb
+
+
+def test_streamed_reads_use_read_ahead_pool(tmp_path, monkeypatch):
+    monkeypatch.setenv("STREAM_CHUNK_MIN", "4096")
+    monkeypatch.setenv("STREAM_CHUNK_MAX", "16384")
+    get_settings.cache_clear()
+    try:
+        path = write_file(tmp_path, size=1_000_003)
+        data = path.read_bytes()
+        client = make_client(path)
+
+        assert client.get("/file").content == data
+        part = client.get("/file", headers={"Range": "bytes=12345-987654"})
+        assert part.content == data[12345:987655]
+    finally:
+        get_settings.cache_clear()
+
+
+def test_disconnect_mid_stream_waits_for_inflight_reads(tmp_path):
+    from app.utils.file_response import RangeFileResponse
+
+    path = write_file(tmp_path, size=2_000_000)
+    sent = []
+
+    async def send(message):
+        if message["type"] == "http.response.body" and sent:
+            raise OSError("client went away")
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "extensions": {}}
+    response = RangeFileResponse(str(path), offset=0, count=2_000_000)
+    try:
+        asyncio.run(response(scope, None, send))
+    except OSError:
+        pass
+    else:
+        raise AssertionError("expected the send error to propagate")
+    assert [m["type"] for m in sent] == ["http.response.start"]
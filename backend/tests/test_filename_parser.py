@@ -0,0 +1,112 @@
+import importlib
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects.sqlite.base import SQLiteTypeCompiler
+
+
+if not hasattr(SQLiteTypeCompiler, "visit_ARRAY"):
+    def _visit_array(self, type_, **kw):
+        return "TEXT"
+    SQLiteTypeCompiler.visit_ARRAY = _visit_array  # type: ignore[attr-defined]
+from app.config import get_settings
+
+
+NAMES = [
+    "Red.Dwarf.S01E01.The.End.720p.BluRay.x264-GROUP.mkv",
+    "Red.Dwarf.S01E02.Future.Echoes.720p.BluRay.x264-GROUP.mkv",
+    "Alien.1979.Directors.Cut.2160p.UHD.BluRay.x265-FGT.mkv",
+    "Show.S01E01E02.mkv",
+]
+
+
+def setup_parser(tmp_path, monkeypatch, **kwargs):
+    db_url = f"sqlite:///{tmp_path}/test.db"
+    monkeypatch.setenv("DATABASE_URL", db_url)
+    get_settings.cache_clear()
+
+    import app.services.filename_parser as filename_parser
+    filename_parser = importlib.reload(filename_parser)
+
+    from app.database import Base
+    engine = create_engine(db_url)
+    Base.metadata.create_all(bind=engine)
+    return filename_parser, filename_parser.FilenameParser(session_factory=sessionmaker(bind=engine), **kwargs)
+
+
+def test_parse_is_memoized_and_persisted_per_guessit_version(tmp_path, monkeypatch):
+    filename_parser, parser = setup_parser(tmp_path, monkeypatch)
+
+    first = parser.parse(NAMES[0])
+    assert first["title"] == "Red Dwarf"
+    assert (first["season"], first["episode"]) == (1, 1)
+    assert parser.parse(NAMES[0]) == first
+    assert parser.stats()["parsed"] == 1
+    assert parser.stats()["memory_hits"] == 1
+
+    # A fresh process (empty LRU) reads the persisted parse
+    parser.clear_memory()
+    assert parser.parse(NAMES[0]) == first
+    assert parser.stats()["db_hits"] == 1
+
+    # A different guessit version does not see old parses
+    from app.models import FilenameParseCacheEntry
+    db = parser.session_factory()
+    entry = db.query(FilenameParseCacheEntry).one()
+    assert entry.guessit_version == filename_parser.GUESSIT_VERSION
+    entry.guessit_version = "0.0.0"
+    db.commit()
+    db.close()
+    parser.clear_memory()
+    parser.parse(NAMES[0])
+    assert parser.stats()["parsed"] == 2
+
+
+def test_batch_mode_matches_serial_parsing(tmp_path, monkeypatch):
+    filename_parser, parser = setup_parser(tmp_path, monkeypatch, pool_min_batch=2, pool_workers=2)
+
+    results = parser.parse_many(NAMES + NAMES[:1])
+
+    assert set(results) == set(NAMES)
+    for name in NAMES:
+        assert results[name] == filename_parser.guessit_parse(name)
+    assert results["Show.S01E01E02.mkv"]["episode"] == [1, 2]
+    assert parser.stats()["parsed"] == len(NAMES)
+
+
+def test_store_skips_names_already_stored_or_too_long(tmp_path, monkeypatch):
+    filename_parser, parser = setup_parser(tmp_path, monkeypatch)
+    from app.models import FilenameParseCacheEntry
+
+    # A concurrent scan stored one name of the batch first
+    parser._store({NAMES[0]: {"title": "Red Dwarf"}})
+    long_name = "x" * 600 + ".mkv"
+    parser._store({**{name: {"title": name} for name in NAMES}, long_name: {}})
+
+    db = parser.session_factory()
+    stored = {name for (name,) in db.query(FilenameParseCacheEntry.filename)}
+    db.close()
+    assert stored == set(NAMES)
+    assert parser.stats()["errors"] == 0
+
+
+def test_row_by_row_store_only_skips_duplicates(tmp_path, monkeypatch):
+    filename_parser, parser = setup_parser(tmp_path, monkeypatch)
+    from sqlalchemy import text
+
+    from app.models import FilenameParseCacheEntry
+
+    # Dialects without ON CONFLICT insert row by row
+    monkeypatch.setattr(filename_parser, "_CONFLICT_IGNORING_INSERTS", {})
+    parser._store({NAMES[0]: {"title": "Red Dwarf"}})
+    parser._store({name: {"title": name} for name in NAMES})
+    db = parser.session_factory()
+    assert db.query(FilenameParseCacheEntry).count() == len(NAMES)
+    assert parser.stats()["errors"] == 0
+
+    # Anything but a duplicate fails the write and is counted
+    db.execute(text("DROP TABLE filename_parse_cache"))
+    db.commit()
+    db.close()
+    parser._store({"Another.Show.S01E01.mkv": {}})
+    assert parser.stats()["errors"] == 1
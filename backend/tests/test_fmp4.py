@@ -0,0 +1,43 @@
+from app.utils.fmp4 import FragmentIndex
+
+
+def _reader(data):
+    return lambda offset, length: data[offset:offset + length]
+
+
+def test_index_records_init_segment_and_fragments(make_fmp4):
+    data = make_fmp4([0.0, 2.0, 4.0, 6.5])
+    index = FragmentIndex()
+    index.update(_reader(data), len(data))
+
+    assert data[index.init_end + 4:index.init_end + 8] == b"moof"
+    assert index.video_track == 1
+    assert index.timescales == {1: 1000}
+    assert index.times == [0.0, 2.0, 4.0, 6.5]
+    assert all(data[offset + 4:offset + 8] == b"moof" for offset in index.offsets)
+
+    assert index.fragment_at(5.0) == (4.0, index.offsets[2])
+    assert index.fragment_at(100) == (6.5, index.offsets[3])
+    assert index.last_time == 6.5
+
+
+def test_index_updates_incrementally(make_fmp4):
+    data = make_fmp4([0.0, 2.0, 4.0])
+    index = FragmentIndex()
+
+    # Partial moof: nothing indexed past the init segment yet
+    partial = len(make_fmp4([])) + 20
+    index.update(_reader(data), partial)
+    assert index.init_end is not None and index.times == []
+
+    for size in range(partial, len(data) + 1, 1000):
+        index.update(_reader(data), size)
+    index.update(_reader(data), len(data))
+    assert index.times == [0.0, 2.0, 4.0]
+
+
+def test_fragment_at_before_first_fragment(make_fmp4):
+    index = FragmentIndex()
+    data = make_fmp4([1.0])
+    index.update(_reader(data), len(data))
+    assert index.fragment_at(0.5) is None
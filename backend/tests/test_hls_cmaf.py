@@ -0,0 +1,135 @@
+import sys
+import time
+
+from app.config import get_settings
+from app.services import transcode_cache
+from app.services.hls_cmaf import CMAFPackager, build_cmaf_playlist, build_dash_manifest
+from app.services.hls_service import DEFAULT_RENDITION
+from app.services.transcode_scheduler import TranscodeScheduler
+from app.services.transcode_sessions import TranscodeSessionManager
+from app.utils.fmp4 import FragmentIndex
+
+
+def _index(data):
+    index = FragmentIndex()
+    index.update(lambda offset, length: data[offset:offset + length], len(data))
+    return index
+
+
+def test_playlist_addresses_fragments_by_byte_range(make_fmp4):
+    data = make_fmp4([0.0, 4.0, 8.0])
+    index = _index(data)
+    offsets = index.offsets
+
+    playlist = build_cmaf_playlist(index, len(data), 10.0, complete=True, segment_seconds=4)
+    lines = playlist.splitlines()
+    assert "#EXT-X-VERSION:7" in lines and lines[-1] == "#EXT-X-ENDLIST"
+    assert f'#EXT-X-MAP:URI="media.mp4",BYTERANGE="{index.init_end}@0"' in lines
+    assert [line for line in lines if line.startswith("#EXT-X-BYTERANGE")] == [
+        f"#EXT-X-BYTERANGE:{offsets[1] - offsets[0]}@{offsets[0]}",
+        f"#EXT-X-BYTERANGE:{offsets[2] - offsets[1]}@{offsets[1]}",
+        f"#EXT-X-BYTERANGE:{len(data) - offsets[2]}@{offsets[2]}",
+    ]
+    assert [line for line in lines if line.startswith("#EXTINF")] == [
+        "#EXTINF:4.000,", "#EXTINF:4.000,", "#EXTINF:2.000,"
+    ]
+
+    # Still encoding: the newest fragment may be partial, so it isn't listed yet
+    growing = build_cmaf_playlist(index, len(data), 10.0, complete=False, segment_seconds=4)
+    assert "#EXT-X-PLAYLIST-TYPE:EVENT" in growing and "#EXT-X-ENDLIST" not in growing
+    assert growing.count("#EXT-X-BYTERANGE") == 2
+
+
+def test_dash_manifest_reuses_fragments(make_fmp4):
+    data = make_fmp4([0.0, 4.0])
+    index = _index(data)
+
+    mpd = build_dash_manifest([(DEFAULT_RENDITION, index, len(data))], 6.0, 4)
+    assert '<BaseURL>720p/media.mp4</BaseURL>' in mpd
+    assert f'<Initialization range="0-{index.init_end - 1}"/>' in mpd
+    assert f'<SegmentURL mediaRange="{index.offsets[1]}-{len(data) - 1}"/>' in mpd
+    assert '<S t="4000" d="2000"/>' in mpd
+
+
+def test_command_aligns_fragments_to_segments():
+    packager = CMAFPackager(segment_seconds=4)
+
+    cmd = packager.command("/media/a.mkv", DEFAULT_RENDITION, use_gpu=False)
+    assert cmd[cmd.index("-vf") + 1] == "scale=1280:720"
+    assert cmd[cmd.index("-sc_threshold") + 1] == "0"
+    assert cmd[cmd.index("-force_key_frames") + 1] == "expr:gte(t,n_forced*4)"
+    assert "frag_keyframe" in cmd[cmd.index("-movflags") + 1]
+    assert cmd[-1] == "pipe:1"
+
+    silent = packager.command("/media/a.mkv", DEFAULT_RENDITION, use_gpu=True, has_audio=False)
+    assert "0:a:0" not in silent and "-c:a" not in silent
+    assert silent[silent.index("-c:v") + 1] == "h264_nvenc"
+
+
+def test_rendition_is_encoded_once_then_served_from_cache(tmp_path, monkeypatch, make_fmp4):
+    monkeypatch.setenv("TRANSCODE_CACHE_DIR", str(tmp_path / "cache"))
+    get_settings.cache_clear()
+    transcode_cache.get_transcode_cache.cache_clear()
+    try:
+        source = tmp_path / "out.mp4"
+        source.write_bytes(make_fmp4([0.0, 4.0, 8.0]))
+        encoder = [sys.executable, "-c",
+                   f"import sys; sys.stdout.buffer.write(open({str(source)!r}, 'rb').read())"]
+        commands = []
+
+        def build_cmd(use_gpu):
+            commands.append(use_gpu)
+            return encoder
+
+        scheduler = TranscodeScheduler(gpu_slots=0, cpu_slots=1)
+        manager = TranscodeSessionManager(spool_dir=str(tmp_path / "spool"), linger=0, scheduler=scheduler)
+        packager = CMAFPackager(manager=manager, segment_seconds=4, segment_timeout=10)
+        first = packager.media("k" * 64, build_cmd, "test")
+        assert first is not None and len(first[1].offsets) >= 2
+
+        deadline = time.time() + 10
+        while packager._sessions and time.time() < deadline:
+            time.sleep(0.02)
+
+        path, index, end, complete = packager.media("k" * 64, build_cmd, "test")
+        assert complete and path == transcode_cache.get_transcode_cache().path_for("k" * 64)
+        assert index.times == [0.0, 4.0, 8.0] and end == source.stat().st_size
+        assert commands == [False]  # no GPU slots: encoded on the CPU
+        assert scheduler.stats()["cpu"]["used"] == 0
+    finally:
+        get_settings.cache_clear()
+        transcode_cache.get_transcode_cache.cache_clear()
+
+
+def test_background_start_never_blocks_and_polling_counts_no_misses(tmp_path, monkeypatch, make_fmp4):
+    monkeypatch.setenv("TRANSCODE_CACHE_DIR", str(tmp_path / "cache"))
+    get_settings.cache_clear()
+    transcode_cache.get_transcode_cache.cache_clear()
+    try:
+        source = tmp_path / "out.mp4"
+        source.write_bytes(make_fmp4([0.0, 4.0]))
+        encoder = [sys.executable, "-c",
+                   f"import sys; sys.stdout.buffer.write(open({str(source)!r}, 'rb').read())"]
+        scheduler = TranscodeScheduler(gpu_slots=0, cpu_slots=1)
+        manager = TranscodeSessionManager(spool_dir=str(tmp_path / "spool"), linger=0, scheduler=scheduler)
+        packager = CMAFPackager(manager=manager, segment_seconds=4, segment_timeout=10)
+        cache = transcode_cache.get_transcode_cache()
+
+        # Every slot is busy: a manifest request must not wait for one
+        busy = scheduler.acquire("interactive", label="viewer")
+        started = time.monotonic()
+        packager.start("k" * 64, lambda use_gpu: encoder, "test", priority="preview")
+        packager.start("k" * 64, lambda use_gpu: encoder, "test", priority="preview")
+        assert time.monotonic() - started < 1
+        assert packager.cached("k" * 64) is None
+        busy.release()
+
+        deadline = time.time() + 10
+        while packager.cached("k" * 64) is None and time.time() < deadline:
+            time.sleep(0.02)
+        assert packager.cached("k" * 64)[3] is True
+        assert cache.stats()["misses"] == 0
+        assert scheduler.stats()["granted"] == 2  # the viewer, then one encode
+    finally:
+        get_settings.cache_clear()
+        transcode_cache.get_transcode_cache.cache_clear()
@@ -0,0 +1,224 @@
+import sys
+import threading
+import time
+
+from app.services.hls_service import DEFAULT_RENDITION, HLSService, build_ladder, build_media_playlist
+from app.services.transcode_scheduler import TranscodeScheduler
+
+# Stand-in for FFmpeg's HLS muxer: writes each rendition's segments from a
+# start index, renaming each into place when complete (like -hls_flags temp_file)
+FAKE_ENCODER = (
+    "import os, sys, time\n"
+    "out, start, total = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])\n"
+    "names = sys.argv[4].split(',')\n"
+    "for i in range(start, total):\n"
+    "    for name in names:\n"
+    "        path = os.path.join(out, name, 'segment_%05d.ts' % i)\n"
+    "        open(path + '.tmp', 'wb').write(b'ts' * 100)\n"
+    "        os.rename(path + '.tmp', path)\n"
+    "    time.sleep(0.05)\n"
+)
+
+LOW = {"name": "480p", "width": 854, "height": 480, "bitrate": "2000k"}
+
+
+def _service(tmp_path, **kwargs):
+    service = HLSService(output_dir=str(tmp_path), segment_seconds=4, segment_timeout=10,
+                         scheduler=TranscodeScheduler(gpu_slots=0, cpu_slots=1), **kwargs)
+    commands = []
+
+    def fake_command(input_path, output_dir, renditions, start_segment, use_gpu, has_audio):
+        names = ",".join(r["name"] for r in renditions)
+        commands.append(start_segment if names == DEFAULT_RENDITION["name"] else (start_segment, names))
+        return [sys.executable, "-c", FAKE_ENCODER, str(output_dir), str(start_segment), "100", names]
+
+    service._encoder_command = fake_command
+    return service, commands
+
+
+def test_media_playlist_is_complete_vod_from_duration():
+    playlist = build_media_playlist(10.5, 4)
+    lines = playlist.splitlines()
+
+    assert "#EXT-X-PLAYLIST-TYPE:VOD" in lines and lines[-1] == "#EXT-X-ENDLIST"
+    assert [line for line in lines if line.startswith("segment_")] == [
+        "segment_00000.ts", "segment_00001.ts", "segment_00002.ts"
+    ]
+    assert [line for line in lines if line.startswith("#EXTINF")] == [
+        "#EXTINF:4.000,", "#EXTINF:4.000,", "#EXTINF:2.500,"
+    ]
+
+
+def test_ladder_never_upscales():
+    def sizes(width, height):
+        return [(r["name"], r["width"], r["height"]) for r in build_ladder(width, height)]
+
+    assert sizes(3840, 2160)[0] == ("1080p", 1920, 1080)
+    assert sizes(1920, 1080) == [
+        ("1080p", 1920, 1080), ("720p", 1280, 720), ("480p", 854, 480), ("360p", 640, 360)
+    ]
+    # 720p source: no 1080p rung
+    assert sizes(1280, 720) == [("720p", 1280, 720), ("480p", 854, 480), ("360p", 640, 360)]
+    # 480p source: offered at its own size and below
+    assert sizes(720, 480) == [("480p", 720, 480), ("360p", 540, 360)]
+    # Scope film keeps full width at the top rung
+    assert sizes(1920, 800)[0] == ("800p", 1920, 800)
+    assert sizes(320, 240) == [("240p", 320, 240)]
+    assert build_ladder(None, None) == [DEFAULT_RENDITION]
+
+
+def test_ladder_caps_bitrate_at_source():
+    ladder = build_ladder(1920, 1080, bitrate_kbps=3000)
+    assert [r["bitrate"] for r in ladder] == ["3000k", "3000k", "2000k", "1000k"]
+
+
+def test_renditions_share_one_decode(tmp_path):
+    service = HLSService(output_dir=str(tmp_path), segment_seconds=4)
+
+    for use_gpu, scaler, encoder in ((False, "scale", "libx264"), (True, "scale_cuda", "h264_nvenc")):
+        cmd = service._encoder_command("/media/a.mkv", tmp_path, [DEFAULT_RENDITION, LOW], 0, use_gpu)
+        assert cmd.count("-i") == 1
+        assert cmd[cmd.index("-filter_complex") + 1] == (
+            f"[0:v:0]split=2[s0][s1];[s0]{scaler}=1280:720[v0];[s1]{scaler}=854:480[v1]"
+        )
+        assert cmd[cmd.index("-c:v:0") + 1] == encoder and cmd[cmd.index("-c:v:1") + 1] == encoder
+        assert cmd[cmd.index("-b:v:1") + 1] == "2000k"
+        assert cmd[cmd.index("-var_stream_map") + 1] == "v:0,a:0,name:720p v:1,a:1,name:480p"
+        assert cmd[-1] == str(tmp_path / "%v" / "encoder.m3u8")
+
+    silent = service._encoder_command("/media/a.mkv", tmp_path, [LOW], 0, False, has_audio=False)
+    assert "0:a:0" not in silent and "-c:a" not in silent
+    assert silent[silent.index("-var_stream_map") + 1] == "v:0,name:480p"
+
+
+def test_encoder_command_restarts_at_segment_timestamp(tmp_path):
+    service = HLSService(output_dir=str(tmp_path), segment_seconds=4)
+
+    cmd = service._encoder_command("/media/a.mkv", tmp_path, [DEFAULT_RENDITION], 30, use_gpu=False)
+    assert cmd[cmd.index("-ss") + 1] == "120.000"
+    assert cmd.index("-ss") < cmd.index("-i")
+    assert cmd[cmd.index("-start_number") + 1] == "30"
+    assert cmd[cmd.index("-output_ts_offset") + 1] == "120.000"
+    assert cmd[cmd.index("-force_key_frames") + 1] == "expr:gte(t,n_forced*4)"
+    assert "temp_file" in cmd[cmd.index("-hls_flags") + 1]
+
+    first = service._encoder_command("/media/a.mkv", tmp_path, [DEFAULT_RENDITION], 0, use_gpu=True)
+    assert "-ss" not in first
+    assert "-forced-idr" in first
+
+
+def test_segments_are_served_as_soon_as_written(tmp_path):
+    service, commands = _service(tmp_path)
+    try:
+        first = service.get_segment(1, 0, "/media/a.mkv", 400.0)
+        assert first is not None and first.name == "segment_00000.ts"
+
+        # Sequential requests ride the same encoder
+        assert service.get_segment(1, 1, "/media/a.mkv", 400.0).name == "segment_00001.ts"
+        assert commands == [0]
+
+        # Generated segments are served from the manifest
+        assert service.store.lookup(1, "720p/segment_00000.ts") == first
+    finally:
+        service.stop_all()
+
+
+def test_jump_restarts_encoder_at_requested_segment(tmp_path):
+    service, commands = _service(tmp_path)
+    try:
+        service.get_segment(1, 0, "/media/a.mkv", 400.0)
+        started = time.monotonic()
+        segment = service.get_segment(1, 80, "/media/a.mkv", 400.0)
+        assert segment.name == "segment_00080.ts"
+        assert commands == [0, 80]
+        assert time.monotonic() - started < 5
+        # The restarted encoder took over the only slot
+        assert service.scheduler.stats()["cpu"]["used"] == 1
+    finally:
+        service.stop_all()
+
+
+def test_new_rendition_restarts_encoder_with_both(tmp_path):
+    service, commands = _service(tmp_path)
+    try:
+        service.get_segment(1, 0, "/media/a.mkv", 400.0)
+        # The player switches down: one encoder now produces both renditions
+        segment = service.get_segment(1, 3, "/media/a.mkv", 400.0, rendition=LOW)
+        assert segment.parent.name == "480p"
+        assert commands == [0, (3, "720p,480p")]
+
+        assert service.get_segment(1, 4, "/media/a.mkv", 400.0).parent.name == "720p"
+        assert len(commands) == 2
+    finally:
+        service.stop_all()
+
+
+def test_encoder_pauses_beyond_prefetch_and_stops_when_idle(tmp_path):
+    service, _ = _service(tmp_path, prefetch_segments=2, idle_timeout=60)
+    try:
+        service.get_segment(1, 0, "/media/a.mkv", 400.0)
+        job = service._jobs[1]
+        deadline = time.monotonic() + 10
+        while job.encoder.refresh() <= 3 and time.monotonic() < deadline:
+            time.sleep(0.02)
+
+        service._check_encoders()
+        assert job.encoder.paused
+
+        # The player catching up resumes it
+        service.get_segment(1, 4, "/media/a.mkv", 400.0)
+        service._check_encoders()
+        assert not job.encoder.paused
+
+        service.idle_timeout = 0
+        service._check_encoders()
+        assert job.encoder is None
+    finally:
+        service.stop_all()
+
+
+def test_prewarm_encodes_the_head_then_stops(tmp_path):
+    service, commands = _service(tmp_path)
+    assert service.prewarm(1, "/media/a.mkv", 400.0, [DEFAULT_RENDITION], 3) >= 3
+    assert service.store.lookup(1, "720p/segment_00002.ts") is not None
+    # The encoder is gone and its slot free
+    assert service.scheduler.stats()["cpu"]["used"] == 0
+
+    # Already there: nothing is encoded
+    assert service.prewarm(1, "/media/a.mkv", 400.0, [DEFAULT_RENDITION], 3) == 3
+    assert commands == [0]
+
+    # Without a free slot it doesn't wait
+    slot = service.scheduler.acquire("interactive")
+    try:
+        assert service.prewarm(2, "/media/b.mkv", 400.0, [DEFAULT_RENDITION], 3) is None
+    finally:
+        slot.release()
+
+
+def test_waiting_for_a_slot_leaves_the_title_unlocked(tmp_path):
+    service, commands = _service(tmp_path)
+    slot = service.scheduler.acquire("interactive")
+    result = {}
+    waiter = threading.Thread(target=lambda: result.update(segment=service.get_segment(1, 0, "/media/a.mkv", 400.0)))
+    try:
+        waiter.start()
+        deadline = time.monotonic() + 5
+        while service.scheduler.stats()["queued"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        # The monitor can still look at (and not drop) the queued title
+        job = service._jobs[1]
+        assert job.lock.acquire(timeout=1)
+        job.lock.release()
+        service.idle_timeout = 0
+        service._check_encoders()
+        assert service._jobs.get(1) is job
+
+        slot.release()
+        waiter.join(10)
+        assert result["segment"].name == "segment_00000.ts"
+        assert commands == [0]
+    finally:
+        slot.release()
+        service.stop_all()
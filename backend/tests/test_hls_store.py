@@ -0,0 +1,113 @@
+import os
+
+from app.services.hls_store import HLSSegmentStore
+
+
+def _write(store, file_id, segment, size, keep=()):
+    path = store.root / str(file_id) / segment
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    store.record(file_id, segment, size, keep=keep)
+    return path
+
+
+def test_budget_evicts_least_recently_watched_title_whole(tmp_path):
+    store = HLSSegmentStore(str(tmp_path), max_bytes=250, max_age=3600)
+    _write(store, 1, "720p/segment_00000.ts", 100)
+    _write(store, 1, "480p/segment_00000.ts", 50)
+    _write(store, 2, "720p/segment_00000.ts", 50)
+    store._titles["1"]["last_access"] -= 10
+    store._titles["2"]["last_access"] -= 5
+
+    # Writing title 3 goes over budget: title 1 (oldest) goes entirely
+    _write(store, 3, "720p/segment_00000.ts", 100)
+    assert not (tmp_path / "1").exists()
+    assert (tmp_path / "2" / "720p" / "segment_00000.ts").exists()
+
+    stats = store.stats()
+    assert stats["bytes"] == 150 and stats["titles"] == 2
+    assert stats["evictions"] == 1 and stats["evicted_bytes"] == 150
+
+
+def test_active_titles_are_not_evicted(tmp_path):
+    store = HLSSegmentStore(str(tmp_path), max_bytes=150, max_age=3600)
+    _write(store, 1, "720p/segment_00000.ts", 100)
+    store._titles["1"]["last_access"] -= 10
+
+    _write(store, 2, "720p/segment_00000.ts", 100, keep=[1])
+    assert (tmp_path / "1").exists() and (tmp_path / "2").exists()
+
+    # Rewriting a segment replaces its size rather than adding to it
+    _write(store, 2, "720p/segment_00000.ts", 40, keep=[1])
+    assert store.stats()["bytes"] == 140
+
+
+def test_sweep_drops_titles_not_watched_recently(tmp_path):
+    store = HLSSegmentStore(str(tmp_path), max_bytes=1000, max_age=60)
+    _write(store, 1, "720p/segment_00000.ts", 10)
+    _write(store, 2, "720p/segment_00000.ts", 10)
+    store._titles["1"]["last_access"] -= 120
+    store._titles["2"]["last_access"] -= 120
+    assert store.lookup(2, "720p/segment_00000.ts") == tmp_path / "2" / "720p" / "segment_00000.ts"
+
+    store.sweep()
+    assert not (tmp_path / "1").exists()
+    assert (tmp_path / "2").exists()
+
+
+def test_manifest_is_invalidated_by_eviction_and_forget(tmp_path):
+    store = HLSSegmentStore(str(tmp_path), max_bytes=150, max_age=3600)
+    _write(store, 1, "720p/segment_00000.ts", 100)
+    _write(store, 1, "480p/segment_00000.ts", 20)
+    assert store.lookup(1, "720p/segment_00001.ts") is None
+
+    store.forget(1, "720p")
+    assert store.lookup(1, "720p/segment_00000.ts") is None
+    assert store.lookup(1, "480p/segment_00000.ts") is not None
+    assert store.stats()["bytes"] == 20
+
+    store._titles["1"]["last_access"] -= 10
+    _write(store, 2, "720p/segment_00000.ts", 140)
+    assert store.lookup(1, "480p/segment_00000.ts") is None
+
+
+def test_index_survives_restart_or_is_rebuilt(tmp_path):
+    store = HLSSegmentStore(str(tmp_path), max_bytes=1000, max_age=3600)
+    _write(store, 1, "720p/segment_00000.ts", 100)
+    store._save_locked(force=True)
+
+    reloaded = HLSSegmentStore(str(tmp_path), max_bytes=1000, max_age=3600)
+    assert reloaded.stats()["bytes"] == 100
+
+    os.remove(tmp_path / "index.json")
+    rebuilt = HLSSegmentStore(str(tmp_path), max_bytes=1000, max_age=3600)
+    assert rebuilt.stats()["bytes"] == 100
+    assert rebuilt._titles["1"]["segments"] == {"720p/segment_00000.ts": 100}
+
+
+def test_evicted_files_are_deleted_without_holding_the_store(tmp_path, monkeypatch):
+    import threading
+    from app.services import hls_store
+
+    release = threading.Event()
+    deleted = threading.Event()
+
+    def slow_rmtree(path, ignore_errors=False):
+        release.wait(10)  # thousands of segments
+        real_rmtree(path, ignore_errors=ignore_errors)
+        deleted.set()
+
+    real_rmtree = hls_store.shutil.rmtree
+    monkeypatch.setattr(hls_store.shutil, "rmtree", slow_rmtree)
+
+    store = HLSSegmentStore(str(tmp_path), max_bytes=150, max_age=3600)
+    _write(store, 1, "720p/segment_00000.ts", 100)
+    store._titles["1"]["last_access"] -= 10
+    _write(store, 2, "720p/segment_00000.ts", 100)
+
+    # Title 1 is gone from the manifest and its directory at once; viewers aren't blocked
+    assert not (tmp_path / "1").exists()
+    assert store.lookup(2, "720p/segment_00000.ts") is not None
+    release.set()
+    assert deleted.wait(10)
+    assert not list(tmp_path.glob(".evicted-*"))
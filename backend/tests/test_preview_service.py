@@ -0,0 +1,73 @@
+import sys
+from types import SimpleNamespace
+
+from app.services.preview_service import (
+    POSTER, SPRITE, THUMBNAILS, PreviewService, build_thumbnail_vtt, sprite_layout,
+)
+from app.services.transcode_scheduler import TranscodeScheduler
+
+# Stand-in for FFmpeg: writes a marker to the output path (the last argument)
+FAKE_RENDER = [sys.executable, "-c", "import sys; open(sys.argv[-1], 'wb').write(b'image')"]
+
+
+class FakePreviewService(PreviewService):
+    def __init__(self, root):
+        super().__init__(root=str(root), scheduler=TranscodeScheduler(gpu_slots=0, cpu_slots=1),
+                         session_factory=lambda: None)
+        self.commands = []
+
+    def _poster_command(self, input_path, duration):
+        self.commands.append(POSTER)
+        return list(FAKE_RENDER)
+
+    def _sprite_command(self, input_path, layout):
+        self.commands.append(SPRITE)
+        return list(FAKE_RENDER)
+
+
+def _media(md5="abc123", duration=95.0):
+    return SimpleNamespace(md5_hash=md5, duration=duration, width=1920, height=800, filename="movie.mkv")
+
+
+def test_sprite_layout_caps_tiles_and_keeps_aspect():
+    short = sprite_layout(95.0, 1920, 800)
+    assert short == {"interval": 10, "count": 10, "columns": 10, "rows": 1, "width": 160, "height": 66}
+
+    movie = sprite_layout(7200.0, 1920, 1080)
+    assert movie["interval"] == 72 and movie["count"] == 100 and movie["rows"] == 10
+    assert movie["height"] == 90
+    assert sprite_layout(None, 1920, 1080) is None
+
+
+def test_thumbnail_vtt_addresses_tiles():
+    layout = sprite_layout(25.0, 1280, 720)
+    vtt = build_thumbnail_vtt(layout, 25.0)
+    assert vtt.startswith("WEBVTT\n")
+    assert "00:00:00.000 --> 00:00:10.000\nsprite.jpg#xywh=0,0,160,90" in vtt
+    assert "00:00:20.000 --> 00:00:25.000\nsprite.jpg#xywh=320,0,160,90" in vtt
+
+
+def test_artifacts_are_generated_once_and_shared_by_content(tmp_path):
+    source = tmp_path / "movie.mkv"
+    source.write_bytes(b"video")
+    service = FakePreviewService(tmp_path / "previews")
+
+    poster = service.artifact(_media(), source, POSTER)
+    assert poster.read_bytes() == b"image"
+    # Same content under another name (a duplicate) reuses it
+    assert service.artifact(_media(), tmp_path / "copy.mkv", POSTER) == poster
+
+    track = service.artifact(_media(), source, THUMBNAILS)
+    assert track.name == THUMBNAILS and "sprite.jpg#xywh=" in track.read_text()
+    assert (track.parent / SPRITE).exists()
+    assert service.artifact(_media(), source, SPRITE) == track.parent / SPRITE
+
+    assert service.commands == [POSTER, SPRITE]
+    assert service.stats()["generated"] == 2 and service.stats()["hits"] == 2
+    assert [p.name for p in track.parent.iterdir() if p.name.startswith(".")] == []
+
+
+def test_sprite_needs_a_duration(tmp_path):
+    service = FakePreviewService(tmp_path)
+    assert service.artifact(_media(duration=None), tmp_path / "x.mkv", SPRITE) is None
+    assert service.artifact(_media(), tmp_path / "x.mkv", POSTER, generate=False) is None
@@ -0,0 +1,139 @@
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.config import get_settings
+from app.services import prewarm_service, transcode_cache
+from app.services.comparison_service import ComparisonMember
+from app.services.ffmpeg_service import FFmpegService
+from app.services.prewarm_service import PrewarmService
+from app.services.stream_profiles import smart_output_key
+from app.services.transcode_scheduler import TranscodeScheduler
+
+# Stand-ins for FFmpeg writing fragmented MP4 to stdout
+QUICK = "import sys; sys.stdout.buffer.write(b'mp4' * 100)"
+ENDLESS = "import sys, time\nwhile True:\n    sys.stdout.buffer.write(b'mp4'); sys.stdout.flush(); time.sleep(0.05)"
+
+
+class FakeFFmpegService(FFmpegService):
+    def __init__(self, script):
+        super().__init__()
+        self.script = script
+        self.runs = 0
+
+    def build_stream_command(self, input_path, recommendation, width=None, height=None, quality=23,
+                             use_gpu=True, output="pipe:1", start_time=None):
+        self.runs += 1
+        return [sys.executable, "-c", self.script]
+
+
+class EmptyStore:
+    def title_bytes(self, file_id):
+        return 0
+
+
+def _service(script, **kwargs):
+    service = PrewarmService(hls_service=SimpleNamespace(store=EmptyStore()),
+                             scheduler=TranscodeScheduler(gpu_slots=0, cpu_slots=1),
+                             session_factory=lambda: None, **kwargs)
+    service.ffmpeg_service = FakeFFmpegService(script)
+    return service
+
+
+def _episode(path, bitrate=2000):
+    return SimpleNamespace(id=7, filepath=str(path), filename="show.s01e02.mkv", md5_hash="md5-ep",
+                           video_codec="hevc", audio_codec="aac", format="matroska,webm",
+                           duration=1500.0, width=1920, height=1080, bitrate=bitrate)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("TRANSCODE_CACHE_DIR", str(tmp_path / "cache"))
+    get_settings.cache_clear()
+    transcode_cache.get_transcode_cache.cache_clear()
+    yield tmp_path / "cache"
+    get_settings.cache_clear()
+    transcode_cache.get_transcode_cache.cache_clear()
+
+
+def test_short_titles_get_their_whole_smart_output(tmp_path, cache_dir):
+    source = tmp_path / "show.s01e02.mkv"
+    source.write_bytes(b"video")
+    service = _service(QUICK)
+    media = _episode(source)
+
+    assert service.prewarm_file(media) is True
+    key = smart_output_key(media, source, "hls_transcode")
+    cached = transcode_cache.get_transcode_cache().lookup(key)
+    assert cached is not None and cached.read_bytes() == b"mp4" * 100
+
+    # Already cached: nothing to do
+    assert service.prewarm_file(media) is True
+    assert service.ffmpeg_service.runs == 1
+    assert service.stats()["prewarmed"] == 1 and service.stats()["bytes"] == 300
+
+
+def test_prewarm_yields_to_interactive_requests(tmp_path, cache_dir):
+    source = tmp_path / "show.s01e02.mkv"
+    source.write_bytes(b"video")
+    service = _service(ENDLESS)
+    media = _episode(source)
+    result = {}
+
+    worker = threading.Thread(target=lambda: result.setdefault("done", service.prewarm_file(media)))
+    worker.start()
+    deadline = time.monotonic() + 5
+    while not service.scheduler.stats()["running"] and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+    # A viewer queues for the only slot: the prewarm encode gives it up
+    slot = service.scheduler.acquire("interactive", label="viewer", timeout=5)
+    slot.release()
+    worker.join(5)
+
+    assert result["done"] is False
+    assert service.stats()["yielded"] == 1
+    assert not transcode_cache.get_transcode_cache().contains(smart_output_key(media, source, "hls_transcode"))
+    assert list((cache_dir / "tmp").iterdir()) == []
+
+
+def test_disk_and_cpu_budgets(tmp_path, cache_dir):
+    source = tmp_path / "show.s01e02.mkv"
+    source.write_bytes(b"video")
+
+    # 2 Mb/s for 25 minutes doesn't fit in 1 MB
+    small = _service(QUICK, max_bytes=1024 ** 2)
+    assert small.prewarm_file(_episode(source)) is True
+    assert small.ffmpeg_service.runs == 0 and small.stats()["over_budget"] == 1
+
+    thrifty = _service(QUICK, cpu_seconds_per_hour=10.0)
+    assert not thrifty.should_yield()
+    thrifty._cpu.append((time.monotonic(), 12.0))
+    assert thrifty.should_yield()
+    assert thrifty.prewarm_file(_episode(source, bitrate=None)) is False
+
+
+def test_group_previews_never_wait_for_a_slot_and_count_their_cpu(cache_dir, monkeypatch):
+    members = [ComparisonMember(1, "/media/a.mkv", "md5-a"), ComparisonMember(2, "/media/b.mkv", "md5-b")]
+    files = [SimpleNamespace(bitrate=100, framerate=24.0)] * 2
+    monkeypatch.setattr(prewarm_service, "group_members", lambda db, group_id: (members, files))
+    service = _service(QUICK)
+    service.session_factory = lambda: SimpleNamespace(close=lambda: None)
+    script = "import sys\nfor path in sys.argv[1:]: open(path, 'wb').write(b'mp4')"
+    service.comparison_service.command = lambda members, start, seconds, fps, outputs, layout, use_gpu: [
+        sys.executable, "-c", script, *map(str, outputs.values())
+    ]
+
+    # The only slot is busy: give up at once instead of queueing behind it
+    slot = service.scheduler.acquire("interactive")
+    started = time.monotonic()
+    assert service.prewarm_group(3) is False
+    assert time.monotonic() - started < 1 and service.scheduler.stats()["queued"] == 0
+    slot.release()
+
+    assert service.prewarm_group(3) is True
+    assert service.stats()["prewarmed"] == 1 and service.scheduler.stats()["cpu"]["used"] == 0
+    assert len(service._cpu) == 1
@@ -35,3 +35,150 @@ def test_check_language_concern_flags_foreign_film_with_english_subs():
     })
     assert concern is True
     assert "Foreign-film" in reason or "Foreign film" in reason
+
+
+def test_sql_score_matches_python_score():
+    import itertools
+
+    from sqlalchemy import Column, Integer, MetaData, Numeric, String, Table, create_engine, select
+
+    from app.services.quality_service import quality_score_sql
+
+    metadata = MetaData()
+    probe = Table(
+        "quality_probe",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("height", Integer),
+        Column("video_codec", String),
+        Column("bitrate", Integer),
+        Column("audio_channels", Numeric(3, 1)),
+        Column("audio_track_count", Integer),
+        Column("subtitle_track_count", Integer),
+        Column("hdr_type", String),
+    )
+    engine = create_engine("sqlite://")
+    metadata.create_all(engine)
+
+    rows = [
+        {
+            "height": height,
+            "video_codec": codec,
+            "bitrate": bitrate,
+            "audio_channels": channels,
+            "audio_track_count": audio_tracks,
+            "subtitle_track_count": subtitles,
+            "hdr_type": hdr,
+        }
+        for height, codec, bitrate, channels, audio_tracks, subtitles, hdr in itertools.product(
+            [None, 0, 360, 480, 720, 1080, 2160],
+            [None, "h264", "HEVC", "vp9", "av1", "mpeg4"],
+            [None, 0, 700, 2499, 5000, 64000],
+            [None, 2, 6],
+            [None, 1, 3, 8],
+            [None, 0, 2, 9],
+            [None, "SDR", "HDR10", "Dolby Vision"],
+        )
+    ]
+
+    service = QualityService()
+    expression = quality_score_sql(**{name: probe.c[name] for name in rows[0]})
+
+    with engine.begin() as conn:
+        conn.execute(probe.insert(), rows)
+        sql_scores = conn.execute(select(expression).order_by(probe.c.id)).scalars().all()
+
+    python_scores = [service.calculate_quality_score(row) for row in rows]
+    assert sql_scores == python_scores
+
+
+def test_profiles_change_keeper_between_4k_hevc_and_1080p_h264():
+    uhd_hevc = {"id": 1, "height": 2160, "video_codec": "hevc", "bitrate": 40000,
+                "audio_channels": 6, "hdr_type": "HDR10"}
+    hd_h264 = {"id": 2, "height": 1080, "video_codec": "h264", "bitrate": 8000,
+               "audio_channels": 2, "hdr_type": "SDR"}
+
+    archive = QualityService(profile="archive").rank_files([hd_h264, uhd_hevc])
+    mobile = QualityService(profile="mobile").rank_files([hd_h264, uhd_hevc])
+
+    assert archive[0]["id"] == 1
+    assert mobile[0]["id"] == 2
+
+
+def test_custom_profile_extends_builtin(monkeypatch):
+    from app.config import get_settings
+    from app.services.quality_service import get_scoring_profile
+
+    monkeypatch.setenv("QUALITY_PROFILES", '{"hdr-lover": {"extends": "default", "hdr_points": 60}}')
+    get_settings.cache_clear()
+    get_scoring_profile.cache_clear()
+    try:
+        base = QualityService().calculate_quality_score({"height": 1080, "hdr_type": "HDR10"})
+        custom = QualityService(profile="hdr-lover").calculate_quality_score({"height": 1080, "hdr_type": "HDR10"})
+        assert custom - base == 45
+        assert get_scoring_profile("hdr-lover") is get_scoring_profile("hdr-lover")
+    finally:
+        get_settings.cache_clear()
+        get_scoring_profile.cache_clear()
+
+
+def test_space_saver_penalises_bitrate_above_the_ideal():
+    service = QualityService(profile="space-saver")
+    lean = service.calculate_quality_score({"height": 1080, "video_codec": "hevc", "bitrate": 5000})
+    bloated = service.calculate_quality_score({"height": 1080, "video_codec": "hevc", "bitrate": 40000})
+    assert bloated < lean
+
+
+def test_migration_function_uses_the_default_profile_tables():
+    import re
+    from pathlib import Path
+
+    from app.services.quality_service import DEFAULT_PROFILE, get_scoring_profile
+
+    sql = (Path(__file__).resolve().parents[2] / "005_quality_score_function.sql").read_text()
+    profile = get_scoring_profile(DEFAULT_PROFILE)
+
+    tiers = re.findall(r"(?:p_height >= (\d+) THEN|ELSE)\s+score := score \+ (\d+); ideal_bitrate := (\d+);", sql)
+    assert sorted((int(h or 0), int(p), int(i)) for h, p, i in tiers) == list(
+        zip(profile.tier_heights, profile.tier_points, profile.tier_ideal_bitrates))
+
+    codecs = re.findall(r"((?:codec LIKE '%\w+%'(?: OR )?)+) THEN\s+score := score \+ (\d+);", sql)
+    assert [(tuple(re.findall(r"%(\w+)%", likes)), int(points)) for likes, points in codecs] == profile.codec_rules
+
+    assert int(re.search(r"\* (\d+)\) / ideal_bitrate", sql).group(1)) == profile.bitrate_points
+    surround, stereo = re.search(r">= 5 THEN\s+score := score \+ (\d+);\s+ELSE\s+score := score \+ (\d+);", sql).groups()
+    assert (int(surround), int(stereo)) == (profile.surround_points, profile.stereo_points)
+    extra_audio = re.search(r"\(audio_tracks - 1\) \* (\d+), (\d+)\)", sql).groups()
+    assert tuple(map(int, extra_audio)) == (profile.extra_audio_points, profile.extra_audio_max)
+    subtitles = re.search(r"subtitle_tracks \* (\d+), (\d+)\)", sql).groups()
+    assert tuple(map(int, subtitles)) == (profile.subtitle_points, profile.subtitle_max)
+
+    hdr_types, hdr_points = re.search(r"p_hdr_type IN \(([^)]*)\) THEN\s+score := score \+ (\d+);", sql).groups()
+    assert set(re.findall(r"'([^']*)'", hdr_types)) == profile.hdr_types and int(hdr_points) == profile.hdr_points
+    assert int(re.search(r"RETURN LEAST\(score, (\d+)\)", sql).group(1)) == profile.max_score
+
+
+def test_custom_profiles_are_validated_when_settings_load(monkeypatch):
+    import pydantic
+    import pytest
+
+    from app.config import get_settings
+    from app.services.quality_service import get_scoring_profile
+
+    get_scoring_profile.cache_clear()
+    try:
+        # Without "extends" a profile builds on the default one
+        monkeypatch.setenv("QUALITY_PROFILES", '{"tiny": {"bitrate_points": 5}}')
+        get_settings.cache_clear()
+        tiny = QualityService(profile="tiny").calculate_quality_score({"height": 1080, "bitrate": 20000})
+        assert tiny == QualityService().calculate_quality_score({"height": 1080}) + 5
+
+        for bad in ('{"tiny": ', '{"default": {"extends": "archive"}}', '{"a": {"extends": "b"}, "b": {"extends": "a"}}',
+                    '{"tiny": {"extends": "nope"}}', '{"tiny": {"bitrate_pts": 5}}', '{"tiny": {"resolution": [[0, 5]]}}'):
+            monkeypatch.setenv("QUALITY_PROFILES", bad)
+            get_settings.cache_clear()
+            with pytest.raises(pydantic.ValidationError, match="QUALITY_PROFILES|Quality profile"):
+                get_settings()
+    finally:
+        get_settings.cache_clear()
+        get_scoring_profile.cache_clear()
@@ -0,0 +1,77 @@
+import importlib
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects.sqlite.base import SQLiteTypeCompiler
+
+
+if not hasattr(SQLiteTypeCompiler, "visit_ARRAY"):
+    def _visit_array(self, type_, **kw):
+        return "TEXT"
+    SQLiteTypeCompiler.visit_ARRAY = _visit_array  # type: ignore[attr-defined]
+from app.config import get_settings
+
+
+class FakeTMDbService:
+    def __init__(self):
+        self.calls = []
+
+    def enrich_many(self, titles):
+        self.calls.extend(titles)
+        return [self.lookup(*key) for key in titles]
+
+    def lookup(self, title, year, media_type):
+        if title == "Unknown Thing":
+            return None
+        return {
+            "tmdb_id": hash((title, year)) % 100000,
+            "tmdb_type": media_type,
+            "tmdb_title": title,
+            "tmdb_year": year,
+            "imdb_id": f"tt{len(title)}",
+        }
+
+
+def test_enrich_batch_looks_up_each_title_once(tmp_path, monkeypatch):
+    db_url = f"sqlite:///{tmp_path}/test.db"
+    monkeypatch.setenv("DATABASE_URL", db_url)
+    get_settings.cache_clear()
+
+    import app.services.scanner_service as scanner_service
+    scanner_service = importlib.reload(scanner_service)
+
+    from app.database import Base
+    from app.models import MediaFile
+    engine = create_engine(db_url)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+
+    titles = [("Red Dwarf", None, "tv")] * 6 + [("Alien", 1979, "movie")] * 3 + [("Unknown Thing", None, "movie")]
+    for i, (title, year, media_type) in enumerate(titles):
+        db.add(MediaFile(
+            filename=f"f{i}.mkv", filepath=f"/media/f{i}.mkv", file_size=1,
+            parsed_title=title, parsed_year=year, media_type=media_type,
+        ))
+    db.commit()
+    ids = [f.id for f in db.query(MediaFile).all()]
+
+    scanner = scanner_service.ScannerService.__new__(scanner_service.ScannerService)
+    scanner.db = db
+    scanner.tmdb_service = FakeTMDbService()
+
+    assert scanner._enrich_batch(ids) == 9
+    assert sorted(scanner.tmdb_service.calls) == [
+        ("Alien", 1979, "movie"), ("Red Dwarf", None, "tv"), ("Unknown Thing", None, "movie"),
+    ]
+
+    db.expire_all()
+    dwarves = db.query(MediaFile).filter(MediaFile.parsed_title == "Red Dwarf").all()
+    assert {f.tmdb_title for f in dwarves} == {"Red Dwarf"}
+    assert all(f.tmdb_last_updated is not None for f in dwarves)
+    unknown = db.query(MediaFile).filter(MediaFile.parsed_title == "Unknown Thing").one()
+    assert unknown.tmdb_id is None
+
+    # Already-enriched files are skipped on the next batch
+    scanner.tmdb_service.calls.clear()
+    assert scanner._enrich_batch(ids) == 0
+    assert scanner.tmdb_service.calls == [("Unknown Thing", None, "movie")]
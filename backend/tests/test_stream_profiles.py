@@ -0,0 +1,83 @@
+from types import SimpleNamespace
+
+from starlette.requests import Request
+
+from app.services.stream_profiles import (
+    ClientHints, StreamProfile, ThroughputHistory, client_hints, client_key, select_profile,
+)
+from app.utils.file_response import ThroughputMeter
+
+
+def _request(headers=None, client="10.0.0.5"):
+    raw = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw, "client": (client, 1234)})
+
+
+def _film(bitrate=12000, width=1920, height=1080):
+    return SimpleNamespace(bitrate=bitrate, width=width, height=height, file_size=None, duration=6000.0)
+
+
+def test_source_is_kept_unless_the_link_or_screen_calls_for_a_rung():
+    # Nothing known: stream as is
+    assert select_profile(_film(), ClientHints()) is None
+    # 20 Mb/s of headroom is enough for a 12 Mb/s source
+    assert select_profile(_film(), ClientHints(downlink_kbps=30000)) is None
+
+    # 6 Mb/s (4.5 usable): the 720p rung at 4 Mb/s plus audio fits
+    assert select_profile(_film(), ClientHints(downlink_kbps=6000)) == StreamProfile("720p", 1280, 720, 4000)
+    # Save-Data caps the budget even on a fast link
+    assert select_profile(_film(), ClientHints(save_data=True)) == StreamProfile("360p", 640, 360, 1000)
+
+    # A phone only shrinks what is transcoded anyway
+    assert select_profile(_film(), ClientHints(device="mobile")) is None
+    assert select_profile(_film(), ClientHints(device="mobile"), transcoding=True).name == "720p"
+
+
+def test_too_slow_for_every_rung_squeezes_the_smallest():
+    profile = select_profile(_film(), ClientHints(downlink_kbps=1000))
+    assert profile.name == "360p" and profile.video_kbps == 558  # 750 usable minus audio
+
+    floor = select_profile(_film(), ClientHints(downlink_kbps=300))
+    assert floor.video_kbps == 400
+
+
+def test_hints_from_headers_query_and_measurements():
+    history_client = "10.0.0.9"
+    hints = client_hints(_request({"Downlink": "2.5", "Save-Data": "on",
+                                   "User-Agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0)"}))
+    assert hints.downlink_kbps == 2500 and hints.save_data and hints.device == "mobile"
+
+    # Browsers report 10 Mb/s for anything faster: not a limit
+    assert client_hints(_request({"Downlink": "10"})).downlink_kbps is None
+    # The query parameter wins over the header
+    assert client_hints(_request({"Downlink": "2.5"}), downlink=1.2).downlink_kbps == 1200
+    assert client_hints(_request({"Sec-CH-UA-Mobile": "?0"}), device="tv").device == "tv"
+    assert client_hints(_request(client=history_client)).measured_kbps is None
+
+
+def test_meter_keeps_the_best_window_and_history_smooths():
+    history = ThroughputHistory()
+    meter = history.meter("client")
+    meter.window_bytes = 1000
+    meter.record(1000, 0.001)  # 8 Mb/s
+    meter.record(1000, 1.0)    # player buffer full: 8 kb/s
+    meter.record(500, 0.0)     # partial window: ignored
+    meter.close()
+    meter.close()
+    assert history.estimate("client") == 8000
+
+    second = ThroughputMeter(lambda kbps: history.record("client", kbps), window_bytes=1000)
+    second.record(1000, 0.002)
+    second.close()
+    assert history.estimate("client") == 6000
+    assert history.estimate("other") is None
+
+
+def test_client_key_trusts_only_what_the_proxy_added():
+    assert client_key(_request()) == "10.0.0.5"
+    # A client-supplied X-Forwarded-For is extended by the proxy, not replaced
+    spoofed = {"X-Forwarded-For": "1.2.3.4, 192.168.1.20"}
+    assert client_key(_request(spoofed, client="127.0.0.1")) == "192.168.1.20"
+    assert client_key(_request({**spoofed, "X-Real-IP": "192.168.1.20"}, client="127.0.0.1")) == "192.168.1.20"
+    # Reached directly (not through a trusted proxy): the headers are the client's own
+    assert client_key(_request({**spoofed, "X-Real-IP": "192.168.1.20"}, client="10.0.0.1")) == "10.0.0.1"
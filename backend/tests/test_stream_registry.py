@@ -0,0 +1,77 @@
+import os
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.services.stream_registry import STALL_SECONDS, StreamRegistry, render_metrics
+from app.utils.file_response import file_range_response
+
+
+def test_requests_join_a_session_and_stalls_are_counted():
+    registry = StreamRegistry()
+    first = registry.open(7, "hls", "10.0.0.2")
+    first.opened -= 0.3  # waited for the encoder
+    first.record(1000, 0.0)
+    first.last_sent -= STALL_SECONDS + 1  # then starved mid-segment
+    first.record(1000, 0.01)
+    first.close()
+    first.close()  # closing twice is harmless
+
+    second = registry.open(7, "hls", "10.0.0.2")
+    second.opened -= STALL_SECONDS + 1  # a later segment arriving late is a stall too
+    second.record(500, 0.01)
+    second.close()
+    registry.open(7, "range", "10.0.0.2").close()
+
+    sessions = registry.sessions()
+    hls = next(s for s in sessions["active"] if s["method"] == "hls")
+    assert hls["requests"] == 2 and hls["open_responses"] == 0
+    assert hls["bytes"] == 2500
+    assert 0.3 <= hls["ttfb"] < 1.0
+    assert hls["stalls"] == 2 and hls["stall_seconds"] >= 2 * STALL_SECONDS
+    assert sessions["totals"]["hls"]["sessions"] == 1 and sessions["totals"]["range"]["requests"] == 1
+
+
+def test_idle_sessions_end_and_stay_listed():
+    registry = StreamRegistry(idle_seconds=0.0)
+    tracker = registry.open(3, "transcode", "10.0.0.3")
+    tracker.session.progress = lambda: {"speed": 1.8}
+    tracker.record(100, 0.0)
+
+    # Still streaming: not idle
+    assert [s["id"] for s in registry.sessions()["active"]] == [tracker.session.id]
+
+    tracker.close()
+    sessions = registry.sessions()
+    assert sessions["active"] == []
+    assert sessions["recent"][0]["ended_at"] is not None
+    assert sessions["recent"][0]["ffmpeg_speed"] == 1.8
+
+    # The next request starts a new session
+    assert registry.open(3, "transcode", "10.0.0.3").session.id != tracker.session.id
+
+
+def test_file_responses_report_to_the_registry_and_metrics(tmp_path):
+    path = tmp_path / "movie.mp4"
+    path.write_bytes(os.urandom(200_000))
+    registry = StreamRegistry()
+    app = FastAPI()
+
+    @app.get("/file")
+    def serve(request: Request):
+        return file_range_response(request, str(path), meter=registry.open(1, "direct", "client"))
+
+    client = TestClient(app)
+    etag = client.get("/file").headers["etag"]
+    # A revalidation sends no body but still ends its response
+    assert client.get("/file", headers={"If-None-Match": etag}).status_code == 304
+
+    session = registry.sessions()["active"][0]
+    assert session["bytes"] == 200_000 and session["requests"] == 2
+    assert session["open_responses"] == 0 and session["ttfb"] is not None
+
+    text = render_metrics(registry.metrics())
+    assert "# TYPE mediavault_stream_ttfb_seconds histogram" in text
+    assert 'mediavault_stream_bytes_total{method="direct"} 200000' in text
+    assert 'mediavault_stream_ttfb_seconds_bucket{method="direct",le="+Inf"} 1' in text
+    assert 'mediavault_stream_sessions_active{method="direct"} 1' in text
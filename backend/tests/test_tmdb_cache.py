@@ -0,0 +1,78 @@
+import importlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects.sqlite.base import SQLiteTypeCompiler
+
+
+if not hasattr(SQLiteTypeCompiler, "visit_ARRAY"):
+    def _visit_array(self, type_, **kw):
+        return "TEXT"
+    SQLiteTypeCompiler.visit_ARRAY = _visit_array  # type: ignore[attr-defined]
+from app.config import get_settings
+
+
+def setup_cache(tmp_path, monkeypatch, **kwargs):
+    db_url = f"sqlite:///{tmp_path}/test.db"
+    monkeypatch.setenv("DATABASE_URL", db_url)
+    get_settings.cache_clear()
+
+    import app.services.tmdb_cache as tmdb_cache
+    tmdb_cache = importlib.reload(tmdb_cache)
+
+    from app.database import Base
+    engine = create_engine(db_url)
+    Base.metadata.create_all(bind=engine)
+    return tmdb_cache, tmdb_cache.TMDbCache(session_factory=sessionmaker(bind=engine), **kwargs)
+
+
+def test_cache_serves_repeat_titles_from_memory_then_database(tmp_path, monkeypatch):
+    tmdb_cache, cache = setup_cache(tmp_path, monkeypatch)
+
+    assert cache.get("search/tv", "Red Dwarf", None) is tmdb_cache.MISS
+    cache.set("search/tv", "Red Dwarf", None, {"tmdb_id": 326})
+
+    assert cache.get("search/tv", "red  dwarf.", None) == {"tmdb_id": 326}
+    cache.clear_memory()
+    assert cache.get("search/tv", "Red Dwarf", None) == {"tmdb_id": 326}
+
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["db_hits"], stats["misses"]) == (1, 1, 1)
+
+
+def test_negative_results_use_shorter_ttl(tmp_path, monkeypatch):
+    tmdb_cache, cache = setup_cache(tmp_path, monkeypatch, ttl_hours=24, negative_ttl_hours=1)
+    cache.set("search/movie", "No Such Film", 1999, None)
+
+    assert cache.get("search/movie", "No Such Film", 1999) is None
+    assert cache.stats()["negative_hits"] == 1
+
+    from app.models import TMDbCacheEntry
+    db = cache.session_factory()
+    entry = db.query(TMDbCacheEntry).one()
+    assert entry.is_negative is True
+    assert entry.expires_at - entry.fetched_at == timedelta(hours=1)
+
+    entry.expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+    db.close()
+    cache.clear_memory()
+
+    assert cache.get("search/movie", "No Such Film", 1999) is tmdb_cache.MISS
+    assert cache.purge_expired() == 1
+
+
+def test_tmdb_service_calls_api_once_per_title(tmp_path, monkeypatch, fake_tmdb_server):
+    _, cache = setup_cache(tmp_path, monkeypatch)
+    import app.services.tmdb_service as tmdb_service
+    tmdb_service = importlib.reload(tmdb_service)
+
+    service = tmdb_service.TMDbService(cache=cache, base_url=fake_tmdb_server.url)
+
+    for _ in range(5):
+        result = service.enrich_media_metadata("Red Dwarf", None, "tv")
+        assert result["tmdb_title"] == "Red Dwarf"
+        assert result["imdb_id"] == f"tt{result['tmdb_id']}"
+
+    assert len(fake_tmdb_server.requests) == 2
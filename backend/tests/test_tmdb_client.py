@@ -0,0 +1,116 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from app.services.tmdb_client import TMDbClient, TokenBucket
+
+
+def test_token_bucket_never_exceeds_limit_in_any_window():
+    bucket = TokenBucket.for_limit(10, 1.0)
+    start = time.monotonic()
+    schedule = sorted(start + bucket.reserve() for _ in range(40))
+
+    for i, t in enumerate(schedule):
+        in_window = [s for s in schedule[i:] if s < t + 1.0 - 1e-6]
+        assert len(in_window) <= 10
+    # Burst of half the budget is immediate, the rest is paced
+    assert schedule[4] - start < 0.05
+    assert schedule[-1] - start == pytest.approx((40 - 5) / 5.0, abs=0.1)
+
+
+def test_client_retries_throttling_and_server_errors(fake_tmdb_server):
+    fake_tmdb_server.failures = [429, 503]
+
+    async def run():
+        async with TMDbClient(base_url=fake_tmdb_server.url, bucket=TokenBucket(100, 100),
+                              backoff_seconds=0.01) as client:
+            return await client.get_json("search/movie", {"query": "Alien"})
+
+    data = asyncio.run(run())
+    assert data["results"][0]["title"] == "Alien"
+    assert fake_tmdb_server.count("search/movie") == 3
+
+
+def test_client_gives_up_after_max_retries(fake_tmdb_server):
+    fake_tmdb_server.failures = [500, 500, 500]
+
+    async def run():
+        async with TMDbClient(base_url=fake_tmdb_server.url, bucket=TokenBucket(100, 100),
+                              max_retries=2, backoff_seconds=0.01) as client:
+            return await client.get_json("search/movie", {"query": "Alien"})
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(run())
+    assert fake_tmdb_server.count("search/movie") == 3
+
+
+def test_enrich_many_overlaps_requests_on_pooled_connections(fake_tmdb_server):
+    from app.services.tmdb_service import TMDbService
+
+    fake_tmdb_server.latency = 0.05
+    service = TMDbService(base_url=fake_tmdb_server.url, bucket=TokenBucket(1000, 1000))
+    service.cache = None
+    titles = [(f"Film {i}", None, "movie") for i in range(20)] + [("Unknown Film", None, "movie")]
+
+    started = time.perf_counter()
+    results = service.enrich_many(titles)
+    elapsed = time.perf_counter() - started
+
+    assert results[-1] is None
+    assert [r["tmdb_title"] for r in results[:-1]] == [t for t, _, _ in titles[:-1]]
+    assert all(r["imdb_id"] for r in results[:-1])
+    assert len(fake_tmdb_server.requests) == 41
+    assert fake_tmdb_server.max_in_flight > 1
+    assert len(fake_tmdb_server.client_ports) <= 10  # keep-alive pool, not one socket per request
+    assert elapsed < 41 * 0.05  # faster than issuing requests one at a time
+
+
+def test_enrich_many_works_inside_a_running_event_loop(fake_tmdb_server):
+    from app.services.tmdb_service import TMDbService
+
+    service = TMDbService(base_url=fake_tmdb_server.url, bucket=TokenBucket(1000, 1000))
+    service.cache = None
+
+    async def caller():
+        # e.g. a scan started from an ``async def`` route
+        return service.enrich_many([("Film 1", None, "movie")])
+
+    results = asyncio.run(caller())
+    assert results[0]["tmdb_title"] == "Film 1" and results[0]["imdb_id"]
+
+
+def test_cache_round_trips_do_not_block_the_event_loop(fake_tmdb_server):
+    import threading
+
+    from app.services.tmdb_cache import MISS
+    from app.services.tmdb_service import TMDbService
+
+    class SlowCache:
+        """Stand-in for the tmdb_cache table: every call is a blocking round-trip."""
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.in_flight = self.max_in_flight = 0
+
+        def _round_trip(self):
+            with self.lock:
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            time.sleep(0.05)
+            with self.lock:
+                self.in_flight -= 1
+
+        def get(self, endpoint, query=None, year=None):
+            self._round_trip()
+            return MISS
+
+        def set(self, endpoint, query, year, value):
+            self._round_trip()
+
+    cache = SlowCache()
+    service = TMDbService(cache=cache, base_url=fake_tmdb_server.url, bucket=TokenBucket(1000, 1000))
+    results = service.enrich_many([(f"Film {i}", None, "movie") for i in range(10)])
+
+    assert all(r["tmdb_title"] for r in results)
+    assert cache.max_in_flight > 1
@@ -0,0 +1,117 @@
+import json
+
+import pytest
+
+from app.services.transcode_cache import TranscodeCache, media_fingerprint, transcode_cache_key
+
+
+def _publish(cache, key, size):
+    temp = cache.temp_path(key)
+    temp.write_bytes(b"x" * size)
+    return cache.publish(key, temp)
+
+
+def test_key_depends_on_content_profile_and_resolution(tmp_path):
+    source = tmp_path / "movie.mkv"
+    source.write_bytes(b"data")
+
+    assert media_fingerprint("abc123", str(source)) == "abc123"
+    assert media_fingerprint(None, str(source)).startswith(str(source))
+
+    base = transcode_cache_key("abc123", "h264-crf23", 1280, 720)
+    assert base == transcode_cache_key("abc123", "h264-crf23", 1280, 720)
+    assert base != transcode_cache_key("abc123", "h264-crf23", 1920, 1080)
+    assert base != transcode_cache_key("abc123", "smart-remux_only", 1280, 720)
+    assert base != transcode_cache_key("def456", "h264-crf23", 1280, 720)
+
+
+def test_publish_lookup_and_stats(tmp_path):
+    cache = TranscodeCache(root=str(tmp_path / "cache"), max_bytes=1000, policy="lru")
+    key = transcode_cache_key("abc", "h264-crf23", 1280, 720)
+
+    assert cache.lookup(key) is None
+    temp = cache.temp_path(key)
+    temp.write_bytes(b"x" * 100)
+    final = cache.publish(key, temp)
+
+    assert not temp.exists()
+    assert final.read_bytes() == b"x" * 100
+    assert cache.lookup(key) == final
+    assert cache.contains(key)
+
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1 and stats["publishes"] == 1
+    assert stats["entries"] == 1 and stats["bytes"] == 100
+    assert stats["hit_rate"] == 0.5
+
+
+def test_lru_evicts_least_recently_used(tmp_path):
+    cache = TranscodeCache(root=str(tmp_path), max_bytes=250, policy="lru")
+    _publish(cache, "aa1", 100)
+    _publish(cache, "bb2", 100)
+    cache.lookup("aa1")  # bb2 is now the oldest access
+
+    _publish(cache, "cc3", 100)
+
+    assert cache.contains("aa1") and cache.contains("cc3")
+    assert not cache.contains("bb2")
+    assert not cache.path_for("bb2").exists()
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lfu_evicts_least_frequently_used(tmp_path):
+    cache = TranscodeCache(root=str(tmp_path), max_bytes=250, policy="lfu")
+    _publish(cache, "aa1", 100)
+    _publish(cache, "bb2", 100)
+    for _ in range(3):
+        cache.lookup("aa1")
+    cache.lookup("bb2")
+    # bb2 is the most recent access but has fewer hits
+    _publish(cache, "cc3", 100)
+
+    assert cache.contains("aa1") and cache.contains("cc3")
+    assert not cache.contains("bb2")
+
+
+def test_oversized_entry_is_kept_until_replaced(tmp_path):
+    cache = TranscodeCache(root=str(tmp_path), max_bytes=50, policy="lru")
+    _publish(cache, "aa1", 100)
+    assert cache.contains("aa1")
+
+    _publish(cache, "bb2", 10)
+    assert not cache.contains("aa1") and cache.contains("bb2")
+
+
+def test_index_survives_restart_and_cleans_partials(tmp_path):
+    cache = TranscodeCache(root=str(tmp_path), max_bytes=1000)
+    _publish(cache, "aa1", 100)
+    cache.lookup("aa1")
+    leftover = cache.temp_path("bb2")
+    leftover.write_bytes(b"partial")
+
+    reloaded = TranscodeCache(root=str(tmp_path), max_bytes=1000)
+    assert reloaded.contains("aa1")
+    assert not leftover.exists()
+    assert reloaded.stats()["bytes"] == 100
+
+    # Missing index is rebuilt from disk; vanished files are dropped
+    (tmp_path / "index.json").unlink()
+    _publish(reloaded, "cc3", 10)
+    reloaded.path_for("cc3").unlink()
+    rebuilt = TranscodeCache(root=str(tmp_path), max_bytes=1000)
+    assert rebuilt.contains("aa1") and not rebuilt.contains("cc3")
+    assert json.loads((tmp_path / "index.json").read_text())
+
+
+def test_adopts_entries_published_by_another_process(tmp_path):
+    first = TranscodeCache(root=str(tmp_path), max_bytes=1000)
+    second = TranscodeCache(root=str(tmp_path), max_bytes=1000)
+    _publish(first, "aa1", 100)
+
+    assert second.lookup("aa1") == second.path_for("aa1")
+    assert second.stats()["entries"] == 1
+
+
+def test_rejects_unknown_policy(tmp_path):
+    with pytest.raises(ValueError):
+        TranscodeCache(root=str(tmp_path), policy="fifo")
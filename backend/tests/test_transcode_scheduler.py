@@ -0,0 +1,94 @@
+import sys
+import threading
+import time
+
+import pytest
+
+from app.services.transcode_scheduler import TranscodeQueueTimeout, TranscodeScheduler
+from app.services.transcode_sessions import TranscodeSessionManager
+
+
+def _wait_queued(scheduler, count):
+    deadline = time.time() + 5
+    while len(scheduler.stats()["queue"]) < count and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_gpu_jobs_fall_back_to_cpu_when_gpu_is_full():
+    scheduler = TranscodeScheduler(gpu_slots=1, cpu_slots=1)
+
+    first = scheduler.acquire(label="a")
+    second = scheduler.acquire(label="b")
+    assert first.gpu and not second.gpu
+    assert scheduler.stats()["cpu_fallbacks"] == 1
+    assert scheduler.try_acquire(label="c") is None
+
+    first.release()
+    first.release()  # idempotent
+    assert scheduler.acquire(label="d").gpu
+
+
+def test_cpu_only_box_uses_cpu_slots():
+    scheduler = TranscodeScheduler(gpu_slots=0, cpu_slots=2)
+    slots = [scheduler.acquire(prefer_gpu=True) for _ in range(2)]
+    assert [s.device for s in slots] == ["cpu", "cpu"]
+    assert scheduler.stats()["cpu_fallbacks"] == 0
+
+
+def test_interactive_is_served_before_preview_and_prewarm():
+    scheduler = TranscodeScheduler(gpu_slots=0, cpu_slots=1)
+    running = scheduler.acquire("interactive", label="playing")
+    order = []
+
+    def wait(priority):
+        with scheduler.slot(priority, label=priority):
+            order.append(priority)
+
+    threads = []
+    for priority in ("prewarm", "preview", "interactive"):
+        threads.append(threading.Thread(target=wait, args=(priority,)))
+        threads[-1].start()
+        _wait_queued(scheduler, len(threads))
+
+    queue = scheduler.stats()["queue"]
+    assert [(q["priority"], q["position"]) for q in queue] == [
+        ("interactive", 1), ("preview", 2), ("prewarm", 3)
+    ]
+    assert scheduler.has_waiters("interactive")
+
+    running.release()
+    for t in threads:
+        t.join(timeout=5)
+    assert order == ["interactive", "preview", "prewarm"]
+
+
+def test_timeout_reports_queue_position():
+    scheduler = TranscodeScheduler(gpu_slots=0, cpu_slots=1)
+    scheduler.acquire()
+    with pytest.raises(TranscodeQueueTimeout) as excinfo:
+        scheduler.acquire("preview", timeout=0.05)
+    assert excinfo.value.position == 1
+    assert scheduler.stats()["queue"] == [] and scheduler.stats()["timeouts"] == 1
+
+
+def test_session_holds_slot_until_ffmpeg_exits(tmp_path):
+    scheduler = TranscodeScheduler(gpu_slots=0, cpu_slots=1)
+    manager = TranscodeSessionManager(spool_dir=str(tmp_path), linger=0, scheduler=scheduler)
+    built = []
+
+    def build_cmd(use_gpu):
+        built.append(use_gpu)
+        return [sys.executable, "-c", "import sys, time; time.sleep(0.3); sys.stdout.buffer.write(b'x' * 1000)"]
+
+    session = manager.open("k1", build_cmd, "test", priority="interactive")
+    assert built == [False]
+    assert scheduler.stats()["cpu"]["used"] == 1
+
+    # Joining doesn't need a slot
+    assert manager.open("k1", build_cmd, "test", priority="interactive") is session
+    manager.release(session)
+    assert built == [False]
+
+    assert b"".join(manager.stream(session)) == b"x" * 1000
+    assert session.wait(timeout=5)
+    assert scheduler.stats()["cpu"]["used"] == 0
@@ -0,0 +1,233 @@
+import asyncio
+import sys
+import threading
+import time
+
+from app.config import get_settings
+from app.services import transcode_cache
+from app.services.transcode_sessions import TranscodeSessionManager
+
+# Stand-in for FFmpeg: writes numbered 64 KB chunks to stdout
+FAKE_FFMPEG = [
+    sys.executable, "-c",
+    "import sys, time\n"
+    "n = int(sys.argv[1])\n"
+    "i = 0\n"
+    "while n < 0 or i < n:\n"
+    "    sys.stdout.buffer.write(bytes([i % 256]) * 65536); sys.stdout.flush()\n"
+    "    time.sleep(0.01); i += 1\n",
+]
+
+
+def _collect(manager, session, out):
+    out.append(b"".join(manager.stream(session)))
+
+
+def test_concurrent_viewers_share_one_process(tmp_path):
+    manager = TranscodeSessionManager(spool_dir=str(tmp_path), linger=0)
+    cmd = FAKE_FFMPEG + ["20"]
+
+    first = manager.open("k1", cmd, "test")
+    time.sleep(0.05)
+    second = manager.open("k1", cmd, "test")
+    assert first is second
+
+    results = []
+    threads = [threading.Thread(target=_collect, args=(manager, s, results)) for s in (first, second)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=10)
+
+    expected = b"".join(bytes([i]) * 65536 for i in range(20))
+    assert results == [expected, expected]
+    stats = manager.stats()
+    assert stats["started"] == 1 and stats["joined"] == 1 and stats["completed"] == 1
+    assert stats["active"] == []
+    assert list(tmp_path.iterdir()) == []  # spool removed after the last reader
+
+
+def test_last_viewer_leaving_stops_ffmpeg(tmp_path):
+    manager = TranscodeSessionManager(spool_dir=str(tmp_path), linger=0)
+    session = manager.open("k1", FAKE_FFMPEG + ["-1"], "test")
+
+    stream = manager.stream(session)
+    assert len(next(stream)) > 0
+    stream.close()
+
+    session._process.wait(timeout=10)
+    deadline = time.time() + 5
+    while not session.done and time.time() < deadline:
+        time.sleep(0.01)
+    assert session.done and session.stopped
+    assert manager.stats()["active"] == []
+    assert not session.spool_path.exists()
+
+
+def test_reconnect_within_linger_rejoins(tmp_path):
+    manager = TranscodeSessionManager(spool_dir=str(tmp_path), linger=5)
+    cmd = FAKE_FFMPEG + ["-1"]
+    session = manager.open("k1", cmd, "test")
+    stream = manager.stream(session)
+    next(stream)
+    stream.close()
+
+    again = manager.open("k1", cmd, "test")
+    assert again is session and not session.stopped
+    manager.release(again)
+    session.stop()
+
+
+def test_completed_session_is_published_to_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("TRANSCODE_CACHE_DIR", str(tmp_path / "cache"))
+    get_settings.cache_clear()
+    transcode_cache.get_transcode_cache.cache_clear()
+    try:
+        manager = TranscodeSessionManager(spool_dir=str(tmp_path / "spool"), linger=0)
+        session = manager.open("k1", FAKE_FFMPEG + ["3"], "test", cache_key="abcdef")
+        data = b"".join(manager.stream(session))
+
+        cache = transcode_cache.get_transcode_cache()
+        assert cache.contains("abcdef")
+        assert cache.path_for("abcdef").read_bytes() == data
+    finally:
+        get_settings.cache_clear()
+        transcode_cache.get_transcode_cache.cache_clear()
+
+
+def test_single_flight_runs_once(tmp_path):
+    manager = TranscodeSessionManager(spool_dir=str(tmp_path), linger=0)
+    calls = []
+
+    def work():
+        calls.append(1)
+        time.sleep(0.2)
+        return "output"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(manager.single_flight("k", work))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert calls == [1]
+    assert results == ["output"] * 4
+    assert manager.stats()["coalesced_runs"] == 3
+
+
+def test_seek_within_produced_output_reuses_spool(tmp_path, make_fmp4):
+    source = tmp_path / "out.mp4"
+    data = make_fmp4([0.0, 2.0, 4.0, 6.0, 8.0])
+    source.write_bytes(data)
+    # Emits the fragments, then keeps "encoding"
+    encoder = [sys.executable, "-c",
+               f"import sys, time; sys.stdout.buffer.write(open({str(source)!r}, 'rb').read()); "
+               "sys.stdout.flush(); time.sleep(30)"]
+
+    manager = TranscodeSessionManager(spool_dir=str(tmp_path / "spool"), linger=0)
+    session = manager.open("base", encoder, "test")
+    try:
+        deadline = time.time() + 10
+        while session.index.last_time != 8.0 and time.time() < deadline:
+            time.sleep(0.01)
+
+        found = manager.find_seekable("base", 5.0)
+        assert found is not None
+        same, offset, fragment_time = found
+        assert same is session and fragment_time == 4.0 and session.subscribers == 2
+        assert session.init_segment() == data[:session.index.init_end]
+
+        stream = manager.stream(same, offset=offset, prefix=session.init_segment())
+        assert next(stream) == data[:session.index.init_end]
+        assert next(stream)[:8] == data[offset:offset + 8]
+        stream.close()
+
+        # Not produced yet (at or past the newest fragment of a running session)
+        assert manager.find_seekable("base", 9.0) is None
+        assert manager.find_seekable("other", 5.0) is None
+        assert manager.stats()["seek_reused"] == 1
+    finally:
+        manager.release(session)
+
+
+def test_seek_sessions_are_keyed_by_start(tmp_path):
+    manager = TranscodeSessionManager(spool_dir=str(tmp_path), linger=0)
+    late = manager.open("base@60.0", FAKE_FFMPEG + ["-1"], "test", base_key="base", start_time=60.0)
+    try:
+        assert late.base_key == "base" and late.start_time == 60.0
+        assert late.seek_offset(30.0) is None
+        assert manager.stats()["active"][0]["start_time"] == 60.0
+    finally:
+        manager.release(late)
+
+
+def test_client_disconnect_releases_a_stalled_stream(tmp_path):
+    from app.routes.stream import until_disconnected
+
+    # One chunk, then nothing: a reader would block waiting for FFmpeg
+    stalled = [sys.executable, "-c",
+               "import sys, time; sys.stdout.buffer.write(b'x' * 65536); sys.stdout.flush(); time.sleep(30)"]
+    manager = TranscodeSessionManager(spool_dir=str(tmp_path), linger=0)
+    session = manager.open("k1", stalled, "test")
+
+    disconnected = threading.Event()
+
+    class Request:
+        headers = {}
+        client = None
+
+        async def is_disconnected(self):
+            return disconnected.is_set()
+
+    async def consume():
+        cancel = threading.Event()
+        received = []
+        async for chunk in until_disconnected(Request(), manager.stream(session, cancel=cancel), cancel):
+            received.append(chunk)
+            disconnected.set()  # client goes away after the first chunk
+        return received
+
+    started = time.monotonic()
+    assert asyncio.run(consume()) == [b"x" * 65536]
+    assert time.monotonic() - started < 5
+    assert session.wait(timeout=10) and session.stopped
+    assert manager.stats()["active"] == []
+
+
+def test_response_cancelled_before_its_body_releases_the_session(tmp_path, monkeypatch):
+    from app.routes import stream as stream_routes
+
+    manager = TranscodeSessionManager(spool_dir=str(tmp_path), linger=0)
+    monkeypatch.setattr(stream_routes, "get_session_manager", lambda: manager)
+    session = manager.open("k1", FAKE_FFMPEG + ["-1"], "test")
+    response = stream_routes._session_response(None, session, 0.0)
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        await asyncio.sleep(30)  # slow client: the disconnect cancels the response first
+
+    # The body iterator never starts, so only the response itself can release
+    asyncio.run(response({"type": "http", "method": "GET", "asgi": {"spec_version": "2.3"}}, receive, send))
+    assert session.wait(timeout=10) and session.stopped
+    assert manager.stats()["active"] == []
+
+
+def test_open_releases_the_slot_if_the_session_cannot_be_set_up(tmp_path):
+    from app.services.transcode_scheduler import TranscodeScheduler
+
+    scheduler = TranscodeScheduler(gpu_slots=0, cpu_slots=1)
+    manager = TranscodeSessionManager(spool_dir=str(tmp_path), linger=0, scheduler=scheduler)
+
+    def broken_cmd(use_gpu):
+        raise ValueError("bad command")
+
+    try:
+        manager.open("k1", broken_cmd, "test", priority="interactive")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("expected ValueError")
+    assert scheduler.stats()["cpu"]["used"] == 0
@@ -13,6 +13,14 @@ interface VideoPlayerProps {
   useSmartStream?: boolean;    // Use smart streaming (auto progressive or direct)
 }
 
+// Declared downlink (Mbit/s) for bandwidth-aware /smart profiles; browsers
+// report at most 10, which the server treats as unconstrained
+function smartStreamUrl(fileId: number): string {
+  const downlink = (navigator as any).connection?.downlink;
+  const url = `/api/stream/${fileId}/smart`;
+  return typeof downlink === 'number' && downlink > 0 && downlink < 10 ? `${url}?downlink=${downlink}` : url;
+}
+
 export default function VideoPlayer({
   fileId,
   filename,
@@ -184,7 +192,7 @@ export default function VideoPlayer({
           style={{ width: '100%', display: error ? 'none' : 'block' }}
         >
           <source
-            src={useSmartStream ? `/api/stream/${fileId}/smart` : `/api/stream/${fileId}`}
+            src={useSmartStream ? smartStreamUrl(fileId) : `/api/stream/${fileId}`}
             type="video/mp4"
           />
           Your browser does not support the video tag.
@@ -4,16 +4,21 @@
 import sys
 sys.path.insert(0, '/home/mercury/projects/mediavault/backend')
 
-from app.services.hls_service import HLSService
+from app.services.ffmpeg_service import FFmpegService
+from app.services.hls_service import HLSService, build_ladder
 from pathlib import Path
 
-# Initialize service
+# Initialize services
 hls = HLSService()
+ffmpeg = FFmpegService()
 
 # Test file
 test_file = "/mnt/nas-synology/docker/transmission/downloads/complete/tv/Red.Dwarf.COMPLETE.DVD.BluRay.REMUX.DD2.0.DTS/10x06 - The Beginning.mkv"
 test_id = 999
 
+# Segments to generate per rendition (from the start of the title)
+SEGMENTS = 3
+
 print("Testing HLS generation...")
 print(f"Input: {test_file}")
 print(f"Output: {hls.get_hls_directory(test_id)}")
@@ -24,12 +29,35 @@ if not Path(test_file).exists():
     print(f"ERROR: File not found: {test_file}")
     sys.exit(1)
 
+metadata = ffmpeg.extract_metadata(test_file)
+if not metadata or not metadata.get("duration"):
+    print("ERROR: ffprobe could not read the file")
+    sys.exit(1)
+
+# Segments are transcoded on demand; request the first few of every rendition
+ladder = build_ladder(metadata.get("width"), metadata.get("height"), metadata.get("bitrate"))
+print(f"Renditions: {', '.join(r['name'] for r in ladder)}")
 print("Starting HLS generation...")
-success = hls.generate_hls_adaptive(
-    input_path=test_file,
-    file_id=test_id,
-    use_gpu=True
-)
+success = True
+try:
+    for rendition in ladder:
+        for index in range(min(SEGMENTS, hls.segment_count(metadata["duration"]))):
+            segment = hls.get_segment(
+                file_id=test_id,
+                index=index,
+                input_path=test_file,
+                duration=metadata["duration"],
+                rendition=rendition,
+                use_gpu=ffmpeg.check_gpu_encoding_available(),
+                has_audio=bool(metadata.get("audio_codec"))
+            )
+            if segment is None:
+                print(f"  {rendition['name']} segment {index}: FAILED")
+                success = False
+                break
+            print(f"  {rendition['name']} segment {index}: {segment.stat().st_size / 1024 / 1024:.1f}MB")
+finally:
+    hls.stop_all()
 
 if success:
     print("\n✓ HLS generation successful!")